@@ -0,0 +1,449 @@
+"""
+本地 OpenAI 兼容的模拟服务器，用于离线基准测试和开发调试（不调用任何真实的 LLM 服务商）。
+
+支持 POST /v1/chat/completions（含 stream=True）和 GET /v1/models。响应延迟按可配置的分布随机抽样，
+并可以按比例注入 429（带 Retry-After）和 500 错误。响应内容根据请求所属的 Agent 生成固定格式的"罐头"回复，
+足以驱动 Heimdallr 的完整流程；也可以通过 JSON 文件提供自定义回复。
+服务器还模拟提供商的前缀缓存：与之前请求相同的消息前缀按块计入 usage.prompt_tokens_details.cached_tokens，
+便于评估 prompt 布局对前缀缓存的影响。请求带 response_format 时返回不带代码块标记的纯 JSON；
+也可以模拟不支持 response_format 的服务商（返回 400），以及按固定速率逐段输出的流式响应。
+此外还提供 Batch API 的替身（POST /v1/files、POST /v1/batches、GET /v1/batches/{id}、GET /v1/files/{id}/content）：
+批任务在 batch_delay 秒后完成，输出文件中的每条结果与直接请求得到的回复相同。
+
+用法:
+    python -m benchmarks.mock_openai_server --port 8765 --latency lognormal:0.3:0.5 --rate-limit-rate 0.05
+    python -m heimdallr.main --file examples/test.py --base-url http://127.0.0.1:8765/v1 --api-key mock --no-cache
+"""
+import re
+import json
+import hashlib
+import time
+import random
+import argparse
+import threading
+import itertools
+from email.parser import BytesParser
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Dict, Any, List
+
+
+def parse_latency(spec: str):
+    """
+    解析延迟分布配置，返回一个无参函数，每次调用抽样一个延迟（秒）:
+        fixed:S               固定 S 秒
+        uniform:A:B           [A, B] 均匀分布
+        normal:MEAN:STD       正态分布（截断为非负）
+        lognormal:MEDIAN:SIGMA 对数正态分布，中位数为 MEDIAN
+        exp:MEAN              指数分布
+    """
+    kind, _, rest = spec.partition(":")
+    params = [float(x) for x in rest.split(":")] if rest else []
+    try:
+        if kind == "fixed":
+            return lambda: params[0]
+        if kind == "uniform":
+            return lambda: random.uniform(params[0], params[1])
+        if kind == "normal":
+            return lambda: max(0.0, random.gauss(params[0], params[1]))
+        if kind == "lognormal":
+            import math
+            return lambda: random.lognormvariate(math.log(params[0]), params[1])
+        if kind == "exp":
+            return lambda: random.expovariate(1.0 / params[0])
+    except IndexError:
+        pass
+    raise ValueError(f"无效的延迟分布 '{spec}'，示例: fixed:0.2, uniform:0.1:0.5, lognormal:0.3:0.5")
+
+
+# token 数按 UTF-8 字节数 / 4 估算。前缀缓存模拟：默认最短 1024 个 token 才可能命中，之后按 128 个 token 为一块匹配
+DEFAULT_PREFIX_CACHE_MIN_TOKENS = 1024
+PREFIX_CACHE_BLOCK_BYTES = 512
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text.encode("utf-8")) // 4
+
+
+class PrefixCache:
+    """记录见过的消息前缀（按块计算哈希），返回新请求中与之前请求相同的前缀长度（字节数）。"""
+    def __init__(self, min_tokens: int = DEFAULT_PREFIX_CACHE_MIN_TOKENS):
+        self.min_bytes = min_tokens * 4
+        self._seen = set()
+        self._lock = threading.Lock()
+
+    def lookup_and_add(self, text: str) -> int:
+        data = text.encode("utf-8")
+        hashes = []
+        digest = hashlib.sha256()
+        for end in range(PREFIX_CACHE_BLOCK_BYTES, len(data) + 1, PREFIX_CACHE_BLOCK_BYTES):
+            digest.update(data[end - PREFIX_CACHE_BLOCK_BYTES:end])
+            hashes.append((end, digest.copy().hexdigest()))
+        with self._lock:
+            cached = 0
+            for end, prefix_hash in hashes:
+                if prefix_hash not in self._seen:
+                    break
+                cached = end
+            self._seen.update(prefix_hash for _, prefix_hash in hashes)
+        return cached if cached >= self.min_bytes else 0
+
+
+def canned_response(messages: List[Dict[str, Any]], custom: List[Dict[str, str]] = None, structured: bool = False) -> str:
+    """
+    根据请求内容生成回复：先匹配自定义回复，再按系统提示判断是哪个 Agent 的请求。
+    structured 为 True（请求带 response_format）时 JSON 回复不加代码块标记。
+    """
+    system = messages[0].get("content", "") if messages else ""
+    last = messages[-1].get("content", "") if messages else ""
+    for entry in custom or []:
+        if entry.get("match", "") in last:
+            return entry["content"]
+
+    if "final_conclusion" in last:
+        return json.dumps({
+            "final_conclusion": "模拟结论：代码中存在命令执行相关的高风险点。",
+            "recommendations": ["避免将外部输入直接传入命令执行函数。", "对所有外部输入进行严格校验。"],
+        }, ensure_ascii=False)
+    if "(Manager Agent)" in system:
+        unit_ids = re.findall(r"^- (\S+) \(第", last, re.M)
+        annotation = json.dumps({
+            "overview": "模拟概述：该文件包含若干处理外部输入的函数。",
+            "units": [{
+                "unit_id": unit_id,
+                "priority": "high" if i % 3 == 0 else "medium",
+                "focus": "检查外部输入是否流入危险函数。",
+                "target_vulnerabilities": ["Command Injection"],
+            } for i, unit_id in enumerate(unit_ids)],
+        }, ensure_ascii=False)
+        return annotation if structured else f"```json\n{annotation}\n```"
+    line_numbers = re.findall(r"^\s*(\d+)\|", last, re.M)
+    line = line_numbers[len(line_numbers) // 2] if line_numbers else "1"
+    if "(Checker Agent)" in system:
+        if structured:
+            return json.dumps({"verdict": "confirmed", "severity": "high",
+                               "reason": f"模拟复核：第 {line} 行的外部输入未经校验。"}, ensure_ascii=False)
+        return f"模拟复核：第 {line} 行的发现成立，未发现明显误报。"
+    report = f"模拟审计：第 {line} 行可能存在命令注入风险，外部输入未经校验即被使用。"
+    if "审计自评" in last:
+        # 模型级联的初审：按行号和代码中的危险调用给出确定性的自评，使部分子任务升级复审
+        confidence = 0.5 if int(line) % 3 == 0 else 0.9
+        severity = "high" if re.search(r"\b(system|popen|subprocess|eval|exec|pickle)\b", last) else "low"
+        report += f"\n\n审计自评: 置信度={confidence}; 最高严重程度={severity}"
+    return report
+
+
+def _jsonl(records: List[Dict[str, Any]]) -> bytes:
+    return "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records).encode("utf-8")
+
+
+class MockOpenAIServer:
+    """
+    可在后台线程中启动的模拟服务器。
+
+    stats 记录请求总数、注入的 429/500 次数和各模型的请求数。
+    """
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: str = "fixed:0.05",
+                 rate_limit_rate: float = 0.0, error_rate: float = 0.0, retry_after: float = 1.0,
+                 responses: List[Dict[str, str]] = None, seed: int = None,
+                 prefix_cache_min_tokens: int = DEFAULT_PREFIX_CACHE_MIN_TOKENS, token_rate: float = 0.0,
+                 reject_response_format: bool = False, batch_delay: float = 1.0):
+        """
+        参数:
+            host (str, optional): 监听地址。
+            port (int, optional): 监听端口，0 表示自动分配。
+            latency (str, optional): 响应延迟分布，格式见 parse_latency。
+            rate_limit_rate (float, optional): 返回 429 的请求比例。
+            error_rate (float, optional): 返回 500 的请求比例。
+            retry_after (float, optional): 429 响应中 Retry-After 头的秒数。
+            responses (List[Dict[str, str]], optional): 自定义回复 [{"match": 子串, "content": 回复}, ...]。
+            seed (int, optional): 随机数种子，便于复现。
+            prefix_cache_min_tokens (int, optional): 模拟前缀缓存的最短命中长度（token），0 表示不模拟前缀缓存。
+            token_rate (float, optional): 模拟的生成速度（每秒 token 数）：流式响应按该速度逐段输出，
+                非流式响应在生成完整回复所需的时间后一次性返回。0 表示不模拟生成耗时。
+            reject_response_format (bool, optional): 模拟不支持结构化输出的服务商，对带 response_format 的请求返回 400。
+            batch_delay (float, optional): 批任务从创建到完成的秒数。
+        """
+        if seed is not None:
+            random.seed(seed)
+        self.sample_latency = parse_latency(latency)
+        self.rate_limit_rate = rate_limit_rate
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.responses = responses or []
+        self.prefix_cache = PrefixCache(prefix_cache_min_tokens) if prefix_cache_min_tokens else None
+        self.token_rate = token_rate
+        self.reject_response_format = reject_response_format
+        self.batch_delay = batch_delay
+        self.stats = {"requests": 0, "rate_limited": 0, "errors": 0, "prompt_tokens": 0, "cached_tokens": 0, "by_model": {},
+                      "batches": 0, "batch_requests": 0}
+        self.files: Dict[str, Dict[str, Any]] = {}
+        self.batches: Dict[str, Dict[str, Any]] = {}
+        self._stats_lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> str:
+        """在后台线程中启动服务器，返回 base_url。"""
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self.base_url
+
+    def serve_forever(self):
+        self._httpd.serve_forever()
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def _count(self, key: str, model: str = None, amount: int = 1):
+        with self._stats_lock:
+            self.stats[key] += amount
+            if model:
+                self.stats["by_model"][model] = self.stats["by_model"].get(model, 0) + 1
+
+    def completion(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        """生成一个非流式 chat.completion 响应体，并记录 prompt token 和前缀缓存命中。"""
+        model = request.get("model", "mock-model")
+        messages = request.get("messages", [])
+        content = canned_response(messages, self.responses, structured=bool(request.get("response_format")))
+        prompt_text = "".join(f"<|{m.get('role')}|>{m.get('content') or ''}" for m in messages)
+        prompt_tokens = estimate_tokens(prompt_text)
+        cached_tokens = self.prefix_cache.lookup_and_add(f"{model}|{prompt_text}") // 4 if self.prefix_cache else 0
+        self._count("prompt_tokens", amount=prompt_tokens)
+        self._count("cached_tokens", amount=cached_tokens)
+        completion_tokens = estimate_tokens(content)
+        return {
+            "id": f"chatcmpl-mock-{next(self._ids)}", "object": "chat.completion", "created": int(time.time()), "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens,
+                      "prompt_tokens_details": {"cached_tokens": cached_tokens}},
+        }
+
+    def _add_file(self, data: bytes, filename: str, purpose: str) -> Dict[str, Any]:
+        file_id = f"file-mock-{next(self._ids)}"
+        self.files[file_id] = {"id": file_id, "object": "file", "bytes": len(data), "created_at": int(time.time()),
+                               "filename": filename, "purpose": purpose, "status": "processed", "_data": data}
+        return self.files[file_id]
+
+    def _run_batch(self, batch: Dict[str, Any]):
+        """在后台线程中执行批任务：逐行生成回复，按 error_rate 注入失败，batch_delay 秒后写出输出和错误文件。"""
+        batch["status"] = "in_progress"
+        batch["in_progress_at"] = int(time.time())
+        lines = self.files[batch["input_file_id"]]["_data"].decode("utf-8").splitlines()
+        outputs, errors = [], []
+        for line in filter(str.strip, lines):
+            entry = json.loads(line)
+            body = entry.get("body", {})
+            self._count("batch_requests", body.get("model", "mock-model"))
+            if random.random() < self.error_rate:
+                errors.append({"id": f"batch_req_{next(self._ids)}", "custom_id": entry.get("custom_id"),
+                               "response": {"status_code": 500, "body": {"error": {"message": "mock server error"}}},
+                               "error": None})
+                continue
+            if body.get("response_format") and self.reject_response_format:
+                errors.append({"id": f"batch_req_{next(self._ids)}", "custom_id": entry.get("custom_id"),
+                               "response": {"status_code": 400, "body": {"error": {"message": "response_format is not supported"}}},
+                               "error": None})
+                continue
+            outputs.append({"id": f"batch_req_{next(self._ids)}", "custom_id": entry.get("custom_id"),
+                            "response": {"status_code": 200, "request_id": f"req-mock-{next(self._ids)}",
+                                         "body": self.completion(body)}, "error": None})
+        time.sleep(self.batch_delay)
+        if batch["status"] == "cancelling":
+            batch["status"] = "cancelled"
+            return
+        if outputs:
+            batch["output_file_id"] = self._add_file(_jsonl(outputs), "batch_output.jsonl", "batch_output")["id"]
+        if errors:
+            batch["error_file_id"] = self._add_file(_jsonl(errors), "batch_errors.jsonl", "batch_output")["id"]
+        batch["request_counts"] = {"total": len(outputs) + len(errors), "completed": len(outputs), "failed": len(errors)}
+        batch["status"] = "completed"
+        batch["completed_at"] = int(time.time())
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send_json(self, status: int, payload: Dict[str, Any], headers: Dict[str, str] = None):
+                body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _send_public(self, status: int, record: Dict[str, Any]):
+                self._send_json(status, {k: v for k, v in record.items() if not k.startswith("_")})
+
+            def do_GET(self):
+                path = self.path.split("?")[0].rstrip("/")
+                if path.endswith("/models"):
+                    self._send_json(200, {"object": "list", "data": [
+                        {"id": model, "object": "model", "owned_by": "mock"} for model in server.stats["by_model"]]})
+                elif (match := re.search(r"/batches/([\w-]+)$", path)) and match.group(1) in server.batches:
+                    self._send_public(200, server.batches[match.group(1)])
+                elif (match := re.search(r"/files/([\w-]+)/content$", path)) and match.group(1) in server.files:
+                    data = server.files[match.group(1)]["_data"]
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/jsonl")
+                    self.send_header("Content-Length", str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                elif (match := re.search(r"/files/([\w-]+)$", path)) and match.group(1) in server.files:
+                    self._send_public(200, server.files[match.group(1)])
+                else:
+                    self._send_json(404, {"error": {"message": "not found"}})
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                raw = self.rfile.read(length)
+                path = self.path.split("?")[0].rstrip("/")
+                if path.endswith("/files"):
+                    self._upload_file(raw)
+                    return
+                request = json.loads(raw or b"{}")
+                if path.endswith("/batches"):
+                    self._create_batch(request)
+                    return
+                if (match := re.search(r"/batches/([\w-]+)/cancel$", path)) and match.group(1) in server.batches:
+                    batch = server.batches[match.group(1)]
+                    if batch["status"] not in ("completed", "failed", "expired", "cancelled"):
+                        batch["status"] = "cancelling"
+                    self._send_public(200, batch)
+                    return
+                if not path.endswith("/chat/completions"):
+                    self._send_json(404, {"error": {"message": "not found"}})
+                    return
+                model = request.get("model", "mock-model")
+                server._count("requests", model)
+                time.sleep(server.sample_latency())
+
+                roll = random.random()
+                if roll < server.rate_limit_rate:
+                    server._count("rate_limited")
+                    self._send_json(429, {"error": {"message": "mock rate limit", "type": "rate_limit_error"}},
+                                    {"Retry-After": f"{server.retry_after:g}"})
+                    return
+                if roll < server.rate_limit_rate + server.error_rate:
+                    server._count("errors")
+                    self._send_json(500, {"error": {"message": "mock server error", "type": "server_error"}})
+                    return
+
+                if request.get("response_format") and server.reject_response_format:
+                    server._count("errors")
+                    self._send_json(400, {"error": {"message": "response_format is not supported by this model",
+                                                    "type": "invalid_request_error", "param": "response_format"}})
+                    return
+
+                body = server.completion(request)
+                if request.get("stream"):
+                    self._stream(body["id"], model, body["choices"][0]["message"]["content"], body["usage"])
+                else:
+                    if server.token_rate:
+                        time.sleep(body["usage"]["completion_tokens"] / server.token_rate)
+                    self._send_json(200, body)
+
+            def _upload_file(self, raw: bytes):
+                """解析 multipart/form-data 上传（字段 file 和 purpose）。"""
+                message = BytesParser().parsebytes(
+                    f"Content-Type: {self.headers.get('Content-Type', '')}\r\n\r\n".encode("utf-8") + raw)
+                fields = {}
+                for part in message.walk() if message.is_multipart() else []:
+                    name = part.get_param("name", header="content-disposition")
+                    if name:
+                        fields[name] = (part.get_filename(), part.get_payload(decode=True) or b"")
+                if "file" not in fields:
+                    self._send_json(400, {"error": {"message": "missing file", "type": "invalid_request_error"}})
+                    return
+                filename, data = fields["file"]
+                purpose = fields.get("purpose", (None, b"batch"))[1].decode("utf-8")
+                self._send_public(200, server._add_file(data, filename or "upload.jsonl", purpose))
+
+            def _create_batch(self, request: Dict[str, Any]):
+                if request.get("input_file_id") not in server.files:
+                    self._send_json(400, {"error": {"message": "unknown input_file_id", "type": "invalid_request_error"}})
+                    return
+                batch_id = f"batch_mock_{next(server._ids)}"
+                batch = {"id": batch_id, "object": "batch", "endpoint": request.get("endpoint", "/v1/chat/completions"),
+                         "input_file_id": request["input_file_id"], "completion_window": request.get("completion_window", "24h"),
+                         "status": "validating", "created_at": int(time.time()), "output_file_id": None,
+                         "error_file_id": None, "metadata": request.get("metadata"),
+                         "request_counts": {"total": 0, "completed": 0, "failed": 0}}
+                server.batches[batch_id] = batch
+                server._count("batches")
+                threading.Thread(target=server._run_batch, args=(batch,), daemon=True).start()
+                self._send_public(200, batch)
+
+            def _stream(self, completion_id: str, model: str, content: str, usage: Dict[str, int]):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+
+                def write_event(payload):
+                    data = f"data: {payload}\n\n".encode("utf-8")
+                    self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+
+                base = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()), "model": model}
+                for i in range(0, len(content), 16):
+                    if server.token_rate:
+                        time.sleep(estimate_tokens(content[i:i + 16]) / server.token_rate)
+                        self.wfile.flush()
+                    write_event(json.dumps({**base, "choices": [
+                        {"index": 0, "delta": {"content": content[i:i + 16]}, "finish_reason": None}]}, ensure_ascii=False))
+                write_event(json.dumps({**base, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}], "usage": usage}))
+                write_event("[DONE]")
+                self.wfile.write(b"0\r\n\r\n")
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地 OpenAI 兼容的模拟服务器 (用于离线基准测试)")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=str, default="fixed:0.05", help="响应延迟分布，例如 fixed:0.2、uniform:0.1:0.5、lognormal:0.3:0.5")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="返回 429 的请求比例 (0-1)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回 500 的请求比例 (0-1)")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="429 响应的 Retry-After 秒数")
+    parser.add_argument("--responses", type=str, help="自定义回复 JSON 文件: [{\"match\": \"子串\", \"content\": \"回复\"}]")
+    parser.add_argument("--seed", type=int, help="随机数种子")
+    parser.add_argument("--prefix-cache-min-tokens", type=int, default=DEFAULT_PREFIX_CACHE_MIN_TOKENS, help="模拟前缀缓存的最短命中长度 (token)，0 表示不模拟")
+    parser.add_argument("--token-rate", type=float, default=0.0, help="模拟的生成速度 (每秒 token 数)，0 表示不模拟生成耗时")
+    parser.add_argument("--reject-response-format", action="store_true", help="模拟不支持 response_format 的服务商 (返回 400)")
+    parser.add_argument("--batch-delay", type=float, default=1.0, help="批任务从创建到完成的秒数 (默认: 1)")
+    args = parser.parse_args()
+
+    responses = None
+    if args.responses:
+        with open(args.responses, "r", encoding="utf-8") as f:
+            responses = json.load(f)
+    server = MockOpenAIServer(args.host, args.port, args.latency, args.rate_limit_rate, args.error_rate,
+                              args.retry_after, responses, args.seed, args.prefix_cache_min_tokens,
+                              args.token_rate, args.reject_response_format, args.batch_delay)
+    print(f"模拟 OpenAI 服务器已启动: {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"统计: {json.dumps(server.stats, ensure_ascii=False)}")
+
+
+if __name__ == "__main__":
+    main()
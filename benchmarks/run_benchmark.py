@@ -0,0 +1,262 @@
+"""
+Heimdallr 离线基准测试：启动本地模拟 OpenAI 服务器，在合成语料上运行 ManagerAgent.process_task
+（api 模式）或命令行仓库审计（cli 模式），报告吞吐量、延迟分位数和峰值内存，便于在 CI 中发现性能回退。
+
+用法:
+    python -m benchmarks.run_benchmark --mode api --size small --latency lognormal:0.2:0.5
+    python -m benchmarks.run_benchmark --mode cli --size medium --rate-limit-rate 0.05 --output bench.json
+    python -m benchmarks.run_benchmark --mode api --size small --compare baseline.json --max-regression 0.2
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import resource
+import subprocess
+from typing import Dict, Any, List
+
+from benchmarks.mock_openai_server import MockOpenAIServer, DEFAULT_PREFIX_CACHE_MIN_TOKENS
+
+# 合成语料规模: (文件数, 每个文件的函数数)
+CORPUS_SIZES = {
+    "small": (5, 4),
+    "medium": (20, 8),
+    "large": (60, 16),
+}
+
+# 比较基线时检查的指标: (字段名, 数值越大越好)
+_COMPARED_METRICS = (
+    ("files_per_second", True),
+    ("calls_per_second", True),
+    ("file_latency_p95", False),
+    ("peak_rss_mb", False),
+)
+
+_FUNCTION_TEMPLATES = (
+    'def handle_{n}(request):\n    cmd = request.args.get("cmd_{n}")\n    return os.popen("echo " + cmd).read()\n',
+    'def load_{n}(path):\n    with open(path, "rb") as f:\n        return pickle.loads(f.read())\n',
+    'def query_{n}(conn, name):\n    cursor = conn.cursor()\n    cursor.execute("SELECT * FROM users WHERE name = \'%s\'" % name)\n    return cursor.fetchall()\n',
+    'def compute_{n}(values):\n    total = 0\n    for value in values:\n        total += value * {n}\n    return total\n',
+)
+
+
+def generate_corpus(root_dir: str, num_files: int, functions_per_file: int, seed: int = 0) -> List[str]:
+    """在 root_dir 下生成 num_files 个 Python 文件，每个文件包含 functions_per_file 个函数。返回文件路径列表。"""
+    rng = random.Random(seed)
+    paths = []
+    for i in range(num_files):
+        package_dir = os.path.join(root_dir, f"pkg{i % 4}")
+        os.makedirs(package_dir, exist_ok=True)
+        functions = [rng.choice(_FUNCTION_TEMPLATES).format(n=i * functions_per_file + j) for j in range(functions_per_file)]
+        path = os.path.join(package_dir, f"module_{i}.py")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("import os\nimport pickle\n\n\n" + "\n\n".join(functions))
+        paths.append(path)
+    return paths
+
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, int(round(q * len(ordered) + 0.5)) - 1)]
+
+
+def _rss_mb(rusage_who: int) -> float:
+    """返回峰值常驻内存 (MiB)。Linux 上 ru_maxrss 的单位是 KiB，macOS 上是字节。"""
+    peak = resource.getrusage(rusage_who).ru_maxrss
+    return round(peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024, 1)
+
+
+async def _bench_api(base_url: str, files: List[str], jobs: int, num_auditors: int) -> Dict[str, Any]:
+    """在当前进程内直接调用 ManagerAgent.process_task，不经过缓存和报告落盘。"""
+    from heimdallr.core.llm_connector import LLMConnector
+    from heimdallr.core.metrics import MetricsCollector
+    from heimdallr.core.agents import ManagerAgent
+
+    metrics = MetricsCollector()
+    connector = LLMConnector(api_key="mock", base_url=base_url, metrics=metrics)
+    semaphore = asyncio.Semaphore(jobs)
+    file_latencies: List[float] = []
+    failed = 0
+
+    async def audit(path: str):
+        nonlocal failed
+        async with semaphore:
+            manager = ManagerAgent(connector, "mock-manager", "mock-auditor", "mock-checker", num_auditors=num_auditors)
+            with open(path, "r", encoding="utf-8") as f:
+                code = f.read()
+            started = time.perf_counter()
+            try:
+                await manager.process_task(code, file_path=path)
+            except Exception as e:
+                failed += 1
+                print(f"BENCH: 审计 {path} 失败: {e}")
+            file_latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(audit(path) for path in files))
+    elapsed = time.perf_counter() - started
+    await connector.aclose()
+
+    totals = metrics.snapshot()["totals"]
+    return {
+        "elapsed_seconds": elapsed,
+        "files_failed": failed,
+        "llm_calls": totals["calls"],
+        "llm_retries": totals["retries"],
+        "prefix_cache_hit_rate": totals["prefix_cache_hit_rate"],
+        "llm_latency_p50": totals["latency_p50"],
+        "llm_latency_p95": totals["latency_p95"],
+        "file_latency_p50": round(_percentile(file_latencies, 0.5), 3),
+        "file_latency_p95": round(_percentile(file_latencies, 0.95), 3),
+        "peak_rss_mb": _rss_mb(resource.RUSAGE_SELF),
+    }
+
+
+def _bench_cli(base_url: str, corpus_dir: str, jobs: int, num_auditors: int) -> Dict[str, Any]:
+    """在子进程中运行 `python -m heimdallr.main --dir ...`，从 repo_summary.json 读取指标。"""
+    output_dir = os.path.join(os.path.dirname(corpus_dir), "reports")
+    command = [
+        sys.executable, "-m", "heimdallr.main", "--dir", corpus_dir, "--output-dir", output_dir,
+        "--findings-db", os.path.join(output_dir, "findings.sqlite3"),
+        "--jobs", str(jobs), "--auditors", str(num_auditors), "--no-cache",
+        "--api-key", "mock", "--base-url", base_url,
+        "--manager-model", "mock-manager", "--auditor-model", "mock-auditor", "--checker-model", "mock-checker",
+    ]
+    started = time.perf_counter()
+    completed = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    elapsed = time.perf_counter() - started
+    if completed.returncode != 0:
+        print(completed.stdout)
+        raise RuntimeError(f"heimdallr 命令行退出码为 {completed.returncode}")
+
+    with open(os.path.join(output_dir, "repo_summary.json"), "r", encoding="utf-8") as f:
+        summary = json.load(f)
+    totals = summary.get("metrics", {}).get("totals", {})
+    file_latencies = [entry.get("elapsed_seconds", 0.0) for entry in summary["files"]]
+    return {
+        "elapsed_seconds": elapsed,
+        "files_failed": summary["files_failed"],
+        "llm_calls": totals.get("calls", 0),
+        "llm_retries": totals.get("retries", 0),
+        "prefix_cache_hit_rate": totals.get("prefix_cache_hit_rate", 0.0),
+        "llm_latency_p50": totals.get("latency_p50", 0.0),
+        "llm_latency_p95": totals.get("latency_p95", 0.0),
+        "file_latency_p50": round(_percentile(file_latencies, 0.5), 3),
+        "file_latency_p95": round(_percentile(file_latencies, 0.95), 3),
+        "peak_rss_mb": _rss_mb(resource.RUSAGE_CHILDREN),
+    }
+
+
+def run_benchmark(mode: str = "api", size: str = "small", jobs: int = 4, num_auditors: int = 3,
+                  latency: str = "fixed:0.05", rate_limit_rate: float = 0.0, error_rate: float = 0.0,
+                  retry_after: float = 1.0, seed: int = 0,
+                  prefix_cache_min_tokens: int = DEFAULT_PREFIX_CACHE_MIN_TOKENS, token_rate: float = 0.0) -> Dict[str, Any]:
+    """
+    运行一次基准测试并返回结果。
+
+    参数:
+        mode (str, optional): "api" 直接调用 ManagerAgent.process_task；"cli" 运行命令行仓库审计。
+        size (str, optional): 合成语料规模，见 CORPUS_SIZES。
+        jobs (int, optional): 同时审计的文件数。
+        num_auditors (int, optional): 每个文件的 Auditor 并发数。
+        latency, rate_limit_rate, error_rate, retry_after: 模拟服务器的延迟分布和错误注入配置。
+        prefix_cache_min_tokens (int, optional): 模拟前缀缓存的最短命中长度，0 表示不模拟。
+        token_rate (float, optional): 模拟的生成速度（每秒 token 数），0 表示不模拟生成耗时。
+        seed (int, optional): 语料生成和模拟服务器的随机数种子。
+    """
+    num_files, functions_per_file = CORPUS_SIZES[size]
+    server = MockOpenAIServer(latency=latency, rate_limit_rate=rate_limit_rate, error_rate=error_rate,
+                              retry_after=retry_after, seed=seed, prefix_cache_min_tokens=prefix_cache_min_tokens,
+                              token_rate=token_rate)
+    base_url = server.start()
+    print(f"BENCH: 模拟服务器 {base_url}，模式 {mode}，语料 {size} ({num_files} 个文件 x {functions_per_file} 个函数)")
+    try:
+        with tempfile.TemporaryDirectory(prefix="heimdallr-bench-") as work_dir:
+            corpus_dir = os.path.join(work_dir, "corpus")
+            files = generate_corpus(corpus_dir, num_files, functions_per_file, seed)
+            if mode == "api":
+                result = asyncio.run(_bench_api(base_url, files, jobs, num_auditors))
+            else:
+                result = _bench_cli(base_url, corpus_dir, jobs, num_auditors)
+    finally:
+        server.stop()
+
+    elapsed = result["elapsed_seconds"]
+    return {
+        "mode": mode,
+        "size": size,
+        "files": num_files,
+        "jobs": jobs,
+        "auditors": num_auditors,
+        "latency": latency,
+        "rate_limit_rate": rate_limit_rate,
+        "error_rate": error_rate,
+        "token_rate": token_rate,
+        **result,
+        "elapsed_seconds": round(elapsed, 3),
+        "files_per_second": round(num_files / elapsed, 3) if elapsed else 0.0,
+        "calls_per_second": round(result["llm_calls"] / elapsed, 3) if elapsed else 0.0,
+        "server": server.stats,
+    }
+
+
+def compare_results(result: Dict[str, Any], baseline: Dict[str, Any], max_regression: float) -> List[str]:
+    """与基线比较，返回超过 max_regression（相对变化比例）的回退描述列表。"""
+    regressions = []
+    for field, higher_is_better in _COMPARED_METRICS:
+        old, new = baseline.get(field), result.get(field)
+        if not old or new is None:
+            continue
+        change = (old - new) / old if higher_is_better else (new - old) / old
+        if change > max_regression:
+            regressions.append(f"{field}: {old} -> {new} (退化 {change:.0%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Heimdallr 离线基准测试 (使用本地模拟 OpenAI 服务器)")
+    parser.add_argument("--mode", choices=("api", "cli"), default="api", help="api: 直接调用 ManagerAgent.process_task；cli: 运行命令行仓库审计")
+    parser.add_argument("--size", choices=sorted(CORPUS_SIZES), default="small", help="合成语料规模")
+    parser.add_argument("--jobs", type=int, default=4, help="同时审计的文件数")
+    parser.add_argument("--auditors", type=int, default=3, help="每个文件的 Auditor 并发数")
+    parser.add_argument("--latency", type=str, default="fixed:0.05", help="模拟响应延迟分布，例如 fixed:0.2、uniform:0.1:0.5、lognormal:0.3:0.5")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="模拟服务器返回 429 的请求比例")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="模拟服务器返回 500 的请求比例")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="429 响应的 Retry-After 秒数")
+    parser.add_argument("--seed", type=int, default=0, help="随机数种子")
+    parser.add_argument("--prefix-cache-min-tokens", type=int, default=DEFAULT_PREFIX_CACHE_MIN_TOKENS, help="模拟前缀缓存的最短命中长度 (token)，0 表示不模拟")
+    parser.add_argument("--token-rate", type=float, default=0.0, help="模拟的生成速度 (每秒 token 数)，0 表示不模拟生成耗时")
+    parser.add_argument("--output", type=str, help="把结果写入 JSON 文件 (可作为后续比较的基线)")
+    parser.add_argument("--compare", type=str, help="与基线 JSON 文件比较，出现回退时以非零状态码退出")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="允许的最大相对退化比例 (默认: 0.2)")
+    args = parser.parse_args()
+
+    result = run_benchmark(args.mode, args.size, args.jobs, args.auditors, args.latency,
+                           args.rate_limit_rate, args.error_rate, args.retry_after, args.seed, args.prefix_cache_min_tokens,
+                           args.token_rate)
+    print(json.dumps(result, indent=4, ensure_ascii=False))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=4, ensure_ascii=False)
+        print(f"BENCH: 结果已保存到 {args.output}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare_results(result, baseline, args.max_regression)
+        if regressions:
+            print("BENCH: 检测到性能回退:")
+            for line in regressions:
+                print(f"  - {line}")
+            sys.exit(1)
+        print("BENCH: 未检测到超过阈值的性能回退。")
+
+
+if __name__ == "__main__":
+    main()
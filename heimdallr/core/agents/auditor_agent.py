@@ -2,7 +2,10 @@ from typing import Dict, Any
 
 from heimdallr.core.agents.base_agent import BaseAgent
 from heimdallr.core.llm_connector import LLMConnector
-from heimdallr.core.prompts import AUDITOR_SYSTEM_PROMPT
+from heimdallr.core.history import NoHistory
+from heimdallr.core.prompts import (AUDITOR_SYSTEM_PROMPT, AUDITOR_SHARED_CONTEXT_TEMPLATE, AUDITOR_LINE_NUMBER_NOTE,
+                                     AUDITOR_TASK_TEMPLATE, AUDITOR_CASCADE_ASSESSMENT_NOTE,
+                                     AUDITOR_RELATED_CODE_TEMPLATE)
 
 class AuditorAgent(BaseAgent):
     """
@@ -11,8 +14,25 @@ class AuditorAgent(BaseAgent):
     - 深入分析代码，查找具体漏洞
     - 报告发现给 Manager
     """
-    def __init__(self, llm_connector: LLMConnector, model_name: str):
-        super().__init__(llm_connector, model_name, AUDITOR_SYSTEM_PROMPT)
+    # 每个审计任务的 prompt 已包含全部所需上下文，任务之间互不相关，无需保留历史
+    HISTORY_POLICY = NoHistory()
+
+    def __init__(self, llm_connector: LLMConnector, model_name: str, stream: bool = False):
+        super().__init__(llm_connector, model_name, AUDITOR_SYSTEM_PROMPT, stream=stream)
+
+    @staticmethod
+    def shared_context(context: Dict[str, Any]) -> str:
+        """
+        构造同一文件所有审计任务共享的 prompt 前缀（固定指令、文件路径和 Manager 的初步分析）。
+
+        共享部分放在 prompt 开头、每个任务不同的审计重点和代码片段放在末尾，
+        这样同一文件的各个 Auditor 请求可以命中提供商的前缀缓存。
+        """
+        return AUDITOR_SHARED_CONTEXT_TEMPLATE.format(
+            line_number_note=AUDITOR_LINE_NUMBER_NOTE if context.get('line_numbered') else "",
+            file_path=context.get('file_path') or 'N/A',
+            manager_analysis=context.get('manager_preliminary_analysis') or 'N/A'
+        )
 
     async def process_task(self, code_snippet: str, context: Dict[str, Any] = None) -> str:
         """
@@ -23,41 +43,34 @@ class AuditorAgent(BaseAgent):
             context (Dict[str, Any], optional):
                 包含任务重点 (task_focus), 目标漏洞类型 (target_vulnerabilities),
                 文件路径 (file_path), 和 Manager 的初步分析 (manager_preliminary_analysis) 等。
+                related_code 为代码索引提供的被调用者/调用者定义（见 heimdallr.tools.code_reader），提供时附在代码片段之后。
+                self_assessment 为 True 时（模型级联的初审），要求在报告末尾输出置信度和最高严重程度的自评行。
 
         返回:
             str: 包含审计发现的文本报告。
+
+        异常:
+            RuntimeError: 未能从 LLM 得到审计报告（网络问题或服务端错误）。失败不会被当作审计结果保存。
         """
         self.clear_history() # 每个独立审计任务开始前，可以考虑清空或选择性保留历史
 
-        file_path_info = f"代码片段来源文件: {context.get('file_path', 'N/A')}\n" if context and context.get('file_path') else ""
-        task_focus_info = f"Manager 指示的审计重点: {context.get('task_focus', 'N/A')}\n" if context and context.get('task_focus') else ""
-        vulnerabilities_info = f"Manager 要求特别关注的漏洞类型: {', '.join(context.get('target_vulnerabilities', ['N/A']))}\n" if context and context.get('target_vulnerabilities') else ""
-        manager_analysis_info = f"Manager 的初步分析摘要:\n{context.get('manager_preliminary_analysis', 'N/A')}\n" if context and context.get('manager_preliminary_analysis') else ""
-
-        prompt = (
-            f"{file_path_info}"
-            f"{task_focus_info}"
-            f"{vulnerabilities_info}"
-            f"{manager_analysis_info}"
-            f"\n请仔细审计以下代码片段:\n```\n{code_snippet}\n```\n"
-            f"请详细报告你发现的任何潜在安全漏洞，包括漏洞类型、具体位置（如行号，如果适用）、"
-            f"触发条件、潜在影响和可能的利用方式。"
-            f"如果没有发现明显漏洞，请明确说明，并简要解释原因。"
-            f"请确保你的分析是基于提供的上下文信息，并且尽可能深入和具体。"
+        context = context or {}
+        prompt = self.shared_context(context) + AUDITOR_TASK_TEMPLATE.format(
+            task_focus=context.get('task_focus') or '全面审计提供的代码片段。',
+            target_vulnerabilities=', '.join(context.get('target_vulnerabilities') or ['General Security Review']),
+            code_snippet=code_snippet
         )
+        if context.get('related_code'):
+            prompt += AUDITOR_RELATED_CODE_TEMPLATE.format(related_code=context['related_code'])
+        if context.get('self_assessment'):
+            prompt += AUDITOR_CASCADE_ASSESSMENT_NOTE
+
+        print(f"AUDITOR ({self.model_name}): 正在分析代码片段... Focus: {context.get('task_focus', 'N/A')}")
 
-        print(f"AUDITOR ({self.model_name}): 正在分析代码片段... Focus: {context.get('task_focus', 'N/A') if context else 'N/A'}")
-        
-        # 为了模拟异步行为，实际的 LLM 调用已经是阻塞的
-        # 在一个真正的异步应用中，llm_connector.invoke_llm 也会是 awaitable
-        # 这里我们保持 process_task 为 async，以便将来可以集成真正的异步I/O
-        
-        report = self.chat(prompt, context=None, temperature=0.4, max_tokens=2048) # 上下文已在 prompt 中
+        report = await self.achat(prompt, context=None, temperature=0.4, max_tokens=2048) # 上下文已在 prompt 中
 
         if not report:
-            report = "Auditor Agent 未能从 LLM 生成审计报告。这可能是一个网络问题或 LLM 服务端错误。"
             print(f"AUDITOR ({self.model_name}):未能生成报告。")
-        else:
-            print(f"AUDITOR ({self.model_name}): 分析完成。")
-            
+            raise RuntimeError("Auditor Agent 未能从 LLM 生成审计报告。这可能是一个网络问题或 LLM 服务端错误。")
+        print(f"AUDITOR ({self.model_name}): 分析完成。")
         return report 
\ No newline at end of file
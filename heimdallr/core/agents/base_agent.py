@@ -1,13 +1,42 @@
 from abc import ABC, abstractmethod
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Callable
 from heimdallr.core.llm_connector import LLMConnector
+from heimdallr.core.history import (HistoryPolicy, TokenCapHistory, HISTORY_SUMMARY_PROMPT, SUMMARY_MAX_TOKENS,
+                                    render_transcript)
+
+class _LineStreamPrinter:
+    """
+    把流式输出的增量文本按行打印并加上 Agent 前缀。
+    多个 Agent 并发流式输出时，按整行输出可以避免各自的内容在同一行内交错。
+    """
+    def __init__(self, prefix: str):
+        self.prefix = prefix
+        self._buffer = ""
+
+    def feed(self, delta: str):
+        self._buffer += delta
+        *lines, self._buffer = self._buffer.split("\n")
+        for line in lines:
+            print(f"{self.prefix} | {line}", flush=True)
+
+    def flush(self):
+        if self._buffer:
+            print(f"{self.prefix} | {self._buffer}", flush=True)
+            self._buffer = ""
+
 
 class BaseAgent(ABC):
     """
     Agent 的抽象基类。
     每个 Agent 都有一个 LLM 连接器、一个角色和一个模型名称。
+
+    对话历史的保留方式由 HISTORY_POLICY 决定（见 heimdallr.core.history），子类按自身的调用方式声明策略；
+    默认按 token 上限丢弃最早的交互，避免历史无限增长、每次请求都重新发送全部历史。
     """
-    def __init__(self, llm_connector: LLMConnector, model_name: str, system_prompt: str = None):
+    HISTORY_POLICY: HistoryPolicy = TokenCapHistory()
+
+    def __init__(self, llm_connector: LLMConnector, model_name: str, system_prompt: str = None, stream: bool = False,
+                 history_policy: HistoryPolicy = None):
         """
         初始化 BaseAgent。
 
@@ -15,11 +44,21 @@ class BaseAgent(ABC):
             llm_connector (LLMConnector): 用于与 LLM API 通信的连接器。
             model_name (str): 此 Agent 使用的 LLM 模型名称。
             system_prompt (str, optional): 此 Agent 的系统级提示。默认为 None。
+            stream (bool, optional): 是否以流式方式请求 LLM，并在生成过程中逐行打印输出。默认为 False。
+            history_policy (HistoryPolicy, optional): 覆盖该类声明的对话历史策略 HISTORY_POLICY。
         """
         self.llm_connector = llm_connector
         self.model_name = model_name
         self.system_prompt = system_prompt or "You are a helpful AI assistant."
         self.history: List[Dict[str, str]] = []
+        self.history_policy = history_policy or self.HISTORY_POLICY
+        self.stream = stream
+        # 流式输出时每行的前缀，例如 "MANAGER"、"AUDITOR-2"
+        self.display_name = self.__class__.__name__.replace("Agent", "").upper()
+        # 当前处理的文件，作为 LLM 调用指标的标签
+        self.file_path: str | None = None
+        # 是否把 achat 的请求交给 Batch API 离线执行（需要 LLMConnector 配置了 batch，见 heimdallr.core.batch）
+        self.batch = False
 
     def _construct_messages(self, user_query: str, context: Dict[str, Any] = None) -> List[Dict[str, str]]:
         """
@@ -42,7 +81,9 @@ class BaseAgent(ABC):
         messages.append({"role": "user", "content": user_query_with_context})
         return messages
 
-    def chat(self, user_query: str, context: Dict[str, Any] = None, temperature: float = 0.5, max_tokens: int = 2048) -> str | None:
+    def chat(self, user_query: str, context: Dict[str, Any] = None, temperature: float = 0.5, max_tokens: int = 2048,
+             record_history: bool = True, on_token: Callable[[str], None] = None,
+             response_format: Dict[str, Any] = None) -> str | None:
         """
         与 LLM 进行单轮对话。
 
@@ -51,10 +92,18 @@ class BaseAgent(ABC):
             context (Dict[str, Any], optional): 提供给 LLM 的附加上下文信息。
             temperature (float, optional): LLM 的温度参数。默认为 0.5。
             max_tokens (int, optional): LLM 生成的最大 token 数。默认为 2048。
+            record_history (bool, optional): 是否把本轮交互写入历史记录。默认为 True。
+            on_token (Callable[[str], None], optional): 增量文本回调。提供时以流式方式请求，
+                调用方可以在响应生成过程中增量解析输出。默认为 None。
+            response_format (Dict[str, Any], optional): 结构化输出格式（JSON 模式 / JSON Schema），见 LLMConnector。
 
         返回:
             str | None: LLM 的响应文本，如果出错则为 None。
         """
+        split = self.history_policy.compaction_split(self.history, self.model_name)
+        if split:
+            summary = self.llm_connector.invoke_llm(**self._summary_request(split))
+            self._apply_compaction(split, summary)
         messages = self._construct_messages(user_query, context)
         
         # print(f"--- Sending to {self.model_name} ({self.__class__.__name__}) ---")
@@ -62,18 +111,95 @@ class BaseAgent(ABC):
         #     print(f"{msg['role'].capitalize()}: {msg['content'][:200]}{'...' if len(msg['content']) > 200 else ''}")
         # print("----------------------------------------------------")
 
+        printer = self._stream_printer()
         response = self.llm_connector.invoke_llm(
             model=self.model_name,
             messages=messages,
             temperature=temperature,
-            max_tokens=max_tokens
+            max_tokens=max_tokens,
+            on_token=self._token_callback(printer, on_token),
+            labels=self._metrics_labels(),
+            response_format=response_format
         )
-        
-        if response:
+        if printer:
+            printer.flush()
+        if record_history:
+            self._record_exchange(user_query, response)
+        return response
+
+    async def achat(self, user_query: str, context: Dict[str, Any] = None, temperature: float = 0.5, max_tokens: int = 2048,
+                    record_history: bool = True, on_token: Callable[[str], None] = None,
+                    response_format: Dict[str, Any] = None) -> str | None:
+        """
+        chat 的异步版本。通过 LLMConnector.ainvoke_llm 发起请求，等待期间不会阻塞事件循环，
+        因此多个 Agent 的调用可以并发执行。参数和返回值与 chat 相同。
+        """
+        split = self.history_policy.compaction_split(self.history, self.model_name)
+        if split:
+            summary = await self.llm_connector.ainvoke_llm(**self._summary_request(split))
+            self._apply_compaction(split, summary)
+        messages = self._construct_messages(user_query, context)
+        printer = self._stream_printer()
+        response = await self.llm_connector.ainvoke_llm(
+            model=self.model_name,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            on_token=self._token_callback(printer, on_token),
+            labels=self._metrics_labels(),
+            response_format=response_format,
+            batch=self.batch
+        )
+        if printer:
+            printer.flush()
+        if record_history:
+            self._record_exchange(user_query, response)
+        return response
+
+    def _summary_request(self, split: int) -> Dict[str, Any]:
+        """构造把前 split 条历史消息压缩为摘要的 LLM 请求参数。"""
+        print(f"{self.display_name}: 对话历史超出上限，正在将 {split} 条较早的消息压缩为摘要...")
+        return {
+            "model": self.model_name,
+            "messages": [
+                {"role": "system", "content": HISTORY_SUMMARY_PROMPT},
+                {"role": "user", "content": render_transcript(self.history[:split])},
+            ],
+            "temperature": 0.2,
+            "max_tokens": SUMMARY_MAX_TOKENS,
+            "labels": self._metrics_labels(),
+        }
+
+    def _apply_compaction(self, split: int, summary: str | None):
+        if not summary:
+            print(f"{self.display_name}: 未能生成历史摘要，改为丢弃最早的消息。")
+        self.history = self.history_policy.compact(self.history, split, summary, self.model_name)
+
+    def _metrics_labels(self) -> Dict[str, str]:
+        """LLM 调用指标的标签：Agent 类名和当前文件。"""
+        return {"agent": self.__class__.__name__, "file": self.file_path}
+
+    @staticmethod
+    def _token_callback(printer: _LineStreamPrinter | None, on_token: Callable[[str], None] | None) -> Callable[[str], None] | None:
+        """合并逐行打印器和调用方的增量文本回调；两者都没有时返回 None（非流式请求）。"""
+        if printer and on_token:
+            def callback(delta: str):
+                printer.feed(delta)
+                on_token(delta)
+            return callback
+        return on_token or (printer.feed if printer else None)
+
+    def _stream_printer(self) -> _LineStreamPrinter | None:
+        """启用流式输出时返回本次调用使用的逐行打印器，否则返回 None。"""
+        return _LineStreamPrinter(f"{self.display_name} ({self.model_name})") if self.stream else None
+
+    def _record_exchange(self, user_query: str, response: str | None):
+        """将一轮成功的交互写入历史记录，并按历史策略裁剪。"""
+        if response and self.history_policy.keep_history:
             # 将当前交互（不包括上下文，因为它已融入user_query）和响应添加到历史记录
             self.history.append({"role": "user", "content": user_query}) # 记录原始 user_query
             self.history.append({"role": "assistant", "content": response})
-        return response
+            self.history = self.history_policy.trim(self.history, self.model_name)
 
     def clear_history(self):
         """清空对话历史。"""
@@ -1,8 +1,23 @@
-from typing import Dict, Any
+from typing import Dict, Any, List
+import asyncio
 
 from heimdallr.core.agents.base_agent import BaseAgent
 from heimdallr.core.llm_connector import LLMConnector
-from heimdallr.core.prompts import CHECKER_SYSTEM_PROMPT
+from heimdallr.core.history import NoHistory
+from heimdallr.core.findings import Finding, VERDICT_LABELS
+from heimdallr.core.json_stream import repair_json
+from heimdallr.core.prompts import (CHECKER_SYSTEM_PROMPT, CHECKER_REVIEW_INSTRUCTIONS, CHECKER_MATERIALS_TEMPLATE,
+                                     CHECKER_FINDING_INSTRUCTIONS, CHECKER_FINDING_TEMPLATE, CHECKER_FINDING_RESPONSE_FORMAT,
+                                     CHECKER_CROSS_FINDING_INSTRUCTIONS, CHECKER_CROSS_FINDING_TEMPLATE)
+
+CHECKER_MODES = ("auto", "single", "per-finding")
+DEFAULT_CHECKER_MODE = "auto"
+# auto 模式下，一次性复核的材料超过该 token 数时改为逐条复核
+CHECKER_SINGLE_PASS_TOKENS = 6000
+# 逐条复核模式下同时进行的复核请求数上限
+CHECKER_MAX_CONCURRENCY = 8
+FINDING_CHECK_MAX_TOKENS = 512
+CROSS_CHECK_MAX_TOKENS = 1024
 
 class CheckerAgent(BaseAgent):
     """
@@ -11,9 +26,18 @@ class CheckerAgent(BaseAgent):
     - 复核整个审计流程和结论
     - 查找误报和漏报
     - 提供反馈给 Manager
+
+    支持两种复核方式：process_task 把所有材料放进一次请求；verify_findings 对每条发现只配上它引用的代码片段
+    并发复核，再做一次很小的跨发现复核，耗时取决于最慢的一条发现而不是整个文件。
+    逐条复核也可以分开进行：check_finding 复核单条发现（Manager 在该发现所属的 Auditor 完成后立即调用），
+    全部完成后再调用 cross_check。
     """
-    def __init__(self, llm_connector: LLMConnector, model_name: str):
-        super().__init__(llm_connector, model_name, CHECKER_SYSTEM_PROMPT)
+    # 复核 prompt 已包含 Manager 分析、Auditor 发现和代码片段，无需保留历史
+    HISTORY_POLICY = NoHistory()
+
+    def __init__(self, llm_connector: LLMConnector, model_name: str, stream: bool = False):
+        super().__init__(llm_connector, model_name, CHECKER_SYSTEM_PROMPT, stream=stream)
+        self._check_slots = asyncio.Semaphore(CHECKER_MAX_CONCURRENCY)
 
     async def process_task(self, task_description: str, context: Dict[str, Any] = None) -> str:
         """
@@ -22,42 +46,110 @@ class CheckerAgent(BaseAgent):
         参数:
             task_description (str): 通常是 Manager 请求校验的指令。
             context (Dict[str, Any], optional):
-                包含原始代码 (original_code), 文件路径 (file_path),
+                包含审计发现所引用的代码片段 (code_slices，带行号；也兼容完整的 original_code), 文件路径 (file_path),
                 Auditor 的发现摘要 (auditor_findings_summary),
                 以及 Manager 的初步分析 (manager_initial_analysis)。
 
         返回:
             str: 包含校验反馈的文本。
+
+        异常:
+            RuntimeError: 未能从 LLM 得到校验反馈，异常信息为代替反馈的说明文本。
         """
         self.clear_history()
 
-        original_code_info = f"原始代码 (文件: {context.get('file_path', 'N/A')}):\n```\n{context.get('original_code', '[代码未提供]')}\n```\n" if context else ""
-        manager_analysis_info = f"Manager 的初步分析:\n{context.get('manager_initial_analysis', 'N/A')}\n" if context else ""
-        auditor_summary_info = f"Auditor Agents 的综合发现:\n{context.get('auditor_findings_summary', 'N/A')}\n" if context else ""
-
-        prompt = (
-            f"{task_description}\n\n"
-            f"以下是相关的审计材料，请仔细复核：\n"
-            f"1. Manager Agent 的初步分析和任务分解逻辑:\n{manager_analysis_info}\n"
-            f"2. Auditor Agents 提交的审计发现摘要:\n{auditor_summary_info}\n"
-            f"3. 相关的原始代码片段 (如果适用，通常 Manager 的分析和 Auditor 的报告中会引用):\n{original_code_info}\n"
-            f"\n你的任务是批判性地评估以上信息。请指出：\n"
-            f"- 是否存在明显的误报 (False Positives)？请说明理由。\n"
-            f"- 是否有 Auditor 可能遗漏的潜在漏洞 (False Negatives) 或风险点？特别注意不同代码部分交互可能产生的问题。\n"
-            f"- Auditor 的分析逻辑是否合理、一致、充分？\n"
-            f"- Manager 的任务分解和整体分析是否恰当？\n"
-            f"- 对于发现的漏洞，其风险评估是否准确？\n"
-            f"请提供具体的、可操作的反馈，帮助 Manager 提高最终审计报告的质量。"
+        context = context or {}
+        # 固定的复核指令放在最前面，文件相关的材料放在后面，使各文件的 Checker 请求共享同一前缀
+        prompt = CHECKER_MATERIALS_TEMPLATE.format(
+            instructions=CHECKER_REVIEW_INSTRUCTIONS,
+            task_description=task_description,
+            file_path=context.get('file_path') or 'N/A',
+            manager_analysis=context.get('manager_initial_analysis') or 'N/A',
+            auditor_findings=context.get('auditor_findings_summary') or 'N/A',
+            code_slices=context.get('code_slices') or context.get('original_code') or '[审计发现未引用具体代码行]'
         )
-        
+
         print(f"CHECKER ({self.model_name}): 正在校验审计结果...")
 
-        feedback = self.chat(prompt, context=None, temperature=0.3, max_tokens=2048) # 上下文已在 prompt 中构建
+        feedback = await self.achat(prompt, context=None, temperature=0.3, max_tokens=2048) # 上下文已在 prompt 中构建
 
         if not feedback:
-            feedback = "Checker Agent 未能从 LLM 生成校验反馈。"
             print(f"CHECKER ({self.model_name}): 未能生成反馈。")
-        else:
-            print(f"CHECKER ({self.model_name}): 校验完成。")
+            raise RuntimeError("Checker Agent 未能从 LLM 生成校验反馈。")
+        print(f"CHECKER ({self.model_name}): 校验完成。")
+        return feedback
+
+    async def verify_findings(self, findings: List[Finding], context: Dict[str, Any] = None) -> str:
+        """
+        逐条并发复核审计发现，再做一次跨发现的综合复核（检查发现之间的交互和遗漏）。
+
+        参数:
+            findings (List[Finding]): 待复核的发现，code_slice 为各自引用的代码片段。复核结论写回每个 Finding。
+            context (Dict[str, Any], optional): 包含文件路径 (file_path) 和 Manager 的初步分析 (manager_initial_analysis)。
 
-        return feedback 
\ No newline at end of file
+        返回:
+            str: 逐条结论和跨发现复核合并后的反馈文本。跨发现复核失败时与 cross_check 相同，抛出 RuntimeError。
+        """
+        self.clear_history()
+        context = context or {}
+        print(f"CHECKER ({self.model_name}): 正在逐条复核 {len(findings)} 条审计发现...")
+        await asyncio.gather(*(self.check_finding(f, context.get('file_path')) for f in findings))
+        return await self.cross_check(findings, context)
+
+    async def check_finding(self, finding: Finding, file_path: str = None) -> bool:
+        """
+        复核单条发现，结论写回 finding。同一 Checker 同时进行的复核请求不超过 CHECKER_MAX_CONCURRENCY；
+        复核失败时结论为 "uncertain"，不会抛出异常。
+
+        返回:
+            bool: 是否得到了 Checker 的有效结论。
+        """
+        prompt = CHECKER_FINDING_TEMPLATE.format(
+            instructions=CHECKER_FINDING_INSTRUCTIONS,
+            file_path=file_path or 'N/A',
+            unit_id=finding.unit_id,
+            finding=finding.text,
+            code_slice=finding.code_slice or '[该发现未引用具体代码行]'
+        )
+        try:
+            async with self._check_slots:
+                response = await self.achat(prompt, temperature=0.3, max_tokens=FINDING_CHECK_MAX_TOKENS,
+                                            response_format=CHECKER_FINDING_RESPONSE_FORMAT)
+        except Exception as e:
+            finding.verdict = "uncertain"
+            finding.reason = f"复核时发生异常: {e}"
+            return False
+        verdict = repair_json(response) if response else None
+        if isinstance(verdict, dict) and verdict.get("verdict") in VERDICT_LABELS:
+            finding.verdict = verdict["verdict"]
+            finding.severity = verdict.get("severity")
+            finding.reason = str(verdict.get("reason", ""))
+            return True
+        finding.verdict = "uncertain"
+        finding.reason = response or "Checker 未能给出该发现的复核结论。"
+        return False
+
+    async def cross_check(self, findings: List[Finding], context: Dict[str, Any] = None) -> str:
+        """
+        在所有发现都已逐条复核后做跨发现复核，返回逐条结论和跨发现复核合并后的反馈文本。context 与 verify_findings 相同。
+        未能从 LLM 得到跨发现复核时抛出 RuntimeError，异常信息为只包含逐条结论的反馈文本。
+        """
+        context = context or {}
+        verdicts = "\n".join(
+            f"- [{VERDICT_LABELS[f.verdict]}{f'/{f.severity}' if f.severity else ''}] {f.location}: {f.reason}"
+            for f in findings
+        )
+        cross_prompt = CHECKER_CROSS_FINDING_TEMPLATE.format(
+            instructions=CHECKER_CROSS_FINDING_INSTRUCTIONS,
+            file_path=context.get('file_path') or 'N/A',
+            manager_analysis=context.get('manager_initial_analysis') or 'N/A',
+            verdicts=verdicts
+        )
+        cross_feedback = await self.achat(cross_prompt, temperature=0.3, max_tokens=CROSS_CHECK_MAX_TOKENS)
+        counts = {label: sum(f.verdict == key for f in findings) for key, label in VERDICT_LABELS.items()}
+        print(f"CHECKER ({self.model_name}): 逐条复核完成 ({', '.join(f'{k} {v}' for k, v in counts.items())})。")
+        feedback = (f"逐条复核 ({len(findings)} 条发现):\n{verdicts}\n\n"
+                    f"跨发现复核:\n{cross_feedback or 'Checker Agent 未能生成跨发现复核反馈。'}")
+        if not cross_feedback:
+            raise RuntimeError(feedback)
+        return feedback
@@ -1,11 +1,54 @@
-from typing import Dict, Any, List
-import json # 用于解析 LLM 可能返回的 JSON 格式的子任务
+from typing import Dict, Any, List, Callable, Awaitable
+import asyncio
+import json # 用于解析 LLM 返回的 JSON 格式的单元标注和最终结论
+import re
 
 from heimdallr.core.agents.base_agent import BaseAgent
 from heimdallr.core.llm_connector import LLMConnector
-from heimdallr.core.prompts import MANAGER_SYSTEM_PROMPT
+from heimdallr.core.history import NoHistory
+from heimdallr.core.prompts import (MANAGER_SYSTEM_PROMPT, AUDITOR_SYSTEM_PROMPT, CHECKER_SYSTEM_PROMPT,
+                                     MANAGER_ANNOTATION_INSTRUCTIONS, MANAGER_ANNOTATION_TEMPLATE,
+                                     MANAGER_ANNOTATION_RESPONSE_FORMAT, MANAGER_FINAL_REPORT_INSTRUCTIONS,
+                                     MANAGER_FINAL_REPORT_TEMPLATE, MANAGER_FINAL_REPORT_RESPONSE_FORMAT,
+                                     AUDITOR_DUPLICATE_DELTA_FOCUS, AUDITOR_LOW_RISK_BATCH_FOCUS,
+                                     AUDITOR_CASCADE_ESCALATION_FOCUS)
 from heimdallr.core.agents.auditor_agent import AuditorAgent # 稍后会创建
-from heimdallr.core.agents.checker_agent import CheckerAgent # 稍后会创建
+from heimdallr.core.agents.checker_agent import (CheckerAgent, DEFAULT_CHECKER_MODE, CHECKER_SINGLE_PASS_TOKENS,
+                                                  FINDING_CHECK_MAX_TOKENS)
+from heimdallr.core.code_units import (CodeUnit, extract_units, format_numbered_lines,
+                                       extract_line_references, render_line_slices)
+from heimdallr.core.incremental import plan_incremental, build_unit_state
+from heimdallr.core.events import EventStream
+from heimdallr.core.json_stream import StreamingJSONParser, repair_json
+from heimdallr.core.dedup import DuplicateIndex, DuplicateMatch, render_delta
+from heimdallr.core.risk import RiskAssessment, assess_units, DEFAULT_RISK_FILTER
+from heimdallr.core.findings import Finding, split_findings, split_report_segments
+from heimdallr.core.cascade import CascadePolicy, ESCALATION_REASONS, parse_assessment
+from heimdallr.core.checkpoint import (FileCheckpoint, STAGE_ANALYSIS, STAGE_AUDITOR, STAGE_CHECKER, STAGE_FINAL,
+                                       input_digest)
+from heimdallr.core.scheduler import TaskGraph
+from heimdallr.core.token_budget import (DEFAULT_MAX_PROMPT_TOKENS, count_tokens, prompt_budget,
+                                         plan_line_windows, truncate_to_tokens)
+from heimdallr.tools.code_reader import CodeIndex, DEFAULT_CODE_CONTEXT_TOKENS
+
+DEFAULT_NUM_AUDITORS = 3
+PRIORITY_ORDER = {"high": 0, "medium": 1, "low": 2}
+# 各阶段 LLM 输出的 token 上限，同时用于计算 prompt 的可用预算
+ANNOTATION_MAX_TOKENS = 1536
+AUDITOR_MAX_TOKENS = 2048
+CHECKER_MAX_TOKENS = 2048
+# 切分窗口时相邻窗口重叠的行数
+WINDOW_OVERLAP_LINES = 20
+# Checker 看到的代码片段在被引用行前后扩展的行数
+CHECKER_CONTEXT_LINES = 3
+# 逐条复核的发现数超过该值时，同一单元的发现合并为一条复核
+CHECKER_MAX_FINDINGS = 40
+# 低风险单元批量快速检查时，每个批次最多包含的单元数
+LOW_RISK_BATCH_MAX_UNITS = 8
+# 批处理模式下同一文件同时等待批任务结果的子任务数上限
+BATCH_AUDITOR_SLOTS = 1024
+# Auditor prompt 中除代码、系统提示和 Manager 分析之外的固定说明部分的估算 token 数
+_AUDITOR_PROMPT_OVERHEAD = 400
 
 class ManagerAgent(BaseAgent):
     """
@@ -17,173 +60,874 @@ class ManagerAgent(BaseAgent):
     - 请求 Checker Agent 校验
     - 生成最终报告
     """
-    def __init__(self, llm_connector: LLMConnector, model_name: str, auditor_model_name: str, checker_model_name: str):
-        super().__init__(llm_connector, model_name, MANAGER_SYSTEM_PROMPT)
+    # 最终总结的 prompt 已包含初步分析、Auditor 发现和 Checker 反馈，保留历史只会让初步分析时发送过的整个源文件再发送一遍
+    HISTORY_POLICY = NoHistory()
+
+    def __init__(self, llm_connector: LLMConnector, model_name: str, auditor_model_name: str, checker_model_name: str,
+                 num_auditors: int = DEFAULT_NUM_AUDITORS, max_prompt_tokens: int = DEFAULT_MAX_PROMPT_TOKENS,
+                 stream: bool = False, events: EventStream = None, duplicate_index: DuplicateIndex = None,
+                 risk_filter: str = DEFAULT_RISK_FILTER, checker_mode: str = DEFAULT_CHECKER_MODE,
+                 cascade: CascadePolicy = None, batch: bool = False, code_index: CodeIndex = None,
+                 code_context_tokens: int = DEFAULT_CODE_CONTEXT_TOKENS):
+        """
+        参数:
+            num_auditors (int, optional): Auditor 池的大小，同时也是并发执行子任务的上限。默认为 3。
+            max_prompt_tokens (int, optional): 单次请求 prompt 的 token 上限（同时受各模型上下文窗口限制）。
+                超出时，Manager 的初步分析按重叠窗口分段进行，过大的代码单元拆分为多个 Auditor 子任务。
+            stream (bool, optional): 是否让 Manager 及其创建的 Auditor/Checker 以流式方式输出。默认为 False。
+            events (EventStream, optional): JSONL 事件流。提供时，每个阶段的结果一产生就写出一个事件。
+            duplicate_index (DuplicateIndex, optional): 跨文件共享的近似重复代码索引。提供时，与已审计单元重复的单元
+                复用其审计结果，近似副本只把差异行交给 Auditor 复核。
+            risk_filter (str, optional): 本地静态风险预筛（见 heimdallr.core.risk）。"batch"：低风险单元不交给 Manager 分析，
+                而是打包成少量批次快速检查；"skip"：低风险单元不交给 LLM 审计；"off"：不预筛。
+                启用时各单元的风险分数作为提示交给 Manager，高风险单元先审计。默认为 "batch"。
+            checker_mode (str, optional): Checker 的复核方式。"single"：所有材料一次复核；"per-finding"：把 Auditor 报告拆分为
+                逐条发现，各自只配上引用的代码片段并发复核（每个单元的发现在其 Auditor 完成后立即开始复核），再做一次跨发现复核；
+                "auto"：材料较多时使用逐条复核（累计的审计材料一超过阈值就开始复核已完成的单元）。默认为 "auto"。
+            cascade (CascadePolicy, optional): 模型级联策略（见 heimdallr.core.cascade）。提供时所有子任务先由快速模型审计，
+                只有自评为低置信度或高严重程度的子任务再交给 auditor_model_name 复审（另有一个同样大小的 Auditor 池）。
+            batch (bool, optional): 是否把 Auditor 请求交给 Batch API 离线执行（LLMConnector 需配置 batch）。
+                此时 num_auditors 不再限制并发：所有子任务的请求同时进入批任务排队；Manager 和 Checker 仍直接请求。
+            code_index (CodeIndex, optional): 仓库的符号/调用图索引（见 heimdallr.tools.code_reader）。提供时每个单元的 Auditor 子任务
+                附带该单元调用到的定义和调用它的单元（可能位于其他文件），最多占用 code_context_tokens 个 token。
+        """
+        super().__init__(llm_connector, model_name, MANAGER_SYSTEM_PROMPT, stream=stream)
         self.auditors: List[AuditorAgent] = []
         self.checker: CheckerAgent = None
         self.auditor_model_name = auditor_model_name
         self.checker_model_name = checker_model_name
-        # 在实际使用中，可能需要动态创建或配置 Auditor
-        # 这里只是一个基本框架
+        self.num_auditors = max(1, num_auditors)
+        self.max_prompt_tokens = max_prompt_tokens
+        self.events = events
+        self.duplicate_index = duplicate_index
+        self.risk_filter = risk_filter
+        self.checker_mode = checker_mode
+        self.cascade = cascade
+        self.batch_auditors = batch
+        self.code_index = code_index
+        self.code_context_tokens = code_context_tokens
+        self.strong_auditors: List[AuditorAgent] = []
+        self._strong_pool: asyncio.Queue = None
+        self._cascade_decisions: List[Dict[str, Any]] = []
+        self._checkpoint: FileCheckpoint = None
 
     def _initialize_auditors(self, num_auditors: int = 1):
-        """根据需要初始化 Auditor Agents"""
+        """根据需要初始化 Auditor Agents；启用模型级联时，Auditor 池使用快速模型，另建一个强模型的复审池。"""
         self.auditors = [
-            AuditorAgent(self.llm_connector, model_name=self.auditor_model_name)
+            AuditorAgent(self.llm_connector, model_name=self.cascade.fast_model if self.cascade else self.auditor_model_name,
+                         stream=self.stream)
             for _ in range(num_auditors)
         ]
+        for i, auditor in enumerate(self.auditors):
+            auditor.display_name = f"AUDITOR-{i+1}"
+        if self.cascade:
+            self.strong_auditors = [
+                AuditorAgent(self.llm_connector, model_name=self.auditor_model_name, stream=self.stream)
+                for _ in range(num_auditors)
+            ]
+            for i, auditor in enumerate(self.strong_auditors):
+                auditor.display_name = f"AUDITOR-STRONG-{i+1}"
+        for auditor in self.auditors + self.strong_auditors:
+            auditor.batch = self.batch_auditors
 
     def _initialize_checker(self):
         """初始化 Checker Agent"""
-        self.checker = CheckerAgent(self.llm_connector, model_name=self.checker_model_name)
+        self.checker = CheckerAgent(self.llm_connector, model_name=self.checker_model_name, stream=self.stream)
+
+    def _attach_metrics(self, report: Dict[str, Any], file_path: str = None):
+        """把本文件的 LLM 调用指标（token 用量、延迟、重试、缓存命中等）写入报告。"""
+        if self.llm_connector.metrics:
+            report["metrics"] = self.llm_connector.metrics.snapshot(file=file_path)
+
+    def _emit(self, event: str, file_path: str = None, **fields):
+        """向事件流写出一个带文件路径的事件（未配置事件流时忽略）。"""
+        if self.events:
+            self.events.emit(event, file_path=file_path, **fields)
+
 
-    async def process_task(self, code_content: str, file_path: str = None) -> Dict[str, Any]:
+    async def process_task(self, code_content: str, file_path: str = None, previous_unit_state: Dict[str, Any] = None,
+                           checkpoint: FileCheckpoint = None) -> Dict[str, Any]:
         """
         Manager Agent 的核心处理流程。
 
+        代码先在本地按函数/类切分为代码单元（见 heimdallr.core.code_units），Manager LLM 只负责
+        概述代码并为各单元排序、标注审计重点；每个单元作为一个子任务交给 Auditor。
+        各阶段作为任务 DAG 执行（见 heimdallr.core.scheduler.TaskGraph），每个节点在其依赖完成后立即开始。
+
         参数:
             code_content (str): 要分析的源代码内容。
             file_path (str, optional): 源代码的文件路径，用于上下文。
+            previous_unit_state (Dict[str, Any], optional): 上一次审计保存的单元状态。提供时（包括空字典）启用增量模式：
+                只有新增或修改的单元及其直接调用者会交给 Auditor，其余单元复用上次的结果。
+            checkpoint (FileCheckpoint, optional): 本文件的检查点（见 heimdallr.core.checkpoint）。提供时每个阶段
+                （初步分析、每个 Auditor 子任务、Checker 复核、最终总结）从 LLM 得到结果后立即持久化，
+                已保存的阶段直接复用而不再请求 LLM；未能得到结果的阶段不保存，恢复时重新请求。
 
         返回:
-            Dict[str, Any]: 包含审计结果的报告。
+            Dict[str, Any]: 包含审计结果的报告。其中 "unit_state" 为本次的单元状态，供下次增量审计使用；
+                "duplicates" 记录复用了其他单元审计结果的重复单元，"risk" 为各单元的本地静态风险评估，
+                "checker_verdicts" 为逐条复核模式下每条发现的复核结论，"cascade" 为模型级联的初审自评和升级记录，
+                "pipeline" 为阶段 DAG 的总耗时、各阶段耗时之和与关键路径。
+        """
+        self._checkpoint = checkpoint
+        try:
+            return await self._audit_file(code_content, file_path, previous_unit_state)
+        finally:
+            self._checkpoint = None
+            if self.duplicate_index:
+                # 本文件登记的规范单元若未能发布审计结果（中途出错或被取消），等待它的副本改为自行审计
+                self.duplicate_index.release(file_path)
+
+    async def _audit_file(self, code_content: str, file_path: str = None, previous_unit_state: Dict[str, Any] = None) -> Dict[str, Any]:
+        """
+        process_task 的主体流程：在本地切分代码单元并规划本次审计（增量复用、静态风险预筛、跨文件重复检测），
+        再由 FileAudit 按阶段构建并执行任务 DAG。
         """
         self.clear_history() # 开始新任务前清空历史
-        self._initialize_auditors(num_auditors=1) # 简化：暂时只用一个 auditor
+        self._initialize_auditors(num_auditors=self.num_auditors)
         self._initialize_checker()
+        for agent in [self, self.checker, *self.auditors, *self.strong_auditors]:
+            agent.file_path = file_path
+        self._cascade_decisions = []
+
+        units = extract_units(code_content, file_path)
+        if not units:
+            return {"error": "文件中没有可审计的代码。"}
+        self._emit("units_extracted", file_path, units=[
+            {"unit_id": u.unit_id, "start_line": u.start_line, "end_line": u.end_line} for u in units])
+
+        incremental = previous_unit_state is not None
+        if incremental:
+            dirty_units, reused_findings = plan_incremental(units, previous_unit_state)
+            print(f"MANAGER: 增量审计: {len(dirty_units)}/{len(units)} 个代码单元需要重新审计，"
+                  f"{len(reused_findings)} 个单元复用上次的审计结果。")
+            self._register_reused_units(units, reused_findings, file_path)
+            file_level = previous_unit_state.get("file_level") or {}
+            if not dirty_units and file_level:
+                return self._reused_report(file_path, units, reused_findings, file_level)
+        else:
+            dirty_units, reused_findings = units, {}
+        print(f"MANAGER: 本地切分得到 {len(units)} 个代码单元。")
+        risk, low_risk = self._assess_risk(units, dirty_units, file_path)
+        low_risk_ids = {u.unit_id for u in low_risk}
+        dirty_units = [u for u in dirty_units if u.unit_id not in low_risk_ids]
+        duplicates = self._claim_duplicates(dirty_units, file_path)
+
+        if not self.auditors:
+            self._initialize_auditors(1) # 确保至少有一个auditor
+        self._strong_pool = self._auditor_pool(self.strong_auditors)
+        audit = FileAudit(self, code_content, file_path, units, incremental=incremental, reused_findings=reused_findings,
+                          risk=risk, low_risk=low_risk, duplicates=duplicates)
+        return await audit.run([u for u in dirty_units if u.unit_id not in duplicates])
+
+    def _reused_report(self, file_path: str, units: List[CodeUnit], reused_findings: Dict[str, str],
+                       file_level: Dict[str, Any]) -> Dict[str, Any]:
+        """增量模式下文件完全未变化时，直接用上次保存的文件级结论和单元审计结果组成报告。"""
+        print("MANAGER: 文件内容未发生变化，直接复用上次的审计报告。")
+        report = self._new_report(file_path, file_level.get("manager_preliminary_analysis", ""),
+                                  self._combine_auditor_reports(units, {}, reused_findings),
+                                  file_level.get("checker_validation_feedback", ""))
+        report["final_conclusion"] = file_level.get("final_conclusion", report["final_conclusion"])
+        report["recommendations"] = file_level.get("recommendations", report["recommendations"])
+        if file_level.get("checker_verdicts"):
+            report["checker_verdicts"] = file_level["checker_verdicts"]
+        report["incremental"] = {"audited_units": [], "reused_units": list(reused_findings)}
+        report["unit_state"] = build_unit_state(file_path, units, reused_findings, file_level=file_level)
+        self._attach_metrics(report, file_path)
+        self._emit("final_report", file_path, reused=True, final_conclusion=report["final_conclusion"],
+                   recommendations=report["recommendations"])
+        return report
+
+    def _assess_risk(self, units: List[CodeUnit], dirty_units: List[CodeUnit], file_path: str) -> tuple:
+        """
+        本地静态风险预筛（risk_filter 为 "off" 时不评估）。
+
+        返回:
+            tuple: ({unit_id: RiskAssessment}, 需要审计的单元中的低风险单元列表)。
+        """
+        risk = assess_units(units) if self.risk_filter != "off" else {}
+        low_risk = [u for u in dirty_units if u.unit_id in risk and risk[u.unit_id].level == "low"]
+        if risk:
+            self._emit("risk_assessed", file_path, units=[
+                {"unit_id": unit_id, "score": r.score, "level": r.level, "signals": r.signals} for unit_id, r in risk.items()])
+        if low_risk:
+            action = "跳过 LLM 审计" if self.risk_filter == "skip" else "批量快速检查"
+            print(f"MANAGER: 本地静态分析判定 {len(low_risk)}/{len(dirty_units)} 个单元为低风险，将{action}。")
+        return risk, low_risk
+
+    def _restore(self, stage: str, key: str = "") -> Any:
+        """读取本文件检查点中已保存的阶段输出；未启用检查点或没有保存时返回 None。"""
+        return self._checkpoint.get(stage, key) if self._checkpoint else None
+
+    def _save(self, stage: str, value: Any, key: str = ""):
+        if self._checkpoint:
+            self._checkpoint.put(stage, value, key)
+
+    @staticmethod
+    def _sub_task_key(task: Dict[str, Any]) -> str:
+        """子任务在检查点中的标识：单元（或低风险批次内的所有单元）加上拆分部分的标签。"""
+        if task.get("batch_units"):
+            return f"batch:{','.join(task['batch_units'])}"
+        return f"unit:{task['unit_id']}#{task.get('part') or ''}"
 
-        initial_analysis_prompt = (
-            f"请分析以下位于 '{file_path if file_path else 'unknown file'}' 的代码。\n"
-            f"首先，对代码的核心功能进行概述。\n"
-            f"然后，识别出需要重点审计的关键代码区域或函数，并说明为什么这些区域是关键的。\n"
-            f"最后，请将审计任务分解成1到3个具体的子任务，说明每个子任务要审计的代码片段（可以直接引用或描述定位方式），以及需要 Auditor Agent 特别关注的潜在漏洞类型。\n"
-            f"以JSON格式返回子任务列表，每个子任务包含 'code_snippet' (字符串，相关代码), 'focus' (字符串，审计关注点), 'target_vulnerabilities' (列表字符串，如 ['Buffer Overflow', 'SQL Injection'])。 \n"
-            f"代码如下:\n```\n{code_content}\n```"
+    async def _checkpointed(self, key: str, run) -> str:
+        """
+        执行一个子任务协程，完成后把报告写入检查点；检查点中已有该子任务的报告时直接返回，不再执行（协程被关闭）。
+        失败的子任务（包括 Auditor 未能从 LLM 得到报告）抛出异常，不写入检查点，恢复时会重新审计。
+        """
+        saved = self._restore(STAGE_AUDITOR, key)
+        if saved is not None:
+            run.close()
+            return saved
+        report = await run
+        self._save(STAGE_AUDITOR, report, key)
+        return report
+
+    def _restored_sub_tasks(self, saved_tasks: List[Dict[str, Any]], annotate_units: List[CodeUnit]) -> List[Dict[str, Any]]:
+        """
+        使用检查点中的子任务列表。需要分析的单元与保存时不同（例如跨文件重复检测的结果不同）时，
+        只保留仍需分析的单元，缺少标注的单元以默认关注点审计。
+        """
+        target_ids = {u.unit_id for u in annotate_units}
+        sub_tasks = [task for task in saved_tasks if task["unit_id"] in target_ids]
+        saved_ids = {task["unit_id"] for task in sub_tasks}
+        return sub_tasks + [self._unit_sub_task(u) for u in annotate_units if u.unit_id not in saved_ids]
+
+    async def _annotate_units(self, target_units: List[CodeUnit], all_units: List[CodeUnit], code_content: str,
+                              file_path: str = None, incremental: bool = False,
+                              on_sub_task: Callable[[Dict[str, Any], str], None] = None,
+                              risk: Dict[str, RiskAssessment] = None) -> tuple:
+        """
+        让 Manager LLM 概述代码，并为需要审计的单元排序、标注审计重点。
+
+        单元划分已在本地完成，LLM 只需输出简短的 JSON 标注（服务商支持时使用 JSON Schema 结构化输出），而不必复述代码片段。
+        响应以流式方式增量解析：概述先于单元标注输出，此后每个单元的标注一闭合就以 (子任务, 概述) 调用 on_sub_task，
+        调用方可以立即开始审计该单元。
+        代码超出 prompt 的 token 预算时，按相互重叠的行窗口分段标注（各窗口并发请求），再合并各段的概述和标注；
+        每个单元只在完整包含它的第一个窗口（或包含其起始行的窗口）中标注。
+        标注失败时不会中断流程：输出被截断时尽量保留已完整的标注，其余单元以默认关注点、按源文件顺序审计。
+        提供 risk 时，单元列表按静态风险分数从高到低排列并附带风险提示，同一优先级内风险高的单元先审计。
+
+        返回:
+            tuple: (供报告和后续 Agent 使用的初步分析文本, 按优先级排序的子任务列表, 代码概述,
+                    是否每个窗口都从 LLM 得到了响应)。
+        """
+        target_ids = {u.unit_id for u in target_units}
+        risk = risk or {}
+        excluded = [u.unit_id for u in all_units if u.unit_id not in target_ids]
+        if incremental:
+            intro = (
+                f"以下代码是自上次审计以来新增或修改的单元，或直接调用了修改过的代码。"
+                f"其余单元（未变化、与已审计代码重复或静态风险低）已有审计结果或另行处理，无需重复分析: "
+                f"{', '.join(excluded) if excluded else '无'}\n\n"
+            )
+            visible = [pair for u in target_units for pair in u.numbered_lines()]
+        elif excluded:
+            # 只发送需要分析的单元，低风险单元和重复代码不再占用 Manager 的 prompt
+            intro = (
+                f"以下只给出需要重点分析的单元。其余单元（与已审计代码重复，或经本地静态分析判定为低风险）另行处理，"
+                f"无需分析: {', '.join(excluded)}\n\n"
+            )
+            visible = [pair for u in target_units for pair in u.numbered_lines()]
+        else:
+            intro = ""
+            visible = list(enumerate(code_content.splitlines(), start=1))
+
+        windows = self._plan_annotation_windows(visible, target_units, intro, file_path, risk)
+        if len(windows) > 1:
+            print(f"MANAGER: 代码超出单次请求的 token 预算，分为 {len(windows)} 个窗口进行初步分析...")
+        else:
+            print("MANAGER: 正在进行初步分析和单元优先级标注...")
+
+        annotations: Dict[str, Dict[str, Any]] = {}
+        manager_order: Dict[str, int] = {}
+        unit_map = {u.unit_id: u for u in target_units}
+
+        def accept(entry: Any, window_ids: set, overview: str = None):
+            if not (isinstance(entry, dict) and entry.get("unit_id") in window_ids and entry["unit_id"] not in annotations):
+                return
+            annotations[entry["unit_id"]] = entry
+            manager_order[entry["unit_id"]] = len(manager_order)
+            if on_sub_task and overview:
+                on_sub_task(self._unit_sub_task(unit_map[entry["unit_id"]], entry), overview)
+
+        async def annotate_window(window_lines: List[tuple], window_units: List[CodeUnit]) -> str | None:
+            window_ids = {u.unit_id for u in window_units}
+            parser = StreamingJSONParser(item_key="units")
+
+            def on_token(delta: str):
+                for entry in parser.feed(delta):
+                    overview = parser.fields.get("overview")
+                    accept(entry, window_ids, str(overview) if overview else None)
+
+            return await self.achat(self._annotation_prompt(window_units, window_lines, intro, file_path, risk),
+                                    max_tokens=ANNOTATION_MAX_TOKENS, record_history=len(windows) == 1,
+                                    on_token=on_token, response_format=MANAGER_ANNOTATION_RESPONSE_FORMAT)
+
+        responses = await asyncio.gather(*(annotate_window(window_lines, window_units)
+                                           for window_lines, window_units in windows))
+
+        overviews = []
+        for (window_lines, window_units), llm_response_str in zip(windows, responses):
+            window_label = f"[第 {window_lines[0][0]}-{window_lines[-1][0]} 行] " if len(windows) > 1 else ""
+            if not llm_response_str:
+                print(f"MANAGER: {window_label}未能从 LLM 获取初步分析，将以默认关注点审计这些单元。")
+                continue
+            print(f"MANAGER: {window_label}初步分析和单元标注结果:\n{llm_response_str}")
+            window_ids = {u.unit_id for u in window_units}
+            parsed = self._parse_json_response(llm_response_str)
+            if isinstance(parsed, dict):
+                overview = str(parsed.get("overview", ""))
+                entries = parsed.get("units", [])
+            elif isinstance(parsed, list):
+                overview = ""
+                entries = parsed
+            else:
+                entries = []
+                overview = llm_response_str
+                print(f"MANAGER: {window_label}未能解析单元标注 JSON，将以默认关注点审计这些单元。")
+            if overview:
+                overviews.append(f"{window_label}{overview}")
+            for entry in entries if isinstance(entries, list) else []:
+                accept(entry, window_ids)
+
+        sub_tasks = [self._unit_sub_task(unit, annotations.get(unit.unit_id)) for unit in target_units]
+        file_order = {u.unit_id: i for i, u in enumerate(target_units)}
+        sub_tasks.sort(key=lambda t: (
+            PRIORITY_ORDER.get(t["priority"], 1),
+            -risk[t["unit_id"]].score if t["unit_id"] in risk else 0.0,
+            manager_order.get(t["unit_id"], len(manager_order)),
+            file_order[t["unit_id"]],
+        ))
+
+        overview = "\n\n".join(overviews)
+        ranking = "\n".join(f"- [{t['priority']}] {t['focus']}" for t in sub_tasks)
+        manager_analysis = f"{overview}\n\n单元审计优先级:\n{ranking}" if overview else f"单元审计优先级:\n{ranking}"
+        return manager_analysis, sub_tasks, overview, all(responses)
+
+    @staticmethod
+    def _annotation_prompt(units: List[CodeUnit], numbered_lines: List[tuple], intro: str, file_path: str = None,
+                           risk: Dict[str, RiskAssessment] = None) -> str:
+        """
+        构造单元标注请求的 prompt。numbered_lines 为 [(源文件行号, 文本), ...]。
+        提供 risk 时单元列表按风险分数从高到低排列，并附带每个单元的静态风险提示。
+        """
+        if risk:
+            units = sorted(units, key=lambda u: -risk[u.unit_id].score if u.unit_id in risk else 0.0)
+        unit_index = "\n".join(
+            f"- {u.unit_id} (第 {u.start_line}-{u.end_line} 行" + (f"; {risk[u.unit_id].hint()})" if risk and u.unit_id in risk else ")")
+            for u in units)
+        return MANAGER_ANNOTATION_TEMPLATE.format(
+            instructions=MANAGER_ANNOTATION_INSTRUCTIONS,
+            file_path=file_path if file_path else 'unknown file',
+            unit_index=unit_index,
+            intro=intro,
+            numbered_code=format_numbered_lines(numbered_lines)
         )
 
-        print("MANAGER: 正在进行初步分析和任务分解...")
-        llm_response_str = self.chat(initial_analysis_prompt, max_tokens=3072)
+    def _plan_annotation_windows(self, visible: List[tuple], units: List[CodeUnit], intro: str, file_path: str = None,
+                                 risk: Dict[str, RiskAssessment] = None) -> List[tuple]:
+        """
+        按 Manager 模型的 prompt 预算把可见代码行切分为窗口，并把每个单元分配到一个窗口。
 
-        if not llm_response_str:
-            return {"error": "Manager Agent 未能从 LLM 获取初步分析结果。"}
+        返回:
+            List[tuple]: [(窗口内的 [(行号, 文本), ...], 该窗口负责标注的单元列表), ...]，不含没有单元的窗口。
+        """
+        reserved = count_tokens(self.system_prompt, self.model_name) + \
+            count_tokens(self._annotation_prompt(units, [], intro, file_path, risk), self.model_name)
+        budget = prompt_budget(self.model_name, ANNOTATION_MAX_TOKENS, self.max_prompt_tokens, reserved=reserved)
+        texts = [text for _, text in visible]
+        if sum(count_tokens(text, self.model_name) + 3 for text in texts) <= budget:
+            return [(visible, units)]
 
-        print(f"MANAGER: 初步分析和任务分解结果:\n{llm_response_str}")
+        spans = plan_line_windows(texts, budget, self.model_name, overlap_lines=WINDOW_OVERLAP_LINES, line_overhead=3)
+        position = {number: i for i, (number, _) in enumerate(visible, start=1)}
+        assigned: List[List[CodeUnit]] = [[] for _ in spans]
+        for unit in units:
+            numbers = [n for n, _ in unit.numbered_lines()]
+            first, last = position.get(numbers[0], 1), position.get(numbers[-1], len(visible))
+            index = next((i for i, (a, b) in enumerate(spans) if a <= first and last <= b), None)
+            if index is None:
+                index = next(i for i, (a, b) in enumerate(spans) if a <= first <= b)
+            assigned[index].append(unit)
+        return [(visible[a - 1:b], window_units) for (a, b), window_units in zip(spans, assigned) if window_units]
 
-        # 解析 LLM 的响应以提取子任务
-        # 这部分比较脆弱，LLM 可能不总是完美遵循格式
-        try:
-            # 尝试找到 JSON 部分
-            json_start = llm_response_str.find('```json')
-            json_end = llm_response_str.rfind('```')
-            sub_tasks_json_str = ""
-            if json_start != -1 and json_end != -1 and json_start < json_end:
-                sub_tasks_json_str = llm_response_str[json_start + 7 : json_end].strip()
-            else: # 如果没有 ```json ... ```, 尝试直接解析整个字符串或特定部分
-                # 这是一个简化的回退，实际中可能需要更复杂的解析逻辑
-                if 'sub_tasks' in llm_response_str.lower() or 'subtasks' in llm_response_str.lower():
-                     # 尝试从包含特定关键词的字典结构中提取
-                    potential_json_part = llm_response_str[llm_response_str.find('{'):llm_response_str.rfind('}')+1]
-                    if potential_json_part:
-                        sub_tasks_json_str = potential_json_part
-                    else: # 最后尝试，看整个回复是否就是json列表
-                        if llm_response_str.strip().startswith('[') and llm_response_str.strip().endswith(']'):
-                            sub_tasks_json_str = llm_response_str.strip()
-            
-            if not sub_tasks_json_str:
-                 print("MANAGER: 未能在LLM响应中找到有效的JSON子任务列表。将尝试把整个响应作为任务描述。")
-                 # 如果无法解析 JSON，可以将整个回复视为一个大的审计任务描述
-                 # 或者提示用户/开发者需要LLM返回更精确的格式
-                 sub_tasks = [{
-                     "code_snippet": code_content, # 整个代码
-                     "focus": "全面审计以下代码，识别潜在安全漏洞。",
-                     "target_vulnerabilities": ["All common web vulnerabilities", "Logic errors"],
-                     "original_llm_response_for_auditor": llm_response_str # 传递原始响应给Auditor参考
-                 }]
+    @staticmethod
+    def _parse_json_response(text: str) -> Any:
+        """
+        从 LLM 输出中提取 JSON：优先解析 ```json 代码块，其次解析整段文本，
+        最后从第一个 { 或 [ 开始尝试解码，并补全被截断的 JSON。全部失败时返回 None。
+        """
+        candidates = [m.group(1) for m in re.finditer(r"```(?:json)?\s*(.*?)```", text, re.DOTALL)]
+        candidates.append(text)
+        decoder = json.JSONDecoder()
+        for candidate in candidates:
+            candidate = candidate.strip()
+            try:
+                return json.loads(candidate)
+            except json.JSONDecodeError:
+                pass
+            for start, ch in enumerate(candidate):
+                if ch in "{[":
+                    try:
+                        return decoder.raw_decode(candidate[start:])[0]
+                    except json.JSONDecodeError:
+                        break
+        return repair_json(text)
+
+    @staticmethod
+    def _unit_sub_task(unit: CodeUnit, annotation: Dict[str, Any] = None) -> Dict[str, Any]:
+        """为单个代码单元构造 Auditor 子任务。"""
+        annotation = annotation or {}
+        priority = str(annotation.get("priority", "medium")).lower()
+        focus = annotation.get("focus") or "全面审计该代码单元，识别潜在安全漏洞。"
+        target_vulnerabilities = annotation.get("target_vulnerabilities") or ["General Security Review"]
+        if isinstance(target_vulnerabilities, str):
+            target_vulnerabilities = [target_vulnerabilities]
+        return {
+            "unit_id": unit.unit_id,
+            "priority": priority if priority in PRIORITY_ORDER else "medium",
+            "code_snippet": unit.numbered_source(),
+            "focus": f"{unit.kind} `{unit.name}` (第 {unit.start_line}-{unit.end_line} 行): {focus}",
+            "target_vulnerabilities": target_vulnerabilities,
+        }
+
+    def _auditor_snippet_budget(self, manager_analysis: str) -> int:
+        """Auditor prompt 中可用于代码片段（及附带的相关定义）的 token 数。"""
+        reserved = count_tokens(AUDITOR_SYSTEM_PROMPT, self.auditor_model_name) + \
+            count_tokens(manager_analysis, self.auditor_model_name) + _AUDITOR_PROMPT_OVERHEAD
+        return prompt_budget(self.auditor_model_name, AUDITOR_MAX_TOKENS, self.max_prompt_tokens, reserved=reserved)
+
+    def _with_related_code(self, task: Dict[str, Any], unit: CodeUnit, file_path: str, manager_analysis: str) -> Dict[str, Any]:
+        """
+        通过代码索引为单元的子任务附上被调用者和调用者的定义（未配置代码索引时原样返回）。
+        相关定义最多占用 code_context_tokens，且不超过代码片段预算的一半，使代码片段本身仍有足够的空间。
+        """
+        if not self.code_index or self.code_context_tokens <= 0:
+            return task
+        budget = min(self.code_context_tokens, self._auditor_snippet_budget(manager_analysis) // 2)
+        related = self.code_index.related_code(file_path, unit, budget, self.auditor_model_name)
+        if not related.text:
+            return task
+        omitted = f"，另有 {len(related.omitted)} 个超出预算只列出位置" if related.omitted else ""
+        print(f"MANAGER: 为 {unit.unit_id} 附上 {len(related.callees)} 个被调用者和 {len(related.callers)} 个调用者的定义"
+              f" (约 {related.tokens} tokens{omitted})。")
+        self._emit("related_code", file_path, unit_id=unit.unit_id, callees=related.callees, callers=related.callers,
+                   omitted=related.omitted, tokens=related.tokens)
+        return {**task, "related_code": related.text}
+
+    def _split_oversized_sub_tasks(self, sub_tasks: List[Dict[str, Any]], units: List[CodeUnit], manager_analysis: str) -> List[Dict[str, Any]]:
+        """
+        将超出 Auditor 模型 prompt 预算的单元拆分为多个相互重叠的部分，每个部分作为一个子任务（共享同一 unit_id）。
+        """
+        budget = self._auditor_snippet_budget(manager_analysis)
+        unit_map = {u.unit_id: u for u in units}
+        result = []
+        for task in sub_tasks:
+            unit = unit_map[task["unit_id"]]
+            # 附带的相关定义出现在每个部分中，占用代码片段的预算
+            task_budget = budget - count_tokens(task.get("related_code") or "", self.auditor_model_name)
+            if count_tokens(task["code_snippet"], self.auditor_model_name) <= task_budget:
+                result.append(task)
+                continue
+            numbered = unit.numbered_lines()
+            spans = plan_line_windows([text for _, text in numbered], task_budget, self.auditor_model_name,
+                                      overlap_lines=WINDOW_OVERLAP_LINES, line_overhead=3)
+            print(f"MANAGER: 单元 {unit.unit_id} 超出 Auditor 的 token 预算，拆分为 {len(spans)} 个部分审计。")
+            for k, (a, b) in enumerate(spans, start=1):
+                # 部分标签会出现在审计发现中，因此不含行号，以免被当作对代码行的引用
+                part = f"第 {k}/{len(spans)} 部分"
+                result.append({
+                    **task,
+                    "code_snippet": format_numbered_lines(numbered[a - 1:b]),
+                    "focus": f"{task['focus']} [{part}: 第 {numbered[a - 1][0]}-{numbered[b - 1][0]} 行，相邻部分之间有重叠]",
+                    "part": part,
+                })
+        return result
+
+    def _low_risk_batches(self, low_risk: List[CodeUnit], units: List[CodeUnit], manager_analysis: str) -> List[Dict[str, Any]]:
+        """
+        把低风险单元按 Auditor 的 prompt 预算打包成少量批次，每个批次作为一个快速检查子任务
+        （报告按引用的行号分配给批次内的各个单元，见 _split_batch_report）。
+        单独超出预算的单元仍按 _split_oversized_sub_tasks 拆分审计。
+        """
+        budget = self._auditor_snippet_budget(manager_analysis)
+        batches: List[List[tuple]] = []
+        size = budget + 1
+        oversized = []
+        for unit in low_risk:
+            snippet = f"# {unit.kind} `{unit.name}` (第 {unit.start_line}-{unit.end_line} 行)\n{unit.numbered_source()}"
+            tokens = count_tokens(snippet, self.auditor_model_name)
+            if tokens > budget:
+                oversized.append(self._unit_sub_task(unit, {"priority": "low", "focus": AUDITOR_LOW_RISK_BATCH_FOCUS}))
+                continue
+            if size + tokens > budget or len(batches[-1]) >= LOW_RISK_BATCH_MAX_UNITS:
+                batches.append([])
+                size = 0
+            batches[-1].append((unit, snippet))
+            size += tokens
+
+        tasks = []
+        for batch in batches:
+            tasks.append({
+                "unit_id": batch[0][0].unit_id,
+                "batch_units": [unit.unit_id for unit, _ in batch],
+                "batch_lines": {unit.unit_id: [number for number, _ in unit.numbered_lines()] for unit, _ in batch},
+                "priority": "low",
+                "code_snippet": "\n\n".join(snippet for _, snippet in batch),
+                "focus": f"{len(batch)} 个低风险单元: {AUDITOR_LOW_RISK_BATCH_FOCUS}",
+                "target_vulnerabilities": ["General Security Review"],
+            })
+        return tasks + self._split_oversized_sub_tasks(oversized, units, manager_analysis)
+
+    def _checker_code_slices(self, code_content: str, findings_by_unit: Dict[str, str], auditor_summary: str,
+                             manager_analysis: str) -> str:
+        """
+        只提取审计发现中引用到的代码行（前后各扩展几行上下文）交给 Checker，并截断到 Checker 模型的 prompt 预算内。
+        """
+        code_lines = code_content.splitlines()
+        ranges = []
+        for findings in findings_by_unit.values():
+            ranges.extend(extract_line_references(findings, max_line=len(code_lines)))
+        slices = render_line_slices(code_lines, ranges, context_lines=CHECKER_CONTEXT_LINES)
+        reserved = sum(count_tokens(text, self.checker_model_name)
+                       for text in (CHECKER_SYSTEM_PROMPT, auditor_summary, manager_analysis)) + _AUDITOR_PROMPT_OVERHEAD
+        budget = prompt_budget(self.checker_model_name, CHECKER_MAX_TOKENS, self.max_prompt_tokens, reserved=reserved)
+        return truncate_to_tokens(slices, budget, self.checker_model_name)
+
+    def _use_per_finding_check(self, checker_context: Dict[str, Any]) -> bool:
+        """根据 checker_mode 决定是否逐条复核；auto 模式下一次性复核的材料超过 CHECKER_SINGLE_PASS_TOKENS 时逐条复核。"""
+        if self.checker_mode != "auto":
+            return self.checker_mode == "per-finding"
+        materials = sum(count_tokens(checker_context[key] or "", self.checker_model_name)
+                        for key in ("code_slices", "auditor_findings_summary", "manager_initial_analysis"))
+        return materials > CHECKER_SINGLE_PASS_TOKENS
+
+    def _unit_findings(self, code_content: str, unit: CodeUnit, report: str, seen: Dict[str, Any],
+                       merge: bool = False) -> tuple:
+        """
+        把一个单元的审计报告拆分为逐条发现，并为每条发现准备它引用的代码片段（未引用行号时使用所属单元的代码），
+        截断到 Checker 模型的 prompt 预算内。seen 为本文件已拆分出的发现 {原文: 复核任务}：其他单元中原文相同的发现
+        （例如多个单元复用了同一份审计结果）只复核一次。merge 为 True 时该单元的所有新发现合并为一条复核。
+
+        返回:
+            tuple: (需要复核的发现列表, 与已拆分的发现原文相同、复用其结论的发现列表)。
+        """
+        code_lines = code_content.splitlines()
+        findings: List[Finding] = []
+        duplicates: List[Finding] = []
+        for finding in split_findings(unit.unit_id, report, max_line=len(code_lines)):
+            if any(f.text == finding.text for f in findings):
+                continue
+            if finding.text in seen:
+                duplicates.append(finding)
+            else:
+                findings.append(finding)
+        if merge and len(findings) > 1:
+            for finding in findings[1:]:
+                findings[0].text += f"\n\n{finding.text}"
+                findings[0].line_ranges += finding.line_ranges
+            findings = findings[:1]
+
+        reserved = count_tokens(CHECKER_SYSTEM_PROMPT, self.checker_model_name) + _AUDITOR_PROMPT_OVERHEAD
+        for finding in findings:
+            if finding.line_ranges:
+                code_slice = render_line_slices(code_lines, finding.line_ranges, context_lines=CHECKER_CONTEXT_LINES)
+            else:
+                code_slice = unit.numbered_source()
+            budget = prompt_budget(self.checker_model_name, FINDING_CHECK_MAX_TOKENS, self.max_prompt_tokens,
+                                   reserved=reserved + count_tokens(finding.text, self.checker_model_name))
+            finding.code_slice = truncate_to_tokens(code_slice, budget, self.checker_model_name)
+        return findings, duplicates
+
+    async def _check_unit_findings(self, code_content: str, unit: CodeUnit, report: str, file_path: str,
+                                   state: Dict[str, Any]) -> List[Finding]:
+        """
+        拆分一个单元的审计报告并逐条并发复核（DAG 中的复核节点）。本文件已复核的发现数达到 CHECKER_MAX_FINDINGS 后，
+        此后每个单元的发现合并为一条复核。每条发现的结论单独保存为检查点；原文与已复核的发现相同的发现复用其结论，
+        并以本单元的 unit_id 记录。
+        """
+        findings, duplicates = self._unit_findings(code_content, unit, report, state["seen"],
+                                                   merge=state["checked"] >= CHECKER_MAX_FINDINGS)
+        state["checked"] += len(findings)
+        for finding in findings:
+            state["seen"][finding.text] = asyncio.ensure_future(self._check_finding(finding, file_path))
+        await asyncio.gather(*(state["seen"][finding.text] for finding in findings))
+        for finding in duplicates:
+            checked = await state["seen"][finding.text]
+            finding.verdict, finding.severity, finding.reason = checked.verdict, checked.severity, checked.reason
+        return findings + duplicates
+
+    async def _check_finding(self, finding: Finding, file_path: str) -> Finding:
+        key = f"finding:{input_digest(finding.unit_id, finding.text, finding.code_slice)}"
+        saved = self._restore(STAGE_CHECKER, key)
+        if saved:
+            finding.verdict, finding.severity, finding.reason = saved["verdict"], saved["severity"], saved["reason"]
+        elif await self.checker.check_finding(finding, file_path):
+            self._save(STAGE_CHECKER, {"verdict": finding.verdict, "severity": finding.severity, "reason": finding.reason}, key)
+        return finding
+
+    @staticmethod
+    async def _gather_checked_findings(check_groups: List[Dict[str, Any]], units: List[CodeUnit]) -> List[Finding]:
+        """
+        等待所有复核节点完成，按源文件顺序返回已复核的发现。所属子任务失败的分组（复核节点随之失败）没有审计结果，
+        不产生发现。
+        """
+        async def group_findings(group: Dict[str, Any]) -> List[Finding]:
+            try:
+                return await group["check"]
+            except Exception:
+                return []
+
+        order = {u.unit_id: i for i, u in enumerate(units)}
+        findings = [f for found in await asyncio.gather(*(group_findings(g) for g in check_groups)) for f in found]
+        return sorted(findings, key=lambda f: order.get(f.unit_id, len(order)))
+
+    @staticmethod
+    def _skipped_unit_report(risk: RiskAssessment) -> str:
+        """risk_filter 为 "skip" 时低风险单元的审计结果。"""
+        return f"本地静态分析未发现危险调用或外部输入（{risk.hint()}），已跳过 LLM 审计。"
+
+    @staticmethod
+    def _combine_auditor_reports(units: List[CodeUnit], audited_findings: Dict[str, str], reused_findings: Dict[str, str]) -> str:
+        """
+        按源文件顺序合并本次审计和复用的单元审计结果。
+
+        内容完全相同的报告（例如多个单元都只得到"未发现明显漏洞"的同一结论）只保留第一份，
+        其余改为引用，避免同一段文字在 Checker 和最终总结的 prompt 中重复出现。
+        """
+        combined = "\n\n-- Auditor Reports Summary --\n"
+        seen: Dict[str, int] = {}
+        for i, unit in enumerate(units):
+            label = f"{unit.kind} `{unit.name}` (第 {unit.start_line}-{unit.end_line} 行)"
+            if unit.unit_id in audited_findings:
+                header, findings = f"Report from Auditor {i+1} - {label}", audited_findings[unit.unit_id]
+            elif unit.unit_id in reused_findings:
+                header, findings = f"Report from Auditor {i+1} - {label} [未变化，复用上次审计结果]", reused_findings[unit.unit_id]
+            else:
+                continue
+            key = findings.strip()
+            if key in seen:
+                findings = f"(与 Report from Auditor {seen[key]} 的内容相同，已省略)"
             else:
-                parsed_response = json.loads(sub_tasks_json_str)
-                # 假设 LLM 返回的 JSON 中有一个名为 'sub_tasks' 或 'subtasks' 的列表
-                # 或者直接返回一个列表
-                if isinstance(parsed_response, list):
-                    sub_tasks = parsed_response
-                elif isinstance(parsed_response, dict):
-                    sub_tasks = parsed_response.get('sub_tasks', parsed_response.get('subtasks', []))
+                seen[key] = i + 1
+            combined += f"\n{header}:\n{findings}\n"
+        combined += "\n-- End of Auditor Reports Summary --\n"
+        return combined
+
+    def _register_reused_units(self, units: List[CodeUnit], reused_findings: Dict[str, str], file_path: str):
+        """把增量模式下复用了上次结果的单元登记到重复代码索引，其他文件中的副本可以直接复用。"""
+        if self.duplicate_index:
+            for unit in units:
+                if unit.unit_id in reused_findings:
+                    self.duplicate_index.add(file_path, unit, reused_findings[unit.unit_id])
+
+    def _claim_duplicates(self, dirty_units: List[CodeUnit], file_path: str) -> Dict[str, DuplicateMatch]:
+        """在重复代码索引中查找需要审计的单元的规范副本；没有副本的单元登记为规范单元。"""
+        if not self.duplicate_index:
+            return {}
+        duplicates = {}
+        for unit in dirty_units:
+            match = self.duplicate_index.claim(file_path, unit)
+            if match:
+                duplicates[unit.unit_id] = match
+        if duplicates:
+            exact = sum(m.exact for m in duplicates.values())
+            print(f"MANAGER: {len(duplicates)} 个单元与已审计的代码重复 (完全相同 {exact} 个，近似 {len(duplicates) - exact} 个)，"
+                  f"将复用其审计结果。")
+        return duplicates
+
+    async def _publish_findings(self, file_path: str, unit_id: str, parts: List[tuple]):
+        """规范单元的所有子任务完成后，把合并后的审计结果发布到重复代码索引；任一部分失败时发布 None。"""
+        results = await asyncio.gather(*(run for _, run in parts), return_exceptions=True)
+        if any(isinstance(result, BaseException) for result in results):
+            self.duplicate_index.publish(file_path, unit_id, None)
+        else:
+            self.duplicate_index.publish(file_path, unit_id, self._join_part_reports([t for t, _ in parts], results)[unit_id])
+
+    async def _audit_duplicate(self, i: int, unit: CodeUnit, match: DuplicateMatch, units: List[CodeUnit],
+                               idle_auditors: asyncio.Queue, code_content: str, file_path: str, manager_analysis: str) -> str:
+        """
+        审计一个重复单元：等待规范单元的审计结果（等待期间不占用 Auditor）。完全相同的副本直接复用该结果；
+        近似副本只把差异行交给 Auditor 复核。规范单元审计失败时改为完整审计。
+        """
+        canonical_findings = await match.findings()
+        if canonical_findings is None:
+            print(f"MANAGER: {unit.unit_id} 的规范副本 ({match.location}) 审计失败，改为完整审计。")
+            tasks = self._split_oversized_sub_tasks([self._unit_sub_task(unit)], units, manager_analysis)
+            reports = await asyncio.gather(*(self._run_sub_task(i, task, idle_auditors, code_content, file_path, manager_analysis)
+                                             for task in tasks))
+            return self._join_part_reports(tasks, reports)[unit.unit_id]
+
+        self._emit("duplicate_reused", file_path, unit_id=unit.unit_id, canonical_file=match.file_path,
+                   canonical_unit=match.unit_id, similarity=match.similarity)
+        if match.exact:
+            print(f"MANAGER: {unit.unit_id} 与 {match.location} 相同，复用其审计结果。")
+            return f"[重复代码: 与 {match.location} 相同，复用其审计结果]\n{canonical_findings}"
+
+        task = {
+            **self._unit_sub_task(unit),
+            "code_snippet": render_delta(match, unit),
+            "focus": AUDITOR_DUPLICATE_DELTA_FOCUS.format(location=match.location, similarity=match.similarity,
+                                                          canonical_findings=canonical_findings),
+        }
+        delta_report = await self._run_sub_task(i, task, idle_auditors, code_content, file_path, manager_analysis)
+        return (f"[近似重复: 与 {match.location} 的相似度为 {match.similarity:.0%}，复用其审计结果并只复核差异行]\n"
+                f"{canonical_findings}\n\n差异复核:\n{delta_report}")
+
+    @staticmethod
+    def _join_part_reports(tasks: List[Dict[str, Any]], reports: List[str]) -> Dict[str, str]:
+        """
+        按 unit_id 合并子任务报告；同一单元拆分出的多个部分按顺序拼接并标注部分标签，
+        低风险单元批次的报告按引用的行号拆分给批次内的各个单元。
+        """
+        findings: Dict[str, str] = {}
+        for task, report in zip(tasks, reports):
+            if task.get("part"):
+                report = f"[{task['part']}]\n{report}"
+            parts = ManagerAgent._split_batch_report(task, report) if task.get("batch_units") else {task["unit_id"]: report}
+            for unit_id, text in parts.items():
+                if unit_id in findings:
+                    findings[unit_id] += f"\n\n{text}"
                 else:
-                    sub_tasks = [] # 或者抛出错误
-                
-                if not sub_tasks:
-                    print("MANAGER: 解析出的 JSON 不包含有效的子任务列表。将使用默认任务。")
-                    # Fallback if JSON is present but not in the expected structure
-                    sub_tasks = [{
-                        "code_snippet": code_content, # 整个代码
-                        "focus": "LLM未能正确分解任务，请全面审计以下代码。",
-                        "target_vulnerabilities": ["All common web vulnerabilities", "Logic errors"],
-                        "original_llm_response_for_auditor": llm_response_str
-                    }]
-
-        except json.JSONDecodeError as e:
-            print(f"MANAGER: 解析 LLM 的子任务响应失败: {e}。将把整个代码作为一个任务。")
-            sub_tasks = [{
-                "code_snippet": code_content,
-                "focus": "全面审计以下代码，由于任务分解失败，请特别关注所有潜在安全漏洞。",
-                "target_vulnerabilities": ["All"],
-                "original_llm_response_for_auditor": llm_response_str
-            }]
-        
-        if not self.auditors:
-            self._initialize_auditors(1) # 确保至少有一个auditor
-        
-        auditor_reports = []
-        # 简化：目前只使用第一个 auditor，未来可以扩展到多个 auditors
-        # 例如，轮询或根据任务类型选择 auditor
-        current_auditor_index = 0 
-        for i, task_data in enumerate(sub_tasks):
-            print(f"MANAGER: 将任务 {i+1}/{len(sub_tasks)} 分配给 Auditor Agent...")
-            auditor = self.auditors[current_auditor_index % len(self.auditors)] # 轮询使用Auditor
-            
-            # 确保 task_data 包含必要字段，如果 LLM 未提供，则使用默认值
-            code_to_audit = task_data.get('code_snippet', code_content) # 如果没有代码片段，就用全部代码
-            focus = task_data.get('focus', '未知关注点，请全面审计提供的代码片段。')
-            target_vulnerabilities = task_data.get('target_vulnerabilities', ['General Security Review'])
-            original_llm_context = task_data.get('original_llm_response_for_auditor', '')
-
-            auditor_context = {
-                "file_path": file_path,
-                "task_focus": focus,
-                "target_vulnerabilities": target_vulnerabilities,
-                "manager_preliminary_analysis": original_llm_context if original_llm_context else llm_response_str
-            }
-            auditor_report = await auditor.process_task(code_to_audit, auditor_context)
-            auditor_reports.append(auditor_report)
-            print(f"MANAGER:收到 Auditor Agent 的报告:\n{auditor_report}")
+                    findings[unit_id] = text
+        return findings
 
-        # 汇总 Auditor 报告
-        print("MANAGER: 正在汇总 Auditor Agents 的报告...")
-        combined_auditor_findings = "\n\n-- Auditor Reports Summary --\n"
-        for i, report in enumerate(auditor_reports):
-            combined_auditor_findings += f"\nReport from Auditor {i+1}:\n{report}\n"
-        combined_auditor_findings += "\n-- End of Auditor Reports Summary --\n"
+    @staticmethod
+    def _split_batch_report(task: Dict[str, Any], report: str) -> Dict[str, str]:
+        """
+        把低风险批次的报告逐段分配给批次内引用到其代码行的单元。未引用行号（或引用的行不属于批次内任何单元）的段落
+        只归入批次的第一个单元；没有分到任何段落的单元记为未发现问题。
+        """
+        unit_lines = {unit_id: set(lines) for unit_id, lines in task["batch_lines"].items()}
+        assigned: Dict[str, List[str]] = {unit_id: [] for unit_id in task["batch_units"]}
+        for text in split_report_segments(report):
+            ranges = extract_line_references(text)
+            owners = [unit_id for unit_id in task["batch_units"]
+                      if any(line in unit_lines[unit_id] for start, end in ranges for line in range(start, end + 1))]
+            for unit_id in owners or task["batch_units"][:1]:
+                assigned[unit_id].append(text)
+        return {unit_id: "\n\n".join(texts) if texts else "低风险批次快速检查未发现问题（报告中没有涉及该单元代码行的内容）。"
+                for unit_id, texts in assigned.items()}
 
-        print(f"MANAGER: 合并后的审计员发现:\n{combined_auditor_findings}")
+    def _auditor_pool(self, auditors: List[AuditorAgent] = None) -> asyncio.Queue:
+        """
+        把所有 Auditor（默认为 self.auditors）放入空闲队列。队列本身充当信号量：同一时刻最多有 len(auditors) 个子任务在执行，
+        且每个 Auditor 同一时刻只处理一个子任务，因此各自的对话历史互不干扰。
+        批处理模式下请求只是在批任务中排队，每个 Auditor 在队列中重复放入多次，使最多 BATCH_AUDITOR_SLOTS 个子任务
+        同时等待结果（Auditor 不保留对话历史，同时处理多个子任务是安全的）。
+        """
+        auditors = self.auditors if auditors is None else auditors
+        copies = -(-BATCH_AUDITOR_SLOTS // len(auditors)) if self.batch_auditors and auditors else 1
+        idle_auditors: asyncio.Queue[AuditorAgent] = asyncio.Queue()
+        for _ in range(copies):
+            for auditor in auditors:
+                idle_auditors.put_nowait(auditor)
+        return idle_auditors
 
-        # 请求 Checker Agent 校验
-        print("MANAGER: 正在请求 Checker Agent 进行校验...")
-        checker_context = {
-            "original_code": code_content,
+    async def _run_sub_task(self, i: int, task_data: Dict[str, Any], idle_auditors: asyncio.Queue,
+                            code_content: str, file_path: str, manager_analysis: str) -> str:
+        """
+        等待一个空闲的 Auditor 并让它审计一个子任务。子任务按开始顺序获取 Auditor，因此优先级高的单元先开始。
+        """
+        # 确保 task_data 包含必要字段，如果缺失则使用默认值
+        code_to_audit = task_data.get('code_snippet', code_content) # 如果没有代码片段，就用全部代码
+        focus = task_data.get('focus', '未知关注点，请全面审计提供的代码片段。')
+        target_vulnerabilities = task_data.get('target_vulnerabilities', ['General Security Review'])
+
+        auditor_context = {
             "file_path": file_path,
-            "auditor_findings_summary": combined_auditor_findings,
-            "manager_initial_analysis": llm_response_str
+            "task_focus": focus,
+            "target_vulnerabilities": target_vulnerabilities,
+            "manager_preliminary_analysis": manager_analysis,
+            "related_code": task_data.get("related_code"),
+            "line_numbered": True,
+            "self_assessment": bool(self.cascade)
         }
-        checker_feedback = await self.checker.process_task("请复核并验证以下代码审计发现和分析逻辑。", checker_context)
-        print(f"MANAGER: 收到 Checker Agent 的反馈:\n{checker_feedback}")
+        auditor = await idle_auditors.get()
+        try:
+            print(f"MANAGER: 将任务 {i+1} ({task_data.get('unit_id')}) 分配给 Auditor Agent...")
+            auditor_report = await auditor.process_task(code_to_audit, auditor_context)
+        finally:
+            idle_auditors.put_nowait(auditor)
+        if self.cascade:
+            auditor_report = await self._cascade_escalate(i, task_data, code_to_audit, auditor_context, auditor_report, file_path)
+        print(f"MANAGER:收到 Auditor Agent 的报告 (任务 {i+1}):\n{auditor_report}")
+        self._emit("auditor_report", file_path, unit_id=task_data.get("unit_id"), part=task_data.get("part"),
+                   priority=task_data.get("priority"), report=auditor_report)
+        return auditor_report
 
-        # 生成最终报告
-        final_report = self._generate_final_report(code_content, file_path, llm_response_str, combined_auditor_findings, checker_feedback)
-        print("MANAGER: 最终审计报告已生成。")
-        return final_report
+    async def _cascade_escalate(self, i: int, task_data: Dict[str, Any], code_to_audit: str, auditor_context: Dict[str, Any],
+                                fast_report: str, file_path: str) -> str:
+        """
+        模型级联：解析快速模型初审报告末尾的自评，置信度低、严重程度高或没有自评时交给强模型 Auditor 复审，并以复审报告为准。
+        每次决策都写入本文件的级联记录和事件流，并计入策略的运行级统计。复审失败时保留初审报告。
+        """
+        report, assessment = parse_assessment(fast_report)
+        reason = self.cascade.escalation_reason(assessment)
+        self.cascade.record(reason)
+        decision = {"unit_id": task_data.get("unit_id"), "part": task_data.get("part"), "confidence": assessment.confidence,
+                    "severity": assessment.severity, "escalated": reason is not None, "reason": reason}
+        self._cascade_decisions.append(decision)
+        self._emit("cascade_decision", file_path, **decision)
+        if reason is None:
+            return report
+
+        label = ESCALATION_REASONS[reason]
+        print(f"MANAGER: 任务 {i+1} ({task_data.get('unit_id')}) 初审{label}，升级给 {self.auditor_model_name} 复审。")
+        context = {
+            **auditor_context,
+            "self_assessment": False,
+            "task_focus": AUDITOR_CASCADE_ESCALATION_FOCUS.format(
+                task_focus=auditor_context["task_focus"], reason=label,
+                confidence="未给出" if assessment.confidence is None else f"{assessment.confidence:.2f}",
+                severity=assessment.severity or "未给出", fast_report=report),
+        }
+        auditor = await self._strong_pool.get()
+        try:
+            strong_report = await auditor.process_task(code_to_audit, context)
+        except Exception as e:
+            print(f"MANAGER: 任务 {i+1} 的强模型复审失败，保留快速模型的初审报告: {e}")
+            return report
+        finally:
+            self._strong_pool.put_nowait(auditor)
+        return f"[级联复审: {self.cascade.fast_model} 初审{label}，由 {self.auditor_model_name} 复审]\n{strong_report}"
+
+    def _cascade_summary(self, file_path: str = None) -> Dict[str, Any]:
+        """打印本文件的级联升级率，并返回写入报告的级联记录。"""
+        stats = {"audited": len(self._cascade_decisions), "escalated": 0, **{reason: 0 for reason in ESCALATION_REASONS}}
+        for decision in self._cascade_decisions:
+            if decision["reason"]:
+                stats["escalated"] += 1
+                stats[decision["reason"]] += 1
+        print(f"MANAGER: 模型级联: {self.cascade.summary(stats)}")
+        self._emit("cascade_stats", file_path, **stats)
+        return {"fast_model": self.cascade.fast_model, "strong_model": self.auditor_model_name, **stats,
+                "decisions": self._cascade_decisions}
+
+    async def _collect_sub_task_results(self, runs: List[tuple], file_path: str) -> tuple:
+        """
+        等待所有已开始的子任务完成。单个子任务失败只会在对应位置留下错误说明，不会影响其他子任务。
+
+        返回:
+            tuple: (与 runs 顺序一致的报告列表, 子任务失败的单元 unit_id 集合)。
+        """
+        results = await asyncio.gather(*(run for _, run in runs), return_exceptions=True)
+
+        auditor_reports, failed_units = [], set()
+        for i, ((task_data, _), result) in enumerate(zip(runs, results)):
+            if isinstance(result, BaseException):
+                print(f"MANAGER: 任务 {i+1} 执行失败: {result}")
+                self._emit("auditor_error", file_path, unit_id=task_data.get("unit_id"), error=str(result))
+                failed_units.update(task_data.get("batch_units") or [task_data["unit_id"]])
+                result = f"Auditor Agent 处理任务 {i+1} 时发生异常，未能生成审计报告: {result}"
+            auditor_reports.append(result)
+        return auditor_reports, failed_units
 
-    def _generate_final_report(self, code, file_path, manager_analysis, auditor_summary, checker_feedback) -> Dict[str, Any]:
-        """根据所有输入生成最终报告。"""
-        report = {
+    @staticmethod
+    def _new_report(file_path, manager_analysis, auditor_summary, checker_feedback) -> Dict[str, Any]:
+        """构造最终报告的基础结构。"""
+        return {
             "file_path": file_path or "N/A",
             "summary": "Heimdallr 代码审计报告",
             "manager_preliminary_analysis": manager_analysis,
@@ -192,29 +936,31 @@ class ManagerAgent(BaseAgent):
             "final_conclusion": "(Heimdallr 最终结论将基于以上所有信息综合判断)", # LLM 可以填充这部分
             "recommendations": "(Heimdallr 修复建议将在此处列出)" # LLM 可以填充这部分
         }
+
+    async def _generate_final_report(self, code, file_path, manager_analysis, auditor_summary, checker_feedback) -> tuple:
+        """根据所有输入生成最终报告。返回 (报告, 是否从 LLM 得到了最终结论)。"""
+        report = self._new_report(file_path, manager_analysis, auditor_summary, checker_feedback)
         
         # 可以再让 Manager LLM 基于所有信息生成一个更精炼的结论和建议
-        final_summary_prompt = (
-            f"基于以下代码审计的各个阶段的输出，请生成一份最终的总结陈述和具体的修复建议。\n"
-            f"代码路径: {file_path if file_path else 'N/A'}\n"
-            f"你的初步分析和任务分解:\n{manager_analysis}\n\n"
-            f"Auditor Agents 的综合发现:\n{auditor_summary}\n\n"
-            f"Checker Agent 的校验反馈:\n{checker_feedback}\n\n"
-            f"请提供一个'final_conclusion'，总结代码的整体安全状况和主要风险点。"
-            f"然后提供一个'recommendations'列表，针对每个关键发现给出具体的、可操作的修复建议。"
-            f"以JSON对象格式返回，包含 final_conclusion (字符串) 和 recommendations (字符串列表) 两个键。"
+        final_summary_prompt = MANAGER_FINAL_REPORT_TEMPLATE.format(
+            instructions=MANAGER_FINAL_REPORT_INSTRUCTIONS,
+            file_path=file_path if file_path else 'N/A',
+            manager_analysis=manager_analysis,
+            auditor_findings=auditor_summary,
+            checker_feedback=checker_feedback
         )
         
         print("MANAGER: 正在生成最终结论和建议...")
-        final_llm_output_str = self.chat(final_summary_prompt, temperature=0.6, max_tokens=2048)
+        final_llm_output_str = await self.achat(final_summary_prompt, temperature=0.6, max_tokens=2048,
+                                                response_format=MANAGER_FINAL_REPORT_RESPONSE_FORMAT)
         
         if final_llm_output_str:
             print(f"MANAGER: LLM生成的最终结论和建议部分:\n{final_llm_output_str}")
-            try:
-                final_data = json.loads(final_llm_output_str)
+            final_data = self._parse_json_response(final_llm_output_str)
+            if isinstance(final_data, dict):
                 report["final_conclusion"] = final_data.get("final_conclusion", report["final_conclusion"])
                 report["recommendations"] = final_data.get("recommendations", report["recommendations"])
-            except json.JSONDecodeError:
+            else:
                 print(f"MANAGER: 解析最终结论JSON失败。将原始LLM输出作为结论。")
                 # 如果解析失败，直接用原始文本，或者只更新一部分
                 report["final_conclusion"] = f"LLM Raw Output (failed to parse JSON): {final_llm_output_str}"
@@ -222,9 +968,10 @@ class ManagerAgent(BaseAgent):
         else:
             print("MANAGER: 未能从LLM获取最终结论和建议。")
             
-        return report
+        return report, bool(final_llm_output_str)
 
-    def _format_report_to_markdown(self, report_data: Dict[str, Any]) -> str:
+    @staticmethod
+    def _format_report_to_markdown(report_data: Dict[str, Any]) -> str:
         """将报告字典转换为 Markdown 格式的字符串。"""
         md = []
         md.append(f"# Heimdallr 代码审计报告")
@@ -273,8 +1020,347 @@ class ManagerAgent(BaseAgent):
                 md.append(f"\n{recommendations}")
         else:
             md.append(f"\n{str(recommendations)}")
+
+        metrics = report_data.get('metrics')
+        if metrics and metrics.get('by_agent'):
+            md.append(f"\n## 6. LLM 调用统计")
+            md.append("\n| Agent | 请求数 | 缓存命中 | 重试 | Prompt Tokens | 前缀缓存命中 Tokens | Completion Tokens | 延迟 p50 (s) | 延迟 p95 (s) | 估算费用 (USD) |")
+            md.append("|---|---|---|---|---|---|---|---|---|---|")
+            for name, row in list(metrics['by_agent'].items()) + [("合计", metrics['totals'])]:
+                md.append(f"| {name} | {row['calls']} | {row['cache_hits']} | {row['retries']} | {row['prompt_tokens']} | "
+                          f"{row['cached_prompt_tokens']} ({row.get('prefix_cache_hit_rate', 0):.0%}) | "
+                          f"{row['completion_tokens']} | {row['latency_p50']} | {row['latency_p95']} | {row['cost_usd']} |")
             
         return "\n".join(md)
 
+
+class FileAudit:
+    """
+    一个文件的一次审计：持有各阶段共享的状态，并把各阶段作为节点加入任务 DAG（见 heimdallr.core.scheduler）。
+
+    Manager 的单元标注以流式方式解析，每个单元的标注一到达就开始审计；逐条复核模式下每组发现的复核在其 Auditor 完成后
+    立即开始，不必等待其他单元；Checker 的汇总复核和最终总结依赖此前完成的所有节点。配置了流水线调度器时，
+    各节点的 LLM 请求按模型的并发上限排队。LLM 调用、检查点读写和报告格式由 ManagerAgent 完成。
+    """
+    def __init__(self, manager: ManagerAgent, code_content: str, file_path: str, units: List[CodeUnit],
+                 incremental: bool = False, reused_findings: Dict[str, str] = None,
+                 risk: Dict[str, RiskAssessment] = None, low_risk: List[CodeUnit] = (),
+                 duplicates: Dict[str, DuplicateMatch] = None):
+        """
+        参数:
+            manager (ManagerAgent): 执行各阶段 LLM 调用的 Manager。
+            units (List[CodeUnit]): 文件中的所有代码单元。
+            incremental (bool, optional): 是否为增量审计；reused_findings 为复用了上次结果的单元 {unit_id: 审计结果}。
+            risk (Dict[str, RiskAssessment], optional): 各单元的静态风险评估；low_risk 为需要审计的低风险单元。
+            duplicates (Dict[str, DuplicateMatch], optional): 与已审计代码重复的单元及其规范副本。
+        """
+        self.manager = manager
+        self.code_content = code_content
+        self.file_path = file_path
+        self.units = units
+        self.unit_map = {u.unit_id: u for u in units}
+        self.incremental = incremental
+        self.reused_findings = reused_findings or {}
+        self.risk = risk or {}
+        self.low_risk = list(low_risk)
+        self.duplicates = duplicates or {}
+        scheduler = manager.llm_connector.scheduler
+        self.graph = scheduler.graph(file_path) if scheduler else TaskGraph(file_path)
+        self.idle_auditors = manager._auditor_pool()
+        self.runs: List[tuple] = [] # [(子任务, asyncio.Task), ...]，按开始顺序排列
+        self.started_units = set()
+        self.publishers: List[asyncio.Task] = []
+        self.skipped_findings: Dict[str, str] = {} # risk_filter 为 "skip" 时低风险单元的结果
+        # 逐条复核的分组：一个单元的所有子任务（或所在的低风险批次），或无需审计的已有结果（复用的、跳过的单元）
+        self.check_groups: List[Dict[str, Any]] = []
+        self.check_state = {"active": manager.checker_mode == "per-finding", "tokens": 0, "reports": set(), "seen": {},
+                            "checked": 0}
+        self.failed_stages: List[str] = [] # 未能从 LLM 得到结果的阶段，这些阶段不写入检查点
+
+    async def run(self, annotate_units: List[CodeUnit]) -> Dict[str, Any]:
+        """依次构建各阶段并返回最终报告。annotate_units 为需要 Manager 标注的单元（不含低风险单元和重复单元）。"""
+        for unit in self.units:
+            if unit.unit_id in self.reused_findings:
+                self.add_check_group(unit.unit_id, report=self.reused_findings[unit.unit_id])
+        manager_analysis, sub_tasks, overview = await self.analyze(annotate_units)
+        analysis = overview or manager_analysis
+        for task in sub_tasks:
+            self.start_sub_task(task, analysis)
+        self.start_low_risk(analysis)
+        self.start_duplicates(analysis)
+        audited_findings, failed_units = await self.collect_audits()
+
+        # 汇总 Auditor 报告
+        print("MANAGER: 正在汇总 Auditor Agents 的报告...")
+        combined_auditor_findings = self.manager._combine_auditor_reports(self.units, audited_findings, self.reused_findings)
+        print(f"MANAGER: 合并后的审计员发现:\n{combined_auditor_findings}")
+
+        checker_feedback, verdicts = await self.review(audited_findings, combined_auditor_findings, manager_analysis)
+        final_report = await self.conclude(manager_analysis, combined_auditor_findings, checker_feedback)
+        return self.finish_report(final_report, audited_findings, failed_units, verdicts)
+
+    # --- 逐条复核分组 ---
+
+    def start_check(self, group: Dict[str, Any]):
+        """为一个分组加入复核节点，在其所有审计节点完成后拆分报告并逐条复核。"""
+        async def run(*reports):
+            report = group["report"] if group["report"] is not None else \
+                self.manager._join_part_reports(group["tasks"], reports)[group["unit_id"]]
+            return await self.manager._check_unit_findings(self.code_content, self.unit_map[group["unit_id"]], report,
+                                                           self.file_path, self.check_state)
+        group["check"] = self.graph.add(f"check:{group['unit_id']}", run, deps=group["nodes"])
+
+    def activate_checks(self):
+        """切换为逐条复核：尚未开始复核的分组立即加入复核节点。"""
+        self.check_state["active"] = True
+        for group in self.check_groups:
+            if group["check"] is None:
+                self.start_check(group)
+
+    def count_check_material(self, text: str):
+        """auto 模式：去重后的审计材料超过一次性复核的阈值时改为逐条复核，已完成的单元立即开始复核。"""
+        state = self.check_state
+        if state["active"] or self.manager.checker_mode != "auto" or not text or text.strip() in state["reports"]:
+            return
+        state["reports"].add(text.strip())
+        state["tokens"] += count_tokens(text, self.manager.checker_model_name)
+        if state["tokens"] > CHECKER_SINGLE_PASS_TOKENS:
+            print("MANAGER: 审计材料超过一次性复核的阈值，改为逐条复核，已完成的单元立即开始复核。")
+            self.activate_checks()
+
+    def add_check_group(self, unit_id: str, nodes: List[str] = (), tasks: List[Dict[str, Any]] = (), report: str = None):
+        """登记一个单元的复核分组：nodes/tasks 为产生其报告的审计节点和子任务，已有结果时提供 report。"""
+        group = {"unit_id": unit_id, "nodes": list(nodes), "tasks": list(tasks), "report": report, "check": None}
+        self.check_groups.append(group)
+        if self.check_state["active"]:
+            self.start_check(group)
+        elif report is not None:
+            self.count_check_material(report)
+        else:
+            for node_id in nodes:
+                self.graph.task(node_id).add_done_callback(
+                    lambda run: None if run.cancelled() or run.exception() else self.count_check_material(run.result()))
+
+    # --- 初步分析和 Auditor 子任务 ---
+
+    def add_audit_node(self, task: Dict[str, Any], key: str, run: Callable[[int], Awaitable]) -> str:
+        """
+        把一个子任务加入 DAG 并返回节点 ID。run(i) 创建第 i 个子任务的协程，其结果按 key 写入检查点。
+        初步分析完成后才开始的子任务依赖分析节点；流式标注期间开始的子任务不等待分析结束。
+        """
+        i, node_id = len(self.runs), f"audit:{key}"
+        deps = ["analysis"] if "analysis" in self.graph and self.graph.task("analysis").done() else []
+        self.runs.append((task, self.graph.add(node_id, lambda *_: self.manager._checkpointed(key, run(i)), deps=deps)))
+        return node_id
+
+    def start_sub_task(self, task: Dict[str, Any], analysis: str):
+        """开始审计一个单元（每个单元只开始一次）：附带跨文件相关定义，过大的单元拆分为多个部分。"""
+        if task["unit_id"] in self.started_units:
+            return
+        self.started_units.add(task["unit_id"])
+        manager = self.manager
+        task = manager._with_related_code(task, self.unit_map[task["unit_id"]], self.file_path, analysis)
+        parts = manager._split_oversized_sub_tasks([task], self.units, analysis)
+        nodes = [self.add_audit_node(part, manager._sub_task_key(part), lambda i, part=part: manager._run_sub_task(
+            i, part, self.idle_auditors, self.code_content, self.file_path, analysis)) for part in parts]
+        if manager.duplicate_index:
+            self.publishers.append(asyncio.create_task(
+                manager._publish_findings(self.file_path, task["unit_id"], self.runs[-len(parts):])))
+        self.add_check_group(task["unit_id"], nodes, parts)
+
+    async def analyze(self, annotate_units: List[CodeUnit]) -> tuple:
+        """
+        初步分析节点（或从检查点恢复）。流式标注期间每个单元的标注一到达就开始审计该单元。
+
+        返回:
+            tuple: (初步分析文本, 按优先级排序的子任务列表, 代码概述)。
+        """
+        manager = self.manager
+        saved_analysis = manager._restore(STAGE_ANALYSIS) if annotate_units else None
+        try:
+            if saved_analysis:
+                manager_analysis, overview = saved_analysis["manager_analysis"], saved_analysis["overview"]
+                sub_tasks = manager._restored_sub_tasks(saved_analysis["sub_tasks"], annotate_units)
+                print(f"MANAGER: 已从检查点恢复初步分析 ({len(sub_tasks)} 个子任务)。")
+            elif annotate_units:
+                manager_analysis, sub_tasks, overview, analysis_ok = await self.graph.add("analysis", lambda: manager._annotate_units(
+                    annotate_units, self.units, self.code_content, self.file_path, self.incremental,
+                    on_sub_task=self.start_sub_task, risk=self.risk))
+                if analysis_ok:
+                    manager._save(STAGE_ANALYSIS, {"manager_analysis": manager_analysis, "overview": overview,
+                                                   "sub_tasks": sub_tasks})
+                else:
+                    self.failed_stages.append("analysis")
+            else:
+                manager_analysis = overview = "本地静态分析未发现需要重点审计的单元（均为低风险单元或已审计代码的副本）。"
+                sub_tasks = []
+        except BaseException:
+            self.graph.cancel()
+            raise
+        if self.started_units:
+            print(f"MANAGER: {len(self.started_units)}/{len(sub_tasks)} 个子任务在初步分析完成前已开始审计。")
+        manager._emit("manager_analysis", self.file_path, analysis=manager_analysis,
+                      sub_tasks=[{"unit_id": t["unit_id"], "priority": t["priority"]} for t in sub_tasks])
+        self.count_check_material(manager_analysis)
+        return manager_analysis, sub_tasks, overview
+
+    def start_low_risk(self, analysis: str):
+        """低风险单元：batch 模式打包成快速检查批次（报告按行号拆分给各个单元，每个单元单独复核）；skip 模式直接记录结果。"""
+        manager = self.manager
+        if not self.low_risk:
+            return
+        if manager.risk_filter == "batch":
+            batch_groups: Dict[str, tuple] = {} # 每个低风险单元的审计节点和子任务（所在批次，或单独拆分出的各个部分）
+            for task in manager._low_risk_batches(self.low_risk, self.units, analysis):
+                node_id = self.add_audit_node(task, manager._sub_task_key(task), lambda i, task=task: manager._run_sub_task(
+                    i, task, self.idle_auditors, self.code_content, self.file_path, analysis))
+                for unit_id in task.get("batch_units") or [task["unit_id"]]:
+                    nodes, tasks = batch_groups.setdefault(unit_id, ([], []))
+                    nodes.append(node_id)
+                    tasks.append(task)
+            for unit_id, (nodes, tasks) in batch_groups.items():
+                self.add_check_group(unit_id, nodes, tasks)
+        elif manager.risk_filter == "skip":
+            for unit in self.low_risk:
+                self.skipped_findings[unit.unit_id] = manager._skipped_unit_report(self.risk[unit.unit_id])
+                self.add_check_group(unit.unit_id, report=self.skipped_findings[unit.unit_id])
+
+    def start_duplicates(self, analysis: str):
+        """重复单元：等待规范副本的审计结果后复用（近似副本只复核差异行）。"""
+        manager = self.manager
+        for unit in self.units:
+            if unit.unit_id in self.duplicates:
+                self.add_audit_node(manager._unit_sub_task(unit), f"duplicate:{unit.unit_id}", lambda i, unit=unit: manager._audit_duplicate(
+                    i, unit, self.duplicates[unit.unit_id], self.units, self.idle_auditors, self.code_content,
+                    self.file_path, analysis))
+
+    async def collect_audits(self) -> tuple:
+        """
+        等待所有审计节点完成。
+
+        返回:
+            tuple: ({unit_id: 本次的审计结果}, 审计失败的单元 unit_id 集合)。
+        """
+        auditor_reports, failed_units = await self.manager._collect_sub_task_results(self.runs, self.file_path)
+        self.failed_stages += [f"auditor:{unit.unit_id}" for unit in self.units if unit.unit_id in failed_units]
+        await asyncio.gather(*self.publishers)
+        audited_findings = self.manager._join_part_reports([task for task, _ in self.runs], auditor_reports)
+        audited_findings.update(self.skipped_findings)
+        return audited_findings, failed_units
+
+    # --- Checker 复核和最终总结 ---
+
+    async def review(self, audited_findings: Dict[str, str], combined_auditor_findings: str, manager_analysis: str) -> tuple:
+        """
+        Checker 节点（或从检查点恢复）：逐条复核模式下等待所有复核节点后做跨发现复核，否则一次性复核全部材料。
+
+        返回:
+            tuple: (Checker 反馈文本, 逐条复核结论列表；未逐条复核时为 None)。
+        """
+        manager = self.manager
+        print("MANAGER: 正在请求 Checker Agent 进行校验...")
+        # 重复单元复用的审计结果引用的是规范单元所在文件的行号，不用于提取本文件的代码片段
+        slice_findings = {k: v for k, v in {**self.reused_findings, **audited_findings}.items() if k not in self.duplicates}
+        checker_context = {
+            "code_slices": manager._checker_code_slices(self.code_content, slice_findings,
+                                                        combined_auditor_findings, manager_analysis),
+            "file_path": self.file_path,
+            "auditor_findings_summary": combined_auditor_findings,
+            "manager_initial_analysis": manager_analysis
+        }
+        checker_key = input_digest(manager_analysis, combined_auditor_findings)
+        saved_checker = manager._restore(STAGE_CHECKER, checker_key)
+        if saved_checker:
+            self.graph.cancel() # 此时只剩提前开始的逐条复核可能尚未完成
+            checker_feedback, verdicts = saved_checker["feedback"], saved_checker["verdicts"]
+            print("MANAGER: 已从检查点恢复 Checker Agent 的反馈。")
+        else:
+            if not self.check_state["active"] and manager._use_per_finding_check(checker_context):
+                self.activate_checks()
+            findings = []
+            if self.check_state["active"]:
+                findings = await manager._gather_checked_findings(self.check_groups, self.units)
+            if findings:
+                print(f"MANAGER: {len(findings)} 条审计发现已逐条复核，正在进行跨发现复核...")
+
+            async def review(*_) -> str:
+                try:
+                    if findings:
+                        return await manager.checker.cross_check(findings, checker_context)
+                    return await manager.checker.process_task("请复核并验证以下代码审计发现和分析逻辑。", checker_context)
+                except RuntimeError as e:
+                    self.failed_stages.append("checker")
+                    return str(e)
+
+            checker_feedback = await self.graph.add("checker", review, deps=self.graph.completed())
+            verdicts = [f.to_dict() for f in findings] if findings else None
+            if "checker" not in self.failed_stages:
+                manager._save(STAGE_CHECKER, {"feedback": checker_feedback, "verdicts": verdicts}, checker_key)
+        print(f"MANAGER: 收到 Checker Agent 的反馈:\n{checker_feedback}")
+        manager._emit("checker_feedback", self.file_path, feedback=checker_feedback, verdicts=verdicts)
+        return checker_feedback, verdicts
+
+    async def conclude(self, manager_analysis: str, combined_auditor_findings: str, checker_feedback: str) -> Dict[str, Any]:
+        """最终总结节点（或从检查点恢复），返回报告的基础结构。"""
+        manager = self.manager
+        final_key = input_digest(manager_analysis, combined_auditor_findings, checker_feedback)
+        saved_final = manager._restore(STAGE_FINAL, final_key)
+        if saved_final:
+            final_report = manager._new_report(self.file_path, manager_analysis, combined_auditor_findings, checker_feedback)
+            final_report.update(saved_final)
+            print("MANAGER: 已从检查点恢复最终结论和建议。")
+            return final_report
+        final_report, final_ok = await self.graph.add("final", lambda *_: manager._generate_final_report(
+            self.code_content, self.file_path, manager_analysis, combined_auditor_findings, checker_feedback),
+            deps=["checker"] if "checker" in self.graph else self.graph.completed())
+        if final_ok:
+            manager._save(STAGE_FINAL, {key: final_report[key] for key in ("final_conclusion", "recommendations")}, final_key)
+        else:
+            self.failed_stages.append("final")
+        return final_report
+
+    def finish_report(self, final_report: Dict[str, Any], audited_findings: Dict[str, str], failed_units: set,
+                      verdicts: List[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """补充报告中的增量、复核、级联、风险、重复和流水线记录，以及供下次增量审计使用的单元状态。"""
+        manager, file_path = self.manager, self.file_path
+        if self.incremental:
+            final_report["incremental"] = {"audited_units": list(audited_findings), "reused_units": list(self.reused_findings)}
+        if verdicts:
+            final_report["checker_verdicts"] = verdicts
+        if manager.cascade:
+            final_report["cascade"] = manager._cascade_summary(file_path)
+        if self.risk:
+            final_report["risk"] = {unit_id: {"score": r.score, "level": r.level, "signals": r.signals}
+                                    for unit_id, r in self.risk.items()}
+        if self.duplicates:
+            final_report["duplicates"] = {
+                unit_id: {"file_path": m.file_path, "unit_id": m.unit_id, "start_line": m.start_line,
+                          "end_line": m.end_line, "similarity": m.similarity}
+                for unit_id, m in self.duplicates.items()
+            }
+        # 审计失败的单元不写入单元状态（下次增量审计时重新审计），有阶段失败时报告标记为错误
+        if self.failed_stages:
+            final_report["failed_stages"] = self.failed_stages
+            final_report["error"] = f"{len(self.failed_stages)} 个阶段未能从 LLM 得到结果，报告不完整: {', '.join(self.failed_stages)}"
+            print(f"MANAGER: {final_report['error']}")
+        final_report["unit_state"] = build_unit_state(
+            file_path, self.units, {**self.reused_findings, **audited_findings}, failed_units=failed_units,
+            file_level=None if self.failed_stages else {key: final_report[key] for key in (
+                "manager_preliminary_analysis", "checker_validation_feedback", "final_conclusion", "recommendations",
+                "checker_verdicts") if key in final_report}
+        )
+        manager._attach_metrics(final_report, file_path)
+        final_report["pipeline"] = self.graph.summary()
+        print(f"MANAGER: 流水线: {final_report['pipeline']['nodes']} 个阶段节点，总耗时 {final_report['pipeline']['wall_seconds']}s，"
+              f"各阶段耗时之和 {final_report['pipeline']['stage_seconds']}s，"
+              f"关键路径 {' → '.join(final_report['pipeline']['critical_path']) or '-'}")
+        if manager._checkpoint and manager._checkpoint.restored:
+            print(f"MANAGER: 共有 {manager._checkpoint.restored} 个阶段的结果从检查点恢复。")
+            final_report["checkpoint_restored"] = manager._checkpoint.restored
+        manager._emit("final_report", file_path, final_conclusion=final_report["final_conclusion"],
+                      recommendations=final_report["recommendations"])
+        print("MANAGER: 最终审计报告已生成。")
+        return final_report
+
 # 注意: AuditorAgent 和 CheckerAgent 此时还未定义。
 # 需要先创建这些文件和类，才能完整运行。 
\ No newline at end of file
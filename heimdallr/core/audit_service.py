@@ -0,0 +1,312 @@
+import os
+import json
+import time
+import asyncio
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, Any, Callable, Awaitable, List
+from urllib.parse import urlsplit, parse_qs
+
+from heimdallr.core.agents import ManagerAgent
+from heimdallr.core.job_queue import new_run_id
+
+# 审计任务状态
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+FINISHED_STATUSES = (DONE, FAILED, CANCELLED)
+
+DEFAULT_SERVE_HOST = "127.0.0.1"
+DEFAULT_SERVE_PORT = 8780 # 与 benchmarks.mock_openai_server 的默认端口 8765 错开
+DEFAULT_SERVE_JOBS = 4 # 同时执行的审计任务数
+DEFAULT_MAX_FINISHED_JOBS = 1000 # 内存中保留的已结束任务数，超出时淘汰最早结束的任务
+MAX_REQUEST_BYTES = 32 * 1024 * 1024
+_HTTP_REASONS = {200: "OK", 202: "Accepted", 400: "Bad Request", 401: "Unauthorized", 404: "Not Found",
+                 405: "Method Not Allowed", 409: "Conflict", 413: "Payload Too Large", 500: "Internal Server Error"}
+
+
+@dataclass
+class AuditJob:
+    """
+    常驻服务中的一个文件审计任务。
+
+    属性:
+        job_id (str): 任务 ID，同时作为审计结果库中的 run_id。
+        file_path (str): 文件路径；提供 code 时只作为报告中的文件名。
+        code (str | None): 提交的源代码；为 None 时由服务读取 file_path。
+        options (dict): 覆盖服务默认值的审计选项。
+        report (dict | None): 审计完成后的报告。
+    """
+    job_id: str
+    file_path: str
+    code: str | None = None
+    options: Dict[str, Any] = field(default_factory=dict)
+    status: str = QUEUED
+    submitted_at: float = field(default_factory=time.time)
+    started_at: float | None = None
+    finished_at: float | None = None
+    error: str | None = None
+    report: Dict[str, Any] | None = None
+    task: asyncio.Task | None = field(default=None, repr=False)
+    finished: asyncio.Event = field(default_factory=asyncio.Event, repr=False)
+
+    def to_dict(self) -> dict:
+        """任务状态（不含报告和源代码）。"""
+        return {"job_id": self.job_id, "file_path": self.file_path, "status": self.status, "options": self.options,
+                "submitted_at": self.submitted_at, "started_at": self.started_at, "finished_at": self.finished_at,
+                "error": self.error}
+
+
+class AuditService:
+    """
+    常驻审计服务的任务管理：接收审计任务，以有界并发在同一个事件循环中执行，并提供状态查询、取消和结果获取。
+
+    任务的执行由 runner 完成（通常复用常驻的 LLMConnector、连接池和缓存），runner 返回报告；
+    报告带 "error" 字段或 runner 抛出异常时任务标记为失败。
+
+    参数:
+        runner (Callable[[AuditJob], Awaitable[dict]]): 执行一个审计任务并返回报告的协程函数。
+        max_concurrent_jobs (int): 同时执行的任务数。
+        max_finished_jobs (int): 内存中保留的已结束任务数。
+    """
+    def __init__(self, runner: Callable[[AuditJob], Awaitable[dict]], max_concurrent_jobs: int = DEFAULT_SERVE_JOBS,
+                 max_finished_jobs: int = DEFAULT_MAX_FINISHED_JOBS):
+        self.runner = runner
+        self.max_finished_jobs = max(1, max_finished_jobs)
+        self.started_at = time.time()
+        self._jobs: "OrderedDict[str, AuditJob]" = OrderedDict()
+        self._slots = asyncio.Semaphore(max(1, max_concurrent_jobs))
+        self.stats = {"submitted": 0, DONE: 0, FAILED: 0, CANCELLED: 0}
+
+    def submit(self, file_path: str, code: str = None, options: Dict[str, Any] = None) -> AuditJob:
+        """提交一个审计任务，立即返回（任务在后台排队执行）。"""
+        job = AuditJob(new_run_id(), file_path, code, dict(options or {}))
+        self._jobs[job.job_id] = job
+        self.stats["submitted"] += 1
+        job.task = asyncio.create_task(self._run(job))
+        return job
+
+    async def _run(self, job: AuditJob):
+        try:
+            async with self._slots:
+                job.status, job.started_at = RUNNING, time.time()
+                report = await self.runner(job)
+            job.report = report
+            job.status = FAILED if report.get("error") else DONE
+            job.error = report.get("error")
+        except asyncio.CancelledError:
+            job.status = CANCELLED
+        except Exception as e:
+            job.status, job.error = FAILED, f"{type(e).__name__}: {e}"
+            print(f"SERVE: 任务 {job.job_id} ({job.file_path}) 失败: {job.error}")
+        finally:
+            job.finished_at = time.time()
+            self.stats[job.status] += 1
+            job.finished.set()
+            self._evict_finished()
+
+    def _evict_finished(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.status in FINISHED_STATUSES]
+        for job_id in finished[:max(0, len(finished) - self.max_finished_jobs)]:
+            del self._jobs[job_id]
+
+    def get(self, job_id: str) -> AuditJob | None:
+        return self._jobs.get(job_id)
+
+    def jobs(self, status: str = None) -> List[AuditJob]:
+        return [job for job in self._jobs.values() if status is None or job.status == status]
+
+    def cancel(self, job_id: str) -> bool:
+        """取消排队中或执行中的任务；任务不存在或已结束时返回 False。"""
+        job = self._jobs.get(job_id)
+        if job is None or job.status in FINISHED_STATUSES:
+            return False
+        job.task.cancel()
+        return True
+
+    async def wait(self, job: AuditJob, timeout: float = None) -> bool:
+        """等待任务结束；超时返回 False。"""
+        try:
+            await asyncio.wait_for(asyncio.shield(job.finished.wait()), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def summary(self) -> dict:
+        counts = {status: 0 for status in (QUEUED, RUNNING)}
+        for job in self._jobs.values():
+            if job.status in counts:
+                counts[job.status] += 1
+        return {"uptime_seconds": round(time.time() - self.started_at, 1), **counts, **self.stats}
+
+    async def shutdown(self):
+        """取消所有未结束的任务并等待它们退出。"""
+        tasks = [job.task for job in self._jobs.values() if job.status not in FINISHED_STATUSES]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+class JsonApiServer:
+    """
+    AuditService 的本地 JSON API（HTTP/1.1，每个请求一个连接），可监听 TCP 端口或 Unix socket：
+
+        GET    /v1/health                     服务状态、任务统计及 health 回调提供的运行时统计
+        GET    /v1/audits[?status=running]    任务列表
+        POST   /v1/audits                     提交任务: {"file_path": ..., "code": 可选, "options": {...}, "wait": 可选}
+        GET    /v1/audits/<id>                任务状态
+        GET    /v1/audits/<id>/result         报告 (?format=md 返回 Markdown，?wait=秒数 等待任务结束)
+        POST   /v1/audits/<id>/cancel         取消任务 (也可以 DELETE /v1/audits/<id>)
+
+    提交时 "wait" 为 true 或秒数时同步等待任务结束并直接返回报告，适合 CI 和编辑器钩子一次请求取得结果。
+    设置 auth_token 时所有请求都需要携带 "Authorization: Bearer <token>"。
+
+    参数:
+        service (AuditService): 任务管理。
+        auth_token (str, optional): 访问令牌。
+        health (Callable[[], dict], optional): 返回附加运行时统计（缓存、指标等）的回调。
+    """
+    def __init__(self, service: AuditService, auth_token: str = None, health: Callable[[], dict] = None):
+        self.service = service
+        self.auth_token = auth_token
+        self.health = health
+
+    async def start(self, host: str = DEFAULT_SERVE_HOST, port: int = DEFAULT_SERVE_PORT,
+                    socket_path: str = None) -> asyncio.AbstractServer:
+        """开始监听；提供 socket_path 时监听 Unix socket（权限 0600），否则监听 host:port。"""
+        if socket_path:
+            if os.path.exists(socket_path):
+                os.unlink(socket_path)
+            server = await asyncio.start_unix_server(self._handle, path=socket_path, limit=MAX_REQUEST_BYTES)
+            os.chmod(socket_path, 0o600)
+            return server
+        return await asyncio.start_server(self._handle, host, port, limit=MAX_REQUEST_BYTES)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            status, body, content_type = await self._respond(reader)
+        except Exception as e:
+            status, body, content_type = 500, {"error": f"{type(e).__name__}: {e}"}, None
+        if not isinstance(body, str):
+            body, content_type = json.dumps(body, ensure_ascii=False, default=str), "application/json"
+        data = body.encode("utf-8")
+        writer.write(f"HTTP/1.1 {status} {_HTTP_REASONS.get(status, '')}\r\nContent-Type: {content_type}; charset=utf-8\r\n"
+                     f"Content-Length: {len(data)}\r\nConnection: close\r\n\r\n".encode("latin-1") + data)
+        try:
+            await writer.drain()
+            writer.close()
+            await writer.wait_closed()
+        except (ConnectionError, OSError):
+            pass
+
+    async def _respond(self, reader: asyncio.StreamReader) -> tuple:
+        """解析一个请求并返回 (状态码, 响应体, Content-Type)。"""
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            return 400, {"error": "请求头不完整"}, None
+        lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, target, _ = lines[0].split(" ", 2)
+        except ValueError:
+            return 400, {"error": "无法解析请求行"}, None
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+        if self.auth_token and headers.get("authorization") != f"Bearer {self.auth_token}":
+            return 401, {"error": "缺少或错误的访问令牌"}, None
+        try:
+            length = int(headers.get("content-length") or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            return 400, {"error": f"无效的 Content-Length: {headers['content-length']}"}, None
+        if length > MAX_REQUEST_BYTES:
+            return 413, {"error": f"请求体超过 {MAX_REQUEST_BYTES} 字节"}, None
+        payload = {}
+        if length:
+            try:
+                body = await reader.readexactly(length)
+            except asyncio.IncompleteReadError:
+                return 400, {"error": f"请求体不完整 (Content-Length 为 {length} 字节)"}, None
+            try:
+                payload = json.loads(body)
+            except ValueError:
+                return 400, {"error": "请求体不是合法的 JSON"}, None
+            if not isinstance(payload, dict):
+                return 400, {"error": "请求体必须是 JSON 对象"}, None
+
+        url = urlsplit(target)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        parts = [part for part in url.path.split("/") if part]
+        if parts[:1] != ["v1"]:
+            return 404, {"error": f"未知路径: {url.path}"}, None
+        parts = parts[1:]
+
+        if parts == ["health"] and method == "GET":
+            return 200, {"status": "ok", "jobs": self.service.summary(), **(self.health() if self.health else {})}, None
+        if parts == ["audits"]:
+            if method == "GET":
+                return 200, {"jobs": [job.to_dict() for job in self.service.jobs(query.get("status"))]}, None
+            if method == "POST":
+                return await self._submit(payload, query)
+            return 405, {"error": f"不支持的方法: {method}"}, None
+        if len(parts) >= 2 and parts[0] == "audits":
+            job = self.service.get(parts[1])
+            if job is None:
+                return 404, {"error": f"任务不存在: {parts[1]}"}, None
+            if len(parts) == 2 and method == "GET":
+                return 200, job.to_dict(), None
+            if (len(parts) == 2 and method == "DELETE") or (parts[2:] == ["cancel"] and method == "POST"):
+                if not self.service.cancel(job.job_id):
+                    return 409, {"error": f"任务已结束 ({job.status})", **job.to_dict()}, None
+                await self.service.wait(job)
+                return 200, job.to_dict(), None
+            if parts[2:] == ["result"] and method == "GET":
+                if query.get("wait"):
+                    await self.service.wait(job, _wait_seconds(query["wait"]))
+                return self._result(job, query.get("format"))
+        return 404, {"error": f"未知路径: {method} {url.path}"}, None
+
+    async def _submit(self, payload: dict, query: dict) -> tuple:
+        file_path, code = payload.get("file_path"), payload.get("code")
+        if not isinstance(file_path, str) or not file_path:
+            return 400, {"error": "缺少 file_path"}, None
+        if code is not None and not isinstance(code, str):
+            return 400, {"error": "code 必须是字符串"}, None
+        if code is None and not os.path.isfile(file_path):
+            return 400, {"error": f"文件不存在: {file_path} (服务读取的是其所在主机上的路径，也可以直接提交 code)"}, None
+        options = payload.get("options") or {}
+        if not isinstance(options, dict):
+            return 400, {"error": "options 必须是 JSON 对象"}, None
+        job = self.service.submit(file_path, code, options)
+        print(f"SERVE: 已接收任务 {job.job_id} ({file_path})")
+        wait = payload.get("wait", query.get("wait"))
+        if not wait:
+            return 202, job.to_dict(), None
+        await self.service.wait(job, _wait_seconds(wait))
+        if job.status not in FINISHED_STATUSES:
+            return 202, job.to_dict(), None
+        return self._result(job, payload.get("format", query.get("format")))
+
+    @staticmethod
+    def _result(job: AuditJob, fmt: str = None) -> tuple:
+        if job.status not in FINISHED_STATUSES:
+            return 409, {"error": f"任务尚未结束 ({job.status})", **job.to_dict()}, None
+        if job.report is None:
+            return 200, {**job.to_dict(), "report": None}, None
+        if fmt == "md":
+            if job.report.get("error"):
+                return 409, {"error": f"报告在处理过程中出现错误，无法生成 Markdown: {job.report['error']}"}, None
+            return 200, ManagerAgent._format_report_to_markdown(job.report), "text/markdown"
+        return 200, {**job.to_dict(), "report": job.report}, None
+
+
+def _wait_seconds(value) -> float | None:
+    """把 wait 参数转换为等待秒数：true 表示一直等待（返回 None），数字表示最长等待秒数。"""
+    if value is True or str(value).lower() in ("true", "yes"):
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,154 @@
+import json
+import time
+import asyncio
+import itertools
+from typing import Dict, List
+
+import openai
+from openai import AsyncOpenAI
+from openai.types.chat import ChatCompletion
+
+DEFAULT_BATCH_POLL_SECONDS = 30.0
+# 超过该时长没有新请求加入时封批提交
+DEFAULT_BATCH_IDLE_SECONDS = 30.0
+# 单个批任务的请求数上限（OpenAI Batch API 的限制为 50000）
+DEFAULT_BATCH_MAX_REQUESTS = 50000
+BATCH_COMPLETION_WINDOW = "24h"
+BATCH_ENDPOINT = "/v1/chat/completions"
+# 轮询批任务状态时，连续出现暂时性错误的次数上限
+MAX_POLL_ERRORS = 10
+_TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+
+class BatchSubmitter:
+    """
+    把 chat completion 请求收集起来，通过 OpenAI 兼容的 Batch API 离线提交：JSONL 上传到 /v1/files，
+    在 /v1/batches 创建批任务并轮询到结束，再把每条结果交还给等待它的调用方。
+
+    请求在 idle_seconds 内没有新请求加入（或累计达到 max_requests）时封批提交，提交之后到达的请求进入下一批。
+    一次运行的 Auditor 请求在各文件的 Manager 初步分析完成后几乎同时产生，因此绝大多数会进入同一个批任务；
+    之后才产生的请求（例如模型级联的复审、近似副本的差异复核）组成后续的小批次。
+    批任务中失败或缺失的请求返回 None，由调用方改为直接请求；服务商不支持 Batch API（返回 404）时不再尝试批处理。
+
+    参数:
+        poll_seconds (float): 轮询批任务状态的间隔（秒）。
+        idle_seconds (float): 封批前等待新请求的时长（秒）。
+        max_requests (int): 单个批任务的请求数上限。
+        completion_window (str): 批任务的完成时限。
+    """
+    def __init__(self, poll_seconds: float = DEFAULT_BATCH_POLL_SECONDS, idle_seconds: float = DEFAULT_BATCH_IDLE_SECONDS,
+                 max_requests: int = DEFAULT_BATCH_MAX_REQUESTS, completion_window: str = BATCH_COMPLETION_WINDOW):
+        self.poll_seconds = poll_seconds
+        self.idle_seconds = idle_seconds
+        self.max_requests = max(1, max_requests)
+        self.completion_window = completion_window
+        self.unavailable = False
+        self.stats = {"batches": 0, "requests": 0, "succeeded": 0, "failed": 0}
+        self._pending: List[tuple] = [] # [(custom_id, 请求体, asyncio.Future), ...]
+        self._ids = itertools.count(1)
+        self._last_added = 0.0
+        self._flusher: asyncio.Task | None = None
+        self._running: set = set()
+
+    async def submit(self, client: AsyncOpenAI, body: dict) -> ChatCompletion | None:
+        """
+        把一个 chat completion 请求（不含 stream 参数）加入下一个批任务，等待并返回其结果；
+        批处理不可用或该请求在批任务中失败时返回 None。
+        """
+        if self.unavailable:
+            return None
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((f"heimdallr-{next(self._ids)}", body, future))
+        self._last_added = time.monotonic()
+        if len(self._pending) >= self.max_requests:
+            self._seal(client)
+        elif self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush_when_idle(client))
+        return await future
+
+    async def _flush_when_idle(self, client: AsyncOpenAI):
+        while (wait := self._last_added + self.idle_seconds - time.monotonic()) > 0:
+            await asyncio.sleep(wait)
+        self._flusher = None
+        self._seal(client)
+
+    def _seal(self, client: AsyncOpenAI):
+        """把当前收集的请求作为一个批任务提交（在后台执行）。"""
+        entries, self._pending = self._pending, []
+        if entries:
+            task = asyncio.create_task(self._run(client, entries))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _run(self, client: AsyncOpenAI, entries: List[tuple]):
+        results: Dict[str, ChatCompletion] = {}
+        try:
+            results = await self._execute(client, entries)
+        except openai.NotFoundError as e:
+            self.unavailable = True
+            print(f"BATCH: 服务商不支持 Batch API，{len(entries)} 个请求及之后的请求改为直接请求: {e}")
+        except Exception as e:
+            print(f"BATCH: 批任务执行失败，{len(entries)} 个请求改为直接请求: {e}")
+        self.stats["requests"] += len(entries)
+        self.stats["succeeded"] += len(results)
+        self.stats["failed"] += len(entries) - len(results)
+        for custom_id, _, future in entries:
+            if not future.done():
+                future.set_result(results.get(custom_id))
+
+    async def _execute(self, client: AsyncOpenAI, entries: List[tuple]) -> Dict[str, ChatCompletion]:
+        """上传请求、创建批任务并轮询到结束，返回 {custom_id: 响应}（只包含成功的请求）。"""
+        data = "\n".join(json.dumps({"custom_id": custom_id, "method": "POST", "url": BATCH_ENDPOINT, "body": body},
+                                    ensure_ascii=False) for custom_id, body, _ in entries).encode("utf-8")
+        input_file = await client.files.create(file=("heimdallr_batch.jsonl", data), purpose="batch")
+        batch = await client.batches.create(input_file_id=input_file.id, endpoint=BATCH_ENDPOINT,
+                                            completion_window=self.completion_window)
+        self.stats["batches"] += 1
+        print(f"BATCH: 已提交批任务 {batch.id} ({len(entries)} 个请求，{len(data) / 1024:.0f} KiB)")
+
+        progress, errors = None, 0
+        while batch.status not in _TERMINAL_STATUSES:
+            await asyncio.sleep(self.poll_seconds)
+            try:
+                batch = await client.batches.retrieve(batch.id)
+                errors = 0
+            except (openai.APIConnectionError, openai.APITimeoutError, openai.RateLimitError,
+                    openai.InternalServerError) as e:
+                errors += 1
+                if errors >= MAX_POLL_ERRORS:
+                    raise
+                print(f"BATCH: 查询批任务 {batch.id} 的状态失败 ({type(e).__name__})，稍后重试。")
+                continue
+            counts = batch.request_counts
+            current = (batch.status, counts.completed if counts else None)
+            if current != progress:
+                progress = current
+                done = f"，已完成 {counts.completed}/{counts.total}" if counts else ""
+                print(f"BATCH: 批任务 {batch.id} 状态 {batch.status}{done}")
+
+        results: Dict[str, ChatCompletion] = {}
+        if batch.output_file_id:
+            output = await client.files.content(batch.output_file_id)
+            for line in output.text.splitlines():
+                custom_id, response = self._parse_result_line(line)
+                if response is not None:
+                    results[custom_id] = response
+        print(f"BATCH: 批任务 {batch.id} 结束 (状态 {batch.status})，{len(results)}/{len(entries)} 个请求成功。")
+        return results
+
+    @staticmethod
+    def _parse_result_line(line: str) -> tuple:
+        """解析输出文件中的一行，返回 (custom_id, 响应)；该请求失败或无法解析时响应为 None。"""
+        try:
+            record = json.loads(line)
+            response = record.get("response") or {}
+            if response.get("status_code") != 200 or not response.get("body"):
+                return record.get("custom_id"), None
+            return record.get("custom_id"), ChatCompletion.model_validate(response["body"])
+        except (ValueError, AttributeError):
+            return None, None
+
+    def summary(self) -> str:
+        stats = self.stats
+        return (f"{stats['batches']} 个批任务，{stats['requests']} 个请求 "
+                f"(成功 {stats['succeeded']}，改为直接请求 {stats['failed']})")
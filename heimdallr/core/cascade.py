@@ -0,0 +1,99 @@
+import re
+from dataclasses import dataclass
+from typing import Dict
+
+SEVERITY_LEVELS = ("none", "low", "medium", "high", "critical")
+DEFAULT_ESCALATE_CONFIDENCE = 0.7
+DEFAULT_ESCALATE_SEVERITY = "high"
+
+# 快速模型在报告末尾输出的自评行，例如 "审计自评: 置信度=0.8; 最高严重程度=high"
+_ASSESSMENT_LINE_RE = re.compile(r"^\W*审计自评\W*[:：].*$", re.M)
+_CONFIDENCE_RE = re.compile(r"置信度\s*[=:：]\s*(\d+(?:\.\d+)?)\s*(%?)")
+_SEVERITY_RE = re.compile(r"严重程度\s*[=:：]\s*\**\s*(" + "|".join(SEVERITY_LEVELS) + r")\b", re.IGNORECASE)
+
+ESCALATION_REASONS = {"low_confidence": "置信度低", "high_severity": "严重程度高", "no_assessment": "未给出自评"}
+
+
+@dataclass
+class Assessment:
+    """
+    快速模型对一次审计的自评。
+
+    属性:
+        confidence (float | None): 对结论（包括"未发现漏洞"）的把握，0 到 1；未给出时为 None。
+        severity (str | None): 报告中最高的严重程度（SEVERITY_LEVELS 之一）；未给出时为 None。
+    """
+    confidence: float | None = None
+    severity: str | None = None
+
+
+def parse_assessment(report: str) -> tuple:
+    """
+    从快速模型的报告中取出最后一行自评并解析。
+
+    返回:
+        tuple: (去掉自评行后的报告, Assessment)。没有自评行时报告原样返回，Assessment 的字段均为 None。
+    """
+    matches = list(_ASSESSMENT_LINE_RE.finditer(report or ""))
+    if not matches:
+        return report, Assessment()
+    line = matches[-1].group(0)
+    confidence = severity = None
+    match = _CONFIDENCE_RE.search(line)
+    if match:
+        value = float(match.group(1))
+        if match.group(2) or value > 1:
+            value /= 100
+        confidence = min(max(value, 0.0), 1.0)
+    match = _SEVERITY_RE.search(line)
+    if match:
+        severity = match.group(1).lower()
+    stripped = (report[:matches[-1].start()] + report[matches[-1].end():]).strip()
+    return stripped, Assessment(confidence, severity)
+
+
+class CascadePolicy:
+    """
+    模型级联策略：由快速模型审计所有子任务，只把自评为低置信度或高严重程度的子任务升级给更强的模型复审。
+
+    同一次运行的所有 ManagerAgent 共享同一个策略对象，stats 累计整个运行的升级情况，用于调整阈值。
+
+    参数:
+        fast_model (str): 快速模型，负责所有子任务的初审。
+        min_confidence (float): 自评置信度低于该值时升级。
+        escalate_severity (str): 自评的最高严重程度不低于该级别时升级。
+    """
+    def __init__(self, fast_model: str, min_confidence: float = DEFAULT_ESCALATE_CONFIDENCE,
+                 escalate_severity: str = DEFAULT_ESCALATE_SEVERITY):
+        if escalate_severity not in SEVERITY_LEVELS:
+            raise ValueError(f"未知的严重程度: {escalate_severity}")
+        self.fast_model = fast_model
+        self.min_confidence = min_confidence
+        self.escalate_severity = escalate_severity
+        self.stats: Dict[str, int] = {"audited": 0, "escalated": 0, **{reason: 0 for reason in ESCALATION_REASONS}}
+
+    def escalation_reason(self, assessment: Assessment) -> str | None:
+        """返回需要升级的原因（ESCALATION_REASONS 的键）；无需升级时返回 None。"""
+        if assessment.confidence is None and assessment.severity is None:
+            return "no_assessment"
+        if assessment.confidence is not None and assessment.confidence < self.min_confidence:
+            return "low_confidence"
+        if assessment.severity and \
+                SEVERITY_LEVELS.index(assessment.severity) >= SEVERITY_LEVELS.index(self.escalate_severity):
+            return "high_severity"
+        return None
+
+    def record(self, reason: str | None):
+        """记录一次初审的升级决策。"""
+        self.stats["audited"] += 1
+        if reason:
+            self.stats["escalated"] += 1
+            self.stats[reason] += 1
+
+    def summary(self, stats: Dict[str, int] = None) -> str:
+        """升级率的一行说明；stats 默认为整个运行的累计值。"""
+        stats = stats or self.stats
+        rate = stats["escalated"] / stats["audited"] if stats["audited"] else 0.0
+        reasons = "，".join(f"{label} {stats[reason]}" for reason, label in ESCALATION_REASONS.items())
+        return (f"{stats['escalated']}/{stats['audited']} 个子任务升级 ({rate:.0%})：{reasons} "
+                f"(阈值: 置信度 < {self.min_confidence}，严重程度 >= {self.escalate_severity})")
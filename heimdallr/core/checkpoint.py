@@ -0,0 +1,120 @@
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from contextlib import contextmanager
+from typing import Dict, Any
+
+# ManagerAgent 流程中保存检查点的阶段
+STAGE_ANALYSIS = "analysis"       # Manager 的初步分析和子任务列表
+STAGE_AUDITOR = "auditor_report"  # 每个 Auditor 子任务的报告（键为子任务标识）
+STAGE_CHECKER = "checker"         # Checker 的反馈和逐条复核结论（键为输入摘要）
+STAGE_FINAL = "final"             # 最终结论和建议（键为输入摘要）
+_FINGERPRINT = "fingerprint"
+
+
+def input_digest(*texts: str) -> str:
+    """阶段输入的摘要，用作检查点的键：输入变化（例如失败的子任务在恢复后重新审计）时不会误用旧的结果。"""
+    digest = hashlib.sha256()
+    for text in texts:
+        digest.update((text or "").encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()[:16]
+
+
+class CheckpointStore:
+    """
+    审计流程的检查点：每个阶段（初步分析、每个 Auditor 子任务、Checker 复核、最终总结）完成后，
+    其输出立即在独立的事务中写入 SQLite，进程在任意阶段退出后，以相同的 run_id 恢复时跳过已完成的阶段。
+
+    检查点按 (run_id, 文件) 划分，并记录文件内容的指纹：恢复时文件内容已变化则丢弃该文件的检查点。
+    默认与审计结果库使用同一个数据库文件（独立的 checkpoints 表），运行结束后由调用方 discard。
+    """
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, timeout=60, isolation_level=None, check_same_thread=False)
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS checkpoints ("
+            " run_id TEXT NOT NULL,"
+            " file_key TEXT NOT NULL,"
+            " stage TEXT NOT NULL,"
+            " key TEXT NOT NULL,"
+            " value TEXT NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " PRIMARY KEY (run_id, file_key, stage, key));"
+        )
+
+    @contextmanager
+    def _transaction(self):
+        """BEGIN IMMEDIATE 事务。调用方需持有 self._lock。"""
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield self._conn
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        self._conn.execute("COMMIT")
+
+    def file(self, run_id: str, file_key: str, code_content: str) -> "FileCheckpoint":
+        """
+        返回一个文件在该运行中的检查点。已有检查点但文件内容已变化时，先丢弃旧的检查点。
+
+        参数:
+            file_key (str): 文件的唯一标识（通常为绝对路径）。
+            code_content (str): 文件内容，用于计算指纹。
+        """
+        fingerprint = hashlib.sha256(code_content.encode("utf-8")).hexdigest()
+        with self._lock:
+            rows = self._conn.execute("SELECT stage, key, value FROM checkpoints WHERE run_id = ? AND file_key = ?",
+                                      (run_id, file_key)).fetchall()
+        entries = {(stage, key): json.loads(value) for stage, key, value in rows}
+        if entries.get((_FINGERPRINT, "")) != fingerprint:
+            if entries:
+                print(f"CHECKPOINT: {file_key} 的内容自上次运行以来已变化，丢弃其检查点。")
+            self.discard(run_id, file_key)
+            self.save(run_id, file_key, _FINGERPRINT, "", fingerprint)
+            entries = {}
+        entries.pop((_FINGERPRINT, ""), None)
+        return FileCheckpoint(self, run_id, file_key, entries)
+
+    def save(self, run_id: str, file_key: str, stage: str, key: str, value: Any):
+        with self._lock, self._transaction() as conn:
+            conn.execute("INSERT OR REPLACE INTO checkpoints (run_id, file_key, stage, key, value, created_at)"
+                         " VALUES (?, ?, ?, ?, ?, ?)",
+                         (run_id, file_key, stage, key, json.dumps(value, ensure_ascii=False), time.time()))
+
+    def discard(self, run_id: str, file_key: str = None):
+        """删除一个文件（默认为整个运行）的检查点。"""
+        with self._lock, self._transaction() as conn:
+            if file_key is None:
+                conn.execute("DELETE FROM checkpoints WHERE run_id = ?", (run_id,))
+            else:
+                conn.execute("DELETE FROM checkpoints WHERE run_id = ? AND file_key = ?", (run_id, file_key))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class FileCheckpoint:
+    """一个文件在一次运行中的检查点，由 CheckpointStore.file 创建并交给 ManagerAgent.process_task。"""
+    def __init__(self, store: CheckpointStore, run_id: str, file_key: str, entries: Dict[tuple, Any]):
+        self.store = store
+        self.run_id = run_id
+        self.file_key = file_key
+        self._entries = entries
+        self.restored = 0 # 本次从检查点恢复的阶段数
+
+    def get(self, stage: str, key: str = "") -> Any:
+        """返回已保存的阶段输出；没有时返回 None。"""
+        value = self._entries.get((stage, key))
+        if value is not None:
+            self.restored += 1
+        return value
+
+    def put(self, stage: str, value: Any, key: str = ""):
+        """持久化一个阶段的输出（立即提交）。"""
+        self._entries[(stage, key)] = value
+        self.store.save(self.run_id, self.file_key, stage, key, value)
@@ -0,0 +1,450 @@
+import ast
+import hashlib
+import os
+import re
+from dataclasses import dataclass, field
+from typing import List, Set, Dict
+
+@dataclass
+class CodeUnit:
+    """
+    源文件中的一个可独立审计的代码单元（函数、方法、类或模块级语句）。
+
+    属性:
+        name (str): 限定名，例如 "handle_request" 或 "Server.start"。模块级语句的名称为 "<module>"。
+        kind (str): "function"、"method"、"class" 或 "module"。
+        start_line (int): 起始行号（从 1 开始，包含）。
+        end_line (int): 结束行号（包含）。
+        source (str): 单元的源代码。
+        calls (Set[str]): 单元内调用到的名称（只保留最后一段，例如 obj.run() 记为 "run"）。
+        line_numbers (List[int]): source 中每一行在源文件中的行号。类头部和模块级单元的行不连续；
+                                  为空时表示从 start_line 开始的连续行。
+    """
+    name: str
+    kind: str
+    start_line: int
+    end_line: int
+    source: str
+    calls: Set[str] = field(default_factory=set)
+    line_numbers: List[int] = field(default_factory=list)
+
+    @property
+    def unit_id(self) -> str:
+        return f"{self.kind}:{self.name}"
+
+    @property
+    def short_name(self) -> str:
+        return self.name.split("#", 1)[0].rsplit(".", 1)[-1]
+
+    def numbered_lines(self) -> List[tuple]:
+        """返回 [(源文件行号, 行文本), ...]。"""
+        source_lines = self.source.splitlines()
+        numbers = self.line_numbers or range(self.start_line, self.start_line + len(source_lines))
+        return list(zip(numbers, source_lines))
+
+    def numbered_source(self) -> str:
+        """带源文件绝对行号的源代码，便于各 Agent 引用准确的位置。"""
+        return format_numbered_lines(self.numbered_lines())
+
+    @property
+    def fingerprint(self) -> str:
+        """忽略行尾空白和空行的内容指纹，仅因格式调整产生的差异不会被视为变化。"""
+        lines = [line.rstrip() for line in self.source.splitlines()]
+        normalized = "\n".join(line for line in lines if line)
+        return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+def format_numbered_lines(numbered_lines: List[tuple]) -> str:
+    """将 [(行号, 文本), ...] 格式化为带行号前缀的代码，行号不连续处插入省略标记。"""
+    out = []
+    previous = None
+    for number, text in numbered_lines:
+        if previous is not None and number != previous + 1:
+            out.append("  ...|")
+        out.append(f"{number:5d}| {text}")
+        previous = number
+    return "\n".join(out)
+
+
+_LINE_REF_RE = re.compile(
+    r"第\s*(\d+)\s*(?:(?:-|~|–|到|至)\s*第?\s*(\d+)\s*)?行"
+    r"|行号?\s*[:：]?\s*(\d+)(?:\s*(?:-|~|–|到|至)\s*(\d+))?"
+    r"|\b[Ll]ines?\s*[:#]?\s*(\d+)(?:\s*(?:-|–|~|to)\s*(\d+))?"
+    r"|\bL(\d+)(?:\s*-\s*L?(\d+))?\b"
+)
+
+
+def extract_line_references(text: str, max_line: int = None) -> List[tuple]:
+    """
+    从审计报告文本中提取引用的行号范围，例如 "第 12 行"、"第 12-20 行"、"line 12"、"L12-L20"。
+
+    返回:
+        List[tuple]: [(起始行, 结束行), ...]，超出 max_line 的引用会被丢弃。
+    """
+    ranges = []
+    for match in _LINE_REF_RE.finditer(text or ""):
+        groups = match.groups()
+        for i in range(0, len(groups), 2):
+            if groups[i]:
+                start = int(groups[i])
+                end = int(groups[i + 1]) if groups[i + 1] else start
+                if end < start:
+                    start, end = end, start
+                if start >= 1 and (max_line is None or start <= max_line):
+                    ranges.append((start, min(end, max_line) if max_line else end))
+                break
+    return ranges
+
+
+def render_line_slices(code_lines: List[str], ranges: List[tuple], context_lines: int = 3) -> str:
+    """
+    把行号范围（前后各扩展 context_lines 行并合并重叠部分）渲染为带行号的代码片段。
+    """
+    if not ranges:
+        return ""
+    total = len(code_lines)
+    expanded = sorted((max(1, s - context_lines), min(total, e + context_lines)) for s, e in ranges)
+    merged = [list(expanded[0])]
+    for start, end in expanded[1:]:
+        if start <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    numbered = [(n, code_lines[n - 1]) for start, end in merged for n in range(start, end + 1)]
+    return format_numbered_lines(numbered)
+
+
+def _collect_calls(node: ast.AST) -> Set[str]:
+    calls = set()
+    for child in ast.walk(node):
+        if isinstance(child, ast.Call):
+            if isinstance(child.func, ast.Name):
+                calls.add(child.func.id)
+            elif isinstance(child.func, ast.Attribute):
+                calls.add(child.func.attr)
+    return calls
+
+
+def _node_span(node: ast.AST) -> tuple:
+    """返回节点（包括装饰器）覆盖的行号范围。"""
+    start = node.lineno
+    for decorator in getattr(node, "decorator_list", []):
+        start = min(start, decorator.lineno)
+    return start, node.end_lineno
+
+
+def _join_lines(lines: List[str], line_numbers: List[int]) -> str:
+    return "\n".join(lines[n - 1] for n in line_numbers)
+
+
+def _extract_python_units(code: str) -> List[CodeUnit]:
+    tree = ast.parse(code)
+    lines = code.splitlines()
+    units: List[CodeUnit] = []
+    covered: Set[int] = set()
+
+    for node in tree.body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            start, end = _node_span(node)
+            units.append(CodeUnit(node.name, "function", start, end, _join_lines(lines, list(range(start, end + 1))), _collect_calls(node)))
+            covered.update(range(start, end + 1))
+        elif isinstance(node, ast.ClassDef):
+            start, end = _node_span(node)
+            method_lines: Set[int] = set()
+            for item in node.body:
+                if isinstance(item, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                    m_start, m_end = _node_span(item)
+                    units.append(CodeUnit(f"{node.name}.{item.name}", "method", m_start, m_end,
+                                          _join_lines(lines, list(range(m_start, m_end + 1))), _collect_calls(item)))
+                    method_lines.update(range(m_start, m_end + 1))
+            # 类单元只包含类定义行和类级语句，方法体由各自的方法单元负责
+            header_lines = [n for n in range(start, end + 1) if n not in method_lines]
+            header_calls = set()
+            for item in node.body:
+                if not isinstance(item, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                    header_calls |= _collect_calls(item)
+            units.append(CodeUnit(node.name, "class", start, end, _join_lines(lines, header_lines), header_calls, header_lines))
+            covered.update(range(start, end + 1))
+
+    module_lines = [n for n in range(1, len(lines) + 1) if n not in covered and lines[n - 1].strip()]
+    if module_lines:
+        module_calls = set()
+        for node in tree.body:
+            if not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                module_calls |= _collect_calls(node)
+        units.append(CodeUnit("<module>", "module", module_lines[0], module_lines[-1],
+                              _join_lines(lines, module_lines), module_calls, module_lines))
+
+    units.sort(key=lambda u: (u.start_line, u.kind != "class"))
+    _disambiguate_names(units)
+    return units
+
+
+def _disambiguate_names(units: List[CodeUnit]):
+    """同名定义（例如 property 的 getter/setter）追加序号，保证 unit_id 唯一。"""
+    seen: Dict[str, int] = {}
+    for unit in units:
+        count = seen.get(unit.unit_id, 0)
+        seen[unit.unit_id] = count + 1
+        if count:
+            unit.name = f"{unit.name}#{count + 1}"
+
+
+# 使用花括号界定代码块的语言
+BRACE_LANGUAGE_EXTENSIONS = {
+    ".c", ".h", ".cc", ".cpp", ".cxx", ".hpp", ".hh", ".java", ".js", ".jsx", ".mjs",
+    ".ts", ".tsx", ".go", ".rs", ".php", ".cs", ".kt", ".swift", ".scala", ".m", ".mm",
+}
+# 以 # 开头的行是预处理指令/注释的语言
+_HASH_COMMENT_EXTENSIONS = {".c", ".h", ".cc", ".cpp", ".cxx", ".hpp", ".hh", ".m", ".mm", ".php"}
+
+_NON_CALL_KEYWORDS = {
+    "if", "for", "while", "switch", "catch", "return", "sizeof", "else", "do", "try", "with",
+    "elif", "except", "foreach", "function", "func", "fn", "new", "typeof", "delete", "throw",
+    "assert", "await", "yield", "lambda", "defer", "go", "select", "synchronized", "using",
+}
+_CLASS_HEADER_RE = re.compile(
+    r"\btype\s+([A-Za-z_]\w*)\s+(?:struct|interface)\b"
+    r"|\b(?:class|struct|interface|enum|trait|impl|namespace|union|object|record)\s+([A-Za-z_][\w:]*)"
+)
+_GO_FUNC_RE = re.compile(r"\bfunc\s*(?:\([^)]*\)\s*)?([A-Za-z_]\w*)\s*(?:\[[^\]]*\])?\s*\(")
+_JS_FUNCTION_RE = re.compile(r"\bfunction\s*\*?\s*([A-Za-z_$][\w$]*)\s*\(")
+_ASSIGNED_FUNCTION_RE = re.compile(
+    r"([A-Za-z_$][\w$]*)\s*[=:]\s*(?:async\s+)?(?:function\b[^(]*\(|\([^)]*\)\s*(?::\s*[^=]+)?=>|[A-Za-z_$][\w$]*\s*=>)"
+)
+_CLOSER_RE = re.compile(r"(?:end\b.*|[})\]]+;?)")
+_CALL_NAME_RE = re.compile(r"([A-Za-z_$][\w$]*)\s*(?:<[^<>()]*>)?\s*\(")
+_INDENT_HEADER_RE = re.compile(
+    r"^(?:async\s+def|def|class|function|func|fn|sub|proc|module|defmodule|defp?)\s+([A-Za-z_$][\w$.:!?]*)"
+)
+
+
+def _collect_regex_calls(source: str) -> Set[str]:
+    return {name for name in _CALL_NAME_RE.findall(source) if name not in _NON_CALL_KEYWORDS}
+
+
+def _classify_brace_header(header: str) -> tuple:
+    """
+    根据 { 之前的声明文本判断代码块类型。
+
+    返回:
+        tuple: ("class" | "function" | None, 名称, 声明关键字在 header 中的偏移；无法确定时为 None)。
+    """
+    if not header.strip():
+        return None, None, None
+    paren = header.find("(")
+    class_match = _CLASS_HEADER_RE.search(header)
+    if class_match and (paren == -1 or class_match.start() < paren):
+        return "class", class_match.group(1) or class_match.group(2), class_match.start()
+    for regex in (_GO_FUNC_RE, _JS_FUNCTION_RE, _ASSIGNED_FUNCTION_RE):
+        match = regex.search(header)
+        if match:
+            return "function", match.group(1), match.start()
+    if paren == -1 or re.search(r"[=+\-*/%]\s*$", header[:paren]):
+        return None, None, None
+    match = _CALL_NAME_RE.search(header)
+    if match and match.group(1) not in _NON_CALL_KEYWORDS:
+        # C/Java 风格的声明：返回类型、修饰符可能写在前面的行上，起始行取整个声明的开头
+        return "function", match.group(1), None
+    return None, None, None
+
+
+def _extract_brace_units(code: str, hash_comments: bool = False) -> List[CodeUnit]:
+    """
+    面向 C/C++/Java/JS/Go 等花括号语言的轻量切分器。
+
+    按字符扫描并跳过字符串和注释，跟踪花括号深度。顶层（或类/命名空间等容器内一层）的代码块
+    根据 { 之前的声明文本判断是否为函数或类。这不是完整的语法分析，但能给出准确的行号范围。
+    """
+    lines = code.splitlines()
+    units: List[CodeUnit] = []
+    stack: List[dict] = []
+    header: List[str] = []
+    header_lines: List[int] = []
+    line = 1
+    in_string = None
+    in_line_comment = False
+    in_block_comment = False
+    i = 0
+    n = len(code)
+
+    def reset_header():
+        header.clear()
+        header_lines.clear()
+
+    def push(text: str):
+        for ch in text:
+            header.append(ch)
+            header_lines.append(line)
+
+    while i < n:
+        c = code[i]
+        nxt = code[i + 1] if i + 1 < n else ""
+        if c == "\n":
+            line += 1
+            in_line_comment = False
+            if in_string in ("'", '"'):
+                in_string = None
+            if header:
+                push(" ")
+        elif in_line_comment:
+            pass
+        elif in_block_comment:
+            if c == "*" and nxt == "/":
+                in_block_comment = False
+                i += 1
+        elif in_string:
+            if c == "\\":
+                i += 1
+            elif c == in_string:
+                in_string = None
+        elif c == "/" and nxt == "/":
+            in_line_comment = True
+            i += 1
+        elif c == "/" and nxt == "*":
+            in_block_comment = True
+            i += 1
+        elif c == "#" and hash_comments and not "".join(header).strip():
+            in_line_comment = True
+        elif c in "\"'`":
+            in_string = c
+            push(c + c)
+        elif c == "{":
+            parent = stack[-1] if stack else None
+            kind, name, offset = None, None, None
+            if parent is None or parent["kind"] == "class":
+                kind, name, offset = _classify_brace_header("".join(header))
+            if kind and parent is not None:
+                name = f"{parent['name']}.{name}"
+                if kind == "function":
+                    kind = "method"
+            if offset is not None:
+                start = header_lines[offset]
+            else:
+                start = next((header_lines[k] for k, ch in enumerate(header) if not ch.isspace()), line)
+            stack.append({"kind": kind, "name": name, "start": start})
+            reset_header()
+        elif c == "}":
+            if stack:
+                entry = stack.pop()
+                if entry["kind"]:
+                    start, end = entry["start"], line
+                    source = "\n".join(lines[start - 1:end])
+                    units.append(CodeUnit(entry["name"], entry["kind"], start, end, source, _collect_regex_calls(source)))
+            reset_header()
+        elif c == ";":
+            reset_header()
+        else:
+            push(c)
+        i += 1
+
+    return _finalize_units(lines, units, containers_keep_members=True)
+
+
+def _extract_indent_units(code: str) -> List[CodeUnit]:
+    """
+    基于缩进的回退切分器：顶格的 def/class/function/func 等声明开始一个单元，
+    直到下一个顶格的非空行为止（只包含 end、}、) 等收尾符号的顶格行归入当前单元）。
+    """
+    lines = code.splitlines()
+    units: List[CodeUnit] = []
+    current = None
+    last_line = 0
+
+    def close_current():
+        name, kind, start = current
+        source = "\n".join(lines[start - 1:last_line])
+        units.append(CodeUnit(name, kind, start, last_line, source, _collect_regex_calls(source)))
+
+    for number, text in enumerate(lines, start=1):
+        stripped = text.strip()
+        if not stripped:
+            continue
+        if text[0].isspace() or (current and _CLOSER_RE.fullmatch(stripped)):
+            last_line = number
+            continue
+        if current:
+            close_current()
+            current = None
+        match = _INDENT_HEADER_RE.match(text)
+        if match:
+            kind = "class" if text.startswith(("class", "module", "defmodule")) else "function"
+            current = (match.group(1), kind, number)
+        last_line = number
+    if current:
+        close_current()
+    return _finalize_units(lines, units, containers_keep_members=False)
+
+
+def _finalize_units(lines: List[str], units: List[CodeUnit], containers_keep_members: bool) -> List[CodeUnit]:
+    """
+    补充模块级单元并整理顺序。
+
+    containers_keep_members 为 True 时，含有成员的类单元只保留不属于任何成员的行（与 Python 的处理一致）。
+    """
+    covered: Set[int] = set()
+    for unit in units:
+        covered.update(range(unit.start_line, unit.end_line + 1))
+        unit.calls.discard(unit.short_name)
+    if containers_keep_members:
+        for unit in units:
+            if unit.kind != "class":
+                continue
+            member_lines = {
+                n for member in units if member is not unit and member.name.startswith(unit.name + ".")
+                for n in range(member.start_line, member.end_line + 1)
+            }
+            if member_lines:
+                header_lines = [n for n in range(unit.start_line, unit.end_line + 1) if n not in member_lines]
+                unit.source = _join_lines(lines, header_lines)
+                unit.line_numbers = header_lines
+                unit.calls = _collect_regex_calls(unit.source) - {unit.short_name}
+
+    module_lines = [n for n in range(1, len(lines) + 1) if n not in covered and lines[n - 1].strip()]
+    if module_lines:
+        source = _join_lines(lines, module_lines)
+        units.append(CodeUnit("<module>", "module", module_lines[0], module_lines[-1], source,
+                              _collect_regex_calls(source), module_lines))
+    units.sort(key=lambda u: (u.start_line, u.kind != "class"))
+    _disambiguate_names(units)
+    return units
+
+
+def extract_units(code: str, file_path: str = None) -> List[CodeUnit]:
+    """
+    将源代码拆分为代码单元（本地切分，无需 LLM）。
+
+    - Python 文件使用 ast 解析为函数、方法、类和模块级语句；
+    - C/C++/Java/JS/TS/Go/Rust 等花括号语言使用轻量的花括号扫描；
+    - 其他语言以及无法解析的 Python 代码使用基于缩进的回退切分。
+    不属于任何函数/类的行归入名为 "<module>" 的模块级单元。
+
+    参数:
+        code (str): 源代码内容。
+        file_path (str, optional): 文件路径，用于根据扩展名选择切分方式。
+
+    返回:
+        List[CodeUnit]: 按起始行排序的代码单元列表。
+    """
+    ext = os.path.splitext(file_path or "")[1].lower()
+    if not code.strip():
+        return []
+    if ext in ("", ".py", ".pyw"):
+        try:
+            return _extract_python_units(code)
+        except SyntaxError:
+            return _extract_indent_units(code)
+    if ext in BRACE_LANGUAGE_EXTENSIONS:
+        return _extract_brace_units(code, hash_comments=ext in _HASH_COMMENT_EXTENSIONS)
+    return _extract_indent_units(code)
+
+
+def find_direct_callers(units: List[CodeUnit], targets: List[CodeUnit]) -> List[CodeUnit]:
+    """返回 units 中直接调用了 targets 中任一单元的单元（不包括 targets 本身）。"""
+    target_names = {t.short_name for t in targets if t.kind != "module"}
+    target_ids = {t.unit_id for t in targets}
+    return [u for u in units if u.unit_id not in target_ids and u.calls & target_names]
+
+
+def units_by_id(units: List[CodeUnit]) -> Dict[str, CodeUnit]:
+    return {u.unit_id: u for u in units}
@@ -0,0 +1,190 @@
+import re
+import asyncio
+import difflib
+import hashlib
+import random
+from dataclasses import dataclass, field
+from typing import Dict, List, Tuple
+
+from heimdallr.core.code_units import CodeUnit, format_numbered_lines
+
+DEFAULT_DUPLICATE_THRESHOLD = 0.85
+MINHASH_PERMUTATIONS = 64
+LSH_BANDS = 16 # 每个 band 含 MINHASH_PERMUTATIONS // LSH_BANDS 行
+SHINGLE_SIZE = 5 # 每个 shingle 包含的 token 数
+# token 数少于该值的单元（例如只有一行的 getter）不参与去重，以免把不同的小函数误判为副本
+MIN_DEDUP_TOKENS = 40
+# 近似副本的差异复核中，每处差异前后附带的上下文行数
+DELTA_CONTEXT_LINES = 1
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+_COMMENT_PREFIXES = ("#", "//", "/*", "*", "--")
+
+_rng = random.Random(0x5EED)
+_PERMUTATIONS = [(_rng.randrange(1, _MERSENNE_PRIME), _rng.randrange(0, _MERSENNE_PRIME))
+                 for _ in range(MINHASH_PERMUTATIONS)]
+
+
+def normalized_lines(source: str) -> List[str]:
+    """
+    归一化代码行：去掉缩进和行尾空白、空行和整行注释，并压缩行内连续空白。
+    仅因缩进层级、格式或注释不同的副本归一化后完全相同。
+    """
+    lines = []
+    for line in source.splitlines():
+        line = " ".join(line.split())
+        if line and not line.startswith(_COMMENT_PREFIXES):
+            lines.append(line)
+    return lines
+
+
+def minhash_signature(tokens: List[str]) -> Tuple[int, ...]:
+    """对 token 序列的 SHINGLE_SIZE-gram 集合计算 MinHash 签名。"""
+    shingles = {" ".join(tokens[i:i + SHINGLE_SIZE]) for i in range(max(1, len(tokens) - SHINGLE_SIZE + 1))}
+    hashes = [int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "big") for s in shingles]
+    return tuple(min((a * h + b) % _MERSENNE_PRIME for h in hashes) for a, b in _PERMUTATIONS)
+
+
+@dataclass
+class _Entry:
+    """索引中的一个规范单元（第一次出现的副本）。findings 在其审计完成前为 None。"""
+    file_path: str
+    unit: CodeUnit
+    lines: List[str]
+    signature: Tuple[int, ...]
+    findings: str | None = None
+    done: asyncio.Event = field(default_factory=asyncio.Event)
+
+
+@dataclass
+class DuplicateMatch:
+    """
+    一个代码单元与索引中规范单元的匹配结果。
+
+    属性:
+        file_path (str): 规范单元所在的文件。
+        unit_id (str): 规范单元的 unit_id。
+        start_line (int), end_line (int): 规范单元在其文件中的行范围。
+        similarity (float): 估算的 Jaccard 相似度；归一化后完全相同时为 1.0。
+    """
+    file_path: str
+    unit_id: str
+    start_line: int
+    end_line: int
+    similarity: float
+    _entry: _Entry = field(repr=False)
+
+    @property
+    def exact(self) -> bool:
+        return self.similarity >= 1.0
+
+    @property
+    def location(self) -> str:
+        return f"{self.file_path} 中的 {self.unit_id} (第 {self.start_line}-{self.end_line} 行)"
+
+    async def findings(self) -> str | None:
+        """等待规范单元审计完成并返回其审计结果；规范单元审计失败时返回 None。"""
+        await self._entry.done.wait()
+        return self._entry.findings
+
+
+class DuplicateIndex:
+    """
+    跨文件的近似重复代码索引，使复制或 vendored 的代码只审计一次。
+
+    对归一化后的单元正文计算 MinHash 签名，并用 LSH 分桶查找候选；估算相似度不低于 threshold 的单元视为副本。
+    claim 时没有匹配的单元登记为规范单元（此时尚未审计），之后的副本通过 DuplicateMatch.findings 等待其结果。
+    索引只存在于内存中，由同一进程内的所有 ManagerAgent 共享（事件循环内使用，无需加锁）。
+    """
+    def __init__(self, threshold: float = DEFAULT_DUPLICATE_THRESHOLD, min_tokens: int = MIN_DEDUP_TOKENS):
+        self.threshold = threshold
+        self.min_tokens = min_tokens
+        self._rows = MINHASH_PERMUTATIONS // LSH_BANDS
+        self._exact: Dict[str, _Entry] = {}
+        self._buckets: Dict[tuple, List[_Entry]] = {}
+        self._owned: Dict[Tuple[str, str], _Entry] = {}
+        self.stats = {"exact": 0, "near": 0}
+
+    def claim(self, file_path: str, unit: CodeUnit) -> DuplicateMatch | None:
+        """
+        查找 unit 的规范副本。找到时返回匹配结果；否则把 unit 登记为规范单元并返回 None，
+        调用方审计完成后需要调用 publish（失败时调用 release）。
+        """
+        lines = normalized_lines(unit.source)
+        tokens = _TOKEN_RE.findall("\n".join(lines))
+        if len(tokens) < self.min_tokens:
+            return None
+        digest = hashlib.sha256("\n".join(lines).encode("utf-8")).hexdigest()
+        entry = self._exact.get(digest)
+        if entry is not None:
+            return self._match(entry, 1.0, "exact")
+
+        signature = minhash_signature(tokens)
+        bands = [(i, signature[i * self._rows:(i + 1) * self._rows]) for i in range(LSH_BANDS)]
+        best, best_similarity = None, 0.0
+        for band in bands:
+            for candidate in self._buckets.get(band, ()):
+                similarity = sum(a == b for a, b in zip(signature, candidate.signature)) / MINHASH_PERMUTATIONS
+                if similarity > best_similarity:
+                    best, best_similarity = candidate, similarity
+        if best is not None and best_similarity >= self.threshold:
+            # MinHash 估算值可能为 1.0，但归一化文本不同，仍需复核差异
+            return self._match(best, min(best_similarity, 0.99), "near")
+
+        entry = _Entry(file_path, unit, lines, signature)
+        self._exact[digest] = entry
+        for band in bands:
+            self._buckets.setdefault(band, []).append(entry)
+        self._owned[(file_path, unit.unit_id)] = entry
+        return None
+
+    def _match(self, entry: _Entry, similarity: float, kind: str) -> DuplicateMatch:
+        self.stats[kind] += 1
+        return DuplicateMatch(entry.file_path, entry.unit.unit_id, entry.unit.start_line, entry.unit.end_line,
+                              round(similarity, 3), entry)
+
+    def add(self, file_path: str, unit: CodeUnit, findings: str):
+        """登记一个已有审计结果的单元（例如增量模式下复用的单元），作为之后副本的规范单元。"""
+        if self.claim(file_path, unit) is None:
+            self.publish(file_path, unit.unit_id, findings)
+
+    def publish(self, file_path: str, unit_id: str, findings: str | None):
+        """写入规范单元的审计结果并唤醒等待它的副本。findings 为 None 表示审计失败，副本需要自行审计。"""
+        entry = self._owned.pop((file_path, unit_id), None)
+        if entry is None:
+            return
+        entry.findings = findings
+        entry.done.set()
+
+    def release(self, file_path: str):
+        """把 file_path 登记的、仍未发布结果的规范单元全部标记为失败（例如该文件的审计中途出错）。"""
+        for key in [key for key in self._owned if key[0] == file_path]:
+            self.publish(*key, None)
+
+
+def render_delta(match: DuplicateMatch, unit: CodeUnit) -> str:
+    """
+    列出 unit 与其规范单元不同的行：本单元中新增或修改的行（带源文件行号及少量上下文），
+    以及规范单元中被删除或替换的行。
+    """
+    canonical = match._entry.lines
+    numbered = [(number, text) for number, text in unit.numbered_lines()
+                if text.strip() and not text.strip().startswith(_COMMENT_PREFIXES)]
+    current = [" ".join(text.split()) for _, text in numbered]
+    changed, removed = set(), []
+    for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(None, canonical, current, autojunk=False).get_opcodes():
+        if tag == "equal":
+            continue
+        removed.extend(canonical[i1:i2])
+        if j2 > j1:
+            changed.update(range(max(0, j1 - DELTA_CONTEXT_LINES), min(len(numbered), j2 + DELTA_CONTEXT_LINES)))
+        else:
+            changed.update(range(max(0, j1 - DELTA_CONTEXT_LINES), min(len(numbered), j1 + DELTA_CONTEXT_LINES)))
+    parts = []
+    if changed:
+        parts.append("本单元中与原单元不同的行（含少量上下文）:\n" +
+                     format_numbered_lines([numbered[i] for i in sorted(changed)]))
+    if removed:
+        parts.append("原单元中被删除或替换的行:\n" + "\n".join(f"    - {line}" for line in removed))
+    return "\n\n".join(parts) or "(归一化后与原单元相同)"
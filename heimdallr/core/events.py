@@ -0,0 +1,36 @@
+import json
+import time
+import threading
+from typing import Any
+
+
+class EventStream:
+    """
+    JSONL 事件流：每个审计阶段（单元切分、Manager 初步分析、每个 Auditor 报告、Checker 反馈、最终报告等）
+    一产生结果就写出一行 JSON 并立即刷新，供仪表盘或 CI 日志实时消费，而不必等整个审计流程结束。
+
+    每行至少包含 "ts"（Unix 时间戳）和 "event"（事件类型）两个字段。
+    """
+    def __init__(self, path: str):
+        """
+        参数:
+            path (str): 输出文件路径，已存在时会被覆盖。
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, "w", encoding="utf-8")
+
+    def emit(self, event: str, **fields: Any):
+        """写出一个事件。无法 JSON 序列化的字段值会被转换为字符串。"""
+        record = {"ts": round(time.time(), 3), "event": event, **fields}
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
@@ -0,0 +1,206 @@
+import os
+import re
+import fnmatch
+from typing import List, Optional, Tuple
+
+# 默认认为是源代码的文件扩展名
+DEFAULT_SOURCE_EXTENSIONS = {
+    ".py", ".c", ".h", ".cc", ".cpp", ".cxx", ".hpp", ".hh",
+    ".js", ".jsx", ".mjs", ".ts", ".tsx", ".go", ".java", ".kt",
+    ".rs", ".php", ".rb", ".cs", ".swift", ".scala", ".m", ".mm",
+    ".sh", ".lua", ".pl",
+}
+
+# 视为第三方/生成代码而跳过的目录名
+VENDORED_DIR_NAMES = {
+    ".git", ".hg", ".svn", "node_modules", "vendor", "vendors", "third_party",
+    "thirdparty", "external", "site-packages", "dist-packages", "bower_components",
+    "venv", ".venv", "env", ".tox", ".nox", "__pycache__", "build", "dist", "target",
+}
+
+# 视为生成代码而跳过的文件名模式
+VENDORED_FILE_PATTERNS = ("*.min.js", "*.min.css", "*.bundle.js", "*_pb2.py", "*.pb.go")
+
+DEFAULT_MAX_FILE_BYTES = 512 * 1024
+_BINARY_SNIFF_BYTES = 8192
+
+
+def glob_to_regex(pattern: str) -> str:
+    """
+    将 gitignore / glob 风格的模式转换为正则表达式（不含首尾锚点）。
+    支持 `*`、`?`、`[...]` 以及跨目录的 `**`。
+    """
+    out = []
+    i = 0
+    n = len(pattern)
+    while i < n:
+        c = pattern[i]
+        if c == "*":
+            if pattern[i:i + 3] == "**/":
+                out.append("(?:.*/)?")
+                i += 3
+                continue
+            if pattern[i:i + 2] == "**":
+                out.append(".*")
+                i += 2
+                continue
+            out.append("[^/]*")
+        elif c == "?":
+            out.append("[^/]")
+        elif c == "[":
+            j = pattern.find("]", i + 1)
+            if j == -1:
+                out.append(re.escape(c))
+            else:
+                body = pattern[i + 1:j]
+                if body.startswith("!"):
+                    body = "^" + body[1:]
+                out.append(f"[{body}]")
+                i = j
+        else:
+            out.append(re.escape(c))
+        i += 1
+    return "".join(out)
+
+
+class _IgnoreRule:
+    """单条 .gitignore 规则。base 为该 .gitignore 所在目录（相对扫描根目录，使用 / 分隔）。"""
+    def __init__(self, base: str, pattern: str):
+        self.negate = pattern.startswith("!")
+        if self.negate:
+            pattern = pattern[1:]
+        self.dir_only = pattern.endswith("/")
+        pattern = pattern.rstrip("/")
+        anchored = "/" in pattern
+        pattern = pattern.lstrip("/")
+        regex = glob_to_regex(pattern)
+        if not anchored:
+            regex = "(?:.*/)?" + regex
+        self.base = base
+        self.regex = re.compile(f"^{regex}$")
+
+    def matches(self, rel_path: str, is_dir: bool) -> bool:
+        if self.dir_only and not is_dir:
+            return False
+        if self.base:
+            if not rel_path.startswith(self.base + "/"):
+                return False
+            rel_path = rel_path[len(self.base) + 1:]
+        return bool(self.regex.match(rel_path))
+
+
+def _load_gitignore(dir_path: str, base: str) -> List[_IgnoreRule]:
+    """读取目录下的 .gitignore（如果存在）并解析为规则列表。"""
+    rules = []
+    gitignore_path = os.path.join(dir_path, ".gitignore")
+    if not os.path.isfile(gitignore_path):
+        return rules
+    try:
+        with open(gitignore_path, "r", encoding="utf-8", errors="replace") as f:
+            for line in f:
+                line = line.rstrip("\n").rstrip()
+                if not line or line.startswith("#"):
+                    continue
+                if line.startswith("\\"):
+                    line = line[1:]
+                rules.append(_IgnoreRule(base, line))
+    except OSError:
+        pass
+    return rules
+
+
+def _is_ignored(rules: List[_IgnoreRule], rel_path: str, is_dir: bool) -> bool:
+    """按 git 的语义判断路径是否被忽略：最后一条匹配的规则生效。"""
+    ignored = False
+    for rule in rules:
+        if rule.matches(rel_path, is_dir):
+            ignored = not rule.negate
+    return ignored
+
+
+def is_binary_file(path: str) -> bool:
+    """通过检查文件开头是否含有 NUL 字节来判断是否为二进制文件。"""
+    try:
+        with open(path, "rb") as f:
+            chunk = f.read(_BINARY_SNIFF_BYTES)
+    except OSError:
+        return True
+    return b"\0" in chunk
+
+
+def discover_source_files(root: str,
+                          pattern: Optional[str] = None,
+                          max_file_bytes: int = DEFAULT_MAX_FILE_BYTES,
+                          extensions: Optional[set] = None) -> Tuple[List[str], List[Tuple[str, str]]]:
+    """
+    在 root 目录下发现需要审计的源代码文件。
+
+    会遵循各级 .gitignore，并跳过二进制文件、第三方/生成代码以及超过 max_file_bytes 的文件。
+
+    参数:
+        root (str): 扫描的根目录。
+        pattern (str, optional): 相对 root 的 glob 模式（例如 "src/**/*.py"）。不含 / 的模式只匹配文件名。
+                                 提供时不再按扩展名过滤。
+        max_file_bytes (int, optional): 单个文件的最大字节数。默认为 512 KiB。
+        extensions (set, optional): 允许的扩展名集合，默认为 DEFAULT_SOURCE_EXTENSIONS。
+
+    返回:
+        Tuple[List[str], List[Tuple[str, str]]]: (按路径排序的待审计文件列表, [(被跳过的文件, 原因), ...])。
+    """
+    extensions = extensions or DEFAULT_SOURCE_EXTENSIONS
+    pattern_regex = None
+    if pattern:
+        if pattern.startswith("./"):
+            pattern = pattern[2:]
+        regex = glob_to_regex(pattern)
+        if "/" not in pattern:
+            regex = "(?:.*/)?" + regex
+        pattern_regex = re.compile(f"^{regex}$")
+
+    root = os.path.abspath(root)
+    files: List[str] = []
+    skipped: List[Tuple[str, str]] = []
+    rules_by_dir = {root: _load_gitignore(root, "")}
+
+    for dir_path, dir_names, file_names in os.walk(root):
+        rel_dir = os.path.relpath(dir_path, root).replace(os.sep, "/")
+        rel_dir = "" if rel_dir == "." else rel_dir
+        rules = rules_by_dir.pop(dir_path, [])
+
+        kept_dirs = []
+        for name in sorted(dir_names):
+            rel = f"{rel_dir}/{name}" if rel_dir else name
+            if name in VENDORED_DIR_NAMES or _is_ignored(rules, rel, True):
+                continue
+            kept_dirs.append(name)
+            child = os.path.join(dir_path, name)
+            rules_by_dir[child] = rules + _load_gitignore(child, rel)
+        dir_names[:] = kept_dirs
+
+        for name in sorted(file_names):
+            rel = f"{rel_dir}/{name}" if rel_dir else name
+            full = os.path.join(dir_path, name)
+            if _is_ignored(rules, rel, False):
+                continue
+            if pattern_regex:
+                if not pattern_regex.match(rel):
+                    continue
+            elif os.path.splitext(name)[1].lower() not in extensions:
+                continue
+            if any(fnmatch.fnmatch(name, p) for p in VENDORED_FILE_PATTERNS):
+                skipped.append((full, "vendored/generated"))
+                continue
+            try:
+                size = os.path.getsize(full)
+            except OSError as e:
+                skipped.append((full, f"unreadable: {e}"))
+                continue
+            if size > max_file_bytes:
+                skipped.append((full, f"too large ({size} bytes)"))
+                continue
+            if is_binary_file(full):
+                skipped.append((full, "binary"))
+                continue
+            files.append(full)
+
+    return files, skipped
@@ -0,0 +1,94 @@
+import re
+from dataclasses import dataclass, field
+from typing import List
+
+from heimdallr.core.code_units import extract_line_references
+
+# 一条发现的起始行的几种形式：Markdown 标题、顶层编号列表项、加粗标题的列表项、"漏洞 N" / "Finding N" 等
+_FINDING_START_PATTERNS = [
+    ("heading", re.compile(r"^(#{1,4})\s+\S")),
+    ("number", re.compile(r"^\d{1,2}[.)、]\s+\S")),
+    ("label", re.compile(r"^\**\s*(漏洞|问题|发现|Finding|Issue|Vulnerability)\s*[#\d一二三四五六七八九十]+", re.IGNORECASE)),
+    ("bullet", re.compile(r"^[-*]\s+\*\*")),
+]
+# 表示"没有发现问题"的报告，且未引用任何代码行时不需要逐条复核
+_NO_FINDING_RE = re.compile(r"未发现(明显|任何)?(的)?(安全)?(漏洞|问题|风险)|没有发现|no (obvious |significant )?(vulnerabilit|issue|finding)",
+                            re.IGNORECASE)
+
+VERDICT_LABELS = {"confirmed": "成立", "false_positive": "误报", "uncertain": "存疑"}
+
+
+@dataclass
+class Finding:
+    """
+    从 Auditor 报告中拆分出的一条审计发现。
+
+    属性:
+        unit_id (str): 报告所属的代码单元。
+        text (str): 发现的原文。
+        line_ranges (List[tuple]): 发现中引用的行号范围 [(起始行, 结束行), ...]。
+        code_slice (str): 复核时交给 Checker 的代码片段（带行号）。
+        verdict (str | None): Checker 的结论："confirmed"、"false_positive" 或 "uncertain"；尚未复核时为 None。
+        severity (str | None): Checker 评估的严重程度。
+        reason (str): Checker 给出的理由。
+    """
+    unit_id: str
+    text: str
+    line_ranges: List[tuple] = field(default_factory=list)
+    code_slice: str = ""
+    verdict: str | None = None
+    severity: str | None = None
+    reason: str = ""
+
+    @property
+    def location(self) -> str:
+        if not self.line_ranges:
+            return self.unit_id
+        lines = ", ".join(f"{s}" if s == e else f"{s}-{e}" for s, e in self.line_ranges[:3])
+        return f"{self.unit_id} 第 {lines} 行"
+
+    def to_dict(self) -> dict:
+        return {"unit_id": self.unit_id, "finding": self.text, "lines": [list(r) for r in self.line_ranges],
+                "verdict": self.verdict, "severity": self.severity, "reason": self.reason}
+
+
+def split_findings(unit_id: str, report: str, max_line: int = None) -> List[Finding]:
+    """
+    把一份 Auditor 报告拆分为逐条发现。
+
+    以顶层的标题、编号列表项、"漏洞 N" 等作为一条发现的开头（只使用报告中最先出现、且至少出现两次的那种形式）；
+    第一条之前未引用代码行的引言会被丢弃。
+    没有可识别结构的报告整体视为一条发现；明确表示"未发现问题"且未引用代码行的报告（或段落）不产生发现。
+    """
+    segments = split_report_segments(report)
+    findings = []
+    for i, text in enumerate(segments):
+        ranges = extract_line_references(text, max_line=max_line)
+        if not ranges and (_NO_FINDING_RE.search(text) or (i == 0 and len(segments) > 1)):
+            continue
+        findings.append(Finding(unit_id, text, ranges))
+    return findings
+
+
+def split_report_segments(report: str) -> List[str]:
+    """
+    按一条发现的起始行（只使用报告中最先出现、且至少出现两次的那种形式）把报告切分为若干段，保留全部非空内容（包括引言）。
+    """
+    lines = (report or "").splitlines()
+    kinds = [_start_kind(line) for line in lines]
+    # 只按出现至少两次的、最先出现的那种起始形式拆分，避免把一条发现内部的小标题或列表项拆开
+    split_kind = next((k for k in kinds if k and kinds.count(k) >= 2), None)
+    segments: List[List[str]] = [[]]
+    for line, kind in zip(lines, kinds):
+        if split_kind and kind == split_kind and any(l.strip() for l in segments[-1]):
+            segments.append([])
+        segments[-1].append(line)
+    return [text for text in ("\n".join(lines).strip() for lines in segments) if text]
+
+
+def _start_kind(line: str) -> str | None:
+    for kind, pattern in _FINDING_START_PATTERNS:
+        match = pattern.match(line)
+        if match:
+            return f"heading{len(match.group(1))}" if kind == "heading" else kind
+    return None
@@ -0,0 +1,316 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Dict, Any, List
+
+from heimdallr.core.findings import split_findings
+from heimdallr.core.cascade import SEVERITY_LEVELS
+
+DEFAULT_FINDINGS_DB = "heimdallr_findings.sqlite3"
+# 缓冲的报告数达到该值、或距上次写入超过 DEFAULT_FLUSH_SECONDS 秒时，在一个事务中批量写入
+DEFAULT_FLUSH_REPORTS = 16
+DEFAULT_FLUSH_SECONDS = 5.0
+
+# (漏洞类型, 正则)，按顺序取第一个匹配，因此更具体的类型排在前面
+VULN_TYPE_PATTERNS = [
+    ("ssrf", re.compile(r"SSRF|服务端请求伪造|server[- ]side request forgery", re.IGNORECASE)),
+    ("sql_injection", re.compile(r"SQL\s*(注入|injection)|SQLi\b", re.IGNORECASE)),
+    ("command_injection", re.compile(r"命令注入|命令执行|command injection|OS command|shell injection", re.IGNORECASE)),
+    ("code_injection", re.compile(r"代码注入|代码执行|code injection|code execution|\bRCE\b|\beval\b", re.IGNORECASE)),
+    ("deserialization", re.compile(r"反序列化|deseriali[sz]", re.IGNORECASE)),
+    ("path_traversal", re.compile(r"路径遍历|目录遍历|路径穿越|path traversal|directory traversal", re.IGNORECASE)),
+    ("xxe", re.compile(r"XXE|XML\s*外部实体|XML external entit", re.IGNORECASE)),
+    ("xss", re.compile(r"XSS|跨站脚本|cross[- ]site scripting", re.IGNORECASE)),
+    ("csrf", re.compile(r"CSRF|跨站请求伪造|cross[- ]site request forgery", re.IGNORECASE)),
+    ("tool_poisoning", re.compile(r"工具投毒|提示注入|tool poisoning|prompt injection", re.IGNORECASE)),
+    ("hardcoded_secret", re.compile(r"硬编码|hard-?coded|密钥泄露|凭据|credential|api[ _]?key", re.IGNORECASE)),
+    ("access_control", re.compile(r"越权|权限|认证|鉴权|authori[sz]ation|authentication|access control", re.IGNORECASE)),
+    ("info_leak", re.compile(r"信息泄露|敏感信息|information (disclosure|leak)|sensitive data", re.IGNORECASE)),
+    ("dos", re.compile(r"拒绝服务|denial of service|\bDoS\b|资源耗尽", re.IGNORECASE)),
+]
+_SEVERITY_PATTERNS = [
+    ("critical", re.compile(r"严重|critical", re.IGNORECASE)),
+    ("high", re.compile(r"高危|高风险|\bhigh\b", re.IGNORECASE)),
+    ("medium", re.compile(r"中危|中等风险|中风险|\bmedium\b", re.IGNORECASE)),
+    ("low", re.compile(r"低危|低风险|\blow\b", re.IGNORECASE)),
+]
+
+
+def default_findings_db_path() -> str:
+    """默认的审计结果库路径：环境变量 HEIMDALLR_FINDINGS_DB，或当前目录下的 heimdallr_findings.sqlite3。"""
+    return os.getenv("HEIMDALLR_FINDINGS_DB", DEFAULT_FINDINGS_DB)
+
+
+def classify_vuln_type(text: str) -> str:
+    """按关键词推断一条发现的漏洞类型；无法判断时返回 "other"。"""
+    for name, pattern in VULN_TYPE_PATTERNS:
+        if pattern.search(text):
+            return name
+    return "other"
+
+
+def infer_severity(text: str) -> str | None:
+    """按关键词推断一条发现的严重程度（取文中出现的最高级别）；无法判断时返回 None。"""
+    for name, pattern in _SEVERITY_PATTERNS:
+        if pattern.search(text):
+            return name
+    return None
+
+
+def extract_finding_rows(report: Dict[str, Any], unit_state: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    把一份报告拆分为逐条发现。发现来自单元状态中各单元的审计结果（含增量模式下复用的结果）；
+    逐条复核模式下的 Checker 结论（严重程度、成立与否）按单元和原文对应到发现上，其余发现的严重程度按关键词推断。
+    """
+    verdicts = {(v.get("unit_id"), (v.get("finding") or "").strip()): v for v in report.get("checker_verdicts") or []}
+    rows = []
+    for unit_id, unit in (unit_state.get("units") or {}).items():
+        for finding in split_findings(unit_id, unit.get("findings") or ""):
+            verdict = verdicts.get((unit_id, finding.text.strip()), {})
+            lines = [line for r in finding.line_ranges for line in r]
+            severity = verdict.get("severity") or infer_severity(finding.text)
+            rows.append({
+                "unit_id": unit_id,
+                "unit_hash": unit.get("fingerprint"),
+                "start_line": min(lines) if lines else unit.get("start_line"),
+                "end_line": max(lines) if lines else unit.get("end_line"),
+                "vuln_type": classify_vuln_type(finding.text),
+                "severity": severity if severity in SEVERITY_LEVELS else None,
+                "verdict": verdict.get("verdict"),
+                "text": finding.text,
+            })
+    return rows
+
+
+class FindingsStore:
+    """
+    基于 SQLite 的审计结果库：记录每次运行 (runs)、每个文件的报告 (reports，含增量审计使用的单元状态)
+    和拆分后的逐条发现 (findings)。发现按文件、单元指纹、漏洞类型、严重程度和运行建立索引，
+    因此可以直接查询"整个仓库中所有高危 SSRF"而不必加载每个文件的报告；JSON/Markdown 报告按需从库中生成。
+
+    并发审计通过 add_report 写入：报告先在内存中缓冲，累计 flush_reports 份或距上次写入超过 flush_seconds 秒时
+    在一个事务中批量写入，close 时写入剩余的报告。与任务队列相同，数据库使用回滚日志，
+    可以放在共享存储上供多台主机的 worker 同时写入。
+    """
+    def __init__(self, db_path: str = None, flush_reports: int = DEFAULT_FLUSH_REPORTS,
+                 flush_seconds: float = DEFAULT_FLUSH_SECONDS):
+        """
+        参数:
+            db_path (str, optional): 数据库文件路径。默认为环境变量 HEIMDALLR_FINDINGS_DB 或当前目录下的 heimdallr_findings.sqlite3。
+            flush_reports (int, optional): 缓冲的报告数上限。
+            flush_seconds (float, optional): 缓冲的最长时间（秒）。
+        """
+        self.db_path = db_path or default_findings_db_path()
+        self.flush_reports = max(1, flush_reports)
+        self.flush_seconds = flush_seconds
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._pending: List[tuple] = []
+        self._last_flush = time.monotonic()
+        self._conn = sqlite3.connect(self.db_path, timeout=60, isolation_level=None, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS runs ("
+            " run_id TEXT PRIMARY KEY,"
+            " target TEXT,"
+            " options TEXT,"
+            " started_at REAL NOT NULL,"
+            " finished_at REAL,"
+            " summary TEXT);"
+            "CREATE TABLE IF NOT EXISTS reports ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " run_id TEXT NOT NULL,"
+            " file_path TEXT NOT NULL,"
+            " abs_path TEXT NOT NULL,"
+            " status TEXT NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " report TEXT NOT NULL,"
+            " unit_state TEXT,"
+            " UNIQUE (run_id, abs_path));"
+            "CREATE INDEX IF NOT EXISTS idx_reports_abs_path ON reports(abs_path, created_at);"
+            "CREATE INDEX IF NOT EXISTS idx_reports_file_path ON reports(file_path, created_at);"
+            "CREATE TABLE IF NOT EXISTS findings ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " report_id INTEGER NOT NULL,"
+            " run_id TEXT NOT NULL,"
+            " file_path TEXT NOT NULL,"
+            " unit_id TEXT NOT NULL,"
+            " unit_hash TEXT,"
+            " start_line INTEGER,"
+            " end_line INTEGER,"
+            " vuln_type TEXT NOT NULL,"
+            " severity TEXT,"
+            " severity_rank INTEGER NOT NULL,"
+            " verdict TEXT,"
+            " text TEXT NOT NULL,"
+            " created_at REAL NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS idx_findings_report ON findings(report_id);"
+            "CREATE INDEX IF NOT EXISTS idx_findings_run ON findings(run_id);"
+            "CREATE INDEX IF NOT EXISTS idx_findings_file ON findings(file_path);"
+            "CREATE INDEX IF NOT EXISTS idx_findings_unit_hash ON findings(unit_hash);"
+            "CREATE INDEX IF NOT EXISTS idx_findings_type_severity ON findings(vuln_type, severity_rank);"
+            "CREATE INDEX IF NOT EXISTS idx_findings_severity ON findings(severity_rank);"
+        )
+
+    @contextmanager
+    def _transaction(self):
+        """BEGIN IMMEDIATE 事务。调用方需持有 self._lock。"""
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield self._conn
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        self._conn.execute("COMMIT")
+
+    def start_run(self, run_id: str, target: str = None, options: Dict[str, Any] = None):
+        """登记一次运行（同一 run_id 重复登记时保留最早的记录）。"""
+        with self._lock, self._transaction() as conn:
+            conn.execute("INSERT OR IGNORE INTO runs (run_id, target, options, started_at) VALUES (?, ?, ?, ?)",
+                         (run_id, target, json.dumps(options or {}, ensure_ascii=False), time.time()))
+
+    def finish_run(self, run_id: str, summary: Dict[str, Any] = None):
+        """写入剩余的报告，并记录运行的结束时间和汇总。"""
+        self.flush()
+        with self._lock, self._transaction() as conn:
+            conn.execute("UPDATE runs SET finished_at = ?, summary = ? WHERE run_id = ?",
+                         (time.time(), json.dumps(summary, ensure_ascii=False) if summary else None, run_id))
+
+    def add_report(self, run_id: str, file_path: str, abs_path: str, report: Dict[str, Any]):
+        """
+        缓冲一份报告，必要时批量写入。报告中的 unit_state 单独保存（供下次增量审计使用），不写入报告正文。
+        同一运行中同一文件再次写入时（例如任务重试）覆盖之前的报告和发现。
+        """
+        report = dict(report)
+        unit_state = report.pop("unit_state", None) or {}
+        with self._lock:
+            self._pending.append((run_id, file_path, abs_path, report, unit_state))
+            if len(self._pending) < self.flush_reports and time.monotonic() - self._last_flush < self.flush_seconds:
+                return
+        self.flush()
+
+    def flush(self):
+        """在一个事务中写入所有缓冲的报告及其发现。"""
+        with self._lock:
+            pending, self._pending = self._pending, []
+            self._last_flush = time.monotonic()
+            if not pending:
+                return
+            now = time.time()
+            with self._transaction() as conn:
+                for run_id, file_path, abs_path, report, unit_state in pending:
+                    old = conn.execute("SELECT id FROM reports WHERE run_id = ? AND abs_path = ?", (run_id, abs_path)).fetchone()
+                    if old:
+                        conn.execute("DELETE FROM findings WHERE report_id = ?", (old["id"],))
+                        conn.execute("DELETE FROM reports WHERE id = ?", (old["id"],))
+                    report_id = conn.execute(
+                        "INSERT INTO reports (run_id, file_path, abs_path, status, created_at, report, unit_state)"
+                        " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (run_id, file_path, abs_path, "error" if report.get("error") else "ok", now,
+                         json.dumps(report, ensure_ascii=False),
+                         json.dumps(unit_state, ensure_ascii=False) if unit_state else None)
+                    ).lastrowid
+                    conn.executemany(
+                        "INSERT INTO findings (report_id, run_id, file_path, unit_id, unit_hash, start_line, end_line,"
+                        " vuln_type, severity, severity_rank, verdict, text, created_at)"
+                        " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        [(report_id, run_id, file_path, row["unit_id"], row["unit_hash"], row["start_line"], row["end_line"],
+                          row["vuln_type"], row["severity"], _severity_rank(row["severity"]), row["verdict"], row["text"], now)
+                         for row in extract_finding_rows(report, unit_state)]
+                    )
+
+    def get_run(self, run_id: str) -> Dict[str, Any] | None:
+        """返回一次运行的记录；不存在时返回 None。"""
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM runs WHERE run_id = ?", (run_id,)).fetchone()
+        return dict(row) if row else None
+
+    def run_reports(self, run_id: str, status: str = "ok") -> Dict[str, Dict[str, Any]]:
+        """返回一次运行中已写入的报告 {文件绝对路径: 报告}（默认只包含成功的报告）。"""
+        with self._lock:
+            rows = self._conn.execute("SELECT abs_path, report FROM reports WHERE run_id = ? AND status = ?",
+                                      (run_id, status)).fetchall()
+        return {row["abs_path"]: json.loads(row["report"]) for row in rows}
+
+    def previous_unit_state(self, abs_path: str) -> Dict[str, Any] | None:
+        """返回该文件最近一次保存的单元状态（供增量审计使用）；没有记录时返回 None。"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT unit_state FROM reports WHERE abs_path = ? AND unit_state IS NOT NULL ORDER BY created_at DESC, id DESC LIMIT 1",
+                (abs_path,)).fetchone()
+        return json.loads(row["unit_state"]) if row else None
+
+    def report(self, file_path: str, run_id: str = None) -> Dict[str, Any] | None:
+        """
+        返回一个文件的报告（默认为最近一次运行的报告）。file_path 可以是报告中记录的路径或文件的绝对路径。
+        """
+        query = "SELECT * FROM reports WHERE (file_path = ? OR abs_path = ?)"
+        params: list = [file_path, os.path.abspath(file_path)]
+        if run_id:
+            query += " AND run_id = ?"
+            params.append(run_id)
+        with self._lock:
+            row = self._conn.execute(query + " ORDER BY created_at DESC, id DESC LIMIT 1", params).fetchone()
+        if row is None:
+            return None
+        report = json.loads(row["report"])
+        report["run_id"] = row["run_id"]
+        return report
+
+    def query_findings(self, run_id: str = None, file_path: str = None, vuln_type: str = None, min_severity: str = None,
+                       verdict: str = None, unit_hash: str = None, latest: bool = False, limit: int = None) -> List[Dict[str, Any]]:
+        """
+        按条件查询发现，结果按严重程度从高到低、再按文件和行号排序。
+
+        参数:
+            file_path (str, optional): 文件路径，支持 SQL LIKE 通配符 (%)。
+            min_severity (str, optional): 只返回严重程度不低于该级别的发现（SEVERITY_LEVELS 之一）。
+            latest (bool, optional): 每个文件只使用最近一次运行的报告中的发现。
+        """
+        conditions, params = [], []
+        for column, value in (("f.run_id", run_id), ("f.vuln_type", vuln_type), ("f.verdict", verdict),
+                              ("f.unit_hash", unit_hash)):
+            if value:
+                conditions.append(f"{column} = ?")
+                params.append(value)
+        if file_path:
+            conditions.append("f.file_path LIKE ?")
+            params.append(file_path)
+        if min_severity:
+            conditions.append("f.severity_rank >= ?")
+            params.append(_severity_rank(min_severity))
+        if latest:
+            conditions.append("f.report_id IN (SELECT MAX(id) FROM reports GROUP BY abs_path)")
+        query = ("SELECT f.run_id, f.file_path, f.unit_id, f.unit_hash, f.start_line, f.end_line, f.vuln_type, f.severity,"
+                 " f.verdict, f.text FROM findings f")
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY f.severity_rank DESC, f.file_path, f.start_line"
+        if limit:
+            query += f" LIMIT {int(limit)}"
+        with self._lock:
+            return [dict(row) for row in self._conn.execute(query, params).fetchall()]
+
+    def runs(self, limit: int = 20) -> List[Dict[str, Any]]:
+        """最近的运行及其报告数和发现数。"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT r.run_id, r.target, r.started_at, r.finished_at,"
+                " (SELECT COUNT(*) FROM reports WHERE run_id = r.run_id) AS reports,"
+                " (SELECT COUNT(*) FROM findings WHERE run_id = r.run_id) AS findings"
+                " FROM runs r ORDER BY r.started_at DESC LIMIT ?", (limit,)).fetchall()
+        return [dict(row) for row in rows]
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            self._conn.close()
+
+
+def _severity_rank(severity: str | None) -> int:
+    """严重程度在 SEVERITY_LEVELS 中的序号；未知时为 -1（排在 "none" 之前）。"""
+    return SEVERITY_LEVELS.index(severity) if severity in SEVERITY_LEVELS else -1
@@ -0,0 +1,101 @@
+from typing import List, Dict
+
+from heimdallr.core.token_budget import count_message_tokens
+
+DEFAULT_HISTORY_MAX_TURNS = 4
+DEFAULT_HISTORY_MAX_TOKENS = 8000
+SUMMARY_MAX_TOKENS = 512
+
+HISTORY_SUMMARY_PROMPT = (
+    "请把下面这段对话压缩为一份简洁的摘要，保留后续对话仍然需要的事实、结论、待办事项和关键代码位置（行号），"
+    "省略寒暄和重复内容。只输出摘要本身。"
+)
+# 压缩后的摘要以一条 system 消息的形式放在历史记录开头
+SUMMARY_MESSAGE_PREFIX = "此前对话的摘要:\n"
+
+
+class HistoryPolicy:
+    """
+    对话历史策略：决定 BaseAgent 每次请求时重新发送多少历史记录。
+
+    trim 在每轮交互写入历史后调用，用于直接丢弃旧消息；compaction_split 在每次请求前调用，返回需要压缩为摘要的
+    前缀消息数，大于 0 时 BaseAgent 先调用 LLM 生成摘要，再通过 compact 用摘要替换这些消息。
+    """
+    keep_history = True
+
+    def trim(self, history: List[Dict[str, str]], model: str = "") -> List[Dict[str, str]]:
+        return history
+
+    def compaction_split(self, history: List[Dict[str, str]], model: str = "") -> int:
+        return 0
+
+    def compact(self, history: List[Dict[str, str]], split: int, summary: str | None, model: str = "") -> List[Dict[str, str]]:
+        return history
+
+    def __repr__(self) -> str:
+        params = ", ".join(f"{key}={value}" for key, value in vars(self).items())
+        return f"{self.__class__.__name__}({params})"
+
+
+class NoHistory(HistoryPolicy):
+    """不保留历史：每次请求只包含系统提示和当前消息。适用于每次调用的 prompt 已自带全部上下文的 Agent。"""
+    keep_history = False
+
+    def trim(self, history: List[Dict[str, str]], model: str = "") -> List[Dict[str, str]]:
+        return []
+
+
+class SlidingWindowHistory(HistoryPolicy):
+    """只保留最近 max_turns 轮交互（每轮为一条 user 消息和一条 assistant 消息）。"""
+    def __init__(self, max_turns: int = DEFAULT_HISTORY_MAX_TURNS):
+        self.max_turns = max(1, max_turns)
+
+    def trim(self, history: List[Dict[str, str]], model: str = "") -> List[Dict[str, str]]:
+        return history[-2 * self.max_turns:]
+
+
+class TokenCapHistory(HistoryPolicy):
+    """从最早的一轮开始丢弃交互，直到历史记录不超过 max_tokens 个 token（至少保留最近一轮）。"""
+    def __init__(self, max_tokens: int = DEFAULT_HISTORY_MAX_TOKENS):
+        self.max_tokens = max_tokens
+
+    def trim(self, history: List[Dict[str, str]], model: str = "") -> List[Dict[str, str]]:
+        start = 0
+        while len(history) - start > 2 and count_message_tokens(history[start:], model) > self.max_tokens:
+            start += 2 if history[start]["role"] != "system" else 1
+        return history[start:]
+
+
+class SummarizingHistory(HistoryPolicy):
+    """
+    历史记录超过 max_tokens 时，把最近 keep_turns 轮之前的所有消息（包括之前的摘要）交给 LLM 压缩为一条摘要。
+    生成摘要失败时退化为按 token 上限丢弃旧消息。
+    """
+    def __init__(self, max_tokens: int = DEFAULT_HISTORY_MAX_TOKENS, keep_turns: int = 1):
+        self.max_tokens = max_tokens
+        self.keep_turns = max(0, keep_turns)
+
+    def compaction_split(self, history: List[Dict[str, str]], model: str = "") -> int:
+        if count_message_tokens(history, model) <= self.max_tokens:
+            return 0
+        split = len(history) - 2 * self.keep_turns
+        # 只剩一条摘要消息可压缩时不再重复压缩
+        if split <= 0 or (split == 1 and history[0]["role"] == "system"):
+            return 0
+        return split
+
+    def compact(self, history: List[Dict[str, str]], split: int, summary: str | None, model: str = "") -> List[Dict[str, str]]:
+        if summary:
+            return [summary_message(summary)] + history[split:]
+        return TokenCapHistory(self.max_tokens).trim(history, model)
+
+
+def render_transcript(messages: List[Dict[str, str]]) -> str:
+    """把待压缩的历史消息渲染为供摘要使用的对话文本。"""
+    names = {"system": "摘要", "user": "用户", "assistant": "助手"}
+    return "\n\n".join(f"[{names.get(m['role'], m['role'])}]\n{m['content']}" for m in messages)
+
+
+def summary_message(summary: str) -> Dict[str, str]:
+    return {"role": "system", "content": f"{SUMMARY_MESSAGE_PREFIX}{summary.strip()}"}
+
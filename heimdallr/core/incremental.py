@@ -0,0 +1,75 @@
+import json
+import os
+from typing import Dict, Any, Iterable, List, Tuple
+
+from heimdallr.core.code_units import CodeUnit, find_direct_callers
+
+UNIT_STATE_VERSION = 1
+UNIT_STATE_SUFFIX = "_audit_units.json"
+
+def load_unit_state(state_path: str) -> Dict[str, Any]:
+    """
+    读取上一次审计保存的单元状态。文件不存在或格式不兼容时返回空状态（即全部单元都需要审计）。
+    """
+    if not os.path.isfile(state_path):
+        return {}
+    try:
+        with open(state_path, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"INCREMENTAL: 读取单元状态 '{state_path}' 失败，将进行完整审计: {e}")
+        return {}
+    if state.get("version") != UNIT_STATE_VERSION:
+        return {}
+    return state
+
+def save_unit_state(state_path: str, state: Dict[str, Any]):
+    with open(state_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=2, ensure_ascii=False)
+
+def plan_incremental(units: List[CodeUnit], previous_state: Dict[str, Any]) -> Tuple[List[CodeUnit], Dict[str, str]]:
+    """
+    比较当前单元与上一次的指纹，决定哪些单元需要重新审计。
+
+    新增或内容变化的单元及其直接调用者需要重新审计（调用者的行为可能因被调用者变化而改变）；
+    其余单元复用上一次的审计结果。
+
+    返回:
+        Tuple[List[CodeUnit], Dict[str, str]]: (需要审计的单元列表（保持源文件顺序）, {unit_id: 复用的审计结果})。
+    """
+    previous_units = previous_state.get("units", {}) if previous_state else {}
+    changed = [
+        u for u in units
+        if u.unit_id not in previous_units or previous_units[u.unit_id].get("fingerprint") != u.fingerprint
+    ]
+    dirty_ids = {u.unit_id for u in changed}
+    dirty_ids |= {u.unit_id for u in find_direct_callers(units, changed)}
+
+    dirty = [u for u in units if u.unit_id in dirty_ids]
+    reused = {
+        u.unit_id: previous_units[u.unit_id].get("findings", "")
+        for u in units if u.unit_id not in dirty_ids
+    }
+    return dirty, reused
+
+def build_unit_state(file_path: str, units: List[CodeUnit], findings_by_unit: Dict[str, str],
+                     file_level: Dict[str, Any] = None, failed_units: Iterable[str] = ()) -> Dict[str, Any]:
+    """
+    构建需要持久化的单元状态。file_level 保存整个文件级别的结论（Checker 反馈、最终结论等），
+    在文件完全未变化时可以直接复用。failed_units 中的单元（本次审计失败）不写入状态，下次增量审计时视为新增单元重新审计。
+    """
+    failed_units = set(failed_units)
+    return {
+        "version": UNIT_STATE_VERSION,
+        "file_path": file_path,
+        "units": {
+            u.unit_id: {
+                "fingerprint": u.fingerprint,
+                "start_line": u.start_line,
+                "end_line": u.end_line,
+                "findings": findings_by_unit.get(u.unit_id, ""),
+            }
+            for u in units if u.unit_id not in failed_units
+        },
+        "file_level": file_level or {},
+    }
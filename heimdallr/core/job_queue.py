@@ -0,0 +1,220 @@
+import os
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Dict, Any, List
+
+DEFAULT_LEASE_SECONDS = 600
+DEFAULT_MAX_ATTEMPTS = 3
+
+# 任务状态
+QUEUED = "queued"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+
+
+def new_run_id() -> str:
+    """生成一次审计运行的 ID（时间戳 + 随机后缀，便于按时间排序）。"""
+    return time.strftime("%Y%m%d-%H%M%S") + "-" + uuid.uuid4().hex[:6]
+
+
+def default_worker_id() -> str:
+    """默认的 worker 标识：主机名:进程号:随机后缀。"""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:4]}"
+
+
+class JobQueue:
+    """
+    基于 SQLite 文件的持久化审计任务队列。
+
+    协调者 (coordinator) 把每个文件作为一个任务写入队列；任意数量的 `heimdallr worker` 进程（可以在多台
+    共享存储的主机上）通过租约 (lease) 领取任务，执行审计后写回结果。租约在 lease_seconds 内未续期即视为过期，
+    该任务会被重新放回队列，因此崩溃的 worker 不会导致任务丢失；重试超过 max_attempts 次的任务标记为失败。
+
+    数据库使用回滚日志而非 WAL 模式，因为 WAL 依赖共享内存，无法在多台主机通过网络文件系统共享。
+    所有状态变更都在 BEGIN IMMEDIATE 事务中完成，同一任务不会被两个 worker 同时领取。
+    各方法是阻塞调用（等待写锁最长 60 秒），在事件循环中使用时应通过 asyncio.to_thread 调用。
+    """
+    def __init__(self, db_path: str):
+        """
+        参数:
+            db_path (str): 队列数据库文件路径，不存在时自动创建。
+        """
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, timeout=60, isolation_level=None, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " run_id TEXT NOT NULL,"
+            " file_path TEXT NOT NULL,"
+            " rel_path TEXT NOT NULL,"
+            " options TEXT NOT NULL,"
+            " status TEXT NOT NULL,"
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " max_attempts INTEGER NOT NULL,"
+            " worker_id TEXT,"
+            " lease_expires_at REAL,"
+            " created_at REAL NOT NULL,"
+            " updated_at REAL NOT NULL,"
+            " result TEXT,"
+            " error TEXT,"
+            " UNIQUE (run_id, rel_path))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, id)")
+
+    @contextmanager
+    def _transaction(self):
+        """BEGIN IMMEDIATE 事务：先获取写锁再读取状态，避免多个 worker 之间的竞争。"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def enqueue(self, run_id: str, files: List[tuple], options: Dict[str, Any] = None,
+                max_attempts: int = DEFAULT_MAX_ATTEMPTS) -> int:
+        """
+        为一次运行批量写入任务。
+
+        参数:
+            run_id (str): 运行 ID。
+            files (List[tuple]): [(绝对路径, 相对路径), ...]。同一运行中相对路径相同的任务只会写入一次。
+            options (Dict[str, Any], optional): worker 执行任务时使用的审计参数（输出目录、模型等）。
+            max_attempts (int, optional): 每个任务最多被领取的次数。
+
+        返回:
+            int: 实际新增的任务数。
+        """
+        now = time.time()
+        options_json = json.dumps(options or {}, ensure_ascii=False)
+        with self._transaction() as conn:
+            before = conn.total_changes
+            conn.executemany(
+                "INSERT OR IGNORE INTO jobs (run_id, file_path, rel_path, options, status, max_attempts, created_at, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(run_id, path, rel_path, options_json, QUEUED, max_attempts, now, now) for path, rel_path in files]
+            )
+            return conn.total_changes - before
+
+    def _requeue_expired(self, conn, now: float) -> int:
+        """把租约过期的任务放回队列（超过最大尝试次数的标记为失败）。调用方需持有事务。"""
+        failed = conn.execute(
+            "UPDATE jobs SET status = ?, error = ?, worker_id = NULL, lease_expires_at = NULL, updated_at = ?"
+            " WHERE status = ? AND lease_expires_at < ? AND attempts >= max_attempts",
+            (FAILED, "租约过期且已达到最大尝试次数", now, LEASED, now)
+        ).rowcount
+        requeued = conn.execute(
+            "UPDATE jobs SET status = ?, worker_id = NULL, lease_expires_at = NULL, updated_at = ?"
+            " WHERE status = ? AND lease_expires_at < ?",
+            (QUEUED, now, LEASED, now)
+        ).rowcount
+        return failed + requeued
+
+    def requeue_expired(self) -> int:
+        """回收所有租约过期的任务，返回受影响的任务数。"""
+        with self._transaction() as conn:
+            return self._requeue_expired(conn, time.time())
+
+    def lease(self, worker_id: str, lease_seconds: float = DEFAULT_LEASE_SECONDS, run_id: str = None) -> Dict[str, Any] | None:
+        """
+        领取最早入队的一个任务。没有可领取的任务时返回 None。
+
+        参数:
+            worker_id (str): 领取者标识。
+            lease_seconds (float, optional): 租约时长，worker 需要在到期前调用 heartbeat 续期。
+            run_id (str, optional): 只领取指定运行的任务。
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            self._requeue_expired(conn, now)
+            query = "SELECT * FROM jobs WHERE status = ?"
+            params: list = [QUEUED]
+            if run_id:
+                query += " AND run_id = ?"
+                params.append(run_id)
+            row = conn.execute(query + " ORDER BY id LIMIT 1", params).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = ?, worker_id = ?, lease_expires_at = ?, attempts = attempts + 1, updated_at = ?"
+                " WHERE id = ?",
+                (LEASED, worker_id, now + lease_seconds, now, row["id"])
+            )
+            job = self._row_to_job(row)
+            job.update(status=LEASED, worker_id=worker_id, attempts=row["attempts"] + 1)
+            return job
+
+    def heartbeat(self, job_id: int, worker_id: str, lease_seconds: float = DEFAULT_LEASE_SECONDS) -> bool:
+        """为仍由 worker_id 持有的任务续租。租约已丢失（过期后被回收或被他人领取）时返回 False。"""
+        now = time.time()
+        with self._transaction() as conn:
+            return conn.execute(
+                "UPDATE jobs SET lease_expires_at = ?, updated_at = ? WHERE id = ? AND worker_id = ? AND status = ?",
+                (now + lease_seconds, now, job_id, worker_id, LEASED)
+            ).rowcount == 1
+
+    def complete(self, job_id: int, worker_id: str, result: Dict[str, Any]) -> bool:
+        """写回任务结果。租约已丢失时返回 False，结果不会被记录。"""
+        now = time.time()
+        with self._transaction() as conn:
+            return conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = NULL, lease_expires_at = NULL, updated_at = ?"
+                " WHERE id = ? AND worker_id = ? AND status = ?",
+                (DONE, json.dumps(result, ensure_ascii=False), now, job_id, worker_id, LEASED)
+            ).rowcount == 1
+
+    def fail(self, job_id: int, worker_id: str, error: str, result: Dict[str, Any] = None) -> bool:
+        """
+        报告任务执行失败。尚未达到最大尝试次数时任务会被放回队列，否则标记为失败。
+        租约已丢失时返回 False。
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            return conn.execute(
+                "UPDATE jobs SET status = CASE WHEN attempts >= max_attempts THEN ? ELSE ? END,"
+                " error = ?, result = ?, worker_id = NULL, lease_expires_at = NULL, updated_at = ?"
+                " WHERE id = ? AND worker_id = ? AND status = ?",
+                (FAILED, QUEUED, error, json.dumps(result, ensure_ascii=False) if result else None, now,
+                 job_id, worker_id, LEASED)
+            ).rowcount == 1
+
+    def counts(self, run_id: str = None) -> Dict[str, int]:
+        """按状态统计任务数。"""
+        query = "SELECT status, COUNT(*) FROM jobs"
+        params = []
+        if run_id:
+            query += " WHERE run_id = ?"
+            params.append(run_id)
+        with self._lock:
+            rows = self._conn.execute(query + " GROUP BY status", params).fetchall()
+        counts = {QUEUED: 0, LEASED: 0, DONE: 0, FAILED: 0}
+        counts.update({status: n for status, n in rows})
+        return counts
+
+    def jobs(self, run_id: str) -> List[Dict[str, Any]]:
+        """返回一次运行的所有任务（按入队顺序）。"""
+        with self._lock:
+            rows = self._conn.execute("SELECT * FROM jobs WHERE run_id = ? ORDER BY id", (run_id,)).fetchall()
+        return [self._row_to_job(row) for row in rows]
+
+    @staticmethod
+    def _row_to_job(row: sqlite3.Row) -> Dict[str, Any]:
+        job = dict(row)
+        job["options"] = json.loads(job["options"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,170 @@
+import json
+from typing import Any, Dict, List
+
+# repair_json 向前回退尝试的最大截断点数
+_MAX_REPAIR_ATTEMPTS = 64
+
+
+class _Container:
+    """解析栈中的一个 JSON 容器。key 对对象而言是当前正在解析的键，对数组而言是该数组在父对象中的键。"""
+    __slots__ = ("kind", "key", "expect_value")
+
+    def __init__(self, kind: str, key: str | None = None):
+        self.kind = kind
+        self.key = key
+        self.expect_value = False
+
+
+class StreamingJSONParser:
+    """
+    增量、容错的 JSON 解析器，用于在 LLM 流式输出的过程中提前取出结构化结果。
+
+    逐段 feed 增量文本，每当 item_key 对应数组（或顶层数组）中的一个对象完整闭合时立即返回该对象；
+    顶层对象中已经完整的字符串字段（例如 "overview"）记录在 fields 中。
+    第一个 { 或 [ 之前的文字（例如 ```json 代码块标记或说明文字）会被忽略；
+    无法解析的元素会被跳过而不会中断后续解析。
+    """
+    def __init__(self, item_key: str = "units"):
+        self.item_key = item_key
+        self.text = ""
+        self.fields: Dict[str, Any] = {}
+        self.items: List[Any] = []
+        self._pos = 0
+        self._stack: List[_Container] = []
+        self._done = False
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        self._last_string: str | None = None
+        self._item_start: int | None = None
+        self._item_depth = 0
+
+    def feed(self, delta: str) -> List[Any]:
+        """追加一段增量文本，返回本次新解析出的完整元素。"""
+        self.text += delta
+        found = []
+        text, stack = self.text, self._stack
+        for i in range(self._pos, len(text)):
+            if self._done:
+                break
+            c = text[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+                    self._end_string(text[self._string_start:i + 1])
+                continue
+            if not stack:
+                if c in "{[":
+                    stack.append(_Container(c))
+                    self._maybe_start_item(c, i)
+                continue
+            top = stack[-1]
+            if c == '"':
+                self._in_string = True
+                self._string_start = i
+            elif c == ":" and top.kind == "{":
+                top.key = self._last_string
+                top.expect_value = True
+            elif c == "," and top.kind == "{":
+                top.expect_value = False
+            elif c in "{[":
+                self._maybe_start_item(c, i)
+                stack.append(_Container(c, top.key if top.kind == "{" else None))
+            elif c in "}]":
+                stack.pop()
+                if self._item_start is not None and c == "}" and len(stack) + 1 == self._item_depth:
+                    try:
+                        item = json.loads(text[self._item_start:i + 1])
+                        self.items.append(item)
+                        found.append(item)
+                    except json.JSONDecodeError:
+                        pass
+                    self._item_start = None
+                if not stack:
+                    self._done = True
+        self._pos = len(text)
+        return found
+
+    def _maybe_start_item(self, c: str, i: int):
+        """即将压入的容器是否是目标数组中的一个对象元素。"""
+        stack = self._stack
+        if c != "{" or self._item_start is not None or not stack or stack[-1].kind != "[":
+            return
+        parent = stack[-1]
+        if parent.key == self.item_key or (len(stack) == 1 and parent.key is None):
+            self._item_start = i
+            self._item_depth = len(stack) + 1
+
+    def _end_string(self, literal: str):
+        try:
+            value = json.loads(literal)
+        except json.JSONDecodeError:
+            value = literal[1:-1]
+        top = self._stack[-1] if self._stack else None
+        if top is not None and top.kind == "{" and top.expect_value:
+            if len(self._stack) == 1 and top.key is not None:
+                self.fields[top.key] = value
+        else:
+            self._last_string = value
+
+    def result(self) -> Any:
+        """按目前收到的全部文本容错地解析整个 JSON（未闭合的部分会被补全或丢弃）。"""
+        return repair_json(self.text)
+
+
+def repair_json(text: str) -> Any:
+    """
+    容错地解析 LLM 输出中的 JSON：忽略第一个 { 或 [ 之前的内容；输出被截断（例如达到 max_tokens）时，
+    补全未闭合的字符串和容器，必要时回退到最近一个完整的元素。完全无法解析时返回 None。
+    """
+    start = next((i for i, c in enumerate(text) if c in "{["), None)
+    if start is None:
+        return None
+    text = text[start:]
+    decoder = json.JSONDecoder()
+    try:
+        return decoder.raw_decode(text)[0]
+    except json.JSONDecodeError:
+        pass
+
+    # 扫描一遍，记录每个逗号 / 容器开始处的截断点及当时未闭合的容器
+    stack: List[str] = []
+    cut_points: List[tuple] = []
+    in_string = escape = False
+    for i, c in enumerate(text):
+        if in_string:
+            if escape:
+                escape = False
+            elif c == "\\":
+                escape = True
+            elif c == '"':
+                in_string = False
+            continue
+        if c == '"':
+            in_string = True
+        elif c in "{[":
+            stack.append(c)
+            cut_points.append((i + 1, "".join(stack)))
+        elif c in "}]":
+            if stack:
+                stack.pop()
+            if not stack:
+                break
+        elif c == ",":
+            cut_points.append((i, "".join(stack)))
+
+    def close(prefix: str, open_containers: str) -> str:
+        return prefix + "".join("}" if c == "{" else "]" for c in reversed(open_containers))
+
+    candidates = [close(text + ('"' if in_string else ""), "".join(stack))]
+    candidates += [close(text[:cut], containers) for cut, containers in reversed(cut_points[-_MAX_REPAIR_ATTEMPTS:])]
+    for candidate in candidates:
+        try:
+            return json.loads(candidate)
+        except json.JSONDecodeError:
+            continue
+    return None
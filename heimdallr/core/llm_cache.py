@@ -0,0 +1,134 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Dict, Any, List
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "heimdallr")
+DEFAULT_CACHE_MAX_BYTES = 256 * 1024 * 1024
+DEFAULT_CACHE_MAX_AGE_SECONDS = 30 * 24 * 3600
+# 每写入多少条记录执行一次淘汰检查
+_EVICT_EVERY_N_WRITES = 64
+
+class LLMCache:
+    """
+    基于 SQLite 的持久化 LLM 响应缓存。
+
+    键是 (model, messages, temperature, max_tokens) 的内容哈希，因此同样的请求在代码未变化时
+    可以直接命中缓存。超过 max_age_seconds 的记录视为过期；总大小超过 max_bytes 时按最近访问时间
+    (LRU) 淘汰。数据库使用 WAL 模式，可被多个进程共享。
+    """
+    def __init__(self, cache_dir: str = None, max_bytes: int = DEFAULT_CACHE_MAX_BYTES,
+                 max_age_seconds: float = DEFAULT_CACHE_MAX_AGE_SECONDS):
+        """
+        初始化 LLMCache。
+
+        参数:
+            cache_dir (str, optional): 缓存目录。默认为环境变量 HEIMDALLR_CACHE_DIR 或 ~/.cache/heimdallr。
+            max_bytes (int, optional): 缓存响应内容的总字节数上限。默认为 256 MiB。
+            max_age_seconds (float, optional): 记录的最长保存时间（秒）。默认为 30 天。
+        """
+        self.cache_dir = cache_dir or os.getenv("HEIMDALLR_CACHE_DIR", DEFAULT_CACHE_DIR)
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.db_path = os.path.join(self.cache_dir, "llm_cache.sqlite3")
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY,"
+            " model TEXT NOT NULL,"
+            " response TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_access ON responses(last_access)")
+        self._conn.commit()
+
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self.evict()
+
+    @staticmethod
+    def make_key(model: str, messages: List[Dict[str, Any]], temperature: float, max_tokens: int,
+                 response_format: Dict[str, Any] = None) -> str:
+        """计算请求的内容哈希，作为缓存键。"""
+        request = {"model": model, "messages": messages, "temperature": temperature, "max_tokens": max_tokens}
+        if response_format:
+            request["response_format"] = response_format
+        payload = json.dumps(request, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> str | None:
+        """查找缓存。命中时刷新访问时间并返回响应文本；未命中或已过期返回 None。"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT response, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row and now - row[1] <= self.max_age_seconds:
+                self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+                self._conn.commit()
+                self.hits += 1
+                return row[0]
+            if row:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                self.evictions += 1
+            self.misses += 1
+            return None
+
+    def put(self, key: str, model: str, response: str):
+        """写入（或覆盖）一条缓存记录。"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, model, response, size, created_at, last_access) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model, response, len(response.encode("utf-8")), now, now)
+            )
+            self._conn.commit()
+            self.writes += 1
+            should_evict = self.writes % _EVICT_EVERY_N_WRITES == 0
+        if should_evict:
+            self.evict()
+
+    def evict(self):
+        """删除过期记录，并按 LRU 顺序淘汰，直到总大小不超过 max_bytes。"""
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM responses WHERE created_at < ?", (time.time() - self.max_age_seconds,))
+            self.evictions += cursor.rowcount
+            total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            if total > self.max_bytes:
+                rows = self._conn.execute("SELECT key, size FROM responses ORDER BY last_access ASC").fetchall()
+                victims = []
+                for key, size in rows:
+                    if total <= self.max_bytes:
+                        break
+                    victims.append((key,))
+                    total -= size
+                self._conn.executemany("DELETE FROM responses WHERE key = ?", victims)
+                self.evictions += len(victims)
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        """返回本进程内的缓存命中统计。"""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "writes": self.writes,
+            "evictions": self.evictions,
+        }
+
+    def close(self):
+        """执行一次淘汰并关闭数据库连接。"""
+        self.evict()
+        with self._lock:
+            self._conn.close()
@@ -1,13 +1,59 @@
 import os
-from openai import OpenAI
+import time
+import random
+import asyncio
+import email.utils
+from typing import Callable
+from contextlib import nullcontext
+import httpx
+from openai import OpenAI, AsyncOpenAI
 import openai
+from heimdallr.core.llm_cache import LLMCache
+from heimdallr.core.rate_limit import ModelRateLimiter
+from heimdallr.core.token_budget import count_message_tokens, count_tokens
+from heimdallr.core.metrics import MetricsCollector
+from heimdallr.core.batch import BatchSubmitter
+from heimdallr.core.scheduler import PipelineScheduler
+
+# HTTP 连接池默认参数。同步与异步客户端各自持有一个连接池，
+# 在整个进程生命周期内复用，以避免每次调用都重新建立 TCP/TLS 连接。
+DEFAULT_MAX_CONNECTIONS = 20
+DEFAULT_MAX_KEEPALIVE_CONNECTIONS = 10
+DEFAULT_KEEPALIVE_EXPIRY = 30.0
+# 重试参数：指数退避（带抖动）的初始间隔和上限（秒）。服务端给出 Retry-After 时以其为准，但不超过 MAX_RETRY_AFTER。
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_BACKOFF_BASE = 1.0
+DEFAULT_BACKOFF_MAX = 60.0
+MAX_RETRY_AFTER = 300.0
+# 视为暂时性错误、可以重试的 HTTP 状态码
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
 
 class LLMConnector:
     """
     负责与 OpenAI 兼容的 LLM API 进行交互。
     支持自定义 api_key 和 base_url。
+    同时提供同步的 invoke_llm 与基于 AsyncOpenAI 的 ainvoke_llm，两者共享同一组连接池配置。
+    两者都支持流式输出：提供 on_token 回调时以 stream=True 请求，每收到一段增量文本就回调一次。
+    遇到限流、超时、连接错误和 5xx 等暂时性错误时按指数退避（带抖动，遵循 Retry-After）重试；
+    配置了 rate_limiter 时，每个请求发送前先按模型的 RPM/TPM 令牌桶排队。
+    配置了 metrics 时，每次调用的 token 用量、延迟、重试和缓存命中都按调用方提供的标签（Agent、文件）记录。
+    调用方可以通过 response_format 请求结构化输出（JSON 模式 / JSON Schema）；服务商不支持时（返回 400/422）
+    自动去掉该参数重新请求，并记住该模型不再发送。
+    配置了 batch 时，调用方可以通过 ainvoke_llm(batch=True) 把请求交给 Batch API 离线执行（见 heimdallr.core.batch），
+    批处理失败的请求自动改为直接请求。
+    配置了 scheduler 时，异步请求在发送期间占用其模型的一个空位（见 heimdallr.core.scheduler），
+    同一进程中所有文件的请求按各模型的并发上限排队。
     """
-    def __init__(self, api_key: str = None, base_url: str = None, timeout: int = 60):
+    def __init__(self, api_key: str = None, base_url: str = None, timeout: int = 60,
+                 max_connections: int = DEFAULT_MAX_CONNECTIONS,
+                 max_keepalive_connections: int = DEFAULT_MAX_KEEPALIVE_CONNECTIONS,
+                 keepalive_expiry: float = DEFAULT_KEEPALIVE_EXPIRY,
+                 cache: LLMCache | None = None,
+                 max_retries: int = DEFAULT_MAX_RETRIES,
+                 rate_limiter: ModelRateLimiter | None = None,
+                 metrics: MetricsCollector | None = None,
+                 batch: BatchSubmitter | None = None,
+                 scheduler: PipelineScheduler | None = None):
         """
         初始化 LLMConnector。
 
@@ -15,20 +61,62 @@ class LLMConnector:
             api_key (str, optional): API 密钥。如果未提供，则从环境变量 OPENAI_API_KEY 中读取。
             base_url (str, optional): API 的基础 URL。如果未提供，则使用 OpenAI 默认 URL 或从 OPENAI_BASE_URL 环境变量读取。
             timeout (int, optional): API 请求的超时时间（秒）。默认为 60。
+            max_connections (int, optional): 连接池允许的最大并发连接数。默认为 20。
+            max_keepalive_connections (int, optional): 连接池中保持 keep-alive 的最大空闲连接数。默认为 10。
+            keepalive_expiry (float, optional): 空闲 keep-alive 连接的过期时间（秒）。默认为 30。
+            cache (LLMCache, optional): 响应缓存。提供时，相同的请求会直接返回缓存结果。默认为 None（不缓存）。
+            max_retries (int, optional): 暂时性错误的最大重试次数。默认为 5。
+            rate_limiter (ModelRateLimiter, optional): 客户端按模型限流器。默认为 None（不限流）。
+            metrics (MetricsCollector, optional): 调用指标收集器。默认为 None（不记录）。
+            batch (BatchSubmitter, optional): Batch API 提交器。默认为 None（所有请求直接发送）。
+            scheduler (PipelineScheduler, optional): 按模型限制在途请求数的流水线调度器。默认为 None（不限制）。
         """
         self.api_key = api_key or os.getenv("OPENAI_API_KEY")
         self.base_url = base_url or os.getenv("OPENAI_BASE_URL")
+        self.timeout = timeout
+        self.cache = cache
+        self.max_retries = max(0, max_retries)
+        self.rate_limiter = rate_limiter
+        self.metrics = metrics
+        self.batch = batch
+        self.scheduler = scheduler
+        self.retries = 0 # 本进程内发生的重试次数
+        self._response_format_unsupported: set[str] = set() # 拒绝 response_format 参数的模型
         
         if not self.api_key:
             raise ValueError("API key must be provided either as an argument or via OPENAI_API_KEY environment variable.")
 
-        client_args = {"api_key": self.api_key, "timeout": timeout}
+        # 重试由本类统一处理（遵循 Retry-After 并与限流器联动），因此关闭 SDK 自带的重试
+        self._client_args = {"api_key": self.api_key, "timeout": timeout, "max_retries": 0}
         if self.base_url:
-            client_args["base_url"] = self.base_url
+            self._client_args["base_url"] = self.base_url
+        self._limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry
+        )
         
-        self.client = OpenAI(**client_args)
+        self.client = OpenAI(
+            **self._client_args,
+            http_client=openai.DefaultHttpxClient(limits=self._limits, timeout=timeout)
+        )
+        # 异步客户端延迟创建：httpx.AsyncClient 的连接会绑定到首次使用时的事件循环，
+        # 因此在 asyncio.run 启动的循环内部再创建它。
+        self._async_client: AsyncOpenAI | None = None
+
+    @property
+    def async_client(self) -> AsyncOpenAI:
+        """返回共享的 AsyncOpenAI 客户端（首次访问时创建）。"""
+        if self._async_client is None:
+            self._async_client = AsyncOpenAI(
+                **self._client_args,
+                http_client=openai.DefaultAsyncHttpxClient(limits=self._limits, timeout=self.timeout)
+            )
+        return self._async_client
 
-    def invoke_llm(self, model: str, messages: list[dict], temperature: float = 0.7, max_tokens: int = 2048) -> str | None:
+    def invoke_llm(self, model: str, messages: list[dict], temperature: float = 0.7, max_tokens: int = 2048,
+                   on_token: Callable[[str], None] | None = None,
+                   labels: dict | None = None, response_format: dict | None = None) -> str | None:
         """
         调用 LLM API 生成聊天完成。
 
@@ -38,32 +126,286 @@ class LLMConnector:
                                   例如: [{"role": "system", "content": "You are an assistant."}, {"role": "user", "content": "Hello!"}]
             temperature (float, optional): 控制生成文本的随机性。默认为 0.7。
             max_tokens (int, optional): 生成文本的最大 token 数。默认为 2048。
+            on_token (Callable[[str], None], optional): 流式输出回调。提供时以 stream=True 请求，
+                每收到一段增量文本调用一次；命中缓存时以完整响应调用一次。默认为 None（非流式）。
+            labels (dict, optional): 记录指标时使用的标签，例如 {"agent": "AuditorAgent", "file": "app.py"}。
+            response_format (dict, optional): 结构化输出格式，例如 {"type": "json_object"} 或
+                {"type": "json_schema", "json_schema": {...}}。服务商不支持时自动退化为普通文本输出。
 
         返回:
             str | None: LLM 生成的文本内容，如果发生错误则返回 None。
         """
+        started_at = time.monotonic()
+        cache_key = self._cache_lookup_key(model, messages, temperature, max_tokens, response_format)
+        if cache_key and (cached := self.cache.get(cache_key)) is not None:
+            if on_token:
+                on_token(cached)
+            self._record_metrics(model, labels, started_at, cache_hit=True)
+            return cached
+        usage = None
+        for attempt in range(self.max_retries + 1):
+            reserved = self._estimate_tokens(model, messages, max_tokens)
+            if self.rate_limiter:
+                self.rate_limiter.acquire_sync(model, reserved)
+            parts = []
+            try:
+                request = self._request_args(model, messages, temperature, max_tokens, on_token is not None, response_format)
+                try:
+                    response = self.client.chat.completions.create(**request)
+                except (openai.BadRequestError, openai.UnprocessableEntityError) as e:
+                    if not self._drop_response_format(model, request, e):
+                        raise
+                    response = self.client.chat.completions.create(**request)
+                if on_token:
+                    for chunk in response:
+                        self._collect_delta(chunk, parts, on_token)
+                        usage = getattr(chunk, "usage", None) or usage
+                    content = self._join_stream(parts)
+                else:
+                    content = self._extract_content(response)
+                    usage = getattr(response, "usage", None)
+                self._settle_usage(model, reserved, usage)
+                break
+            except Exception as e:
+                delay = self._retry_delay(e, attempt, streamed=bool(parts))
+                if delay is None:
+                    self._report_error(e)
+                    self._record_metrics(model, labels, started_at, retries=attempt, error=True)
+                    return None
+                self._before_retry(model, e, attempt, delay)
+                time.sleep(delay)
+        self._record_metrics(model, labels, started_at, usage=usage, messages=messages, content=content, retries=attempt)
+        if cache_key and content:
+            self.cache.put(cache_key, model, content)
+        return content
+
+    async def ainvoke_llm(self, model: str, messages: list[dict], temperature: float = 0.7, max_tokens: int = 2048,
+                          on_token: Callable[[str], None] | None = None,
+                          labels: dict | None = None, response_format: dict | None = None,
+                          batch: bool = False) -> str | None:
+        """
+        invoke_llm 的异步版本，基于 AsyncOpenAI，不会阻塞事件循环。
+        batch 为 True 且配置了 Batch API 提交器时，请求进入批任务离线执行（不占用限流额度，也不流式输出：
+        结果到达后以完整响应回调一次 on_token）；批处理未返回结果时改为直接请求。其余参数和返回值与 invoke_llm 相同。
+        """
+        started_at = time.monotonic()
+        cache_key = self._cache_lookup_key(model, messages, temperature, max_tokens, response_format)
+        if cache_key and (cached := self.cache.get(cache_key)) is not None:
+            if on_token:
+                on_token(cached)
+            self._record_metrics(model, labels, started_at, cache_hit=True)
+            return cached
+        if batch and self.batch is not None:
+            request = self._request_args(model, messages, temperature, max_tokens, False, response_format)
+            del request["stream"]
+            response = await self.batch.submit(self.async_client, request)
+            content = self._extract_content(response) if response is not None else None
+            if content:
+                if on_token:
+                    on_token(content)
+                self._record_metrics(model, labels, started_at, usage=response.usage, messages=messages, content=content)
+                if cache_key:
+                    self.cache.put(cache_key, model, content)
+                return content
+        usage = None
+        for attempt in range(self.max_retries + 1):
+            reserved = self._estimate_tokens(model, messages, max_tokens)
+            parts = []
+            # 只在发送期间占用模型空位（及全局空位）：等待限流额度和退避期间让给其他请求，
+            # 否则等待某个模型 RPM/TPM 额度的请求会占满全局空位，使其他模型的请求也无法发送
+            if self.rate_limiter:
+                await self.rate_limiter.acquire(model, reserved)
+            async with (self.scheduler.slot(model) if self.scheduler else nullcontext()):
+                try:
+                    request = self._request_args(model, messages, temperature, max_tokens, on_token is not None, response_format)
+                    try:
+                        response = await self.async_client.chat.completions.create(**request)
+                    except (openai.BadRequestError, openai.UnprocessableEntityError) as e:
+                        if not self._drop_response_format(model, request, e):
+                            raise
+                        response = await self.async_client.chat.completions.create(**request)
+                    if on_token:
+                        async for chunk in response:
+                            self._collect_delta(chunk, parts, on_token)
+                            usage = getattr(chunk, "usage", None) or usage
+                        content = self._join_stream(parts)
+                    else:
+                        content = self._extract_content(response)
+                        usage = getattr(response, "usage", None)
+                    self._settle_usage(model, reserved, usage)
+                    break
+                except Exception as e:
+                    delay = self._retry_delay(e, attempt, streamed=bool(parts))
+                    if delay is None:
+                        self._report_error(e)
+                        self._record_metrics(model, labels, started_at, retries=attempt, error=True)
+                        return None
+                    self._before_retry(model, e, attempt, delay)
+            await asyncio.sleep(delay)
+        self._record_metrics(model, labels, started_at, usage=usage, messages=messages, content=content, retries=attempt)
+        if cache_key and content:
+            self.cache.put(cache_key, model, content)
+        return content
+
+    async def aclose(self):
+        """关闭连接池。应在事件循环结束前调用。"""
+        if self._async_client is not None:
+            await self._async_client.close()
+            self._async_client = None
+        self.client.close()
+
+    def _cache_lookup_key(self, model: str, messages: list[dict], temperature: float, max_tokens: int,
+                          response_format: dict | None = None) -> str | None:
+        """未启用缓存时返回 None，否则返回请求对应的缓存键。"""
+        if self.cache is None:
+            return None
+        return LLMCache.make_key(model, messages, temperature, max_tokens, response_format)
+
+    def _request_args(self, model: str, messages: list[dict], temperature: float, max_tokens: int, stream: bool,
+                      response_format: dict | None = None) -> dict:
+        """构造 chat.completions.create 的参数。已知不支持 response_format 的模型不再发送该参数。"""
+        request = {"model": model, "messages": messages, "temperature": temperature, "max_tokens": max_tokens,
+                   "stream": stream}
+        if response_format and model not in self._response_format_unsupported:
+            request["response_format"] = response_format
+        return request
+
+    def _drop_response_format(self, model: str, request: dict, error: openai.APIStatusError) -> bool:
+        """
+        请求因参数错误被拒绝、且错误信息指向 response_format（或 json_schema）时，认为服务商不支持结构化输出：
+        从请求中去掉该参数并记住该模型，返回 True 表示应当重新请求。
+        其他参数错误（上下文超长、max_tokens 无效、内容过滤等）与结构化输出无关，返回 False，由调用方按原错误处理。
+        """
+        if "response_format" not in request:
+            return False
+        detail = f"{getattr(error, 'message', '')} {getattr(error, 'body', '')} {error}".lower()
+        if "response_format" not in detail and "json_schema" not in detail:
+            return False
+        del request["response_format"]
+        self._response_format_unsupported.add(model)
+        print(f"LLM 服务商拒绝了 response_format 参数 (模型 {model})，改为普通文本输出。")
+        return True
+
+    @staticmethod
+    def _estimate_tokens(model: str, messages: list[dict], max_tokens: int) -> int:
+        """估算请求占用的 TPM 额度：prompt token 数 + max_tokens（与服务商的计费口径一致）。"""
+        return count_message_tokens(messages, model) + max_tokens
+
+    def _settle_usage(self, model: str, reserved: int, usage):
+        """按响应中的实际 token 用量校正限流器。"""
+        if self.rate_limiter and usage is not None and getattr(usage, "total_tokens", None):
+            self.rate_limiter.settle(model, reserved, usage.total_tokens)
+
+    def _record_metrics(self, model: str, labels: dict | None, started_at: float, usage=None, messages: list[dict] = None,
+                        content: str = None, cache_hit: bool = False, retries: int = 0, error: bool = False):
+        """
+        记录一次调用的指标。响应中没有 usage（例如流式响应）时按本地计数估算 token 数。
+        """
+        if self.metrics is None:
+            return
+        labels = labels or {}
+        prompt_tokens = completion_tokens = cached_prompt_tokens = 0
+        if usage is not None:
+            prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+            completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+            details = getattr(usage, "prompt_tokens_details", None)
+            cached_prompt_tokens = (getattr(details, "cached_tokens", 0) or 0) if details else 0
+        elif messages is not None and not cache_hit:
+            prompt_tokens = count_message_tokens(messages, model)
+            completion_tokens = count_tokens(content or "", model)
+        self.metrics.record_call(
+            agent=labels.get("agent"), model=model, file=labels.get("file"),
+            prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, cached_prompt_tokens=cached_prompt_tokens,
+            latency_seconds=time.monotonic() - started_at, cache_hit=cache_hit, retries=retries, error=error
+        )
+
+    def _retry_delay(self, e: Exception, attempt: int, streamed: bool = False) -> float | None:
+        """
+        判断异常是否值得重试并计算等待时间；不重试时返回 None。
+        流式输出已经回调过部分内容时不再重试，以免重复输出。
+        """
+        if streamed or attempt >= self.max_retries:
+            return None
+        if isinstance(e, (openai.APITimeoutError, openai.APIConnectionError, openai.RateLimitError)):
+            pass
+        elif not (isinstance(e, openai.APIStatusError) and
+                  (e.status_code in RETRYABLE_STATUS_CODES or e.status_code >= 500)):
+            return None
+        retry_after = self._retry_after_seconds(e)
+        if retry_after is not None:
+            return min(retry_after, MAX_RETRY_AFTER) + random.uniform(0, 0.5)
+        # 带抖动的指数退避：在 [backoff/2, backoff] 之间随机取值，避免并发请求同时重试
+        backoff = min(DEFAULT_BACKOFF_MAX, DEFAULT_BACKOFF_BASE * (2 ** attempt))
+        return backoff / 2 + random.uniform(0, backoff / 2)
+
+    @staticmethod
+    def _retry_after_seconds(e: Exception) -> float | None:
+        """从错误响应的 retry-after-ms / Retry-After 头（秒数或 HTTP 日期）中读取服务端要求的等待时间。"""
+        response = getattr(e, "response", None)
+        headers = getattr(response, "headers", None)
+        if not headers:
+            return None
+        retry_after_ms = headers.get("retry-after-ms")
+        if retry_after_ms:
+            try:
+                return max(0.0, float(retry_after_ms) / 1000)
+            except ValueError:
+                pass
+        retry_after = headers.get("retry-after")
+        if not retry_after:
+            return None
         try:
-            response = self.client.chat.completions.create(
-                model=model,
-                messages=messages,
-                temperature=temperature,
-                max_tokens=max_tokens
-            )
-            if response.choices and response.choices[0].message:
-                return response.choices[0].message.content.strip()
-            else:
-                print("LLM API 响应中没有有效的 choices 或 message。")
-                return None
-        except openai.APITimeoutError:
-            print(f"Error: API request timed out after {self.client.timeout}s.")
+            return max(0.0, float(retry_after))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, email.utils.parsedate_to_datetime(retry_after).timestamp() - time.time())
+        except (TypeError, ValueError):
             return None
-        except openai.APIConnectionError as e:
-            print(f"Error: Could not connect to API: {e}")
+
+    def _before_retry(self, model: str, e: Exception, attempt: int, delay: float):
+        """记录一次重试；服务端限流时让同一模型的其他并发请求也一起退避。"""
+        self.retries += 1
+        if self.rate_limiter and isinstance(e, openai.RateLimitError):
+            self.rate_limiter.pause(model, delay)
+        status = getattr(e, "status_code", None)
+        reason = f"{type(e).__name__}{f' ({status})' if status else ''}"
+        print(f"LLM 请求失败: {reason}，{delay:.1f}s 后进行第 {attempt + 1}/{self.max_retries} 次重试 (模型 {model})。")
+
+    @staticmethod
+    def _extract_content(response) -> str | None:
+        """从 chat.completions 响应中提取文本内容。"""
+        if response.choices and response.choices[0].message and response.choices[0].message.content is not None:
+            return response.choices[0].message.content.strip()
+        print("LLM API 响应中没有有效的 choices 或 message。")
+        return None
+
+    @staticmethod
+    def _collect_delta(chunk, parts: list[str], on_token: Callable[[str], None]):
+        """处理一个流式响应块：收集增量文本并回调。"""
+        if chunk.choices and chunk.choices[0].delta and chunk.choices[0].delta.content:
+            delta = chunk.choices[0].delta.content
+            parts.append(delta)
+            on_token(delta)
+
+    @staticmethod
+    def _join_stream(parts: list[str]) -> str | None:
+        """拼接流式响应的增量文本。"""
+        content = "".join(parts).strip()
+        if not content:
+            print("LLM API 流式响应中没有有效的内容。")
             return None
-        except openai.RateLimitError as e:
+        return content
+
+    def _report_error(self, e: Exception):
+        """打印 API 调用过程中出现的异常信息。"""
+        if isinstance(e, openai.APITimeoutError):
+            print(f"Error: API request timed out after {self.timeout}s.")
+        elif isinstance(e, openai.APIConnectionError):
+            print(f"Error: Could not connect to API: {e}")
+        elif isinstance(e, openai.RateLimitError):
             print(f"Error: API rate limit exceeded: {e}")
-            return None
-        except openai.APIStatusError as e:
+        elif isinstance(e, openai.APIStatusError):
             error_details = "No additional details available."
             try:
                 # 尝试将响应体解析为JSON，因为错误信息通常是JSON格式
@@ -75,13 +417,10 @@ class LLMConnector:
                 except Exception:
                     pass # 保留 "No additional details available."
             print(f"Error: API returned an error status: {e.status_code} - {e.response}\nDetails: {error_details}")
-            return None
-        except Exception as e:
-            if isinstance(e, openai.APIError):
-                print(f"An OpenAI API error occurred: {e}")
-            else:
-                print(f"An unexpected error occurred while invoking LLM: {e}")
-            return None
+        elif isinstance(e, openai.APIError):
+            print(f"An OpenAI API error occurred: {e}")
+        else:
+            print(f"An unexpected error occurred while invoking LLM: {e}")
 
 if __name__ == '__main__':
     # 这是一个简单的使用示例
@@ -0,0 +1,185 @@
+import os
+import math
+import threading
+from typing import Dict, Any, List, Tuple
+
+# 延迟直方图的桶上界（秒）
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+# 计数类指标：(字段名, Prometheus 指标名, 说明)
+_COUNTERS = (
+    ("calls", "heimdallr_llm_requests", "LLM 请求数（包括命中缓存的请求）"),
+    ("cache_hits", "heimdallr_llm_cache_hits", "命中响应缓存的请求数"),
+    ("errors", "heimdallr_llm_errors", "最终失败的请求数"),
+    ("retries", "heimdallr_llm_retries", "因暂时性错误发生的重试次数"),
+    ("prompt_tokens", "heimdallr_llm_prompt_tokens", "prompt token 数"),
+    ("completion_tokens", "heimdallr_llm_completion_tokens", "completion token 数"),
+    ("cached_prompt_tokens", "heimdallr_llm_cached_prompt_tokens", "服务端前缀缓存命中的 prompt token 数"),
+    ("cost_usd", "heimdallr_llm_cost_usd", "按 --model-price 估算的费用（美元）"),
+)
+
+
+def _percentile(values: List[float], q: float) -> float:
+    """最近秩法计算分位数。"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q * len(ordered)) - 1)]
+
+
+def _escape_label(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+class _Series:
+    """同一组 (agent, model, file) 标签下的累计值。"""
+    def __init__(self):
+        self.values = {field: 0 for field, _, _ in _COUNTERS}
+        self.latencies: List[float] = []
+
+
+class MetricsCollector:
+    """
+    LLM 调用指标收集器：按 Agent 类、模型和文件记录请求数、缓存命中、重试、错误、token 用量、估算费用和延迟。
+
+    由 LLMConnector 在每次调用结束时记录；汇总结果写入 JSON 报告，也可以导出为 Prometheus textfile
+    （供 node_exporter 的 textfile collector 采集）或 OpenMetrics 格式。
+    """
+    def __init__(self, model_prices: Dict[str, Tuple[float, float]] = None, textfile: str = None,
+                 openmetrics: bool = False):
+        """
+        参数:
+            model_prices (Dict[str, Tuple[float, float]], optional): 各模型每百万 prompt / completion token 的价格（美元），
+                用于估算费用。未配置价格的模型费用记为 0。
+            textfile (str, optional): 指标导出文件路径。提供时 flush() 会把当前指标写入该文件。
+            openmetrics (bool, optional): 导出为 OpenMetrics 格式而不是 Prometheus 文本格式。默认为 False。
+        """
+        self.model_prices = dict(model_prices or {})
+        self.textfile = textfile
+        self.openmetrics = openmetrics
+        self._series: Dict[Tuple[str, str, str], _Series] = {}
+        self._lock = threading.Lock()
+
+    def record_call(self, agent: str, model: str, file: str = None, prompt_tokens: int = 0, completion_tokens: int = 0,
+                    cached_prompt_tokens: int = 0, latency_seconds: float = 0.0, cache_hit: bool = False,
+                    retries: int = 0, error: bool = False):
+        """记录一次 LLM 调用。"""
+        key = (agent or "unknown", model or "unknown", file or "")
+        prompt_price, completion_price = self.model_prices.get(model, (0.0, 0.0))
+        cost = 0.0 if cache_hit else (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1_000_000
+        with self._lock:
+            series = self._series.setdefault(key, _Series())
+            values = series.values
+            values["calls"] += 1
+            values["cache_hits"] += int(cache_hit)
+            values["errors"] += int(error)
+            values["retries"] += retries
+            values["prompt_tokens"] += prompt_tokens or 0
+            values["completion_tokens"] += completion_tokens or 0
+            values["cached_prompt_tokens"] += cached_prompt_tokens or 0
+            values["cost_usd"] += cost
+            series.latencies.append(latency_seconds)
+
+    @staticmethod
+    def _summarize(series_list: List[_Series]) -> Dict[str, Any]:
+        summary = {field: 0 for field, _, _ in _COUNTERS}
+        latencies = []
+        for series in series_list:
+            for field, value in series.values.items():
+                summary[field] += value
+            latencies.extend(series.latencies)
+        summary["cost_usd"] = round(summary["cost_usd"], 6)
+        # 提供商前缀缓存命中的 prompt token 比例，用于观察 prompt 布局是否有效复用了共享前缀
+        summary["prefix_cache_hit_rate"] = round(summary["cached_prompt_tokens"] / summary["prompt_tokens"], 4) \
+            if summary["prompt_tokens"] else 0.0
+        summary["latency_seconds_sum"] = round(sum(latencies), 3)
+        summary["latency_p50"] = round(_percentile(latencies, 0.5), 3)
+        summary["latency_p95"] = round(_percentile(latencies, 0.95), 3)
+        return summary
+
+    def snapshot(self, file: str = None) -> Dict[str, Any]:
+        """
+        返回汇总指标，可按文件过滤。
+
+        返回:
+            Dict[str, Any]: {"totals": {...}, "by_agent": {agent: {...}}, "by_model": {model: {...}}}；
+                不按文件过滤时还包含 "by_file"。
+        """
+        with self._lock:
+            items = [(key, series) for key, series in self._series.items() if file is None or key[2] == file]
+
+        def group(index: int) -> Dict[str, Any]:
+            groups: Dict[str, List[_Series]] = {}
+            for key, series in items:
+                groups.setdefault(key[index], []).append(series)
+            return {name: self._summarize(group_series) for name, group_series in sorted(groups.items())}
+
+        snapshot = {
+            "totals": self._summarize([series for _, series in items]),
+            "by_agent": group(0),
+            "by_model": group(1),
+        }
+        if file is None:
+            snapshot["by_file"] = group(2)
+        return snapshot
+
+    def render(self, openmetrics: bool = False) -> str:
+        """把所有指标渲染为 Prometheus 文本格式（openmetrics 为 True 时为 OpenMetrics 格式）。"""
+        with self._lock:
+            items = sorted(self._series.items())
+        lines = []
+        for field, name, help_text in _COUNTERS:
+            # Prometheus 文本格式中 TYPE 行使用完整的样本名；OpenMetrics 中计数器的 TYPE 行不带 _total 后缀
+            lines.append(f"# HELP {name if openmetrics else name + '_total'} {help_text}")
+            lines.append(f"# TYPE {name if openmetrics else name + '_total'} counter")
+            for (agent, model, file), series in items:
+                labels = self._labels(agent, model, file)
+                lines.append(f"{name}_total{{{labels}}} {series.values[field]:g}")
+
+        name = "heimdallr_llm_latency_seconds"
+        lines.append(f"# HELP {name} LLM 请求延迟（秒）")
+        lines.append(f"# TYPE {name} histogram")
+        for (agent, model, file), series in items:
+            labels = self._labels(agent, model, file)
+            for bound in LATENCY_BUCKETS:
+                count = sum(1 for latency in series.latencies if latency <= bound)
+                lines.append(f"{name}_bucket{{{labels},le=\"{bound:g}\"}} {count}")
+            lines.append(f"{name}_bucket{{{labels},le=\"+Inf\"}} {len(series.latencies)}")
+            lines.append(f"{name}_sum{{{labels}}} {sum(series.latencies):.6f}")
+            lines.append(f"{name}_count{{{labels}}} {len(series.latencies)}")
+        if openmetrics:
+            lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _labels(agent: str, model: str, file: str) -> str:
+        return f"agent=\"{_escape_label(agent)}\",model=\"{_escape_label(model)}\",file=\"{_escape_label(file)}\""
+
+    def write_textfile(self, path: str, openmetrics: bool = False):
+        """原子地写出指标文件（先写临时文件再重命名），避免采集方读到写了一半的文件。"""
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.render(openmetrics=openmetrics))
+        os.replace(tmp_path, path)
+
+    def flush(self):
+        """配置了导出文件时写出当前指标（每个文件审计完成后调用，便于长时间运行时持续采集）。"""
+        if self.textfile:
+            self.write_textfile(self.textfile, openmetrics=self.openmetrics)
+
+    @staticmethod
+    def parse_model_price(spec: str) -> Tuple[str, Tuple[float, float]]:
+        """
+        解析 "MODEL=PROMPT:COMPLETION" 形式的价格配置（每百万 token 的美元价格），例如 "gpt-4o=2.5:10"。
+        格式错误时抛出 ValueError。
+        """
+        model, sep, prices = spec.rpartition("=")
+        prompt_price, colon, completion_price = prices.partition(":")
+        if not sep or not model or not colon:
+            raise ValueError(f"无效的模型价格配置 '{spec}'，应为 MODEL=PROMPT:COMPLETION")
+        try:
+            return model, (float(prompt_price), float(completion_price))
+        except ValueError:
+            raise ValueError(f"无效的模型价格配置 '{spec}'，价格必须是数字")
@@ -59,4 +59,229 @@ CHECKER_SYSTEM_PROMPT = """
 
 你需要具备批判性思维，并能够从宏观和微观两个层面审视审计结果。
 你的反馈应该是具体、可操作的，并帮助 Manager 完善最终的审计报告。
-""" 
\ No newline at end of file
+"""
+
+# --- 用户消息模板 ---
+# 提供商的前缀缓存 (prefix caching) 只对请求开头完全相同的部分生效，因此模板都按
+# "稳定的共享前缀 (固定指令 → 文件 → 初步分析) + 每个任务不同的后缀" 排列：
+# 同一文件的所有 Auditor 请求共享 system prompt、文件路径和 Manager 的初步分析，只有审计重点和代码片段不同。
+
+MANAGER_ANNOTATION_INSTRUCTIONS = """请对下面的代码进行安全审计前的初步分析。代码已在本地按函数/类切分为代码单元。
+请完成：
+1. 概述代码的核心功能和主要数据流（overview）。
+2. 按安全审计的优先级为每个需要审计的单元标注：priority ('high'/'medium'/'low')、focus (字符串，Auditor 需要关注的要点)、target_vulnerabilities (字符串列表，如 ['Command Injection', 'SSRF'])。
+以JSON对象格式返回: {"overview": "...", "units": [{"unit_id": "...", "priority": "high", "focus": "...", "target_vulnerabilities": ["..."]}]}，units 按优先级从高到低排列，unit_id 必须来自给出的单元列表。
+单元列表中可能附带本地静态分析的风险提示（命中的危险调用和外部输入类别），仅供参考，请以代码的实际数据流为准。
+"""
+
+MANAGER_ANNOTATION_TEMPLATE = """{instructions}
+文件: {file_path}
+需要审计的代码单元（单元 ID 及行号范围）:
+{unit_index}
+
+{intro}代码如下（每行开头为源文件行号）:
+```
+{numbered_code}
+```"""
+
+AUDITOR_SHARED_CONTEXT_TEMPLATE = """请审计下面给出的代码片段，详细报告你发现的任何潜在安全漏洞，包括漏洞类型、具体位置（如行号，如果适用）、触发条件、潜在影响和可能的利用方式。
+如果没有发现明显漏洞，请明确说明，并简要解释原因。请确保你的分析是基于提供的上下文信息，并且尽可能深入和具体。
+{line_number_note}
+代码片段来源文件: {file_path}
+
+Manager 的初步分析摘要:
+{manager_analysis}
+"""
+
+AUDITOR_LINE_NUMBER_NOTE = "代码片段每行开头的数字是该行在源文件中的行号，报告漏洞位置时请使用这些行号（例如“第 12 行”）。\n"
+
+AUDITOR_TASK_TEMPLATE = """
+--- 本次审计任务 ---
+Manager 指示的审计重点: {task_focus}
+Manager 要求特别关注的漏洞类型: {target_vulnerabilities}
+
+请仔细审计以下代码片段:
+```
+{code_snippet}
+```"""
+
+# 跨文件上下文：代码索引提供的被调用者和调用者定义（见 heimdallr.tools.code_reader），追加在代码片段之后
+AUDITOR_RELATED_CODE_TEMPLATE = """
+
+以下是与该代码片段存在调用关系的其他定义（可能位于其他文件），仅用于理解数据如何流入、流出该片段（例如外部输入是否已在调用者中校验、
+被调用的函数是否执行危险操作）。调用关系按名称匹配，可能不完全准确。报告漏洞位置时只引用上面代码片段的行号；
+如果漏洞的关键部分位于这些定义中，请注明其所在文件和单元:
+```
+{related_code}
+```"""
+
+# 近似重复单元的差异复核：规范副本的审计结论作为任务后缀的一部分，代码片段只包含差异行
+AUDITOR_DUPLICATE_DELTA_FOCUS = """该单元是 {location} 的近似副本（相似度 {similarity:.0%}），原单元已审计，结论如下:
+{canonical_findings}
+
+下面只给出两者不同的行。请判断这些差异是否引入了新的漏洞、或使原结论中的某些漏洞不再成立；原结论已覆盖的相同部分无需重复报告。"""
+
+# 模型级联：快速模型初审时追加在任务末尾的自评要求（自评行由 heimdallr.core.cascade 解析）
+AUDITOR_CASCADE_ASSESSMENT_NOTE = """
+报告的最后请单独输出一行自评，格式严格为:
+审计自评: 置信度=<0 到 1 之间的小数>; 最高严重程度=<critical|high|medium|low|none>
+置信度表示你对整个结论（包括"未发现漏洞"）的把握，代码上下文不足或无法确定漏洞能否被触发时请如实给出较低的置信度。"""
+
+# 模型级联：升级给强模型复审时的审计重点，附带快速模型的初审报告
+AUDITOR_CASCADE_ESCALATION_FOCUS = """{task_focus}
+
+快速模型已初审该代码，因{reason}（置信度 {confidence}，最高严重程度 {severity}）升级由你复审。初审报告如下，仅供参考:
+{fast_report}
+
+请独立审计并给出完整结论：确认、修正或补充初审中的发现，并重新评估其严重程度。"""
+
+# 低风险单元批量快速检查时的审计重点
+AUDITOR_LOW_RISK_BATCH_FOCUS = ("本地静态分析未在这些单元中发现危险调用或外部输入。请快速检查其中是否有遗漏的安全问题"
+                                "（例如逻辑错误、权限检查、异常处理），报告时注明对应的单元；没有问题时简要说明即可。")
+
+CHECKER_REVIEW_INSTRUCTIONS = """请批判性地复核下面的代码审计材料，并指出：
+- 是否存在明显的误报 (False Positives)？请说明理由。
+- 是否有 Auditor 可能遗漏的潜在漏洞 (False Negatives) 或风险点？特别注意不同代码部分交互可能产生的问题。
+- Auditor 的分析逻辑是否合理、一致、充分？
+- Manager 的任务分解和整体分析是否恰当？
+- 对于发现的漏洞，其风险评估是否准确？
+请提供具体的、可操作的反馈，帮助 Manager 提高最终审计报告的质量。
+"""
+
+CHECKER_MATERIALS_TEMPLATE = """{instructions}
+{task_description}
+
+文件: {file_path}
+
+1. Manager Agent 的初步分析和任务分解逻辑:
+{manager_analysis}
+
+2. Auditor Agents 提交的审计发现摘要:
+{auditor_findings}
+
+3. 审计发现中引用到的原始代码片段 (仅包含被引用的行及其上下文，每行开头为源文件行号):
+```
+{code_slices}
+```"""
+
+# 逐条复核模式：每条审计发现只配上它引用的代码片段单独复核，最后用一次很小的跨发现复核检查组合问题
+CHECKER_FINDING_INSTRUCTIONS = """请复核下面这一条由 Auditor 提交的审计发现，只依据给出的代码片段判断它是否成立，并给出:
+- verdict: 'confirmed'（确实存在且可被触发）、'false_positive'（误报）或 'uncertain'（片段不足以判断）；
+- severity: 'critical'、'high'、'medium'、'low' 或 'info'；
+- reason: 简要说明理由，引用具体行号。
+以JSON对象格式返回: {"verdict": "...", "severity": "...", "reason": "..."}
+"""
+
+CHECKER_FINDING_TEMPLATE = """{instructions}
+文件: {file_path}
+
+--- 待复核的审计发现 (来自 {unit_id}) ---
+{finding}
+
+发现引用的代码片段 (每行开头为源文件行号):
+```
+{code_slice}
+```"""
+
+CHECKER_CROSS_FINDING_INSTRUCTIONS = """下面是对同一文件的各条审计发现逐条复核后的结论。请只做跨发现的综合复核，指出:
+- 多个发现或代码单元之间的交互是否会组合出新的漏洞（例如一个单元的输出流入另一个单元的危险调用）？
+- 是否有明显被遗漏的风险点 (False Negatives)？
+- 逐条结论之间是否存在矛盾，或风险评估是否需要调整？
+不需要重复逐条结论；没有补充时简要说明即可。
+"""
+
+CHECKER_CROSS_FINDING_TEMPLATE = """{instructions}
+文件: {file_path}
+
+Manager 的初步分析:
+{manager_analysis}
+
+逐条复核结论:
+{verdicts}"""
+
+MANAGER_FINAL_REPORT_INSTRUCTIONS = """基于下面代码审计各个阶段的输出，请生成一份最终的总结陈述和具体的修复建议。
+请提供一个'final_conclusion'，总结代码的整体安全状况和主要风险点。然后提供一个'recommendations'列表，针对每个关键发现给出具体的、可操作的修复建议。
+以JSON对象格式返回，包含 final_conclusion (字符串) 和 recommendations (字符串列表) 两个键。
+"""
+
+MANAGER_FINAL_REPORT_TEMPLATE = """{instructions}
+代码路径: {file_path}
+
+你的初步分析和任务分解:
+{manager_analysis}
+
+Auditor Agents 的综合发现:
+{auditor_findings}
+
+Checker Agent 的校验反馈:
+{checker_feedback}"""
+
+# --- 结构化输出格式 (response_format) ---
+# 服务商支持 JSON Schema 时，Manager 的单元标注、最终总结和 Checker 的逐条复核结论直接按以下结构输出；
+# 不支持时由 LLMConnector 自动退化为普通文本。
+# "overview" 排在 "units" 之前，流式解析时可以先拿到概述，再随着每个单元的标注到达逐个分派 Auditor 任务。
+
+MANAGER_ANNOTATION_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "unit_annotations",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "overview": {"type": "string"},
+                "units": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "unit_id": {"type": "string"},
+                            "priority": {"type": "string", "enum": ["high", "medium", "low"]},
+                            "focus": {"type": "string"},
+                            "target_vulnerabilities": {"type": "array", "items": {"type": "string"}},
+                        },
+                        "required": ["unit_id", "priority", "focus", "target_vulnerabilities"],
+                        "additionalProperties": False,
+                    },
+                },
+            },
+            "required": ["overview", "units"],
+            "additionalProperties": False,
+        },
+    },
+}
+
+MANAGER_FINAL_REPORT_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "final_report",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "final_conclusion": {"type": "string"},
+                "recommendations": {"type": "array", "items": {"type": "string"}},
+            },
+            "required": ["final_conclusion", "recommendations"],
+            "additionalProperties": False,
+        },
+    },
+}
+
+CHECKER_FINDING_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "finding_verdict",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "verdict": {"type": "string", "enum": ["confirmed", "false_positive", "uncertain"]},
+                "severity": {"type": "string", "enum": ["critical", "high", "medium", "low", "info"]},
+                "reason": {"type": "string"},
+            },
+            "required": ["verdict", "severity", "reason"],
+            "additionalProperties": False,
+        },
+    },
+}
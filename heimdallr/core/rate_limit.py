@@ -0,0 +1,122 @@
+import time
+import asyncio
+import threading
+from typing import Dict, Tuple
+
+
+class TokenBucket:
+    """
+    令牌桶限流器。容量为 capacity，每秒补充 refill_per_second 个令牌。
+
+    获取令牌时立即从桶中扣除（余额可以为负），并返回需要等待的时间：
+    先到的请求先被满足，并发请求按到达顺序依次排队，不会互相饿死。
+    """
+    def __init__(self, capacity: float, refill_per_second: float):
+        self.capacity = float(capacity)
+        self.refill_per_second = float(refill_per_second)
+        self._tokens = float(capacity)
+        self._updated_at = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.refill_per_second)
+        self._updated_at = now
+
+    def reserve(self, amount: float) -> float:
+        """预订 amount 个令牌，返回需要等待的秒数（0 表示可立即执行）。超过容量的请求按容量计算等待时间。"""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._tokens -= min(amount, self.capacity)
+            wait = -self._tokens / self.refill_per_second if self._tokens < 0 else 0.0
+            return max(wait, self._paused_until - now)
+
+    def refund(self, amount: float):
+        """归还多预订的令牌（amount 为负时追加扣除）。"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens = min(self.capacity, self._tokens + amount)
+
+    def pause(self, seconds: float):
+        """在接下来的 seconds 秒内暂停发放令牌，例如服务端返回 429 并要求 Retry-After 时。"""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+class ModelRateLimiter:
+    """
+    按模型区分的客户端限流：每个模型各有一个请求数/分钟 (RPM) 和 token 数/分钟 (TPM) 的令牌桶，
+    共享同一个 LLMConnector 的所有并发审计都经过它整形流量，而不是撞上服务商的限额后失败。
+    """
+    def __init__(self, requests_per_minute: int = None, tokens_per_minute: int = None,
+                 model_limits: Dict[str, Tuple[int | None, int | None]] = None):
+        """
+        参数:
+            requests_per_minute (int, optional): 默认的每模型每分钟请求数上限。None 或 0 表示不限制。
+            tokens_per_minute (int, optional): 默认的每模型每分钟 token 数上限（prompt + max_tokens）。None 或 0 表示不限制。
+            model_limits (Dict[str, Tuple[int, int]], optional): 针对特定模型的 (RPM, TPM) 覆盖值。
+        """
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.model_limits = dict(model_limits or {})
+        self._buckets: Dict[str, Tuple[TokenBucket | None, TokenBucket | None]] = {}
+        self._lock = threading.Lock()
+
+    def _buckets_for(self, model: str) -> Tuple[TokenBucket | None, TokenBucket | None]:
+        with self._lock:
+            if model not in self._buckets:
+                rpm, tpm = self.model_limits.get(model, (self.requests_per_minute, self.tokens_per_minute))
+                self._buckets[model] = (
+                    TokenBucket(rpm, rpm / 60.0) if rpm else None,
+                    TokenBucket(tpm, tpm / 60.0) if tpm else None,
+                )
+            return self._buckets[model]
+
+    def _reserve(self, model: str, tokens: int) -> float:
+        request_bucket, token_bucket = self._buckets_for(model)
+        wait = request_bucket.reserve(1) if request_bucket else 0.0
+        if token_bucket:
+            wait = max(wait, token_bucket.reserve(tokens))
+        return wait
+
+    async def acquire(self, model: str, tokens: int) -> float:
+        """等待直到可以向 model 发送一个预计消耗 tokens 个 token 的请求。返回实际等待的秒数。"""
+        wait = self._reserve(model, tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+    def acquire_sync(self, model: str, tokens: int) -> float:
+        """acquire 的同步版本。"""
+        wait = self._reserve(model, tokens)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def settle(self, model: str, reserved_tokens: int, actual_tokens: int):
+        """请求完成后按实际用量校正 TPM 令牌桶。"""
+        _, token_bucket = self._buckets_for(model)
+        if token_bucket and actual_tokens is not None:
+            token_bucket.refund(reserved_tokens - actual_tokens)
+
+    def pause(self, model: str, seconds: float):
+        """服务端要求退避时，暂停该模型的所有后续请求。"""
+        for bucket in self._buckets_for(model):
+            if bucket:
+                bucket.pause(seconds)
+
+    @staticmethod
+    def parse_model_limit(spec: str) -> Tuple[str, Tuple[int | None, int | None]]:
+        """
+        解析 "MODEL=RPM:TPM" 形式的配置（RPM 或 TPM 可留空），例如 "gpt-4o=500:30000"、"gpt-4o=:30000"。
+        格式错误时抛出 ValueError。
+        """
+        model, sep, limits = spec.rpartition("=")
+        if not sep or not model:
+            raise ValueError(f"无效的模型限流配置 '{spec}'，应为 MODEL=RPM:TPM")
+        rpm, _, tpm = limits.partition(":")
+        try:
+            return model, (int(rpm) if rpm else None, int(tpm) if tpm else None)
+        except ValueError:
+            raise ValueError(f"无效的模型限流配置 '{spec}'，RPM 和 TPM 必须是整数")
@@ -0,0 +1,111 @@
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List
+
+from heimdallr.core.code_units import CodeUnit
+
+RISK_FILTER_MODES = ("batch", "skip", "off")
+DEFAULT_RISK_FILTER = "batch"
+HIGH_RISK_SCORE = 5.0
+# 低于该分数的单元视为低风险（没有命中任何危险调用、外部输入或敏感路径）
+LOW_RISK_SCORE = 1.0
+# 同时出现外部输入和危险调用时的加成系数
+SOURCE_SINK_MULTIPLIER = 1.5
+# 调用了本文件中高风险单元的单元，继承被调用者分数的比例
+CALLEE_RISK_FACTOR = 0.5
+
+# (类别, 权重, 正则)。只匹配调用处或字面量，不匹配 import 语句本身
+SINK_PATTERNS = [
+    ("command_exec", 5.0, re.compile(
+        r"\bsubprocess\.\w+\s*\(|\bos\.(system|popen|exec\w*|spawn\w*)\s*\(|\bshell\s*=\s*True|"
+        r"\bRuntime\.getRuntime\(\)\.exec|\bchild_process\b|\bProcessBuilder\s*\(|(?<![\w.])(system|popen|execv\w*)\s*\(")),
+    ("code_eval", 5.0, re.compile(r"(?<![\w.])(eval|exec|compile|__import__)\s*\(|\bnew\s+Function\s*\(")),
+    ("deserialization", 5.0, re.compile(
+        r"\b(pickle|cPickle|marshal|shelve|dill)\.\w*loads?\s*\(|\byaml\.(unsafe_)?load\s*\(|\bObjectInputStream\b|"
+        r"\bunserialize\s*\(")),
+    ("sql_building", 4.0, re.compile(
+        r"(?i)\b(select|insert\s+into|update|delete\s+from)\b[^\n]*(\"\s*\+|'\s*\+|%\s*\(?\w|\.format\s*\(|\$\{|\{\w+\})|"
+        r"\.(execute|executemany|raw|query)\s*\(\s*f[\"']")),
+    ("network", 2.0, re.compile(
+        r"\b(requests|httpx|urllib\.request|urllib2|aiohttp)\.\w+\s*\(|\burlopen\s*\(|\bsocket\.\w+\s*\(|\bfetch\s*\(")),
+    ("file_access", 2.0, re.compile(r"(?<![\w.])open\s*\(|\bos\.(remove|unlink|rename|makedirs|chmod)\s*\(|\bshutil\.\w+\s*\(|"
+                                    r"\bfopen\s*\(")),
+    ("sensitive_path", 3.0, re.compile(r"[\"'](/etc/|/proc/|/root/|~/\.ssh|/var/run/|C:\\\\Windows)")),
+    ("memory_unsafe", 4.0, re.compile(r"(?<![\w.])(strcpy|strcat|sprintf|gets|memcpy|scanf)\s*\(")),
+    ("dom_injection", 3.0, re.compile(r"\.(innerHTML|outerHTML)\s*=|\bdocument\.write\s*\(|dangerouslySetInnerHTML")),
+    # 运行时篡改工具描述、嵌入隐藏指令等针对 LLM/MCP 工具的投毒手法
+    ("tool_poisoning", 5.0, re.compile(r"\.__doc__\s*=|<IMPORTANT>|(?i:ignore (all )?previous instructions)")),
+]
+
+SOURCE_PATTERNS = [
+    ("user_input", 1.5, re.compile(
+        r"(?<![\w.])input\s*\(|\bsys\.argv\b|\brequest\.(args|form|json|data|values|files|cookies|headers|GET|POST|body|query|params)\b|"
+        r"\bos\.(environ|getenv)\b|\bgetenv\s*\(|\.recv\s*\(|\bargv\b")),
+    # MCP 工具、Web 路由等入口函数的参数都来自外部
+    ("entry_point", 1.5, re.compile(r"^\s*@\w*\.?(tool|route|get|post|put|delete|resource|prompt|app\.\w+)\b", re.M)),
+]
+
+
+@dataclass
+class RiskAssessment:
+    """
+    一个代码单元的本地静态风险评估。
+
+    属性:
+        score (float): 风险分数，越高越优先审计。
+        signals (List[str]): 命中的危险调用 / 外部输入类别，例如 ["command_exec", "user_input"]。
+    """
+    score: float = 0.0
+    signals: List[str] = field(default_factory=list)
+
+    @property
+    def level(self) -> str:
+        if self.score >= HIGH_RISK_SCORE:
+            return "high"
+        return "medium" if self.score >= LOW_RISK_SCORE else "low"
+
+    def hint(self) -> str:
+        """供 Manager 参考的一行提示。"""
+        signals = ", ".join(self.signals) if self.signals else "未命中危险调用"
+        return f"静态风险 {self.level} {self.score:.1f}: {signals}"
+
+
+def score_unit(unit: CodeUnit) -> RiskAssessment:
+    """按单元源码中命中的危险调用（sink）和外部输入（source）计算风险分数。每个类别只计一次。"""
+    sink_score = source_score = 0.0
+    signals = []
+    for name, weight, pattern in SINK_PATTERNS:
+        if pattern.search(unit.source):
+            sink_score += weight
+            signals.append(name)
+    for name, weight, pattern in SOURCE_PATTERNS:
+        if pattern.search(unit.source):
+            source_score += weight
+            signals.append(name)
+    score = sink_score + source_score
+    if sink_score and source_score:
+        score *= SOURCE_SINK_MULTIPLIER
+    return RiskAssessment(round(score, 2), signals)
+
+
+def assess_units(units: List[CodeUnit]) -> Dict[str, RiskAssessment]:
+    """
+    评估所有单元的风险。调用了本文件中有风险的单元的单元，按 CALLEE_RISK_FACTOR 继承被调用者的分数
+    （只传播一层），以免把危险调用封装在辅助函数中的入口函数被判为低风险。
+    """
+    direct = {u.unit_id: score_unit(u) for u in units}
+    by_name: Dict[str, List[CodeUnit]] = {}
+    for unit in units:
+        by_name.setdefault(unit.short_name, []).append(unit)
+
+    result = {}
+    for unit in units:
+        own = direct[unit.unit_id]
+        callees = {callee.unit_id for name in unit.calls for callee in by_name.get(name, []) if callee is not unit}
+        inherited = max((direct[c].score for c in callees), default=0.0) * CALLEE_RISK_FACTOR
+        if inherited > 0:
+            signals = own.signals + [f"calls:{c}" for c in sorted(callees) if direct[c].score >= LOW_RISK_SCORE]
+            result[unit.unit_id] = RiskAssessment(round(own.score + inherited, 2), signals)
+        else:
+            result[unit.unit_id] = own
+    return result
@@ -0,0 +1,226 @@
+import time
+import heapq
+import asyncio
+import itertools
+import contextvars
+from contextlib import asynccontextmanager
+from typing import Dict, Any, List, Callable, Awaitable, Iterable
+
+# 每个模型同时在途的 LLM 请求数上限（未单独配置的模型）
+DEFAULT_MODEL_CONCURRENCY = 8
+
+# 当前任务所属文件进入流水线的顺序号，用作等待模型空位时的优先级（越小越先）。
+# asyncio 任务创建时复制上下文，因此一个文件的所有阶段任务都继承该文件的优先级。
+_priority: contextvars.ContextVar[int] = contextvars.ContextVar("heimdallr_pipeline_priority", default=0)
+
+
+class _PrioritySlots:
+    """
+    带优先级的信号量：空位被释放时交给优先级最高（数值最小）、同优先级中最早到达的等待者。
+    """
+    def __init__(self, limit: int):
+        self.limit = max(1, limit)
+        self.in_flight = 0
+        self._waiters: List[tuple] = [] # 堆：(优先级, 到达顺序, future)
+        self._arrivals = itertools.count()
+        self.stats = {"limit": self.limit, "requests": 0, "queued": 0, "wait_seconds": 0.0, "max_in_flight": 0}
+
+    async def acquire(self, priority: int):
+        self.stats["requests"] += 1
+        if self.in_flight < self.limit and not self._waiters:
+            self._take()
+            return
+        self.stats["queued"] += 1
+        started_at = time.monotonic()
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._arrivals), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # 空位已经交给本等待者，但它在恢复执行前被取消：转交给下一个等待者
+                self.release()
+            else:
+                future.cancel()
+            raise
+        finally:
+            self.stats["wait_seconds"] += time.monotonic() - started_at
+
+    def _take(self):
+        self.in_flight += 1
+        self.stats["max_in_flight"] = max(self.stats["max_in_flight"], self.in_flight)
+
+    def release(self):
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                # 空位直接转交，in_flight 不变
+                future.set_result(None)
+                return
+        self.in_flight -= 1
+
+
+class TaskGraph:
+    """
+    一个文件的审计流程的阶段 DAG。每个节点是一个阶段任务（初步分析、各 Auditor 子任务、各组发现的逐条复核、
+    Checker 复核、最终总结），在它依赖的节点全部完成后立即开始，而不是等待上一阶段的所有任务；
+    节点可以在运行过程中继续添加（例如初步分析流式产生的子任务）。
+
+    每个节点记录开始和结束时间，summary 给出文件的总耗时、各阶段耗时之和（严格串行执行时的耗时）和关键路径。
+    """
+    def __init__(self, name: str = None):
+        self.name = name
+        self.started_at = time.monotonic()
+        self._nodes: Dict[str, Dict[str, Any]] = {}
+
+    def add(self, node_id: str, run: Callable[..., Awaitable], deps: Iterable[str] = ()) -> asyncio.Task:
+        """
+        添加一个节点：deps 中的节点全部完成后以它们的结果（按 deps 顺序）调用 run(*results)。
+        任一依赖失败时本节点以同样的异常失败。返回节点的 asyncio.Task。
+        """
+        if node_id in self._nodes:
+            raise ValueError(f"节点 {node_id} 已存在")
+        deps = list(deps)
+        for dep in deps:
+            if dep not in self._nodes:
+                raise ValueError(f"节点 {node_id} 依赖的节点 {dep} 不存在")
+        node = {"deps": deps, "started_at": None, "finished_at": None}
+        self._nodes[node_id] = node
+
+        async def execute():
+            results = [await self._nodes[dep]["task"] for dep in deps]
+            node["started_at"] = time.monotonic()
+            try:
+                return await run(*results)
+            finally:
+                node["finished_at"] = time.monotonic()
+
+        node["task"] = asyncio.create_task(execute())
+        return node["task"]
+
+    def __contains__(self, node_id: str) -> bool:
+        return node_id in self._nodes
+
+    def task(self, node_id: str) -> asyncio.Task:
+        return self._nodes[node_id]["task"]
+
+    def completed(self) -> List[str]:
+        """已成功完成的节点，用作汇总阶段的依赖。"""
+        return [node_id for node_id, node in self._nodes.items()
+                if node["task"].done() and not node["task"].cancelled() and node["task"].exception() is None]
+
+    def cancel(self):
+        """取消所有尚未完成的节点（已失败节点的异常视为已处理）。"""
+        for node in self._nodes.values():
+            if node["task"].done() and not node["task"].cancelled():
+                node["task"].exception()
+            node["task"].cancel()
+
+    def critical_path(self) -> List[str]:
+        """
+        从最后完成的节点出发，沿最晚完成的依赖回溯得到的节点链，即决定文件总耗时的阶段序列。
+        """
+        finished = {node_id: node for node_id, node in self._nodes.items() if node["finished_at"] is not None}
+        if not finished:
+            return []
+        path = [max(finished, key=lambda node_id: finished[node_id]["finished_at"])]
+        while True:
+            deps = [dep for dep in finished[path[-1]]["deps"] if dep in finished]
+            if not deps:
+                return path[::-1]
+            path.append(max(deps, key=lambda dep: finished[dep]["finished_at"]))
+
+    def summary(self) -> Dict[str, Any]:
+        """返回写入报告的流水线统计。"""
+        durations = {node_id: node["finished_at"] - node["started_at"] for node_id, node in self._nodes.items()
+                     if node["finished_at"] is not None and node["started_at"] is not None}
+        path = self.critical_path()
+        return {
+            "nodes": len(self._nodes),
+            "wall_seconds": round(time.monotonic() - self.started_at, 2),
+            "stage_seconds": round(sum(durations.values()), 2),
+            "critical_path": path,
+            "critical_path_seconds": round(sum(durations.get(node_id, 0.0) for node_id in path), 2),
+        }
+
+
+class PipelineScheduler:
+    """
+    跨文件的流水线调度器。同一进程中同时审计的所有文件共享它（通过 LLMConnector），
+    限制的是每个模型同时在途的请求数，而不是同时审计的文件数：一个文件的 Auditor 请求在途时，
+    其他文件的初步分析、复核等阶段只要对应模型还有空位就可以立即执行，仓库审计的总耗时趋近于关键路径而不是各阶段之和。
+
+    等待空位的请求按所属文件进入流水线的顺序排队（graph 为文件分配顺序号），先进入的文件的后续阶段优先，
+    新文件只占用空闲的位置，不会拖慢已在途的文件。另有一个所有模型共享的总上限（通常为连接池大小）。
+    """
+    def __init__(self, max_concurrency: int = DEFAULT_MODEL_CONCURRENCY, model_limits: Dict[str, int] = None,
+                 max_total: int = None):
+        """
+        参数:
+            max_concurrency (int, optional): 默认的每模型在途请求数上限。
+            model_limits (Dict[str, int], optional): 针对特定模型的上限覆盖值。
+            max_total (int, optional): 所有模型合计的在途请求数上限。None 表示不限制。
+        """
+        self.max_concurrency = max_concurrency
+        self.model_limits = dict(model_limits or {})
+        self._models: Dict[str, _PrioritySlots] = {}
+        self._total = _PrioritySlots(max_total) if max_total else None
+        self.files = 0 # 已进入流水线的文件数
+
+    def graph(self, name: str = None) -> TaskGraph:
+        """
+        为一个文件创建阶段 DAG，并为当前任务（及此后创建的子任务）分配该文件的排队优先级。
+        """
+        _priority.set(self.files)
+        self.files += 1
+        return TaskGraph(name)
+
+    @asynccontextmanager
+    async def slot(self, model: str):
+        """在 model 的一个空位（及总上限的一个空位）中执行请求。"""
+        if model not in self._models:
+            self._models[model] = _PrioritySlots(self.model_limits.get(model, self.max_concurrency))
+        slots = self._models[model]
+        priority = _priority.get()
+        await slots.acquire(priority)
+        try:
+            if self._total:
+                await self._total.acquire(priority)
+            try:
+                yield
+            finally:
+                if self._total:
+                    self._total.release()
+        finally:
+            slots.release()
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "files": self.files,
+            "models": {model: {**slots.stats, "wait_seconds": round(slots.stats["wait_seconds"], 2)}
+                       for model, slots in self._models.items()},
+        }
+
+    def summary(self) -> str:
+        return "; ".join(
+            f"{model} 上限 {slots.limit}，最多同时 {slots.stats['max_in_flight']} 个请求，"
+            f"{slots.stats['queued']}/{slots.stats['requests']} 个请求排队共 {slots.stats['wait_seconds']:.1f}s"
+            for model, slots in self._models.items()
+        )
+
+    @staticmethod
+    def parse_model_concurrency(spec: str) -> tuple:
+        """
+        解析 "MODEL=N" 形式的配置，例如 "gpt-4o=16"。格式错误时抛出 ValueError。
+        """
+        model, sep, limit = spec.rpartition("=")
+        if not sep or not model:
+            raise ValueError(f"无效的模型并发配置 '{spec}'，应为 MODEL=N")
+        try:
+            limit = int(limit)
+        except ValueError:
+            raise ValueError(f"无效的模型并发配置 '{spec}'，N 必须是整数")
+        if limit < 1:
+            raise ValueError(f"无效的模型并发配置 '{spec}'，N 必须大于 0")
+        return model, limit
@@ -0,0 +1,137 @@
+import math
+import re
+from typing import List, Tuple, Iterable
+
+try:
+    import tiktoken
+except ImportError: # tiktoken 是可选依赖，缺失时使用启发式估算
+    tiktoken = None
+
+# 各模型的上下文窗口（token）。按前缀匹配，越具体的前缀越靠前。
+MODEL_CONTEXT_WINDOWS = [
+    ("gpt-4o", 128000),
+    ("gpt-4.1", 1000000),
+    ("gpt-4-turbo", 128000),
+    ("gpt-4-32k", 32768),
+    ("gpt-4", 8192),
+    ("gpt-3.5-turbo", 16385),
+    ("o1", 128000),
+    ("o3", 200000),
+    ("gemini-1.5-pro", 2000000),
+    ("gemini-1.5-flash", 1000000),
+    ("gemini-2", 1000000),
+    ("gemini-pro", 32000),
+    ("claude-3", 200000),
+    ("claude", 200000),
+    ("deepseek", 64000),
+    ("qwen", 32000),
+]
+DEFAULT_CONTEXT_WINDOW = 32000
+# 即便模型窗口更大，单次请求的 prompt 也不超过此值，避免在超长文件上浪费 token
+DEFAULT_MAX_PROMPT_TOKENS = 32000
+# 预留给消息格式开销和估算误差的 token 数
+_SAFETY_MARGIN = 512
+
+_CJK_RE = re.compile(r"[\u3000-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uff00-\uffef]")
+_encoders = {}
+
+
+def _get_encoder(model: str):
+    if tiktoken is None:
+        return None
+    if model not in _encoders:
+        try:
+            _encoders[model] = tiktoken.encoding_for_model(model)
+        except KeyError:
+            _encoders[model] = tiktoken.get_encoding("cl100k_base")
+    return _encoders[model]
+
+
+def count_tokens(text: str, model: str = "") -> int:
+    """
+    估算文本在指定模型下的 token 数。
+
+    安装了 tiktoken 时使用对应模型的编码（未知模型使用 cl100k_base）；否则使用启发式估算：
+    每个 CJK 字符约 1 个 token，其余字符约 4 个字符 1 个 token。
+    """
+    if not text:
+        return 0
+    encoder = _get_encoder(model)
+    if encoder is not None:
+        return len(encoder.encode(text, disallowed_special=()))
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+
+def count_message_tokens(messages: Iterable[dict], model: str = "") -> int:
+    """估算一组聊天消息的 token 数（每条消息额外计入少量格式开销）。"""
+    return sum(count_tokens(m.get("content") or "", model) + 4 for m in messages)
+
+
+def context_window_for(model: str) -> int:
+    """返回模型的上下文窗口大小，未知模型返回 DEFAULT_CONTEXT_WINDOW。"""
+    name = (model or "").lower().rsplit("/", 1)[-1]
+    for prefix, window in MODEL_CONTEXT_WINDOWS:
+        if name.startswith(prefix):
+            return window
+    return DEFAULT_CONTEXT_WINDOW
+
+
+def prompt_budget(model: str, max_output_tokens: int, max_prompt_tokens: int = DEFAULT_MAX_PROMPT_TOKENS,
+                  reserved: int = 0) -> int:
+    """
+    计算一次请求中可用于 prompt 正文的 token 数：
+    min(模型窗口 - 输出上限, max_prompt_tokens) - reserved（系统提示等固定部分）- 安全余量。
+    """
+    available = context_window_for(model) - max_output_tokens
+    if max_prompt_tokens:
+        available = min(available, max_prompt_tokens)
+    return max(256, available - reserved - _SAFETY_MARGIN)
+
+
+def plan_line_windows(lines: List[str], budget_tokens: int, model: str = "", overlap_lines: int = 20,
+                      line_overhead: int = 2) -> List[Tuple[int, int]]:
+    """
+    将源代码行切分为相互重叠的窗口，每个窗口的 token 数不超过 budget_tokens。
+
+    参数:
+        lines (List[str]): 源代码行。
+        budget_tokens (int): 每个窗口的 token 上限。
+        model (str, optional): 用于计数的模型名。
+        overlap_lines (int, optional): 相邻窗口之间重叠的行数，保证跨窗口边界的代码在某个窗口中完整可见。
+        line_overhead (int, optional): 每行额外的 token 开销（例如行号前缀）。
+
+    返回:
+        List[Tuple[int, int]]: 窗口的 (起始行, 结束行) 列表，行号从 1 开始且包含两端。
+    """
+    costs = [count_tokens(line, model) + line_overhead for line in lines]
+    windows: List[Tuple[int, int]] = []
+    start = 0
+    total = len(lines)
+    while start < total:
+        end = start
+        used = 0
+        while end < total and (used + costs[end] <= budget_tokens or end == start):
+            used += costs[end]
+            end += 1
+        windows.append((start + 1, end))
+        if end >= total:
+            break
+        # 下一个窗口与当前窗口重叠（最多重叠当前窗口的一半），但至少前进一行
+        start = max(end - min(overlap_lines, (end - start) // 2), start + 1)
+    return windows
+
+
+def truncate_to_tokens(text: str, budget_tokens: int, model: str = "") -> str:
+    """按行截断文本，使其 token 数不超过 budget_tokens，被截断时在末尾附加说明。"""
+    if count_tokens(text, model) <= budget_tokens:
+        return text
+    kept = []
+    used = 0
+    for line in text.splitlines():
+        cost = count_tokens(line, model) + 1
+        if used + cost > budget_tokens:
+            break
+        kept.append(line)
+        used += cost
+    return "\n".join(kept) + "\n... [内容超出 token 预算，已截断]"
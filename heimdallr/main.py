@@ -1,11 +1,38 @@
 import argparse
 import os
+import sys
 import asyncio
 import json
+import time
+import signal
+from dataclasses import dataclass, asdict, fields, replace
+from typing import Awaitable, Callable
 from dotenv import load_dotenv
-from openai import OpenAI
-from heimdallr.core.llm_connector import LLMConnector
+from heimdallr.core.llm_connector import LLMConnector, DEFAULT_MAX_CONNECTIONS, DEFAULT_MAX_RETRIES
+from heimdallr.core.rate_limit import ModelRateLimiter
+from heimdallr.core.llm_cache import LLMCache, DEFAULT_CACHE_MAX_BYTES, DEFAULT_CACHE_MAX_AGE_SECONDS
 from heimdallr.core.agents import ManagerAgent
+from heimdallr.core.agents.manager_agent import DEFAULT_NUM_AUDITORS
+from heimdallr.core.agents.checker_agent import CHECKER_MODES, DEFAULT_CHECKER_MODE
+from heimdallr.core.file_discovery import discover_source_files, DEFAULT_MAX_FILE_BYTES
+from heimdallr.core.incremental import load_unit_state, UNIT_STATE_SUFFIX
+from heimdallr.core.findings import VERDICT_LABELS
+from heimdallr.core.checkpoint import CheckpointStore
+from heimdallr.core.findings_store import FindingsStore, VULN_TYPE_PATTERNS, DEFAULT_FINDINGS_DB, default_findings_db_path
+from heimdallr.core.token_budget import DEFAULT_MAX_PROMPT_TOKENS
+from heimdallr.core.scheduler import PipelineScheduler, DEFAULT_MODEL_CONCURRENCY
+from heimdallr.tools.code_reader import CodeIndex, DEFAULT_CODE_CONTEXT_TOKENS, DEFAULT_CODE_INDEX, default_code_index_path
+from heimdallr.core.events import EventStream
+from heimdallr.core.metrics import MetricsCollector
+from heimdallr.core.dedup import DuplicateIndex, DEFAULT_DUPLICATE_THRESHOLD
+from heimdallr.core.risk import RISK_FILTER_MODES, DEFAULT_RISK_FILTER
+from heimdallr.core.batch import BatchSubmitter, DEFAULT_BATCH_POLL_SECONDS, DEFAULT_BATCH_IDLE_SECONDS
+from heimdallr.core.cascade import (CascadePolicy, SEVERITY_LEVELS, DEFAULT_ESCALATE_CONFIDENCE,
+                                    DEFAULT_ESCALATE_SEVERITY)
+from heimdallr.core.audit_service import (AuditService, AuditJob, JsonApiServer, DEFAULT_SERVE_HOST, DEFAULT_SERVE_PORT,
+                                           DEFAULT_SERVE_JOBS)
+from heimdallr.core.job_queue import (JobQueue, new_run_id, default_worker_id, DEFAULT_LEASE_SECONDS,
+                                      QUEUED, LEASED, DONE, FAILED)
 
 # 尝试加载 .env 文件 (如果存在)
 load_dotenv()
@@ -13,44 +40,305 @@ load_dotenv()
 DEFAULT_MANAGER_MODEL = "gemini-1.5-flash-latest" # 例如 "gemini-1.5-flash-latest", "gemini-2.0-flash", "gpt-4o", "gpt-3.5-turbo"
 DEFAULT_AUDITOR_MODEL = "gemini-1.5-flash-latest" # 例如 "gemini-1.5-flash-latest", "gemini-2.0-flash", "gpt-4", "gpt-3.5-turbo"
 DEFAULT_CHECKER_MODEL = "gemini-1.5-pro-latest"   # 例如 "gemini-1.5-pro-latest", "gpt-4-turbo", "gpt-4"
+DEFAULT_FILE_JOBS = 16 # 仓库模式下同时在流水线中的文件数（LLM 请求的并发由各模型的并发上限控制）
+DEFAULT_REPO_OUTPUT_DIR = "heimdallr_reports"
+DEFAULT_QUEUE_POLL_SECONDS = 2.0 # worker 和协调者轮询任务队列的间隔
 
-async def run_audit(file_path: str, 
-                  api_key: str = None, 
-                  base_url: str = None, 
-                  manager_model: str = None,
-                  auditor_model: str = None,
-                  checker_model: str = None,
-                  debug: bool = False):
+@dataclass
+class Runtime:
     """
-    运行代码审计流程。
+    一个进程中所有审计共享的 LLM 运行时：连接参数、LLM 缓存、限流器、流水线调度器、指标、事件流和批处理提交器。
+    由 _create_runtime 根据命令行参数创建一次并传给各运行模式，LLMConnector 由 _create_connector 创建。
+
+    manager_model 等为命令行显式提供的模型名，None 时使用环境变量或默认值（见 _resolve_settings）。
+    """
+    api_key: str = None
+    base_url: str = None
+    manager_model: str = None
+    auditor_model: str = None
+    checker_model: str = None
+    max_connections: int = DEFAULT_MAX_CONNECTIONS
+    max_retries: int = DEFAULT_MAX_RETRIES
+    llm_cache: LLMCache = None
+    rate_limiter: ModelRateLimiter = None
+    scheduler: PipelineScheduler = None
+    metrics: MetricsCollector = None
+    events: EventStream = None
+    batch: BatchSubmitter = None
+    stream: bool = False
+    debug: bool = False
+
+    def settings(self, require_api_key: bool = True) -> dict | None:
+        """解析后的 API 和模型设置，见 _resolve_settings。"""
+        return _resolve_settings(self.api_key, self.base_url, self.manager_model, self.auditor_model,
+                                 self.checker_model, self.debug, require_api_key)
+
+    def close(self):
+        if self.llm_cache:
+            self.llm_cache.close()
+        if self.events:
+            self.events.close()
+
+@dataclass
+class AuditOptions:
+    """
+    审计流程参数（见 _add_audit_arguments）。仓库队列模式下写入任务选项，由 worker 通过 from_dict 还原。
+    """
+    num_auditors: int = DEFAULT_NUM_AUDITORS
+    max_prompt_tokens: int = DEFAULT_MAX_PROMPT_TOKENS
+    incremental: bool = False
+    dedup_threshold: float = DEFAULT_DUPLICATE_THRESHOLD
+    risk_filter: str = DEFAULT_RISK_FILTER
+    checker_mode: str = DEFAULT_CHECKER_MODE
+    cascade_model: str = None
+    cascade_min_confidence: float = DEFAULT_ESCALATE_CONFIDENCE
+    cascade_severity: str = DEFAULT_ESCALATE_SEVERITY
+    code_context_tokens: int = DEFAULT_CODE_CONTEXT_TOKENS
+    findings_db: str = None
+
+    @classmethod
+    def from_dict(cls, options: dict) -> "AuditOptions":
+        """从任务选项还原：忽略其他键（输出目录、模型名等），缺少的键使用默认值。"""
+        names = {f.name for f in fields(cls)}
+        return cls(**{key: value for key, value in options.items() if key in names})
+
+def _resolve_settings(api_key: str = None, base_url: str = None, manager_model: str = None,
+                      auditor_model: str = None, checker_model: str = None, debug: bool = False,
+                      require_api_key: bool = True) -> dict | None:
+    """
+    合并命令行参数、环境变量和默认值。require_api_key 为 True 且 API 密钥缺失时打印错误并返回 None。
     """
     # 获取环境变量或使用默认值
-    api_key = api_key or os.getenv("OPENAI_API_KEY")
-    base_url = base_url or os.getenv("OPENAI_BASE_URL")
-    manager_model = manager_model or os.getenv("HEIMDALLR_MANAGER_MODEL", DEFAULT_MANAGER_MODEL)
-    auditor_model = auditor_model or os.getenv("HEIMDALLR_AUDITOR_MODEL", DEFAULT_AUDITOR_MODEL)
-    checker_model = checker_model or os.getenv("HEIMDALLR_CHECKER_MODEL", DEFAULT_CHECKER_MODEL)
+    settings = {
+        "api_key": api_key or os.getenv("OPENAI_API_KEY"),
+        "base_url": base_url or os.getenv("OPENAI_BASE_URL"),
+        "manager_model": manager_model or os.getenv("HEIMDALLR_MANAGER_MODEL", DEFAULT_MANAGER_MODEL),
+        "auditor_model": auditor_model or os.getenv("HEIMDALLR_AUDITOR_MODEL", DEFAULT_AUDITOR_MODEL),
+        "checker_model": checker_model or os.getenv("HEIMDALLR_CHECKER_MODEL", DEFAULT_CHECKER_MODEL),
+    }
 
     if debug:
         print("*** DEBUG MODE ENABLED ***")
-        if api_key:
-            print(f"DEBUG: API Key (Full String): {api_key}")
+        if settings["api_key"]:
+            print(f"DEBUG: API Key (Full String): {settings['api_key']}")
         else:
             print("DEBUG: API Key is not set.")
         print("************************")
-        
-    if not api_key:
+
+    if require_api_key and not settings["api_key"]:
         print("错误: OpenAI API 密钥未找到。请设置 OPENAI_API_KEY 环境变量或通过 --api-key 参数提供。")
+        return None
+    return settings
+
+def _print_settings(settings: dict, num_auditors: int, llm_cache: LLMCache = None):
+    print(f"Manager Model: {settings['manager_model']}")
+    print(f"Auditor Model: {settings['auditor_model']}")
+    print(f"Checker Model: {settings['checker_model']}")
+    print(f"Auditor 并发数: {num_auditors}")
+    if settings["base_url"]:
+        print(f"API Base URL: {settings['base_url']}")
+    print(f"LLM 响应缓存: {llm_cache.db_path if llm_cache else '已禁用'}")
+    print("--------------------------------")
+
+def _print_cache_stats(llm_cache: LLMCache = None, metrics: MetricsCollector = None):
+    if llm_cache:
+        stats = llm_cache.stats()
+        print(f"LLM 缓存: 命中 {stats['hits']} 次, 未命中 {stats['misses']} 次, 命中率 {stats['hit_rate']:.0%}")
+    if metrics:
+        totals = metrics.snapshot()["totals"]
+        if totals["prompt_tokens"]:
+            print(f"提供商前缀缓存: 命中 {totals['cached_prompt_tokens']}/{totals['prompt_tokens']} 个 prompt token "
+                  f"({totals['prefix_cache_hit_rate']:.0%})")
+
+def _create_connector(settings: dict, runtime: Runtime) -> LLMConnector:
+    """用解析后的设置和进程的运行时创建 LLMConnector（各运行模式共用一个）。"""
+    return LLMConnector(api_key=settings["api_key"], base_url=settings["base_url"],
+                        max_connections=runtime.max_connections, cache=runtime.llm_cache,
+                        max_retries=runtime.max_retries, rate_limiter=runtime.rate_limiter, metrics=runtime.metrics,
+                        batch=runtime.batch, scheduler=runtime.scheduler)
+
+def _create_manager(llm_connector: LLMConnector, settings: dict, options: AuditOptions, runtime: Runtime,
+                    duplicate_index: DuplicateIndex = None, cascade: CascadePolicy = None,
+                    code_index: CodeIndex = None) -> ManagerAgent:
+    return ManagerAgent(
+        llm_connector=llm_connector,
+        model_name=settings["manager_model"],
+        auditor_model_name=settings["auditor_model"],
+        checker_model_name=settings["checker_model"],
+        num_auditors=options.num_auditors,
+        max_prompt_tokens=options.max_prompt_tokens,
+        stream=runtime.stream,
+        events=runtime.events,
+        duplicate_index=duplicate_index,
+        risk_filter=options.risk_filter,
+        checker_mode=options.checker_mode,
+        cascade=cascade,
+        batch=runtime.batch is not None,
+        code_index=code_index,
+        code_context_tokens=options.code_context_tokens
+    )
+
+def _print_dedup_stats(duplicate_index: DuplicateIndex = None):
+    if duplicate_index and (duplicate_index.stats["exact"] or duplicate_index.stats["near"]):
+        print(f"重复代码: {duplicate_index.stats['exact']} 个单元与已审计代码完全相同，"
+              f"{duplicate_index.stats['near']} 个近似相同 (只复核差异行)")
+
+def _create_cascade(cascade_model: str = None, min_confidence: float = DEFAULT_ESCALATE_CONFIDENCE,
+                    escalate_severity: str = DEFAULT_ESCALATE_SEVERITY) -> CascadePolicy | None:
+    if not cascade_model:
+        return None
+    print(f"模型级联: {cascade_model} 初审，置信度 < {min_confidence} 或严重程度 >= {escalate_severity} 时由 Auditor Model 复审")
+    return CascadePolicy(cascade_model, min_confidence, escalate_severity)
+
+def _print_cascade_stats(cascade: CascadePolicy = None):
+    if cascade and cascade.stats["audited"]:
+        print(f"模型级联: {cascade.summary()}")
+
+def _print_batch_stats(batch: BatchSubmitter = None):
+    if batch and batch.stats["requests"]:
+        print(f"Batch API: {batch.summary()}")
+
+def _build_code_index(index_path: str, root_dir: str, files: list = None,
+                      max_file_bytes: int = DEFAULT_MAX_FILE_BYTES) -> CodeIndex:
+    """
+    打开 index_path 处的代码索引并使其与 root_dir 下的源文件保持一致（只重新解析有变化的文件）。
+    files 为 None 时在 root_dir 下重新发现源文件（不受 --glob 限制，被调用的定义可能位于审计范围之外的文件中）。
+    """
+    if files is None:
+        files, _ = discover_source_files(root_dir, max_file_bytes=max_file_bytes)
+    code_index = CodeIndex(index_path)
+    stats = code_index.build(root_dir, files)
+    print(f"代码索引: {code_index.db_path} ({stats['files']} 个文件，重新解析 {stats['parsed']} 个，"
+          f"移除 {stats['removed']} 个，共 {stats['units']} 个代码单元，用时 {stats['seconds']:.2f}s)")
+    return code_index
+
+def _print_scheduler_stats(scheduler: PipelineScheduler = None):
+    if scheduler and scheduler.stats["models"]:
+        print(f"流水线调度: {scheduler.summary()}")
+
+def _report_base(file_path: str, output_dir: str = None, rel_path: str = None) -> str:
+    """
+    返回报告文件的路径前缀。
+
+    默认为当前目录下的 <文件名>；提供 output_dir 时为 output_dir/<rel_path>，保留目录结构以避免同名文件互相覆盖。
+    """
+    if output_dir:
+        return os.path.join(output_dir, rel_path or os.path.basename(file_path))
+    return os.path.splitext(os.path.basename(file_path))[0]
+
+def _load_previous_unit_state(store: FindingsStore, file_path: str, output_dir: str = None, rel_path: str = None) -> dict:
+    """增量模式下读取该文件上次的单元状态：优先使用审计结果库，其次是旧版本保存在报告旁边的 _audit_units.json。"""
+    state = store.previous_unit_state(os.path.abspath(file_path))
+    if state:
+        print(f"增量模式: 已从审计结果库 {store.db_path} 加载上次的单元状态")
+        return state
+    state_path = f"{_report_base(file_path, output_dir, rel_path)}{UNIT_STATE_SUFFIX}"
+    state = load_unit_state(state_path)
+    if state:
+        print(f"增量模式: 已加载上次的单元状态 {state_path}")
+    else:
+        print("增量模式: 未找到上次的单元状态，将审计全部代码单元。")
+    return state
+
+def _save_reports(store: FindingsStore, run_id: str, report: dict, file_path: str, output_dir: str = None,
+                  rel_path: str = None, write_files: bool = False):
+    """
+    将报告（连同增量模式的 unit_state 和拆分后的逐条发现）写入审计结果库。
+    write_files 为 True 时另外保存 JSON 和 Markdown 报告文件（文件位置见 _report_base）；
+    否则可以随时通过 `heimdallr query report` 从库中生成。
+    """
+    store.add_report(run_id, rel_path or file_path, os.path.abspath(file_path), report)
+    report.pop("unit_state", None)
+    if not write_files:
+        print(f"\n报告已写入审计结果库 {store.db_path} (run_id: {run_id})，"
+              f"导出: python -m heimdallr.main query report --file {rel_path or file_path} --format md")
+        return
+
+    report_base = _report_base(file_path, output_dir, rel_path)
+    if output_dir:
+        os.makedirs(os.path.dirname(report_base) or ".", exist_ok=True)
+
+    # 保存 JSON 报告
+    report_json_filename = f"{report_base}_audit_report.json"
+    with open(report_json_filename, 'w', encoding='utf-8') as rf_json:
+        json.dump(report, rf_json, indent=4, ensure_ascii=False)
+    print(f"\nJSON 报告已保存到: {report_json_filename}")
+
+    # 生成并保存 Markdown 报告
+    if report and not report.get("error"):
+        markdown_report_str = ManagerAgent._format_report_to_markdown(report)
+        report_md_filename = f"{report_base}_audit_report.md"
+        with open(report_md_filename, 'w', encoding='utf-8') as rf_md:
+            rf_md.write(markdown_report_str)
+        print(f"Markdown 报告已保存到: {report_md_filename}")
+    elif report.get("error"):
+        print(f"由于处理过程中出现错误，Markdown 报告未生成: {report.get('error')}")
+
+def _start_run(store: FindingsStore, resume: str = None, target: str = None, options: dict = None) -> str | None:
+    """
+    开始一次新的运行，或恢复 resume 指定的运行。返回 run_id；要恢复的运行不存在时返回 None。
+    """
+    if resume:
+        run = store.get_run(resume)
+        if run is None:
+            print(f"错误: 审计结果库 {store.db_path} 中没有运行 {resume}，无法恢复。")
+            return None
+        if run["target"] != target:
+            print(f"警告: 运行 {resume} 的审计目标为 {run['target']}，与本次的 {target} 不同。")
+        print(f"恢复运行 {resume}: 跳过已完成的文件，未完成文件中已完成的阶段从检查点恢复。")
+        return resume
+    run_id = new_run_id()
+    store.start_run(run_id, target=target, options=options)
+    print(f"run_id: {run_id} (中断后可使用 --resume {run_id} 继续)")
+    return run_id
+
+def _report_entry(rel_path: str, report: dict) -> dict:
+    """根据一个文件的报告生成仓库级汇总中的条目。"""
+    entry = {"file_path": rel_path}
+    if report.get("error"):
+        entry.update(status="error", error=report["error"])
+    else:
+        entry.update(status="ok", final_conclusion=report.get("final_conclusion"))
+        if "incremental" in report:
+            entry["incremental"] = {key: len(value) for key, value in report["incremental"].items()}
+        if "duplicates" in report:
+            entry["duplicate_units"] = len(report["duplicates"])
+        if "cascade" in report:
+            entry["cascade"] = {key: report["cascade"][key] for key in ("audited", "escalated")}
+        if "checkpoint_restored" in report:
+            entry["checkpoint_restored"] = report["checkpoint_restored"]
+    return entry
+
+async def run_audit(file_path: str,
+                  options: AuditOptions = None,
+                  runtime: Runtime = None,
+                  code_index: str = None,
+                  code_root: str = None,
+                  write_reports: bool = False,
+                  resume: str = None):
+    """
+    运行代码审计流程。
+
+    报告和逐条发现写入 options.findings_db 审计结果库（见 heimdallr.core.findings_store）；
+    write_reports 为 True 时另外在当前目录保存 JSON 和 Markdown 报告。
+    每个阶段的输出都保存为检查点（见 heimdallr.core.checkpoint），进程中途退出后以 resume=run_id 重新运行时
+    跳过已完成的阶段；运行完成后检查点被删除。
+
+    提供 options.cascade_model 时启用模型级联：该模型初审所有子任务，只有自评置信度低于 cascade_min_confidence
+    或严重程度不低于 cascade_severity 的子任务交给 auditor_model 复审（见 heimdallr.core.cascade）。
+    runtime 提供 batch 时 Auditor 请求通过 Batch API 离线执行，结果返回后继续 Checker 和最终报告（见 heimdallr.core.batch）。
+    提供 code_index（索引路径）时先为 code_root（默认为文件所在目录）下的源文件构建或更新代码索引，
+    每个 Auditor 子任务附带最多 options.code_context_tokens 个 token 的被调用者和调用者定义（见 heimdallr.tools.code_reader）。
+    """
+    options = options or AuditOptions()
+    runtime = runtime or Runtime()
+    settings = runtime.settings()
+    if not settings:
         return
 
     print(f"--- Heimdallr 代码审计开始 ---")
     print(f"目标文件: {file_path}")
-    print(f"Manager Model: {manager_model}")
-    print(f"Auditor Model: {auditor_model}")
-    print(f"Checker Model: {checker_model}")
-    if base_url:
-        print(f"API Base URL: {base_url}")
-    print("--------------------------------")
+    _print_settings(settings, options.num_auditors, runtime.llm_cache)
 
     try:
         with open(file_path, 'r', encoding='utf-8') as f:
@@ -62,37 +350,50 @@ async def run_audit(file_path: str,
         print(f"错误: 读取文件 '{file_path}' 时发生错误: {e}")
         return
 
+    llm_connector = None
+    cascade = None
+    store = None
+    checkpoints = None
+    code_reader = None
     try:
-        llm_connector = LLMConnector(api_key=api_key, base_url=base_url)
-        manager = ManagerAgent(
-            llm_connector=llm_connector, 
-            model_name=manager_model,
-            auditor_model_name=auditor_model,
-            checker_model_name=checker_model
-        )
+        cascade = _create_cascade(options.cascade_model, options.cascade_min_confidence, options.cascade_severity)
+        store = FindingsStore(options.findings_db)
+        run_id = _start_run(store, resume, os.path.abspath(file_path),
+                            {"manager_model": settings["manager_model"], "auditor_model": settings["auditor_model"],
+                             "checker_model": settings["checker_model"], "incremental": options.incremental})
+        if run_id is None:
+            return
+        if resume and os.path.abspath(file_path) in store.run_reports(run_id):
+            print(f"运行 {run_id} 中该文件已审计完成，无需恢复。"
+                  f"导出: python -m heimdallr.main query report --file {file_path} --run {run_id}")
+            return
+        checkpoints = CheckpointStore(store.db_path)
+        if code_index:
+            code_reader = _build_code_index(code_index, code_root or os.path.dirname(os.path.abspath(file_path)))
+        llm_connector = _create_connector(settings, runtime)
+        # 单文件模式下只能发现同一文件内的重复单元
+        manager = _create_manager(llm_connector, settings, options, runtime,
+                                  DuplicateIndex(options.dedup_threshold) if options.dedup_threshold else None,
+                                  cascade, code_reader)
+
+        previous_unit_state = _load_previous_unit_state(store, file_path) if options.incremental else None
 
         # 运行 Manager Agent 的处理任务
-        report = await manager.process_task(code_content, file_path=file_path)
+        if runtime.events:
+            runtime.events.emit("file_started", file_path=file_path)
+        started_at = time.monotonic()
+        report = await manager.process_task(code_content, file_path=file_path, previous_unit_state=previous_unit_state,
+                                            checkpoint=checkpoints.file(run_id, os.path.abspath(file_path), code_content))
 
         print("\n--- Heimdallr 最终审计报告 ---")
         # 使用 json.dumps 美化输出
         print(json.dumps(report, indent=4, ensure_ascii=False))
-        
-        # 保存 JSON 报告
-        report_json_filename = f"{os.path.splitext(os.path.basename(file_path))[0]}_audit_report.json"
-        with open(report_json_filename, 'w', encoding='utf-8') as rf_json:
-            json.dump(report, rf_json, indent=4, ensure_ascii=False)
-        print(f"\nJSON 报告已保存到: {report_json_filename}")
-
-        # 生成并保存 Markdown 报告
-        if report and not report.get("error"):
-            markdown_report_str = manager._format_report_to_markdown(report)
-            report_md_filename = f"{os.path.splitext(os.path.basename(file_path))[0]}_audit_report.md"
-            with open(report_md_filename, 'w', encoding='utf-8') as rf_md:
-                rf_md.write(markdown_report_str)
-            print(f"Markdown 报告已保存到: {report_md_filename}")
-        elif report.get("error"):
-            print(f"由于处理过程中出现错误，Markdown 报告未生成: {report.get('error')}")
+        _save_reports(store, run_id, report, file_path, write_files=write_reports)
+        store.finish_run(run_id, {"status": "error" if report.get("error") else "ok"})
+        checkpoints.discard(run_id)
+        if runtime.events:
+            runtime.events.emit("file_finished", file_path=file_path, status="error" if report.get("error") else "ok",
+                        error=report.get("error"), elapsed_seconds=round(time.monotonic() - started_at, 2))
 
     except ValueError as ve:
         print(f"初始化错误: {ve}")
@@ -101,30 +402,822 @@ async def run_audit(file_path: str,
         import traceback
         traceback.print_exc()
     finally:
+        if llm_connector:
+            await llm_connector.aclose()
+        if store:
+            store.close()
+        if checkpoints:
+            checkpoints.close()
+        if code_reader:
+            code_reader.close()
+        _print_cache_stats(runtime.llm_cache, runtime.metrics)
+        _print_cascade_stats(cascade)
+        _print_batch_stats(runtime.batch)
+        _print_scheduler_stats(runtime.scheduler)
+        if runtime.metrics:
+            runtime.metrics.flush()
         print("--- Heimdallr 代码审计结束 ---")
 
-def main():
-    parser = argparse.ArgumentParser(description="Heimdallr - LLM 代码审计工具")
-    parser.add_argument("--file", "-f", type=str, required=True, help="需要审计的源代码文件路径")
+async def _audit_one_file(manager: ManagerAgent, store: FindingsStore, run_id: str, path: str, rel_path: str,
+                          output_dir: str, incremental: bool = False, write_reports: bool = False,
+                          events: EventStream = None, checkpoints: CheckpointStore = None,
+                          lease_check: Callable[[], Awaitable[bool]] = None) -> dict:
+    """
+    审计仓库中的单个文件并把报告写入审计结果库，返回写入仓库级汇总的条目。
+    提供 checkpoints 时各阶段的输出保存为该文件在本运行中的检查点，已保存的阶段直接复用。
+    提供 lease_check 时（worker 模式）写入报告前确认任务租约仍然有效，租约已丢失时抛出 RuntimeError 而不写入，
+    避免覆盖已重新领取该任务的 worker 的结果。
+    报告本身的错误（例如文件中没有代码）记录在条目中；读取文件等异常向上抛出，由调用方决定如何处理。
+    """
+    started_at = time.monotonic()
+    if events:
+        events.emit("file_started", file_path=rel_path)
+    with open(path, 'r', encoding='utf-8') as f:
+        code_content = f.read()
+    previous_unit_state = _load_previous_unit_state(store, path, output_dir, rel_path) if incremental else None
+    checkpoint = checkpoints.file(run_id, os.path.abspath(path), code_content) if checkpoints else None
+    report = await manager.process_task(code_content, file_path=rel_path, previous_unit_state=previous_unit_state,
+                                        checkpoint=checkpoint)
+    if lease_check and not await lease_check():
+        raise RuntimeError("任务租约已丢失，报告未写入审计结果库")
+    _save_reports(store, run_id, report, path, output_dir=output_dir, rel_path=rel_path, write_files=write_reports)
+    entry = _report_entry(rel_path, report)
+    entry["elapsed_seconds"] = round(time.monotonic() - started_at, 2)
+    if events:
+        events.emit("file_finished", **entry)
+    return entry
+
+def _write_repo_summary(root_dir: str, pattern: str, files: list, skipped: list, entries: list, elapsed_seconds: float,
+                        output_dir: str, extra: dict = None, events: EventStream = None) -> dict:
+    """生成并保存仓库级汇总 repo_summary.json。"""
+    summary = {
+        "root_dir": os.path.abspath(root_dir),
+        "pattern": pattern,
+        "files_total": len(files),
+        "files_ok": sum(1 for r in entries if r["status"] == "ok"),
+        "files_failed": sum(1 for r in entries if r["status"] != "ok"),
+        "files_skipped": [{"file_path": os.path.relpath(p, root_dir), "reason": reason} for p, reason in skipped],
+        "elapsed_seconds": round(elapsed_seconds, 2),
+        **(extra or {}),
+        "files": entries,
+    }
+    os.makedirs(output_dir, exist_ok=True)
+    summary_path = os.path.join(output_dir, "repo_summary.json")
+    with open(summary_path, 'w', encoding='utf-8') as sf:
+        json.dump(summary, sf, indent=4, ensure_ascii=False)
+    print(f"\n仓库审计完成: {summary['files_ok']} 成功, {summary['files_failed']} 失败, 用时 {summary['elapsed_seconds']}s")
+    print(f"仓库级汇总已保存到: {summary_path}")
+    if events:
+        events.emit("run_finished", **{key: summary[key] for key in (
+            "files_total", "files_ok", "files_failed", "elapsed_seconds")}, summary_path=summary_path)
+    return summary
+
+async def run_repo_audit(root_dir: str,
+                         pattern: str = None,
+                         options: AuditOptions = None,
+                         runtime: Runtime = None,
+                         jobs: int = DEFAULT_FILE_JOBS,
+                         max_file_bytes: int = DEFAULT_MAX_FILE_BYTES,
+                         output_dir: str = DEFAULT_REPO_OUTPUT_DIR,
+                         code_index: str = None,
+                         write_reports: bool = False,
+                         resume: str = None,
+                         queue_path: str = None,
+                         wait: bool = True) -> dict | None:
+    """
+    仓库模式：发现 root_dir 下的源代码文件，并通过有界并发的工作队列逐个审计。
+
+    所有文件共享同一个 LLMConnector（及其连接池）和重复代码索引；每个工作协程使用各自的 ManagerAgent。
+    options.dedup_threshold 大于 0 时，与已审计单元的相似度不低于该值的单元复用其审计结果（见 heimdallr.core.dedup）。
+    提供 options.cascade_model 时所有文件共享同一个模型级联策略，结束时打印整个运行的升级率。
+    runtime 提供 batch 时所有文件同时开始审计（不受 jobs 限制），使整个运行的 Auditor 请求进入同一个 Batch API 批任务。
+    每个文件的报告和逐条发现写入 options.findings_db 审计结果库（write_reports 为 True 时另外写入 output_dir），
+    最后在 output_dir 生成仓库级汇总 repo_summary.json。
+    提供 code_index（索引路径）时先为 root_dir 下的所有源文件构建或更新代码索引，每个 Auditor 子任务附带
+    最多 options.code_context_tokens 个 token 的被调用者和调用者定义（见 heimdallr.tools.code_reader）。
+    提供 resume 时恢复该运行：结果库中已有报告的文件直接计入汇总，其余文件已完成的阶段从检查点恢复。
+
+    提供 queue_path 时作为协调者运行：只把每个文件作为任务写入持久化队列（见 heimdallr.core.job_queue），
+    由任意数量的 `heimdallr worker` 进程领取执行；wait 为 True 时等待所有任务结束后再生成汇总。
+
+    返回:
+        dict | None: 仓库级汇总；配置错误时返回 None。
+    """
+    options = options or AuditOptions()
+    runtime = runtime or Runtime()
+    settings = runtime.settings(require_api_key=not queue_path)
+    if not settings:
+        return None
+
+    print(f"--- Heimdallr 仓库审计开始 ---")
+    print(f"目标目录: {root_dir}")
+    if pattern:
+        print(f"文件匹配模式: {pattern}")
+    _print_settings(settings, options.num_auditors, runtime.llm_cache)
+
+    if not os.path.isdir(root_dir):
+        print(f"错误: 目录 '{root_dir}' 不存在。")
+        return None
+
+    files, skipped = discover_source_files(root_dir, pattern=pattern, max_file_bytes=max_file_bytes)
+    print(f"发现 {len(files)} 个待审计文件，跳过 {len(skipped)} 个文件。")
+    for skipped_path, reason in skipped:
+        print(f"  跳过 {os.path.relpath(skipped_path, root_dir)}: {reason}")
+    if not files:
+        print("--- Heimdallr 仓库审计结束 ---")
+        return None
+
+    if runtime.events:
+        runtime.events.emit("run_started", root_dir=os.path.abspath(root_dir), pattern=pattern, files_total=len(files),
+                    files_skipped=len(skipped))
+    code_reader = _build_code_index(code_index, root_dir, None if pattern else files, max_file_bytes) if code_index else None
+    if queue_path:
+        job_options = {
+            **asdict(options),
+            "output_dir": os.path.abspath(output_dir),
+            "findings_db": os.path.abspath(options.findings_db or default_findings_db_path()),
+            "write_reports": write_reports,
+            "manager_model": settings["manager_model"],
+            "auditor_model": settings["auditor_model"],
+            "checker_model": settings["checker_model"],
+            "code_index": os.path.abspath(code_index) if code_index else None,
+        }
+        if code_reader:
+            # 索引已构建，worker 按任务选项中的路径打开它
+            code_reader.close()
+        return await _coordinate_repo_audit(queue_path, root_dir, pattern, files, skipped, job_options, output_dir, wait,
+                                            runtime.events)
+
+    if runtime.batch:
+        # 批处理模式下各文件的大部分时间都在等待批任务，同时审计所有文件才能把它们的 Auditor 请求放进同一批
+        jobs = len(files)
+        print(f"Batch API 模式: {len(files)} 个文件同时审计，Auditor 请求合并为离线批任务提交。")
+    store = FindingsStore(options.findings_db)
+    run_id = _start_run(store, resume, os.path.abspath(root_dir), {
+        "pattern": pattern, "manager_model": settings["manager_model"], "auditor_model": settings["auditor_model"],
+        "checker_model": settings["checker_model"], "incremental": options.incremental})
+    if run_id is None:
+        store.close()
+        return None
+    print(f"审计结果库: {store.db_path}")
+    results: dict = {}
+    if resume:
+        completed = store.run_reports(run_id)
+        for path in files:
+            if os.path.abspath(path) in completed:
+                results[path] = {**_report_entry(os.path.relpath(path, root_dir), completed[os.path.abspath(path)]),
+                                 "resumed": True}
+        print(f"运行 {run_id} 中已有 {len(results)} 个文件审计完成，审计剩余 {len(files) - len(results)} 个文件。")
+    queue: asyncio.Queue[str] = asyncio.Queue()
+    for path in files:
+        if path not in results:
+            queue.put_nowait(path)
+    checkpoints = CheckpointStore(store.db_path)
+    started_at = time.monotonic()
+    llm_connector = _create_connector(settings, runtime)
+    duplicate_index = DuplicateIndex(options.dedup_threshold) if options.dedup_threshold else None
+    cascade = _create_cascade(options.cascade_model, options.cascade_min_confidence, options.cascade_severity)
+
+    async def worker():
+        manager = _create_manager(llm_connector, settings, options, runtime, duplicate_index, cascade, code_reader)
+        while True:
+            try:
+                path = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            rel_path = os.path.relpath(path, root_dir)
+            file_started_at = time.monotonic()
+            try:
+                entry = await _audit_one_file(manager, store, run_id, path, rel_path, output_dir, options.incremental,
+                                              write_reports, runtime.events, checkpoints)
+            except Exception as e:
+                entry = {"file_path": rel_path, "status": "error", "error": str(e),
+                         "elapsed_seconds": round(time.monotonic() - file_started_at, 2)}
+                if runtime.events:
+                    runtime.events.emit("file_finished", **entry)
+            results[path] = entry
+            if runtime.metrics:
+                runtime.metrics.flush()
+            done = len(results)
+            elapsed = time.monotonic() - started_at
+            print(f"[进度] {done}/{len(files)} 完成 ({entry['status']}) {rel_path} | 已用时 {elapsed:.1f}s")
+
+    try:
+        await asyncio.gather(*(worker() for _ in range(max(1, min(jobs, queue.qsize())))))
+    finally:
+        await llm_connector.aclose()
+        store.flush()
+        if code_reader:
+            code_reader.close()
+
+    ordered = [results[path] for path in files if path in results]
+    summary = _write_repo_summary(
+        root_dir, pattern, files, skipped, ordered, time.monotonic() - started_at, output_dir,
+        extra={"run_id": run_id, "findings_db": store.db_path,
+               "llm_cache": runtime.llm_cache.stats() if runtime.llm_cache else None, "llm_retries": llm_connector.retries,
+               "metrics": runtime.metrics.snapshot() if runtime.metrics else None,
+               "duplicates": duplicate_index.stats if duplicate_index else None,
+               "cascade": cascade.stats if cascade else None,
+               "batch": runtime.batch.stats if runtime.batch else None},
+        events=runtime.events
+    )
+    store.finish_run(run_id, {key: value for key, value in summary.items() if key != "files"})
+    store.close()
+    checkpoints.discard(run_id)
+    checkpoints.close()
+    _print_cache_stats(runtime.llm_cache, runtime.metrics)
+    _print_dedup_stats(duplicate_index)
+    _print_cascade_stats(cascade)
+    _print_batch_stats(runtime.batch)
+    _print_scheduler_stats(runtime.scheduler)
+    print("--- Heimdallr 仓库审计结束 ---")
+    return summary
+
+async def _coordinate_repo_audit(queue_path: str, root_dir: str, pattern: str, files: list, skipped: list,
+                                 options: dict, output_dir: str, wait: bool = True,
+                                 events: EventStream = None) -> dict | None:
+    """协调者：把文件写入持久化任务队列，并（可选）等待 worker 处理完毕后生成仓库级汇总。"""
+    job_queue = JobQueue(queue_path)
+    store = FindingsStore(options["findings_db"])
+    run_id = new_run_id()
+    started_at = time.monotonic()
+    try:
+        store.start_run(run_id, target=os.path.abspath(root_dir), options={"pattern": pattern, "queue": queue_path,
+                                                                            **options})
+        added = job_queue.enqueue(run_id, [(os.path.abspath(p), os.path.relpath(p, root_dir)) for p in files], options)
+        print(f"已将 {added} 个审计任务写入队列 {queue_path} (run_id: {run_id})")
+        print(f"启动 worker: python -m heimdallr.main worker --queue {queue_path}")
+        if events:
+            events.emit("run_enqueued", run_id=run_id, queue=queue_path, jobs=added)
+        if not wait:
+            print("--- Heimdallr 仓库审计任务已入队 ---")
+            return {"run_id": run_id, "queue": queue_path, "jobs": added}
+
+        reported = set()
+        while True:
+            # 回收崩溃 worker 遗留的过期租约，即使当前没有 worker 在领取任务
+            job_queue.requeue_expired()
+            for job in job_queue.jobs(run_id):
+                if job["status"] in (DONE, FAILED) and job["id"] not in reported:
+                    reported.add(job["id"])
+                    print(f"[进度] {len(reported)}/{len(files)} 完成 ({job['status']}) {job['rel_path']} "
+                          f"| worker {job['worker_id'] or '-'} | 已用时 {time.monotonic() - started_at:.1f}s")
+            counts = job_queue.counts(run_id)
+            if counts[QUEUED] == 0 and counts[LEASED] == 0:
+                break
+            await asyncio.sleep(DEFAULT_QUEUE_POLL_SECONDS)
+
+        entries = []
+        for job in job_queue.jobs(run_id):
+            entry = job["result"] or {"file_path": job["rel_path"], "status": "error"}
+            if job["status"] == FAILED:
+                entry = {**entry, "status": "error", "error": job["error"]}
+            entries.append({**entry, "attempts": job["attempts"]})
+        summary = _write_repo_summary(root_dir, pattern, files, skipped, entries, time.monotonic() - started_at,
+                                      output_dir, extra={"run_id": run_id, "queue": queue_path,
+                                                         "findings_db": store.db_path}, events=events)
+        store.finish_run(run_id, {key: value for key, value in summary.items() if key != "files"})
+        checkpoints = CheckpointStore(store.db_path)
+        checkpoints.discard(run_id)
+        checkpoints.close()
+        print("--- Heimdallr 仓库审计结束 ---")
+        return summary
+    finally:
+        job_queue.close()
+        store.close()
+
+async def run_worker(queue_path: str,
+                     runtime: Runtime = None,
+                     concurrency: int = 1,
+                     lease_seconds: float = DEFAULT_LEASE_SECONDS,
+                     run_id: str = None,
+                     exit_when_idle: bool = False) -> int:
+    """
+    worker 模式：从持久化任务队列中领取文件审计任务，执行完整的 Agent 流程并写回结果。
+
+    任务执行期间会定期续租；worker 崩溃后租约过期，任务会被其他 worker 重新领取。
+    审计参数（输出目录、模型等）来自协调者写入任务的选项，命令行显式提供的模型名优先。
+
+    参数:
+        concurrency (int, optional): 本进程同时执行的任务数。默认为 1。
+        lease_seconds (float, optional): 任务租约时长（秒）。
+        run_id (str, optional): 只处理指定运行的任务。
+        exit_when_idle (bool, optional): 队列中没有待处理和执行中的任务时退出；否则持续等待新任务。
+
+    返回:
+        int: 本进程处理完成的任务数。
+    """
+    runtime = runtime or Runtime()
+    settings = runtime.settings()
+    if not settings:
+        return 0
+
+    worker_id = default_worker_id()
+    print(f"--- Heimdallr worker 启动 ({worker_id}) ---")
+    print(f"任务队列: {queue_path}")
+    job_queue = JobQueue(queue_path)
+    llm_connector = _create_connector(settings, runtime)
+    processed = 0
+    # 重复代码索引和模型级联统计按运行划分，只在本进程领取的同一运行的文件之间共享
+    duplicate_indexes: dict = {}
+    cascades: dict = {}
+    # 审计结果库按协调者指定的路径打开，同一路径的任务共享一个连接（写入在其中批量进行）；
+    # 检查点保存在同一数据库中，崩溃 worker 的任务被重新领取后从其已完成的阶段继续
+    stores: dict = {}
+    checkpoint_stores: dict = {}
+    # 代码索引由协调者构建，按任务选项中的路径以只读方式使用
+    code_indexes: dict = {}
+
+    # 队列和结果库的读写是阻塞的 SQLite 调用，多个 worker 通过网络文件系统共享数据库时可能长时间等待锁；
+    # 这些调用在线程中执行，避免阻塞事件循环中正在进行的流式请求和续租
+    async def renew_lease(job_id: int) -> bool:
+        return await asyncio.to_thread(job_queue.heartbeat, job_id, worker_id, lease_seconds)
+
+    async def keep_lease(job_id: int, audit: asyncio.Task) -> bool:
+        # 租约丢失后任务可能已被其他 worker 领取：取消本地的审计，不再消耗 LLM 调用，也不写入结果
+        while True:
+            await asyncio.sleep(lease_seconds / 3)
+            if not await renew_lease(job_id):
+                print(f"WORKER: 任务 {job_id} 的租约已丢失，取消本地审计。")
+                audit.cancel()
+                return True
+
+    async def work_loop():
+        nonlocal processed
+        while True:
+            job = await asyncio.to_thread(job_queue.lease, worker_id, lease_seconds, run_id=run_id)
+            if job is None:
+                counts = await asyncio.to_thread(job_queue.counts, run_id)
+                if exit_when_idle and counts[QUEUED] == 0 and counts[LEASED] == 0:
+                    return
+                await asyncio.sleep(DEFAULT_QUEUE_POLL_SECONDS)
+                continue
+
+            job_options = job["options"]
+            options = AuditOptions.from_dict(job_options)
+            job_settings = {
+                **settings,
+                "manager_model": runtime.manager_model or job_options.get("manager_model") or settings["manager_model"],
+                "auditor_model": runtime.auditor_model or job_options.get("auditor_model") or settings["auditor_model"],
+                "checker_model": runtime.checker_model or job_options.get("checker_model") or settings["checker_model"],
+            }
+            if options.dedup_threshold and job["run_id"] not in duplicate_indexes:
+                duplicate_indexes[job["run_id"]] = DuplicateIndex(options.dedup_threshold)
+            if options.cascade_model and job["run_id"] not in cascades:
+                cascades[job["run_id"]] = _create_cascade(options.cascade_model, options.cascade_min_confidence,
+                                                          options.cascade_severity)
+            code_index = job_options.get("code_index")
+            if code_index and code_index not in code_indexes:
+                code_indexes[code_index] = CodeIndex(code_index)
+            manager = _create_manager(llm_connector, job_settings, options, runtime, duplicate_indexes.get(job["run_id"]),
+                                      cascades.get(job["run_id"]), code_indexes.get(code_index))
+            findings_db = options.findings_db or default_findings_db_path()
+            if findings_db not in stores:
+                stores[findings_db] = FindingsStore(findings_db)
+                checkpoint_stores[findings_db] = CheckpointStore(findings_db)
+            print(f"WORKER: 领取任务 {job['id']} ({job['rel_path']}，第 {job['attempts']} 次尝试)")
+            audit = asyncio.create_task(_audit_one_file(
+                manager, stores[findings_db], job["run_id"], job["file_path"], job["rel_path"],
+                job_options.get("output_dir", DEFAULT_REPO_OUTPUT_DIR), options.incremental,
+                job_options.get("write_reports", False), runtime.events, checkpoint_stores[findings_db],
+                lease_check=lambda job_id=job["id"]: renew_lease(job_id)))
+            heartbeat = asyncio.create_task(keep_lease(job["id"], audit))
+            try:
+                entry = await audit
+                # 任务完成前写入缓冲的报告，协调者据任务状态判断结果是否已可查询
+                await asyncio.to_thread(stores[findings_db].flush)
+            except asyncio.CancelledError:
+                if not (heartbeat.done() and not heartbeat.cancelled() and heartbeat.result()):
+                    raise
+                continue
+            except Exception as e:
+                print(f"WORKER: 任务 {job['id']} 执行失败: {e}")
+                await asyncio.to_thread(job_queue.fail, job["id"], worker_id, str(e))
+                continue
+            finally:
+                heartbeat.cancel()
+            if runtime.metrics:
+                runtime.metrics.flush()
+            if await asyncio.to_thread(job_queue.complete, job["id"], worker_id, entry):
+                processed += 1
+                # 报告已写入结果库，该文件的检查点不再需要（协调者不等待任务完成时也不会遗留）
+                await asyncio.to_thread(checkpoint_stores[findings_db].discard, job["run_id"], job["file_path"])
+                print(f"WORKER: 任务 {job['id']} 完成 ({entry['status']}) {job['rel_path']}")
+
+    try:
+        await asyncio.gather(*(work_loop() for _ in range(max(1, concurrency))))
+    finally:
+        await llm_connector.aclose()
+        job_queue.close()
+        for store in stores.values():
+            store.close()
+        for checkpoints in checkpoint_stores.values():
+            checkpoints.close()
+        for code_index in code_indexes.values():
+            code_index.close()
+        _print_cache_stats(runtime.llm_cache, runtime.metrics)
+        for cascade in cascades.values():
+            _print_cascade_stats(cascade)
+        _print_scheduler_stats(runtime.scheduler)
+        print(f"--- Heimdallr worker 退出，共完成 {processed} 个任务 ---")
+    return processed
+
+async def run_server(host: str = DEFAULT_SERVE_HOST,
+                     port: int = DEFAULT_SERVE_PORT,
+                     socket_path: str = None,
+                     auth_token: str = None,
+                     jobs: int = DEFAULT_SERVE_JOBS,
+                     options: AuditOptions = None,
+                     runtime: Runtime = None):
+    """
+    服务模式：常驻进程持有一个 LLMConnector（及其连接池、LLM 缓存、限流器和指标），
+    通过本地 JSON API（见 heimdallr.core.audit_service）接收文件审计任务，
+    使 CI 和编辑器钩子提交的审计不必每次承担 Python 启动、客户端构造和 TLS 握手的开销。
+
+    每个任务的报告写入 options.findings_db 审计结果库（run_id 即任务 ID）；任务可以通过 options 覆盖
+    incremental、risk_filter、checker_mode 和 num_auditors。收到 SIGINT/SIGTERM 时取消未完成的任务并退出。
+    """
+    options = options or AuditOptions()
+    runtime = runtime or Runtime()
+    settings = runtime.settings()
+    if not settings:
+        return
+
+    print(f"--- Heimdallr 审计服务启动 ---")
+    _print_settings(settings, options.num_auditors, runtime.llm_cache)
+    llm_connector = _create_connector(settings, runtime)
+    cascade = _create_cascade(options.cascade_model, options.cascade_min_confidence, options.cascade_severity)
+    store = FindingsStore(options.findings_db)
+
+    async def run_job(job: AuditJob) -> dict:
+        job_options = {"incremental": options.incremental, "risk_filter": options.risk_filter,
+                       "checker_mode": options.checker_mode, "num_auditors": options.num_auditors, **job.options}
+        if job_options["risk_filter"] not in RISK_FILTER_MODES:
+            raise ValueError(f"未知的 risk_filter: {job_options['risk_filter']}")
+        if job_options["checker_mode"] not in CHECKER_MODES:
+            raise ValueError(f"未知的 checker_mode: {job_options['checker_mode']}")
+        code = job.code
+        if code is None:
+            with open(job.file_path, 'r', encoding='utf-8') as f:
+                code = f.read()
+        # 重复代码索引按任务划分：不同任务提交的文件互不相关，跨任务复用审计结果没有意义
+        job_audit = replace(options, num_auditors=int(job_options["num_auditors"]),
+                            risk_filter=job_options["risk_filter"], checker_mode=job_options["checker_mode"])
+        manager = _create_manager(llm_connector, settings, job_audit, runtime,
+                                  DuplicateIndex(options.dedup_threshold) if options.dedup_threshold else None, cascade)
+        abs_path = os.path.abspath(job.file_path)
+        store.start_run(job.job_id, target=abs_path, options=job_options)
+        previous_unit_state = _load_previous_unit_state(store, job.file_path) if job_options["incremental"] else None
+        if runtime.events:
+            runtime.events.emit("file_started", file_path=job.file_path, job_id=job.job_id)
+        started_at = time.monotonic()
+        report = await manager.process_task(code, file_path=job.file_path, previous_unit_state=previous_unit_state)
+        store.add_report(job.job_id, job.file_path, abs_path, report)
+        report.pop("unit_state", None)
+        store.finish_run(job.job_id, {"status": "error" if report.get("error") else "ok"})
+        if runtime.events:
+            runtime.events.emit("file_finished", file_path=job.file_path, job_id=job.job_id,
+                        status="error" if report.get("error") else "ok", error=report.get("error"),
+                        elapsed_seconds=round(time.monotonic() - started_at, 2))
+        if runtime.metrics:
+            runtime.metrics.flush()
+        print(f"SERVE: 任务 {job.job_id} 完成 ({job.file_path})，用时 {time.monotonic() - started_at:.1f}s")
+        return report
+
+    def health() -> dict:
+        return {"llm_cache": runtime.llm_cache.stats() if runtime.llm_cache else None, "llm_retries": llm_connector.retries,
+                "metrics": runtime.metrics.snapshot() if runtime.metrics else None,
+                "cascade": cascade.stats if cascade else None, "findings_db": store.db_path}
+
+    service = AuditService(run_job, jobs)
+    server = await JsonApiServer(service, auth_token, health).start(host, port, socket_path)
+    print(f"审计服务已启动: {f'unix:{socket_path}' if socket_path else f'http://{host}:{port}'} "
+          f"(同时执行 {jobs} 个任务，审计结果库: {store.db_path})")
+    if not socket_path and not auth_token and host not in ("127.0.0.1", "localhost", "::1"):
+        print(f"警告: 服务监听在 {host} 上且未设置 --auth-token，任何能访问该地址的人都可以提交任务并读取服务器上的文件。")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError: # Windows
+            pass
+    try:
+        await stop.wait()
+    finally:
+        print("SERVE: 正在停止，取消未完成的任务...")
+        server.close()
+        await service.shutdown()
+        await server.wait_closed()
+        await llm_connector.aclose()
+        store.close()
+        if socket_path and os.path.exists(socket_path):
+            os.unlink(socket_path)
+        _print_cache_stats(runtime.llm_cache, runtime.metrics)
+        _print_cascade_stats(cascade)
+        _print_scheduler_stats(runtime.scheduler)
+        summary = service.summary()
+        print(f"--- Heimdallr 审计服务退出，共完成 {summary['done']} 个任务 "
+              f"(失败 {summary['failed']}，取消 {summary['cancelled']}) ---")
+
+def _add_audit_arguments(parser: argparse.ArgumentParser):
+    """审计模式和服务模式共用的审计流程参数。"""
+    parser.add_argument("--findings-db", type=str, help=f"审计结果库 (SQLite) 路径，报告和逐条发现写入其中，可用 `heimdallr query` 查询和导出 (默认: 环境变量 HEIMDALLR_FINDINGS_DB 或 {DEFAULT_FINDINGS_DB})")
+    parser.add_argument("--auditors", type=int, default=DEFAULT_NUM_AUDITORS, help=f"并发执行子任务的 Auditor Agent 数量 (默认: {DEFAULT_NUM_AUDITORS})")
+    parser.add_argument("--max-prompt-tokens", type=int, default=DEFAULT_MAX_PROMPT_TOKENS, help=f"单次 LLM 请求 prompt 的 token 上限 (同时受模型上下文窗口限制)，超出时按重叠窗口切分代码 (默认: {DEFAULT_MAX_PROMPT_TOKENS})")
+    parser.add_argument("--incremental", action="store_true", help="增量审计：只重新审计新增/修改的函数和类 (及其直接调用者)，其余单元复用 --findings-db 审计结果库中该文件上次的结果 (库中没有记录时回退到旧版本保存在报告旁的 _audit_units.json)")
+    parser.add_argument("--risk-filter", choices=RISK_FILTER_MODES, default=DEFAULT_RISK_FILTER, help="本地静态风险预筛：batch 把低风险单元打包快速检查，skip 不用 LLM 审计低风险单元，off 关闭预筛；启用时风险分数作为提示交给 Manager，高风险单元先审计 (默认: batch)")
+    parser.add_argument("--checker-mode", choices=CHECKER_MODES, default=DEFAULT_CHECKER_MODE, help="Checker 复核方式：single 一次复核全部材料，per-finding 逐条发现并发复核 (只带引用的代码片段) 后再做跨发现复核，auto 在材料较多时逐条复核 (默认: auto)")
+    parser.add_argument("--dedup-threshold", type=float, default=DEFAULT_DUPLICATE_THRESHOLD, help=f"重复代码检测的相似度阈值：与已审计单元的相似度不低于该值的单元复用其审计结果，近似副本只复核差异行；0 表示禁用 (默认: {DEFAULT_DUPLICATE_THRESHOLD})")
+    parser.add_argument("--cascade-model", type=str, help="模型级联：用该快速模型初审所有子任务，只有自评置信度低或严重程度高的子任务再交给 --auditor-model 复审 (默认不启用)")
+    parser.add_argument("--cascade-min-confidence", type=float, default=DEFAULT_ESCALATE_CONFIDENCE, help=f"模型级联中初审自评置信度低于该值时升级 (默认: {DEFAULT_ESCALATE_CONFIDENCE})")
+    parser.add_argument("--cascade-severity", choices=SEVERITY_LEVELS, default=DEFAULT_ESCALATE_SEVERITY, help=f"模型级联中初审报告的最高严重程度不低于该级别时升级 (默认: {DEFAULT_ESCALATE_SEVERITY})")
+
+def _add_llm_arguments(parser: argparse.ArgumentParser):
+    """审计模式、worker 模式和服务模式共用的 LLM、Agent 和缓存相关参数。"""
     parser.add_argument("--api-key", type=str, help="OpenAI API 密钥 (覆盖环境变量 OPENAI_API_KEY)")
     parser.add_argument("--base-url", type=str, help="自定义 OpenAI API 基础 URL (覆盖环境变量 OPENAI_BASE_URL)")
     parser.add_argument("--manager-model", type=str, help=f"Manager Agent 使用的 LLM 模型 (默认: {DEFAULT_MANAGER_MODEL} 或环境变量 HEIMDALLR_MANAGER_MODEL)")
     parser.add_argument("--auditor-model", type=str, help=f"Auditor Agent 使用的 LLM 模型 (默认: {DEFAULT_AUDITOR_MODEL} 或环境变量 HEIMDALLR_AUDITOR_MODEL)")
     parser.add_argument("--checker-model", type=str, help=f"Checker Agent 使用的 LLM 模型 (默认: {DEFAULT_CHECKER_MODEL} 或环境变量 HEIMDALLR_CHECKER_MODEL)")
+    parser.add_argument("--max-connections", type=int, default=DEFAULT_MAX_CONNECTIONS, help=f"LLM API 连接池的最大并发连接数 (默认: {DEFAULT_MAX_CONNECTIONS})")
+    parser.add_argument("--max-retries", type=int, default=DEFAULT_MAX_RETRIES, help=f"LLM 请求遇到限流、超时等暂时性错误时的最大重试次数 (默认: {DEFAULT_MAX_RETRIES})")
+    parser.add_argument("--rpm", type=int, help="客户端限流：每个模型每分钟的最大请求数 (默认不限制)")
+    parser.add_argument("--tpm", type=int, help="客户端限流：每个模型每分钟的最大 token 数 (prompt + max_tokens，默认不限制)")
+    parser.add_argument("--model-limit", action="append", default=[], metavar="MODEL=RPM:TPM", help="为特定模型单独设置限流，可重复使用，例如 gpt-4o=500:30000")
+    parser.add_argument("--max-model-concurrency", type=int, default=DEFAULT_MODEL_CONCURRENCY, help=f"流水线调度：每个模型同时在途的 LLM 请求数上限，所有文件和阶段共享，先进入流水线的文件优先 (默认: {DEFAULT_MODEL_CONCURRENCY})")
+    parser.add_argument("--model-concurrency", action="append", default=[], metavar="MODEL=N", help="为特定模型单独设置在途请求数上限，可重复使用，例如 gpt-4o=16")
+    parser.add_argument("--model-price", action="append", default=[], metavar="MODEL=PROMPT:COMPLETION", help="模型每百万 prompt/completion token 的价格 (美元)，用于在报告中估算费用，可重复使用，例如 gpt-4o=2.5:10")
+    parser.add_argument("--metrics-textfile", type=str, help="将 LLM 调用指标 (token、延迟、重试、缓存命中，按 Agent/模型/文件标注) 写入该 Prometheus textfile")
+    parser.add_argument("--metrics-format", choices=["prometheus", "openmetrics"], default="prometheus", help="指标文件格式 (默认: prometheus)")
+    parser.add_argument("--stream", action="store_true", help="以流式方式请求 LLM，各 Agent 的输出在生成过程中逐行打印")
+    parser.add_argument("--events", type=str, help="将每个审计阶段的结果实时写入该 JSONL 事件流文件 (例如 out.jsonl)")
+    parser.add_argument("--no-cache", action="store_true", help="禁用持久化 LLM 响应缓存")
+    parser.add_argument("--cache-dir", type=str, help="LLM 响应缓存目录 (默认: 环境变量 HEIMDALLR_CACHE_DIR 或 ~/.cache/heimdallr)")
+    parser.add_argument("--cache-max-mb", type=int, default=DEFAULT_CACHE_MAX_BYTES // (1024 * 1024), help="LLM 响应缓存的容量上限 (MiB)，超出时按 LRU 淘汰")
+    parser.add_argument("--cache-max-age-days", type=float, default=DEFAULT_CACHE_MAX_AGE_SECONDS / 86400, help="LLM 响应缓存记录的最长保存天数")
     parser.add_argument("--debug", action="store_true", help="启用调试模式，将打印包括 API 密钥在内的额外信息 (有安全风险，仅用于本地调试)")
 
+def _create_runtime(args: argparse.Namespace, parser: argparse.ArgumentParser) -> Runtime:
+    """根据 _add_llm_arguments 添加的命令行参数创建 LLM 缓存、限流器、流水线调度器、事件流和指标收集器。"""
+    llm_cache = None
+    if not args.no_cache:
+        llm_cache = LLMCache(
+            cache_dir=args.cache_dir,
+            max_bytes=args.cache_max_mb * 1024 * 1024,
+            max_age_seconds=args.cache_max_age_days * 86400
+        )
+
+    rate_limiter = None
+    if args.rpm or args.tpm or args.model_limit:
+        try:
+            model_limits = dict(ModelRateLimiter.parse_model_limit(spec) for spec in args.model_limit)
+        except ValueError as e:
+            parser.error(str(e))
+        rate_limiter = ModelRateLimiter(args.rpm, args.tpm, model_limits)
+
+    try:
+        model_concurrency = dict(PipelineScheduler.parse_model_concurrency(spec) for spec in args.model_concurrency)
+    except ValueError as e:
+        parser.error(str(e))
+    # 所有模型合计的在途请求数不超过连接池大小，避免请求在连接池中排队直至超时
+    scheduler = PipelineScheduler(args.max_model_concurrency, model_concurrency, max_total=args.max_connections)
+
+    try:
+        model_prices = dict(MetricsCollector.parse_model_price(spec) for spec in args.model_price)
+    except ValueError as e:
+        parser.error(str(e))
+    metrics = MetricsCollector(model_prices, textfile=args.metrics_textfile,
+                               openmetrics=args.metrics_format == "openmetrics")
+
+    events = EventStream(args.events) if args.events else None
+    return Runtime(api_key=args.api_key, base_url=args.base_url, manager_model=args.manager_model,
+                   auditor_model=args.auditor_model, checker_model=args.checker_model,
+                   max_connections=args.max_connections, max_retries=args.max_retries, llm_cache=llm_cache,
+                   rate_limiter=rate_limiter, scheduler=scheduler, metrics=metrics, events=events,
+                   stream=args.stream, debug=args.debug)
+
+def _audit_options(args: argparse.Namespace) -> AuditOptions:
+    """根据 _add_audit_arguments 添加的命令行参数创建审计流程参数。"""
+    return AuditOptions(
+        num_auditors=args.auditors,
+        max_prompt_tokens=args.max_prompt_tokens,
+        incremental=args.incremental,
+        dedup_threshold=args.dedup_threshold,
+        risk_filter=args.risk_filter,
+        checker_mode=args.checker_mode,
+        cascade_model=args.cascade_model,
+        cascade_min_confidence=args.cascade_min_confidence,
+        cascade_severity=args.cascade_severity,
+        code_context_tokens=getattr(args, "code_context_tokens", DEFAULT_CODE_CONTEXT_TOKENS),
+        findings_db=args.findings_db
+    )
+
+def worker_main(argv: list = None):
+    """`heimdallr worker` 子命令：从持久化任务队列领取并执行审计任务。"""
+    parser = argparse.ArgumentParser(prog="heimdallr worker", description="Heimdallr 审计 worker：从任务队列领取并执行文件审计任务")
+    parser.add_argument("--queue", type=str, required=True, help="任务队列数据库路径 (与协调者的 --queue 相同，可位于共享存储上)")
+    parser.add_argument("--concurrency", "-j", type=int, default=1, help="本进程同时执行的任务数 (默认: 1)")
+    parser.add_argument("--lease-seconds", type=float, default=DEFAULT_LEASE_SECONDS, help=f"任务租约时长 (秒)，worker 崩溃后任务在租约过期时重新入队 (默认: {DEFAULT_LEASE_SECONDS})")
+    parser.add_argument("--run-id", type=str, help="只处理指定运行的任务")
+    parser.add_argument("--exit-when-idle", action="store_true", help="队列中没有待处理和执行中的任务时退出 (默认持续等待新任务)")
+    _add_llm_arguments(parser)
+    args = parser.parse_args(argv)
+
+    runtime = _create_runtime(args, parser)
+    try:
+        asyncio.run(run_worker(
+            queue_path=args.queue,
+            runtime=runtime,
+            concurrency=args.concurrency,
+            lease_seconds=args.lease_seconds,
+            run_id=args.run_id,
+            exit_when_idle=args.exit_when_idle
+        ))
+    except KeyboardInterrupt:
+        print("WORKER: 已中断，未完成任务的租约过期后将由其他 worker 重新领取。")
+    finally:
+        runtime.close()
+
+def serve_main(argv: list = None):
+    """`heimdallr serve` 子命令：常驻审计服务。"""
+    parser = argparse.ArgumentParser(prog="heimdallr serve", description="Heimdallr 常驻审计服务：通过本地 JSON API 接收审计任务，复用已建立的 LLM 连接和缓存")
+    parser.add_argument("--host", type=str, default=DEFAULT_SERVE_HOST, help=f"监听地址 (默认: {DEFAULT_SERVE_HOST})")
+    parser.add_argument("--port", type=int, default=DEFAULT_SERVE_PORT, help=f"监听端口 (默认: {DEFAULT_SERVE_PORT})")
+    parser.add_argument("--socket", type=str, help="改为监听该 Unix socket 路径 (权限 0600)")
+    parser.add_argument("--auth-token", type=str, default=os.getenv("HEIMDALLR_SERVE_TOKEN"), help="要求请求携带 'Authorization: Bearer <token>' (默认: 环境变量 HEIMDALLR_SERVE_TOKEN)")
+    parser.add_argument("--jobs", "-j", type=int, default=DEFAULT_SERVE_JOBS, help=f"同时执行的审计任务数 (默认: {DEFAULT_SERVE_JOBS})")
+    _add_audit_arguments(parser)
+    _add_llm_arguments(parser)
+    args = parser.parse_args(argv)
+
+    runtime = _create_runtime(args, parser)
+    try:
+        asyncio.run(run_server(
+            host=args.host,
+            port=args.port,
+            socket_path=args.socket,
+            auth_token=args.auth_token,
+            jobs=args.jobs,
+            options=_audit_options(args),
+            runtime=runtime
+        ))
+    finally:
+        runtime.close()
+
+def _print_findings_table(findings: list):
+    for finding in findings:
+        lines = f"{finding['start_line']}-{finding['end_line']}" if finding["start_line"] is not None else "-"
+        summary = next((line.strip(" #*-") for line in finding["text"].splitlines() if line.strip(" #*-")), "")
+        print(f"{finding['severity'] or '-':<8} {finding['vuln_type']:<18} {finding['file_path']}:{lines} "
+              f"[{finding['unit_id']}] {VERDICT_LABELS.get(finding['verdict'], '-')} | {summary[:100]}")
+    print(f"共 {len(findings)} 条发现")
+
+def query_main(argv: list = None):
+    """`heimdallr query` 子命令：查询审计结果库中的发现和运行，或从库中导出单个文件的 JSON/Markdown 报告。"""
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--findings-db", type=str, default=default_findings_db_path(), help=f"审计结果库路径 (默认: 环境变量 HEIMDALLR_FINDINGS_DB 或 {DEFAULT_FINDINGS_DB})")
+    parser = argparse.ArgumentParser(prog="heimdallr query", description="查询 Heimdallr 审计结果库")
+    actions = parser.add_subparsers(dest="action", required=True)
+
+    findings_parser = actions.add_parser("findings", parents=[common], help="按条件查询逐条发现")
+    findings_parser.add_argument("--run", type=str, help="只查询指定运行的发现 (默认使用每个文件最近一次运行的结果)")
+    findings_parser.add_argument("--all-runs", action="store_true", help="查询所有运行的发现，而不只是每个文件最近一次的结果")
+    findings_parser.add_argument("--file", type=str, help="文件路径 (报告中记录的路径)，支持 SQL LIKE 通配符 %%，例如 'src/api/%%'")
+    findings_parser.add_argument("--type", choices=[name for name, _ in VULN_TYPE_PATTERNS] + ["other"], help="漏洞类型")
+    findings_parser.add_argument("--min-severity", choices=SEVERITY_LEVELS, help="只返回严重程度不低于该级别的发现")
+    findings_parser.add_argument("--verdict", choices=list(VERDICT_LABELS), help="Checker 逐条复核的结论")
+    findings_parser.add_argument("--unit-hash", type=str, help="代码单元指纹 (同一段代码在不同文件和运行中的发现)")
+    findings_parser.add_argument("--limit", type=int, help="最多返回的条数")
+    findings_parser.add_argument("--format", choices=["table", "json", "jsonl"], default="table", help="输出格式 (默认: table)")
+
+    runs_parser = actions.add_parser("runs", parents=[common], help="列出最近的运行")
+    runs_parser.add_argument("--limit", type=int, default=20, help="最多列出的运行数 (默认: 20)")
+
+    report_parser = actions.add_parser("report", parents=[common], help="从库中导出一个文件的报告")
+    report_parser.add_argument("--file", type=str, required=True, help="文件路径 (报告中记录的路径或绝对路径)")
+    report_parser.add_argument("--run", type=str, help="指定运行 (默认为最近一次)")
+    report_parser.add_argument("--format", choices=["md", "json"], default="md", help="报告格式 (默认: md)")
+    report_parser.add_argument("--output", "-o", type=str, help="写入该文件 (默认打印到标准输出)")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.findings_db):
+        print(f"错误: 审计结果库 '{args.findings_db}' 不存在。")
+        sys.exit(1)
+    store = FindingsStore(args.findings_db)
+    try:
+        if args.action == "findings":
+            findings = store.query_findings(run_id=args.run, file_path=args.file, vuln_type=args.type,
+                                            min_severity=args.min_severity, verdict=args.verdict,
+                                            unit_hash=args.unit_hash, latest=not (args.run or args.all_runs),
+                                            limit=args.limit)
+            if args.format == "json":
+                print(json.dumps(findings, indent=4, ensure_ascii=False))
+            elif args.format == "jsonl":
+                for finding in findings:
+                    print(json.dumps(finding, ensure_ascii=False))
+            else:
+                _print_findings_table(findings)
+        elif args.action == "runs":
+            for run in store.runs(args.limit):
+                started = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(run["started_at"]))
+                status = "已完成" if run["finished_at"] else "未完成"
+                print(f"{run['run_id']}  {started}  {status}  {run['reports']} 个报告  {run['findings']} 条发现  {run['target']}")
+        else:
+            report = store.report(args.file, args.run)
+            if report is None:
+                print(f"错误: 审计结果库中没有 '{args.file}' 的报告。")
+                sys.exit(1)
+            if args.format == "json":
+                content = json.dumps(report, indent=4, ensure_ascii=False)
+            elif report.get("error"):
+                print(f"错误: 该报告在处理过程中出现错误，无法生成 Markdown: {report['error']}")
+                sys.exit(1)
+            else:
+                content = ManagerAgent._format_report_to_markdown(report)
+            if args.output:
+                with open(args.output, 'w', encoding='utf-8') as f:
+                    f.write(content)
+                print(f"报告已保存到: {args.output}")
+            else:
+                print(content)
+    finally:
+        store.close()
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "worker":
+        worker_main(sys.argv[2:])
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == "query":
+        query_main(sys.argv[2:])
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == "serve":
+        serve_main(sys.argv[2:])
+        return
+
+    parser = argparse.ArgumentParser(description="Heimdallr - LLM 代码审计工具 (子命令: worker, query, serve)")
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--file", "-f", type=str, help="需要审计的源代码文件路径")
+    target.add_argument("--dir", "-d", type=str, help="仓库模式：审计该目录下的所有源代码文件 (遵循 .gitignore)")
+    parser.add_argument("--glob", type=str, help="仓库模式下相对于 --dir 的文件匹配模式，例如 'src/**/*.py' (默认按源代码扩展名过滤；未指定 --dir 时以当前目录为根)")
+    parser.add_argument("--jobs", "-j", type=int, default=DEFAULT_FILE_JOBS, help=f"仓库模式下同时在流水线中的文件数：一个文件的 Auditor 请求在途时，其他文件的初步分析等阶段可以同时进行，LLM 请求的并发由 --max-model-concurrency 控制 (默认: {DEFAULT_FILE_JOBS})")
+    parser.add_argument("--max-file-size", type=int, default=DEFAULT_MAX_FILE_BYTES, help=f"仓库模式下跳过大于该字节数的文件 (默认: {DEFAULT_MAX_FILE_BYTES})")
+    parser.add_argument("--output-dir", type=str, default=DEFAULT_REPO_OUTPUT_DIR, help=f"仓库模式下仓库级汇总 (及 --write-reports 的报告文件) 的输出目录 (默认: {DEFAULT_REPO_OUTPUT_DIR})")
+    parser.add_argument("--write-reports", action="store_true", help="除写入审计结果库外，另外保存每个文件的 JSON 和 Markdown 报告 (单文件模式保存在当前目录，仓库模式保存在 --output-dir)")
+    parser.add_argument("--queue", type=str, help="仓库模式下作为协调者运行：把文件审计任务写入该持久化队列 (SQLite 文件)，由 `heimdallr worker` 进程执行")
+    parser.add_argument("--no-wait", action="store_true", help="与 --queue 一起使用：任务入队后立即退出，不等待 worker 完成")
+    parser.add_argument("--resume", type=str, metavar="RUN_ID", help="恢复中途退出的运行：跳过该运行中已完成的文件，未完成文件中已完成的阶段 (初步分析、各 Auditor 子任务、Checker 复核、最终总结) 从检查点恢复")
+    _add_audit_arguments(parser)
+    parser.add_argument("--batch", action="store_true", help="离线批处理模式：把一次运行的 Auditor 请求合并为 Batch API (/v1/files + /v1/batches) 批任务提交，轮询到完成后继续 Checker 和最终报告；适合不要求交互延迟的夜间批量审计")
+    parser.add_argument("--batch-poll-seconds", type=float, default=DEFAULT_BATCH_POLL_SECONDS, help=f"批处理模式下轮询批任务状态的间隔 (秒，默认: {DEFAULT_BATCH_POLL_SECONDS:g})")
+    parser.add_argument("--batch-idle-seconds", type=float, default=DEFAULT_BATCH_IDLE_SECONDS, help=f"批处理模式下超过该时长没有新的 Auditor 请求时封批提交 (秒，默认: {DEFAULT_BATCH_IDLE_SECONDS:g})")
+    parser.add_argument("--code-context", action="store_true", help="跨文件上下文：构建 (或增量更新) 仓库的符号/调用图索引，每个 Auditor 子任务附带该单元调用到的定义和调用它的单元 (可能位于其他文件)")
+    parser.add_argument("--code-index", type=str, help=f"与 --code-context 一起使用：代码索引 (SQLite) 路径，只在首次使用时完整构建，之后只重新解析有变化的文件 (默认: 环境变量 HEIMDALLR_CODE_INDEX 或 {DEFAULT_CODE_INDEX})")
+    parser.add_argument("--code-root", type=str, help="与 --code-context 一起使用：单文件模式下建立索引的目录 (默认: 文件所在目录；仓库模式下为 --dir)")
+    parser.add_argument("--code-context-tokens", type=int, default=DEFAULT_CODE_CONTEXT_TOKENS, help=f"每个 Auditor 子任务附带的相关定义的 token 上限 (默认: {DEFAULT_CODE_CONTEXT_TOKENS})")
+    _add_llm_arguments(parser)
+
     args = parser.parse_args()
+    if not args.file and not args.dir:
+        if not args.glob:
+            parser.error("必须提供 --file、--dir 或 --glob 之一")
+        args.dir = "."
+    if args.queue and not args.dir:
+        parser.error("--queue 只能在仓库模式 (--dir/--glob) 下使用")
+    if args.queue and args.batch:
+        parser.error("--batch 不能与 --queue 同时使用")
+    if args.queue and args.resume:
+        parser.error("--resume 不能与 --queue 同时使用 (队列中的任务被重新领取时自动从检查点恢复)")
 
-    # Python 3.7+ 可以使用 asyncio.run
-    asyncio.run(run_audit(
-        file_path=args.file,
-        api_key=args.api_key,
-        base_url=args.base_url,
-        manager_model=args.manager_model,
-        auditor_model=args.auditor_model,
-        checker_model=args.checker_model,
-        debug=args.debug
-    ))
+    runtime = _create_runtime(args, parser)
+    if args.batch:
+        runtime.batch = BatchSubmitter(args.batch_poll_seconds, args.batch_idle_seconds)
+    common_args = dict(
+        options=_audit_options(args),
+        runtime=runtime,
+        code_index=(args.code_index or default_code_index_path()) if args.code_context else None,
+        write_reports=args.write_reports,
+        resume=args.resume
+    )
+
+    try:
+        # Python 3.7+ 可以使用 asyncio.run
+        if args.dir:
+            asyncio.run(run_repo_audit(
+                root_dir=args.dir,
+                pattern=args.glob,
+                jobs=args.jobs,
+                max_file_bytes=args.max_file_size,
+                output_dir=args.output_dir,
+                queue_path=args.queue,
+                wait=not args.no_wait,
+                **common_args
+            ))
+        else:
+            asyncio.run(run_audit(file_path=args.file, code_root=args.code_root, **common_args))
+    finally:
+        runtime.close()
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
@@ -0,0 +1,208 @@
+import os
+import time
+import sqlite3
+import hashlib
+from dataclasses import dataclass, field
+from typing import Dict, Any, List, Iterable
+
+from heimdallr.core.code_units import CodeUnit, extract_units
+from heimdallr.core.token_budget import count_tokens
+
+DEFAULT_CODE_INDEX = "heimdallr_code_index.sqlite3"
+# 每个 Auditor 子任务附带的跨文件相关定义的 token 上限
+DEFAULT_CODE_CONTEXT_TOKENS = 1500
+# 同名定义超过该数量的符号（例如 get、run）视为无法按名称确定，不附带其定义，也不查找其调用者
+MAX_DEFINITIONS_PER_SYMBOL = 3
+# 每个单元最多附带的调用者数
+MAX_CALLERS = 8
+# 超出预算的定义最多列出的位置数
+MAX_OMITTED_LISTED = 10
+
+_INDEX_VERSION = 1
+_DEFINITION_KINDS = ("function", "method", "class")
+
+
+def default_code_index_path() -> str:
+    """默认的代码索引路径：环境变量 HEIMDALLR_CODE_INDEX，或当前目录下的 heimdallr_code_index.sqlite3。"""
+    return os.getenv("HEIMDALLR_CODE_INDEX", DEFAULT_CODE_INDEX)
+
+
+@dataclass
+class RelatedCode:
+    """
+    一个代码单元的跨文件相关定义。
+
+    属性:
+        text (str): 交给 Auditor 的相关定义文本；没有相关定义时为空字符串。
+        callees (List[str]), callers (List[str]): 已附带的被调用者/调用者，形如 "path 中的 unit_id"。
+        omitted (List[str]): 超出 token 预算而只列出位置的定义。
+        tokens (int): text 的估算 token 数。
+    """
+    text: str = ""
+    callees: List[str] = field(default_factory=list)
+    callers: List[str] = field(default_factory=list)
+    omitted: List[str] = field(default_factory=list)
+    tokens: int = 0
+
+
+class CodeIndex:
+    """
+    仓库级的符号/定义/调用图索引，为 Auditor 提供代码片段之外的相关定义。
+
+    每个文件用本地切分器（见 heimdallr.core.code_units）拆分为代码单元，记录每个单元的定义（名称、位置、源代码）
+    和它调用到的名称。调用按名称（最后一段）匹配，不做类型推断：同名定义过多的符号视为无法确定而不使用。
+    索引保存在 SQLite 文件中，build 时只重新解析修改时间或大小发生变化的文件，因此只需在第一次使用时完整构建。
+    """
+    def __init__(self, db_path: str = None):
+        self.db_path = db_path or default_code_index_path()
+        directory = os.path.dirname(os.path.abspath(self.db_path))
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(self.db_path, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        version = self._conn.execute("PRAGMA user_version").fetchone()[0]
+        if version != _INDEX_VERSION:
+            # 索引可以随时重建，格式不兼容时直接丢弃
+            self._conn.executescript(
+                "DROP TABLE IF EXISTS files; DROP TABLE IF EXISTS units; DROP TABLE IF EXISTS calls;")
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS files ("
+            " path TEXT PRIMARY KEY, rel_path TEXT NOT NULL, mtime_ns INTEGER NOT NULL, size INTEGER NOT NULL,"
+            " digest TEXT NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS units ("
+            " path TEXT NOT NULL, unit_id TEXT NOT NULL, short_name TEXT NOT NULL, kind TEXT NOT NULL,"
+            " start_line INTEGER NOT NULL, end_line INTEGER NOT NULL, source TEXT NOT NULL,"
+            " PRIMARY KEY (path, unit_id));"
+            "CREATE INDEX IF NOT EXISTS idx_units_short_name ON units(short_name);"
+            "CREATE TABLE IF NOT EXISTS calls ("
+            " path TEXT NOT NULL, unit_id TEXT NOT NULL, callee TEXT NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS idx_calls_callee ON calls(callee);"
+            "CREATE INDEX IF NOT EXISTS idx_calls_unit ON calls(path, unit_id);"
+            f"PRAGMA user_version = {_INDEX_VERSION};"
+        )
+        self._conn.commit()
+
+    def build(self, root_dir: str, files: Iterable[str]) -> Dict[str, Any]:
+        """
+        使索引与 root_dir 下的 files 保持一致：新增或修改的文件重新解析，root_dir 下已不存在（或不再列出）的文件被移除。
+
+        返回:
+            Dict[str, Any]: 构建统计 (files, parsed, removed, units, seconds)。
+        """
+        started_at = time.monotonic()
+        root = os.path.abspath(root_dir)
+        paths = sorted({os.path.abspath(path) for path in files})
+        known = {row[0]: row[1:] for row in self._conn.execute(
+            "SELECT path, mtime_ns, size, digest FROM files WHERE path LIKE ? ESCAPE '\\'",
+            (_like_prefix(root + os.sep),))}
+        parsed = 0
+        with self._conn:
+            for path in paths:
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                previous = known.pop(path, None)
+                if previous and previous[0] == stat.st_mtime_ns and previous[1] == stat.st_size:
+                    continue
+                try:
+                    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+                        code = f.read()
+                except OSError as e:
+                    print(f"CODE INDEX: 读取 '{path}' 失败，跳过: {e}")
+                    continue
+                digest = hashlib.sha256(code.encode("utf-8")).hexdigest()
+                rel_path = os.path.relpath(path, root)
+                if not previous or previous[2] != digest:
+                    self._replace_units(path, extract_units(code, path))
+                    parsed += 1
+                self._conn.execute("INSERT OR REPLACE INTO files (path, rel_path, mtime_ns, size, digest) "
+                                   "VALUES (?, ?, ?, ?, ?)", (path, rel_path, stat.st_mtime_ns, stat.st_size, digest))
+            for path in known:
+                self._remove(path)
+        units = self._conn.execute("SELECT COUNT(*) FROM units WHERE path LIKE ? ESCAPE '\\'",
+                                   (_like_prefix(root + os.sep),)).fetchone()[0]
+        return {"files": len(paths), "parsed": parsed, "removed": len(known), "units": units,
+                "seconds": round(time.monotonic() - started_at, 2)}
+
+    def _replace_units(self, path: str, units: List[CodeUnit]):
+        self._remove(path)
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO units (path, unit_id, short_name, kind, start_line, end_line, source) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(path, u.unit_id, u.short_name, u.kind, u.start_line, u.end_line, u.source) for u in units])
+        self._conn.executemany("INSERT INTO calls (path, unit_id, callee) VALUES (?, ?, ?)",
+                               [(path, u.unit_id, callee) for u in units for callee in sorted(u.calls)])
+
+    def _remove(self, path: str):
+        for table in ("files", "units", "calls"):
+            self._conn.execute(f"DELETE FROM {table} WHERE path = ?", (path,))
+
+    def _definitions(self, name: str) -> List[tuple]:
+        return self._conn.execute(
+            "SELECT u.path, f.rel_path, u.unit_id, u.kind, u.start_line, u.end_line, u.source "
+            "FROM units u JOIN files f ON f.path = u.path "
+            f"WHERE u.short_name = ? AND u.kind IN ({','.join('?' * len(_DEFINITION_KINDS))})",
+            (name, *_DEFINITION_KINDS)).fetchall()
+
+    def _callers(self, name: str) -> List[tuple]:
+        return self._conn.execute(
+            "SELECT u.path, f.rel_path, u.unit_id, u.kind, u.start_line, u.end_line, u.source "
+            "FROM calls c JOIN units u ON u.path = c.path AND u.unit_id = c.unit_id JOIN files f ON f.path = u.path "
+            "WHERE c.callee = ? ORDER BY u.path, u.start_line", (name,)).fetchall()
+
+    def related_code(self, file_path: str, unit: CodeUnit, budget_tokens: int, model: str = "") -> RelatedCode:
+        """
+        返回 unit 调用到的定义（被调用者）和调用了 unit 的单元（调用者），在 budget_tokens 内按以下顺序附带源代码：
+        同一文件中的被调用者、其他文件中的被调用者、调用者。放不下的定义只列出位置。
+        名称在索引中有多于 MAX_DEFINITIONS_PER_SYMBOL 个定义时无法确定实际调用的是哪一个，不附带。
+        """
+        # 仓库模式下 file_path 是相对仓库根目录的路径，单文件模式下是相对当前目录的路径
+        own_paths = {os.path.abspath(file_path), file_path} if file_path else set()
+        same_file = lambda row: row[0] in own_paths or row[1] in own_paths
+        callees, seen = [], set()
+        for name in sorted(unit.calls):
+            definitions = self._definitions(name)
+            if len(definitions) > MAX_DEFINITIONS_PER_SYMBOL:
+                continue
+            for row in definitions:
+                if (row[0], row[2]) not in seen and not (same_file(row) and row[2] == unit.unit_id):
+                    seen.add((row[0], row[2]))
+                    callees.append(row)
+        callees.sort(key=lambda row: (not same_file(row), row[1], row[4]))
+        callers = []
+        if unit.kind != "module" and len(self._definitions(unit.short_name)) <= MAX_DEFINITIONS_PER_SYMBOL:
+            for row in self._callers(unit.short_name):
+                if (row[0], row[2]) not in seen and not (same_file(row) and row[2] == unit.unit_id) \
+                        and len(callers) < MAX_CALLERS:
+                    seen.add((row[0], row[2]))
+                    callers.append(row)
+
+        related = RelatedCode()
+        sections = []
+        for label, rows, names in (("被调用", callees, related.callees), ("调用者", callers, related.callers)):
+            for _, rel_path, unit_id, kind, start_line, end_line, source in rows:
+                location = f"{rel_path} 中的 {unit_id} (第 {start_line}-{end_line} 行)"
+                section = f"# [{label}] {location}\n{source}"
+                cost = count_tokens(section, model) + 2
+                if related.tokens + cost > budget_tokens:
+                    related.omitted.append(location)
+                    continue
+                sections.append(section)
+                names.append(f"{rel_path} 中的 {unit_id}")
+                related.tokens += cost
+        if related.omitted:
+            listed = related.omitted[:MAX_OMITTED_LISTED]
+            more = len(related.omitted) - len(listed)
+            sections.append("# 超出 token 预算未附带源代码的相关定义:\n" +
+                            "\n".join(f"#   {location}" for location in listed) + (f"\n#   ... 等 {more} 个" if more else ""))
+        related.text = "\n\n".join(sections)
+        related.tokens = count_tokens(related.text, model)
+        return related
+
+    def close(self):
+        self._conn.close()
+
+
+def _like_prefix(prefix: str) -> str:
+    """把路径前缀转义为 SQL LIKE 模式。"""
+    return prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
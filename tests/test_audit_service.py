@@ -0,0 +1,36 @@
+import asyncio
+
+from heimdallr.core.audit_service import AuditService, JsonApiServer
+
+
+async def report(job):
+    return {"file_path": job.file_path, "final_conclusion": "未发现问题"}
+
+
+def respond(raw: bytes) -> tuple:
+    async def run():
+        reader = asyncio.StreamReader()
+        reader.feed_data(raw)
+        reader.feed_eof()
+        return await JsonApiServer(AuditService(report))._respond(reader)
+
+    return asyncio.run(run())
+
+
+def test_invalid_content_length_is_rejected():
+    for value in (b"abc", b"-5"):
+        status, body, _ = respond(b"POST /v1/audits HTTP/1.1\r\nContent-Length: " + value + b"\r\n\r\n{}")
+        assert status == 400 and "Content-Length" in body["error"]
+
+
+def test_short_body_is_rejected():
+    status, body, _ = respond(b"POST /v1/audits HTTP/1.1\r\nContent-Length: 100\r\n\r\n{}")
+    assert status == 400 and "不完整" in body["error"]
+
+
+def test_submit_and_wait_returns_report():
+    payload = b'{"file_path": "a.py", "code": "x = 1", "wait": true}'
+    status, body, _ = respond(b"POST /v1/audits HTTP/1.1\r\nContent-Length: " + str(len(payload)).encode() +
+                              b"\r\n\r\n" + payload)
+    assert status == 200
+    assert body["status"] == "done" and body["report"]["final_conclusion"] == "未发现问题"
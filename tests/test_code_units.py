@@ -0,0 +1,141 @@
+from heimdallr.core.code_units import extract_units, find_direct_callers, units_by_id
+
+
+PYTHON_CODE = '''import os
+
+CONFIG = load_config()
+
+
+@cached
+def read_file(path):
+    return open(path).read()
+
+
+class Server:
+    port = 8080
+
+    def start(self):
+        data = read_file("config")
+        self.handle(data)
+
+    @property
+    def name(self):
+        return "server"
+
+    @name.setter
+    def name(self, value):
+        pass
+
+
+def main():
+    Server().start()
+'''
+
+C_CODE = '''#include <stdio.h>
+
+static int helper(int x) {
+    return x * 2;
+}
+
+int
+process(const char *s)
+{
+    /* } 注释中的花括号不影响切分 */
+    printf("{%s}", s);
+    return helper(1);
+}
+
+struct Point {
+    int x;
+    int y;
+};
+'''
+
+JAVA_CODE = '''public class Service {
+    private int count;
+
+    public void run() {
+        log("run");
+    }
+
+    private void log(String msg) {
+        System.out.println(msg);
+    }
+}
+'''
+
+RUBY_CODE = '''require "json"
+
+def load(path)
+  JSON.parse(File.read(path))
+end
+
+class Parser
+  def parse(text)
+    load(text)
+  end
+end
+'''
+
+
+def test_python_units_cover_functions_methods_classes_and_module():
+    units = units_by_id(extract_units(PYTHON_CODE, "app.py"))
+    assert set(units) == {"module:<module>", "function:read_file", "class:Server", "method:Server.start",
+                          "method:Server.name", "method:Server.name#2", "function:main"}
+    # 装饰器属于函数单元
+    assert (units["function:read_file"].start_line, units["function:read_file"].end_line) == (6, 8)
+    assert units["method:Server.start"].calls == {"read_file", "handle"}
+    # 类单元只保留类定义行和类级语句，方法体由方法单元负责
+    server = units["class:Server"]
+    assert server.line_numbers == [11, 12, 13, 17, 21]
+    assert "def start" not in server.source
+    module = units["module:<module>"]
+    assert module.line_numbers == [1, 3]
+    assert module.calls == {"load_config"}
+
+
+def test_python_syntax_error_falls_back_to_indent_chunking():
+    units = extract_units("def broken(:\n    pass\n\ndef ok():\n    return 1\n", "bad.py")
+    assert [(u.unit_id, u.start_line, u.end_line) for u in units] == [
+        ("function:broken", 1, 2), ("function:ok", 4, 5)]
+
+
+def test_brace_units_skip_comments_and_strings():
+    units = units_by_id(extract_units(C_CODE, "main.c"))
+    assert set(units) == {"module:<module>", "function:helper", "function:process", "class:Point"}
+    assert (units["function:helper"].start_line, units["function:helper"].end_line) == (3, 5)
+    # 返回类型写在前一行时，单元从声明的开头开始
+    assert (units["function:process"].start_line, units["function:process"].end_line) == (7, 13)
+    assert units["function:process"].calls == {"printf", "helper"}
+    assert units["module:<module>"].line_numbers == [1]
+
+
+def test_brace_class_keeps_only_lines_outside_its_methods():
+    units = units_by_id(extract_units(JAVA_CODE, "Service.java"))
+    assert set(units) == {"class:Service", "method:Service.run", "method:Service.log"}
+    assert (units["method:Service.run"].start_line, units["method:Service.run"].end_line) == (4, 6)
+    assert units["method:Service.run"].calls == {"log"}
+    assert units["class:Service"].line_numbers == [1, 2, 3, 7, 11]
+
+
+def test_indent_units_for_other_languages():
+    units = units_by_id(extract_units(RUBY_CODE, "parser.rb"))
+    assert set(units) == {"module:<module>", "function:load", "class:Parser"}
+    assert (units["function:load"].start_line, units["function:load"].end_line) == (3, 5)
+    # 顶格的 end 归入当前单元
+    assert (units["class:Parser"].start_line, units["class:Parser"].end_line) == (7, 11)
+    assert units["module:<module>"].line_numbers == [1]
+
+
+def test_empty_code_has_no_units():
+    assert extract_units("\n  \n", "empty.py") == []
+
+
+def test_find_direct_callers():
+    units = extract_units(PYTHON_CODE, "app.py")
+    by_id = units_by_id(units)
+    callers = find_direct_callers(units, [by_id["function:read_file"]])
+    assert [u.unit_id for u in callers] == ["method:Server.start"]
+    # 目标本身和模块级单元的名称不参与匹配
+    callers = find_direct_callers(units, [by_id["method:Server.start"], by_id["module:<module>"]])
+    assert [u.unit_id for u in callers] == ["function:main"]
@@ -0,0 +1,115 @@
+import asyncio
+
+from heimdallr.core.code_units import CodeUnit
+from heimdallr.core.dedup import DuplicateIndex, render_delta
+
+
+SOURCE = '''def load_user(db, user_id):
+    # 读取用户记录
+    row = db.execute("SELECT * FROM users WHERE id = ?", (user_id,)).fetchone()
+    if row is None:
+        raise KeyError(user_id)
+    profile = {"id": row[0], "name": row[1], "email": row[2]}
+    profile["roles"] = [r[0] for r in db.execute("SELECT role FROM roles WHERE user_id = ?", (user_id,))]
+    profile["active"] = bool(row[3])
+    return profile'''
+
+
+def make_unit(source: str, name: str = "load_user", start_line: int = 1) -> CodeUnit:
+    return CodeUnit(name, "function", start_line, start_line + len(source.splitlines()) - 1, source)
+
+
+def reformatted(source: str) -> str:
+    """缩进和注释不同、内容相同的副本。"""
+    lines = ["    " + line for line in source.splitlines() if not line.strip().startswith("#")]
+    return "\n".join(lines) + "\n    # vendored copy"
+
+
+def near_copy(source: str) -> str:
+    return source.replace('profile["active"] = bool(row[3])', 'profile["active"] = row[3] == 1')
+
+
+def test_exact_copy_ignores_formatting_and_comments():
+    index = DuplicateIndex()
+    assert index.claim("a.py", make_unit(SOURCE)) is None
+    match = index.claim("b.py", make_unit(reformatted(SOURCE), start_line=20))
+    assert match is not None and match.exact
+    assert (match.file_path, match.unit_id, match.start_line, match.end_line) == ("a.py", "function:load_user", 1, 9)
+    assert index.stats == {"exact": 1, "near": 0}
+
+
+def test_near_copy_matches_above_threshold_and_renders_delta():
+    index = DuplicateIndex(threshold=0.5)
+    index.claim("a.py", make_unit(SOURCE))
+    copy = make_unit(near_copy(SOURCE), start_line=30)
+    match = index.claim("b.py", copy)
+    assert match is not None and not match.exact
+    assert 0.5 <= match.similarity < 1.0
+    assert index.stats == {"exact": 0, "near": 1}
+    delta = render_delta(match, copy)
+    assert "   37| " in delta and "row[3] == 1" in delta
+    assert 'profile["active"] = bool(row[3])' in delta
+
+
+def test_similarity_below_threshold_registers_a_new_canonical_unit():
+    index = DuplicateIndex(threshold=0.999)
+    index.claim("a.py", make_unit(SOURCE))
+    assert index.claim("b.py", make_unit(near_copy(SOURCE))) is None
+    # 第二个单元成为自己的规范单元，其完全相同的副本匹配到它
+    match = index.claim("c.py", make_unit(near_copy(SOURCE)))
+    assert match.exact and match.file_path == "b.py"
+
+
+def test_unrelated_and_small_units_do_not_match():
+    index = DuplicateIndex()
+    index.claim("a.py", make_unit(SOURCE))
+    other = "\n".join(f"def handler_{i}(request):\n    return render(request, 'page_{i}.html', {{'n': {i}}})"
+                      for i in range(5))
+    assert index.claim("b.py", make_unit(other, "handlers")) is None
+    small = "def name(self):\n    return self._name"
+    assert index.claim("a.py", make_unit(small, "name")) is None
+    assert index.claim("b.py", make_unit(small, "name")) is None
+    assert index.stats == {"exact": 0, "near": 0}
+
+
+def test_copies_wait_for_published_findings():
+    async def run():
+        index = DuplicateIndex()
+        index.claim("a.py", make_unit(SOURCE))
+        match = index.claim("b.py", make_unit(SOURCE))
+        waiter = asyncio.create_task(match.findings())
+        await asyncio.sleep(0)
+        assert not waiter.done()
+        index.publish("a.py", "function:load_user", "未发现问题")
+        assert await waiter == "未发现问题"
+        # 已发布的结果直接返回给之后的副本
+        assert await index.claim("c.py", make_unit(SOURCE)).findings() == "未发现问题"
+
+    asyncio.run(run())
+
+
+def test_release_marks_unpublished_canonical_units_as_failed():
+    async def run():
+        index = DuplicateIndex()
+        index.claim("a.py", make_unit(SOURCE))
+        match = index.claim("b.py", make_unit(SOURCE))
+        index.release("b.py") # 其他文件的规范单元不受影响
+        waiter = asyncio.create_task(match.findings())
+        await asyncio.sleep(0)
+        assert not waiter.done()
+        index.release("a.py")
+        assert await waiter is None
+        # 释放后再次发布不会覆盖结果
+        index.publish("a.py", "function:load_user", "迟到的结果")
+        assert await match.findings() is None
+
+    asyncio.run(run())
+
+
+def test_add_registers_existing_findings():
+    async def run():
+        index = DuplicateIndex()
+        index.add("a.py", make_unit(SOURCE), "复用的结果")
+        assert await index.claim("b.py", make_unit(SOURCE)).findings() == "复用的结果"
+
+    asyncio.run(run())
@@ -0,0 +1,84 @@
+import json
+
+from heimdallr.core.json_stream import StreamingJSONParser, repair_json
+
+
+ANNOTATION = {
+    "overview": "处理 \"用户\" 输入的模块",
+    "units": [
+        {"unit_id": "function:a", "priority": 1, "focus": "SQL 注入 {id}"},
+        {"unit_id": "function:b", "priority": 2, "notes": {"lines": [3, 4]}},
+    ],
+    "summary": "完成",
+}
+
+
+def feed_in_chunks(parser: StreamingJSONParser, text: str, size: int) -> list:
+    found = []
+    for i in range(0, len(text), size):
+        found.extend(parser.feed(text[i:i + size]))
+    return found
+
+
+def test_items_are_returned_as_soon_as_they_close():
+    text = "```json\n" + json.dumps(ANNOTATION, ensure_ascii=False) + "\n```"
+    parser = StreamingJSONParser()
+    # 字符串中的花括号不会结束元素
+    first = text.index('"}', text.index("function:a")) + 2
+    assert parser.feed(text[:first - 1]) == []
+    assert parser.feed(text[first - 1:first]) == [ANNOTATION["units"][0]]
+    assert parser.feed(text[first:]) == [ANNOTATION["units"][1]]
+    assert parser.fields == {"overview": ANNOTATION["overview"], "summary": "完成"}
+    assert parser.result() == ANNOTATION
+
+
+def test_split_at_every_position_gives_the_same_items():
+    text = json.dumps(ANNOTATION, ensure_ascii=False)
+    for size in (1, 2, 3, 7):
+        parser = StreamingJSONParser()
+        assert feed_in_chunks(parser, text, size) == ANNOTATION["units"]
+        assert parser.fields["overview"] == ANNOTATION["overview"]
+
+
+def test_top_level_array_and_invalid_items():
+    parser = StreamingJSONParser(item_key="findings")
+    found = parser.feed('[{"id": 1}, {"id": 2,}, {"id": 3}]')
+    # 无法解析的元素被跳过，后续元素继续返回
+    assert found == [{"id": 1}, {"id": 3}]
+    assert parser.items == found
+
+
+def test_truncated_stream_keeps_completed_items():
+    text = json.dumps(ANNOTATION, ensure_ascii=False)
+    truncated = text[:text.index('"notes"') + 12]
+    parser = StreamingJSONParser()
+    assert parser.feed(truncated) == [ANNOTATION["units"][0]]
+    result = parser.result()
+    assert result["overview"] == ANNOTATION["overview"]
+    assert result["units"][0] == ANNOTATION["units"][0]
+
+
+def test_repair_json_ignores_leading_text():
+    assert repair_json('结果如下：\n```json\n{"a": [1, 2]}\n```') == {"a": [1, 2]}
+    assert repair_json("没有 JSON") is None
+
+
+def test_repair_json_closes_truncated_strings_and_containers():
+    assert repair_json('{"overview": "截断的说') == {"overview": "截断的说"}
+    assert repair_json('{"units": [{"unit_id": "a"}, {"unit_id": "b"') == {
+        "units": [{"unit_id": "a"}, {"unit_id": "b"}]}
+
+
+def test_repair_json_falls_back_to_last_complete_value():
+    # 截断在键值对中间时回退到上一个逗号
+    assert repair_json('{"units": [{"unit_id": "a"}, {"unit_id": "b", "priority":') == {
+        "units": [{"unit_id": "a"}, {"unit_id": "b"}]}
+    assert repair_json('[1, 2, tr') == [1, 2]
+
+
+def test_repair_json_every_prefix_is_parsed_or_none():
+    text = json.dumps(ANNOTATION, ensure_ascii=False)
+    for end in range(1, len(text) + 1):
+        result = repair_json(text[:end])
+        assert result is None or isinstance(result, dict)
+    assert repair_json(text) == ANNOTATION
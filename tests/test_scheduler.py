@@ -0,0 +1,216 @@
+import asyncio
+
+import pytest
+
+from heimdallr.core.scheduler import PipelineScheduler, TaskGraph, _PrioritySlots
+
+
+async def hold(slots: _PrioritySlots, priority: int, order: list, name: str, release: asyncio.Event = None):
+    await slots.acquire(priority)
+    order.append(name)
+    if release:
+        await release.wait()
+    slots.release()
+
+
+def test_priority_slots_hand_over_to_highest_priority_waiter():
+    async def run():
+        slots = _PrioritySlots(1)
+        order, gate = [], asyncio.Event()
+        holder = asyncio.create_task(hold(slots, 0, order, "holder", gate))
+        await asyncio.sleep(0)
+        waiters = [asyncio.create_task(hold(slots, priority, order, name))
+                   for priority, name in ((5, "late-file"), (1, "early-file"), (1, "early-file-2"))]
+        await asyncio.sleep(0)
+        assert slots.in_flight == 1 and len(slots._waiters) == 3
+        gate.set()
+        await asyncio.gather(holder, *waiters)
+        assert order == ["holder", "early-file", "early-file-2", "late-file"]
+        assert slots.in_flight == 0
+        assert slots.stats["queued"] == 3 and slots.stats["max_in_flight"] == 1
+
+    asyncio.run(run())
+
+
+def test_cancelled_waiter_is_skipped():
+    async def run():
+        slots = _PrioritySlots(1)
+        await slots.acquire(0)
+        order = []
+        cancelled = asyncio.create_task(hold(slots, 0, order, "cancelled"))
+        waiting = asyncio.create_task(hold(slots, 1, order, "waiting"))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await cancelled
+        slots.release()
+        await waiting
+        assert order == ["waiting"]
+        assert slots.in_flight == 0
+
+    asyncio.run(run())
+
+
+def test_slot_handed_to_a_cancelled_waiter_is_passed_on():
+    async def run():
+        slots = _PrioritySlots(1)
+        await slots.acquire(0)
+        order = []
+        first = asyncio.create_task(hold(slots, 0, order, "first"))
+        second = asyncio.create_task(hold(slots, 1, order, "second"))
+        await asyncio.sleep(0)
+        # 空位已转交给 first，但它在恢复执行前被取消
+        slots.release()
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        await second
+        assert order == ["second"]
+        assert slots.in_flight == 0
+        # 空位没有泄漏：新的请求可以立即获得
+        await asyncio.wait_for(slots.acquire(0), timeout=1)
+        assert slots.in_flight == 1
+
+    asyncio.run(run())
+
+
+def test_scheduler_limits_requests_per_model_and_in_total():
+    async def run():
+        scheduler = PipelineScheduler(max_concurrency=2, model_limits={"small": 1}, max_total=3)
+        active = {"big": 0, "small": 0, "total": 0}
+        peak = {"big": 0, "small": 0, "total": 0}
+
+        async def request(model: str):
+            async with scheduler.slot(model):
+                for key in (model, "total"):
+                    active[key] += 1
+                    peak[key] = max(peak[key], active[key])
+                await asyncio.sleep(0.01)
+                for key in (model, "total"):
+                    active[key] -= 1
+
+        await asyncio.gather(*(request(model) for model in ["big"] * 5 + ["small"] * 5))
+        assert peak == {"big": 2, "small": 1, "total": 3}
+        assert scheduler.stats["models"]["small"]["requests"] == 5
+
+    asyncio.run(run())
+
+
+def test_earlier_files_are_served_first():
+    async def run():
+        scheduler = PipelineScheduler(max_concurrency=1)
+        order = []
+        gate = asyncio.Event()
+
+        async def blocker():
+            scheduler.graph("blocker")
+            async with scheduler.slot("m"):
+                await gate.wait()
+
+        async def file_stage(name: str, delay: int):
+            scheduler.graph(name)
+            for _ in range(delay):
+                await asyncio.sleep(0) # 后进入流水线的文件先到达等待队列
+            async with scheduler.slot("m"):
+                order.append(name)
+
+        first = asyncio.create_task(blocker())
+        await asyncio.sleep(0)
+        files = [asyncio.create_task(file_stage("file-1", 3)), asyncio.create_task(file_stage("file-2", 0))]
+        await asyncio.sleep(0.01)
+        gate.set()
+        await asyncio.gather(first, *files)
+        assert order == ["file-1", "file-2"]
+
+    asyncio.run(run())
+
+
+def test_task_graph_passes_dependency_results():
+    async def run():
+        graph = TaskGraph("a.py")
+
+        async def value(x):
+            await asyncio.sleep(0.01 * x)
+            return x
+
+        graph.add("a", lambda: value(1))
+        graph.add("b", lambda: value(2))
+        total = graph.add("sum", lambda a, b: value(a + b), deps=["a", "b"])
+        assert await total == 3
+        assert graph.completed() == ["a", "b", "sum"]
+        assert graph.critical_path() == ["b", "sum"]
+        summary = graph.summary()
+        assert summary["nodes"] == 3 and summary["critical_path"] == ["b", "sum"]
+
+    asyncio.run(run())
+
+
+def test_task_graph_propagates_failures_to_dependents():
+    async def run():
+        graph = TaskGraph()
+        started = []
+
+        async def fail():
+            raise RuntimeError("LLM 没有返回结果")
+
+        async def dependent(*_):
+            started.append("dependent")
+
+        async def ok():
+            return "ok"
+
+        graph.add("analysis", fail)
+        graph.add("audit", ok)
+        node = graph.add("checker", dependent, deps=["audit", "analysis"])
+        with pytest.raises(RuntimeError, match="LLM 没有返回结果"):
+            await node
+        assert started == []
+        assert graph.completed() == ["audit"]
+        # 失败的依赖不计入关键路径
+        assert graph.critical_path() == ["audit"]
+
+    asyncio.run(run())
+
+
+def test_task_graph_cancel_stops_pending_nodes():
+    async def run():
+        graph = TaskGraph()
+        gate = asyncio.Event()
+
+        async def fail():
+            raise RuntimeError("失败")
+
+        graph.add("failed", fail)
+        waiting = graph.add("waiting", gate.wait)
+        await asyncio.sleep(0)
+        graph.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+        assert graph.completed() == []
+
+    asyncio.run(run())
+
+
+def test_task_graph_rejects_duplicate_and_unknown_nodes():
+    async def run():
+        async def noop(*_):
+            pass
+
+        graph = TaskGraph()
+        graph.add("a", noop)
+        with pytest.raises(ValueError):
+            graph.add("a", noop)
+        with pytest.raises(ValueError):
+            graph.add("b", noop, deps=["missing"])
+        assert "b" not in graph
+        await graph.task("a")
+
+    asyncio.run(run())
+
+
+def test_parse_model_concurrency():
+    assert PipelineScheduler.parse_model_concurrency("gpt-4o=16") == ("gpt-4o", 16)
+    assert PipelineScheduler.parse_model_concurrency("org/model=v2=3") == ("org/model=v2", 3)
+    for spec in ("gpt-4o", "=4", "gpt-4o=x", "gpt-4o=0"):
+        with pytest.raises(ValueError):
+            PipelineScheduler.parse_model_concurrency(spec)